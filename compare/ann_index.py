@@ -0,0 +1,352 @@
+import os
+
+import numpy as np
+
+from compare.growable_array import GrowableArray
+from utils.logging_setup import get_logger
+
+logger = get_logger("ann_index")
+
+
+class IVFIndex:
+    '''
+    Approximate nearest neighbour index for embeddings compared by inner
+    product, implemented in NumPy as an inverted file (IVF).
+
+    The embedding space is partitioned into n_lists cells with spherical
+    k-means. Each indexed vector is stored by id in the list of its nearest
+    centroid, so a query only has to be scored against the vectors in the
+    n_probe lists whose centroids are closest to it rather than against every
+    vector. Optionally the residual of each vector from its centroid is
+    product-quantized into pq_subspaces one-byte codes, in which case
+    candidates are first ranked from the codes and only the best are scored
+    exactly.
+
+    Ids are arbitrary non-negative integers. The persisted index beside a
+    feature store uses store row numbers as ids, and remap() translates these
+    to positions in the list of files found for a comparison.
+    '''
+    VERSION = 1
+    INDEX_EXT = ".ivf.npz"
+    KMEANS_ITERATIONS = 8
+    TRAIN_POINTS_PER_LIST = 32
+    PQ_CLUSTERS = 256
+    PQ_TRAIN_POINTS = 65536
+    # Multiple of k candidates ranked by PQ codes that are rescored exactly
+    PQ_RERANK_FACTOR = 10
+    CHUNK_ROWS = 8192
+    # Retrain once the number of vectors exceeds this multiple of the training set size
+    RETRAIN_GROWTH = 4
+
+    def __init__(self, n_lists, pq_subspaces=0, seed=0):
+        self.n_lists = int(n_lists)
+        self.pq_subspaces = int(pq_subspaces)
+        self.seed = seed
+        self.centroids = None
+        self.pq_codebooks = None
+        self.generation = None
+        self.n_trained = 0
+        self.n_indexed = 0
+        self._reset_lists()
+
+    def _reset_lists(self):
+        self._list_ids = [GrowableArray((), dtype=np.int64) for _ in range(self.n_lists)]
+        self._list_codes = [GrowableArray((self.pq_subspaces,), dtype=np.uint8) for _ in range(self.n_lists)]
+
+    @staticmethod
+    def n_lists_for(n_vectors):
+        return max(1, int(4 * np.sqrt(n_vectors)))
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def dim(self):
+        return None if self.centroids is None else self.centroids.shape[1]
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._list_ids)
+
+    # Training
+
+    @staticmethod
+    def _nearest(vectors, centroids, spherical=True):
+        '''
+        Index of the nearest centroid for each vector, by inner product for
+        spherical k-means or by euclidean distance otherwise.
+        '''
+        half_norms = None if spherical else 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+        nearest = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), IVFIndex.CHUNK_ROWS):
+            scores = vectors[start:start + IVFIndex.CHUNK_ROWS] @ centroids.T
+            if half_norms is not None:
+                scores -= half_norms
+            nearest[start:start + IVFIndex.CHUNK_ROWS] = np.argmax(scores, axis=1)
+        return nearest
+
+    @staticmethod
+    def _kmeans(data, k, rng, spherical=True, iterations=None):
+        iterations = IVFIndex.KMEANS_ITERATIONS if iterations is None else iterations
+        k = min(k, len(data))
+        centroids = data[rng.choice(len(data), k, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = IVFIndex._nearest(data, centroids, spherical)
+            # Sum the members of each cluster with one pass over the sorted data
+            order = np.argsort(assignments, kind="stable")
+            sorted_assignments = assignments[order]
+            starts = np.flatnonzero(np.r_[True, sorted_assignments[1:] != sorted_assignments[:-1]])
+            labels = sorted_assignments[starts]
+            sums = np.add.reduceat(data[order], starts, axis=0)
+            counts = np.diff(np.r_[starts, len(data)])
+            empty = np.ones(k, dtype=bool)
+            empty[labels] = False
+            centroids[labels] = sums / counts[:, None]
+            if empty.any():
+                centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+            if spherical:
+                norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+                centroids /= np.maximum(norms, 1e-12)
+        return centroids.astype(np.float32)
+
+    def train(self, vectors):
+        '''
+        Fit the coarse centroids, and the PQ codebooks if enabled, on a sample
+        of the given vectors. Any indexed vectors are dropped.
+        '''
+        rng = np.random.default_rng(self.seed)
+        n_sample = min(len(vectors), self.n_lists * IVFIndex.TRAIN_POINTS_PER_LIST)
+        sample_rows = np.sort(rng.choice(len(vectors), n_sample, replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+        self.centroids = IVFIndex._kmeans(sample, self.n_lists, rng, spherical=True)
+        self.n_lists = len(self.centroids)
+
+        if self.pq_subspaces > 0:
+            if sample.shape[1] % self.pq_subspaces != 0:
+                raise ValueError(f"Embedding dimension {sample.shape[1]} is not divisible into {self.pq_subspaces} PQ subspaces")
+            n_pq_sample = min(len(vectors), max(n_sample, IVFIndex.PQ_TRAIN_POINTS))
+            if n_pq_sample > n_sample:
+                sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), n_pq_sample, replace=False))], dtype=np.float32)
+            residuals = sample - self.centroids[IVFIndex._nearest(sample, self.centroids)]
+            sub_dim = sample.shape[1] // self.pq_subspaces
+            self.pq_codebooks = np.zeros((self.pq_subspaces, IVFIndex.PQ_CLUSTERS, sub_dim), dtype=np.float32)
+            for s in range(self.pq_subspaces):
+                codebook = IVFIndex._kmeans(np.ascontiguousarray(residuals[:, s * sub_dim:(s + 1) * sub_dim]),
+                                            IVFIndex.PQ_CLUSTERS, rng, spherical=False)
+                self.pq_codebooks[s, :len(codebook)] = codebook
+
+        self.n_trained = len(vectors)
+        self.n_indexed = 0
+        self._reset_lists()
+
+    def _encode(self, residuals):
+        sub_dim = self.pq_codebooks.shape[2]
+        codes = np.empty((len(residuals), self.pq_subspaces), dtype=np.uint8)
+        for s in range(self.pq_subspaces):
+            codes[:, s] = IVFIndex._nearest(residuals[:, s * sub_dim:(s + 1) * sub_dim], self.pq_codebooks[s], spherical=False)
+        return codes
+
+    # Updates
+
+    def add(self, vectors, ids):
+        '''
+        Add vectors to the lists of their nearest centroids under the given ids.
+        '''
+        if not self.is_trained:
+            raise ValueError("IVF index must be trained before vectors are added")
+        ids = np.asarray(ids, dtype=np.int64)
+        for start in range(0, len(ids), IVFIndex.CHUNK_ROWS):
+            chunk = np.asarray(vectors[start:start + IVFIndex.CHUNK_ROWS], dtype=np.float32)
+            chunk_ids = ids[start:start + IVFIndex.CHUNK_ROWS]
+            assignments = IVFIndex._nearest(chunk, self.centroids)
+            codes = self._encode(chunk - self.centroids[assignments]) if self.pq_subspaces > 0 else None
+            order = np.argsort(assignments, kind="stable")
+            sorted_assignments = assignments[order]
+            starts = np.flatnonzero(np.r_[True, sorted_assignments[1:] != sorted_assignments[:-1]])
+            ends = np.r_[starts[1:], len(order)]
+            for list_start, list_end in zip(starts.tolist(), ends.tolist()):
+                list_index = sorted_assignments[list_start]
+                members = order[list_start:list_end]
+                self._list_ids[list_index].extend(chunk_ids[members])
+                if codes is not None:
+                    self._list_codes[list_index].extend(codes[members])
+        if len(ids) > 0:
+            self.n_indexed = max(self.n_indexed, int(ids.max()) + 1)
+
+    def remap(self, id_map):
+        '''
+        Return a copy of this index with each id replaced by id_map[id].
+        Entries with ids mapped to -1 or outside of id_map are dropped.
+        '''
+        id_map = np.asarray(id_map, dtype=np.int64)
+        remapped = IVFIndex(self.n_lists, pq_subspaces=self.pq_subspaces, seed=self.seed)
+        remapped.centroids = self.centroids
+        remapped.pq_codebooks = self.pq_codebooks
+        remapped.generation = self.generation
+        remapped.n_trained = self.n_trained
+        for list_index in range(self.n_lists):
+            ids = self._list_ids[list_index].view()
+            new_ids = np.full(len(ids), -1, dtype=np.int64)
+            in_range = ids < len(id_map)
+            new_ids[in_range] = id_map[ids[in_range]]
+            keep = new_ids >= 0
+            remapped._list_ids[list_index] = GrowableArray.from_array(new_ids[keep], dtype=np.int64)
+            if self.pq_subspaces > 0:
+                remapped._list_codes[list_index] = GrowableArray.from_array(
+                    self._list_codes[list_index].view()[keep], dtype=np.uint8)
+        remapped.n_indexed = int(id_map.max()) + 1 if len(id_map) > 0 else 0
+        return remapped
+
+    # Queries
+
+    def _probe(self, queries, n_probe):
+        n_probe = max(1, min(n_probe, self.n_lists))
+        probes = np.empty((len(queries), n_probe), dtype=np.int64)
+        for start in range(0, len(queries), IVFIndex.CHUNK_ROWS):
+            scores = queries[start:start + IVFIndex.CHUNK_ROWS] @ self.centroids.T
+            if n_probe < self.n_lists:
+                probes[start:start + IVFIndex.CHUNK_ROWS] = np.argpartition(-scores, n_probe - 1, axis=1)[:, :n_probe]
+            else:
+                probes[start:start + IVFIndex.CHUNK_ROWS] = np.arange(self.n_lists)
+        return probes
+
+    def _candidates(self, probe_lists):
+        ids = [self._list_ids[list_index].view() for list_index in probe_lists]
+        if self.pq_subspaces == 0:
+            return np.concatenate(ids), None, None
+        codes = [self._list_codes[list_index].view() for list_index in probe_lists]
+        list_indexes = np.repeat(probe_lists, [len(list_ids) for list_ids in ids])
+        return np.concatenate(ids), np.concatenate(codes), list_indexes
+
+    def search(self, queries, k, vectors, n_probe=32):
+        '''
+        Find approximate k nearest neighbours by inner product.
+
+        :param queries: Q x D array of query embeddings.
+        :param k: Number of neighbours per query.
+        :param vectors: Array of all embeddings indexed by id, used to score
+            candidates exactly.
+        :param n_probe: Number of lists searched per query.
+        :returns: (ids, scores) arrays of shape Q x k in descending score
+            order, padded with -1 and -inf where fewer than k were found.
+        '''
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        result_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        probes = self._probe(queries, n_probe)
+        for q, query in enumerate(queries):
+            candidate_ids, codes, list_indexes = self._candidates(probes[q])
+            if len(candidate_ids) == 0:
+                continue
+            if codes is not None and len(candidate_ids) > k * IVFIndex.PQ_RERANK_FACTOR:
+                # Asymmetric distance: centroid score plus the score of each residual code
+                sub_dim = self.pq_codebooks.shape[2]
+                lookup = np.einsum("scd,sd->sc", self.pq_codebooks, query.reshape(self.pq_subspaces, sub_dim))
+                approx = (self.centroids[list_indexes] @ query
+                          + lookup[np.arange(self.pq_subspaces), codes].sum(axis=1))
+                n_rerank = k * IVFIndex.PQ_RERANK_FACTOR
+                candidate_ids = candidate_ids[np.argpartition(-approx, n_rerank - 1)[:n_rerank]]
+            scores = np.asarray(vectors[candidate_ids], dtype=np.float32) @ query
+            n_found = min(k, len(candidate_ids))
+            top = np.argpartition(-scores, n_found - 1)[:n_found] if n_found < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            result_ids[q, :n_found] = candidate_ids[top]
+            result_scores[q, :n_found] = scores[top]
+        return result_ids, result_scores
+
+    def range_pairs(self, vectors, threshold, n_probe=32, faces=None, start_list=0):
+        '''
+        Find pairs of indexed vectors with similarity above threshold, where
+        one vector lies in a list probed by the other. Each indexed vector is
+        used as a query, and the work is done one list at a time against all
+        of the queries that probe it.
+
+        :param vectors: Array of all embeddings indexed by id.
+        :param threshold: Minimum similarity (exclusive).
+        :param n_probe: Number of lists probed per vector.
+        :param faces: Optional array of face counts indexed by id. Only pairs
+            with equal face counts are returned.
+        :param start_list: List to start from, used to resume from a checkpoint.
+        :returns: Generator of (lists_done, ids_i, ids_j, similarities) per
+            list, where ids_i < ids_j. A pair may be returned more than once.
+        '''
+        query_ids = np.concatenate([ids.view() for ids in self._list_ids]) if self.n_lists > 0 else np.empty(0, dtype=np.int64)
+        if len(query_ids) == 0:
+            return
+        # Queries are read in chunks, so reduced precision vectors are never
+        # dequantized all at once
+        probes = np.concatenate([
+            self._probe(np.asarray(vectors[query_ids[start:start + IVFIndex.CHUNK_ROWS]], dtype=np.float32), n_probe)
+            for start in range(0, len(query_ids), IVFIndex.CHUNK_ROWS)])
+        # Group the queries by the lists they probe
+        n_probe = probes.shape[1]
+        flat_probes = probes.ravel()
+        order = np.argsort(flat_probes, kind="stable")
+        list_starts = np.searchsorted(flat_probes[order], np.arange(self.n_lists + 1))
+        for list_index in range(start_list, self.n_lists):
+            members = self._list_ids[list_index].view()
+            probing = order[list_starts[list_index]:list_starts[list_index + 1]] // n_probe
+            if len(members) == 0 or len(probing) == 0:
+                yield list_index + 1, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+                continue
+            probing_ids = query_ids[probing]
+            sims = np.asarray(vectors[probing_ids], dtype=np.float32) @ np.asarray(vectors[members], dtype=np.float32).T
+            mask = sims > threshold
+            mask &= probing_ids[:, None] != members[None, :]
+            if faces is not None:
+                mask &= faces[probing_ids][:, None] == faces[members][None, :]
+            rows, cols = np.nonzero(mask)
+            ids_a = probing_ids[rows]
+            ids_b = members[cols]
+            yield (list_index + 1, np.minimum(ids_a, ids_b), np.maximum(ids_a, ids_b), sims[rows, cols])
+
+    # Persistence
+
+    @staticmethod
+    def path_for(base_path):
+        return base_path + IVFIndex.INDEX_EXT
+
+    def save(self, path):
+        list_lengths = np.array([len(ids) for ids in self._list_ids], dtype=np.int64)
+        list_ids = np.concatenate([ids.view() for ids in self._list_ids]) if self.n_lists > 0 else np.empty(0, dtype=np.int64)
+        if self.pq_subspaces > 0:
+            list_codes = np.concatenate([codes.view() for codes in self._list_codes])
+        else:
+            list_codes = np.empty((0, 0), dtype=np.uint8)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path,
+                 version=np.array(IVFIndex.VERSION),
+                 n_lists=np.array(self.n_lists),
+                 pq_subspaces=np.array(self.pq_subspaces),
+                 seed=np.array(self.seed),
+                 generation=np.array("" if self.generation is None else self.generation),
+                 n_trained=np.array(self.n_trained),
+                 n_indexed=np.array(self.n_indexed),
+                 centroids=self.centroids,
+                 pq_codebooks=self.pq_codebooks if self.pq_codebooks is not None else np.empty((0, 0, 0), dtype=np.float32),
+                 list_lengths=list_lengths,
+                 list_ids=list_ids,
+                 list_codes=list_codes)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            if int(data["version"]) != IVFIndex.VERSION:
+                raise ValueError(f"Unsupported IVF index version in {path}")
+            index = IVFIndex(int(data["n_lists"]), pq_subspaces=int(data["pq_subspaces"]), seed=int(data["seed"]))
+            generation = str(data["generation"])
+            index.generation = generation if generation != "" else None
+            index.n_trained = int(data["n_trained"])
+            index.n_indexed = int(data["n_indexed"])
+            index.centroids = data["centroids"]
+            index.pq_codebooks = data["pq_codebooks"] if index.pq_subspaces > 0 else None
+            list_ends = np.cumsum(data["list_lengths"])
+            list_starts = list_ends - data["list_lengths"]
+            list_ids = data["list_ids"]
+            list_codes = data["list_codes"]
+            for list_index, (start, end) in enumerate(zip(list_starts.tolist(), list_ends.tolist())):
+                index._list_ids[list_index] = GrowableArray.from_array(list_ids[start:end], dtype=np.int64)
+                if index.pq_subspaces > 0:
+                    index._list_codes[list_index] = GrowableArray.from_array(list_codes[start:end], dtype=np.uint8)
+        return index
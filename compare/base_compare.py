@@ -1,7 +1,7 @@
-from glob import glob
 import os
 import random
 import sys
+import threading
 
 import cv2
 import numpy as np
@@ -9,6 +9,10 @@ import numpy as np
 from compare.compare_args import CompareArgs
 from compare.compare_data import CompareData
 from compare.compare_result import CompareResult
+from compare.growable_array import GrowableArray
+from compare.pipeline import PipelineStage, StagedPipeline
+from files.directory_listing import directory_listing_cache, walk_files
+from image.decoded_image_cache import decoded_image_cache
 from image.frame_cache import FrameCache
 from utils.config import config
 from utils.constants import CompareMode
@@ -22,8 +26,10 @@ logger = get_logger("base_compare")
 
 
 def gather_files(base_dir=".", exts=config.image_types, recursive=True, include_videos=False, include_gifs=False, include_pdfs=False):
-    files = []
-    recursive_str = "**/" if recursive else ""
+    '''
+    List the media files in a directory in a single walk over the tree, skipping
+    hidden files and directories. Extensions are matched case-insensitively.
+    '''
     exts = exts[:]
     
     # Add video types if enabled (excluding GIFs)
@@ -46,9 +52,13 @@ def gather_files(base_dir=".", exts=config.image_types, recursive=True, include_
     elif not include_pdfs and '.pdf' in exts:
         exts.remove('.pdf')
     
-    for ext in exts:
-        pattern = os.path.join(base_dir, recursive_str + "*" + ext)
-        files.extend(glob(pattern, recursive=recursive))
+    # Reuse a listing of the directory made by a file browser or another compare
+    files = directory_listing_cache.get(base_dir, recursive, exts, skip_hidden=True)
+    if files is not None:
+        return files
+    dir_mtimes = {}
+    files = list(walk_files(base_dir, exts, recursive=recursive, skip_hidden=True, dir_mtimes=dir_mtimes))
+    directory_listing_cache.store(base_dir, recursive, exts, files, dir_mtimes, skip_hidden=True)
     return files
 
 
@@ -69,7 +79,8 @@ class BaseCompare:
         # self.args.match_dims = match_dims
         self.verbose = self.args.verbose
         self.progress_listener = self.args.listener
-        self._faceCascade = None
+        self._face_cascade_path = None
+        self._face_cascades = threading.local()
         self._cancelled = False
         if self.compare_faces:
             self._set_face_cascade()
@@ -91,6 +102,41 @@ class BaseCompare:
         """Raise CompareCancelled exception."""
         raise CompareCancelled("Compare cancelled by user")
 
+    @staticmethod
+    def top_k_indices(scores, k, largest=True):
+        """
+        Select the indices of the k best scores with np.argpartition, so only
+        the selected scores are sorted.
+        :param scores: 1-D array of scores.
+        :param k: Number of indices to return. All indices are returned if k is
+            at least the number of scores.
+        :param largest: True if higher scores are better, False if lower.
+        :returns: Array of indices ordered from best to worst score.
+        """
+        keys = -scores if largest else scores
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < len(keys):
+            candidates = np.argpartition(keys, k - 1)[:k]
+        else:
+            candidates = np.arange(len(keys))
+        return candidates[np.argsort(keys[candidates], kind="stable")]
+
+    @staticmethod
+    def top_k_candidate_indices(scores, candidates, k, largest=True):
+        """
+        Select the k best scores among the candidate indices only, so that an
+        index left out of the candidates, such as the search file, is never
+        returned even if k is at least the number of scores.
+        :param scores: 1-D array of scores.
+        :param candidates: 1-D array of indices into scores.
+        :param k: Number of indices to return.
+        :param largest: True if higher scores are better, False if lower.
+        :returns: Array of indices into scores ordered from best to worst score.
+        """
+        candidates = np.asarray(candidates, dtype=np.int64)
+        return candidates[BaseCompare.top_k_indices(scores[candidates], k, largest=largest)]
+
     @staticmethod
     def calculate_chunk_size(embeddings, max_mem_gb=None):
         """
@@ -166,6 +212,157 @@ class BaseCompare:
 
         return similar_pairs
 
+    TILE_MAX_ROWS = 2048
+    TILE_COLS = 8192
+
+    @staticmethod
+    def tiled_similarity_pairs(embeddings, threshold, faces=None, start_row=0, tile_rows=None, max_mem_gb=None):
+        """
+        Stream the pairs (i < j) whose similarity exceeds the threshold, computing
+        the upper triangle of the similarity matrix one tile at a time.
+
+        Each row block is multiplied against column blocks starting at the diagonal,
+        so every pair is computed exactly once and only the above-threshold pairs of
+        each tile are kept. Row block height is sized from calculate_chunk_size so a
+        tile fits in the memory budget.
+        :param embeddings: N x D numpy array of embeddings.
+        :param threshold: Minimum similarity (exclusive) for a pair to be returned.
+        :param faces: Optional array of N face counts; pairs must have equal counts.
+        :param start_row: Row block start to resume from.
+        :param tile_rows: Optional override for the row block height.
+        :param max_mem_gb: Memory budget for a tile (defaults to half of available RAM).
+        :returns: Generator of (row_end, i, j, similarities) per row block, where
+            i, j and similarities are arrays of the qualifying pairs.
+        """
+        n = embeddings.shape[0]
+        if n < 2:
+            return
+        tile_cols = min(n, BaseCompare.TILE_COLS)
+        if tile_rows is None:
+            if max_mem_gb is None:
+                max_mem_gb = Utils.calculate_available_ram() / 2
+            tile_rows = BaseCompare.calculate_chunk_size(embeddings[:tile_cols], max_mem_gb=max_mem_gb)
+            tile_rows = min(tile_rows, BaseCompare.TILE_MAX_ROWS)
+        tile_rows = max(1, tile_rows)
+
+        for i_start in range(start_row, n, tile_rows):
+            i_end = min(i_start + tile_rows, n)
+            row_block = embeddings[i_start:i_end]
+            pairs_i = []
+            pairs_j = []
+            pairs_sim = []
+            for j_start in range(i_start, n, tile_cols):
+                j_end = min(j_start + tile_cols, n)
+                tile = row_block @ embeddings[j_start:j_end].T
+                mask = tile > threshold
+                if j_start < i_end:
+                    # Tile overlaps the diagonal, keep the strict upper triangle only
+                    mask &= (np.arange(j_start, j_end)[None, :] > np.arange(i_start, i_end)[:, None])
+                if faces is not None:
+                    mask &= (faces[i_start:i_end, None] == faces[None, j_start:j_end])
+                local_i, local_j = np.nonzero(mask)
+                if len(local_i) == 0:
+                    continue
+                pairs_i.append(local_i + i_start)
+                pairs_j.append(local_j + j_start)
+                pairs_sim.append(tile[local_i, local_j])
+            if len(pairs_i) == 0:
+                yield i_end, np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=embeddings.dtype)
+            else:
+                yield i_end, np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_sim)
+
+    @staticmethod
+    def similarity_pairs_for_rows(embeddings, rows, threshold, faces=None, tile_rows=None):
+        """
+        Find the pairs above a similarity threshold between the given rows and
+        all rows of the embeddings, without comparing the other rows to each
+        other. Used to add new files to a completed comparison.
+        :param embeddings: N x D numpy array of embeddings.
+        :param rows: Indexes of the rows to compare against all rows.
+        :param threshold: Minimum similarity (exclusive) for a pair to be returned.
+        :param faces: Optional array of N face counts; pairs must have equal counts.
+        :param tile_rows: Optional override for the number of given rows per block.
+        :returns: Generator of (i, j, similarities) per block of rows, where i
+            are given rows. Pairs between two given rows are returned once.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        n = embeddings.shape[0]
+        if len(rows) == 0 or n < 2:
+            return
+        is_row = np.zeros(n, dtype=bool)
+        is_row[rows] = True
+        tile_cols = min(n, BaseCompare.TILE_COLS)
+        tile_rows = max(1, tile_rows or BaseCompare.TILE_MAX_ROWS)
+
+        for start in range(0, len(rows), tile_rows):
+            block_rows = rows[start:start + tile_rows]
+            row_block = embeddings[block_rows]
+            pairs_i = []
+            pairs_j = []
+            pairs_sim = []
+            for j_start in range(0, n, tile_cols):
+                j_end = min(j_start + tile_cols, n)
+                cols = np.arange(j_start, j_end)
+                tile = row_block @ embeddings[j_start:j_end].T
+                # Skip the row itself, and keep pairs of two given rows only where the row comes first
+                mask = (tile > threshold) & ~(is_row[j_start:j_end][None, :] & (cols[None, :] <= block_rows[:, None]))
+                if faces is not None:
+                    mask &= (faces[block_rows, None] == faces[None, j_start:j_end])
+                local_i, local_j = np.nonzero(mask)
+                if len(local_i) == 0:
+                    continue
+                pairs_i.append(block_rows[local_i])
+                pairs_j.append(cols[local_j])
+                pairs_sim.append(tile[local_i, local_j])
+            if len(pairs_i) > 0:
+                yield np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_sim)
+
+    def _stream_similarity_pairs(self, embeddings, threshold, faces=None, store_checkpoints=False):
+        """
+        Run tiled_similarity_pairs over the found files, reporting progress and
+        storing checkpoints as row blocks complete.
+        :returns: Generator of (pairs_i, pairs_j, similarities) arrays per row block.
+        """
+        return self._stream_tiled_pairs(
+            len(embeddings),
+            lambda start_row: BaseCompare.tiled_similarity_pairs(
+                embeddings, threshold, faces=faces, start_row=start_row),
+            store_checkpoints=store_checkpoints)
+
+    def _stream_tiled_pairs(self, n, tiled_pairs_func, store_checkpoints=False):
+        """
+        Run a tiled upper triangle comparison of n files, reporting progress
+        and storing checkpoints as row blocks complete.
+        :param tiled_pairs_func: Called with the row to start from, returns a
+            generator of (row_end, pairs_i, pairs_j, scores) per row block.
+        :returns: Generator of (pairs_i, pairs_j, scores) arrays per row block.
+        """
+        if n > 5000:
+            logger.warning("\nWARNING: Large image file set found, comparison between all"
+                           + " images may take a while.\n")
+        start_row = self.compare_result.tile_row if store_checkpoints else 0
+        # Work per row is proportional to the number of columns right of the diagonal
+        total_work = n * (n - 1) / 2
+        last_checkpoint_row = start_row
+        for row_end, pairs_i, pairs_j, scores in tiled_pairs_func(start_row):
+            yield pairs_i, pairs_j, scores
+            if store_checkpoints:
+                self.compare_result.tile_row = row_end
+                if row_end - last_checkpoint_row >= 250 and row_end < n:
+                    self.compare_result.store()
+                    last_checkpoint_row = row_end
+            rows_remaining = n - row_end
+            work_done = total_work - rows_remaining * (rows_remaining - 1) / 2
+            self._handle_progress(work_done, total_work, gathering_data=False, force_update=True)
+
+    @property
+    def _file_faces(self):
+        return self._file_faces_array.view()
+
+    @_file_faces.setter
+    def _file_faces(self, file_faces):
+        self._file_faces_array = GrowableArray.from_array(file_faces)
+
     def get_similarity_threshold(self):
         return -1.0 # overridden method
 
@@ -241,6 +438,7 @@ class BaseCompare:
         else:
             raise Exception("No gather files function found.")
         self.files.sort()
+        self._restrict_to_candidate_files()
         self.compare_data.has_new_file_data = False
         self.max_files_processed = min(
             self.args.counter_limit, len(self.files))
@@ -256,6 +454,13 @@ class BaseCompare:
         if self.verbose:
             self.print_settings()
 
+    def _restrict_to_candidate_files(self):
+        '''
+        Limit the files to the candidates passed on by a pre-filter mode, if any.
+        '''
+        if self.args.candidate_files is not None:
+            self.files = [f for f in self.files if f in self.args.candidate_files]
+
     def get_image_path(self, path: str) -> str:
         """
         Get the image path for a file, using FrameCache if needed.
@@ -266,12 +471,53 @@ class BaseCompare:
     def get_data(self):
         pass
 
-    def _handle_progress(self, counter, total, gathering_data=True):
+    @staticmethod
+    def pipeline_workers():
+        '''
+        Number of threads for each parallel stage of a data pipeline.
+        '''
+        n_workers = config.pipeline_workers
+        if n_workers <= 0:
+            n_workers = max(1, (os.cpu_count() or 1) - 1)
+        return n_workers
+
+    def _open_rgb_image(self, path):
+        '''
+        Decode a file to an RGB image, from its first frame if PIL cannot read
+        it. Decoded images are shared with the other modes reading the file.
+        '''
+        return decoded_image_cache.get_image(path)
+
+    def _decode_stage(self):
+        '''
+        Pipeline stage reading file paths into RGB images.
+        '''
+        return PipelineStage("decode", self._open_rgb_image, workers=self.pipeline_workers())
+
+    def _run_pipeline(self, stages, items, is_done=None):
+        '''
+        Run items through a StagedPipeline of the given stages, stopping if the
+        compare is cancelled. Data is extracted for a file while later files are
+        decoded, instead of each file going through every step before the next.
+        :param is_done: Optional function returning True for items that already
+            have their data, which are yielded as their own result.
+        :returns: Generator of (item, result, error) in the order of the items.
+        '''
+        pipeline = StagedPipeline(stages, queue_size=config.pipeline_queue_size, is_cancelled=self.is_cancelled)
+        yield from pipeline.run(items, is_done=is_done)
+        if self.is_cancelled():
+            self.raise_cancellation_exception()
+        if self.verbose:
+            logger.info(f"Pipeline stage timings: {pipeline.timings_summary()}")
+        else:
+            logger.debug(f"Pipeline stage timings: {pipeline.timings_summary()}")
+
+    def _handle_progress(self, counter, total, gathering_data=True, force_update=False):
         if self.is_cancelled():
             self.raise_cancellation_exception()
         
         percent_complete = counter / total * 100
-        if percent_complete % 10 == 0 or counter % 500 == 0:
+        if force_update or percent_complete % 10 == 0 or counter % 500 == 0:
             if self.verbose:
                 desc1 = "data gathered" if gathering_data else "compared"
                 logger.info(str(int(percent_complete)) + "% " + desc1)
@@ -303,7 +549,32 @@ class BaseCompare:
             logger.warning("Run with flag --faces=False to avoid this warning.")
             self.compare_faces = False
         else:
-            self._faceCascade = cv2.CascadeClassifier(cascPath)
+            self._face_cascade_path = cascPath
+
+    def _get_face_cascade(self):
+        '''
+        Face model for the current thread, as cascade classifiers cannot be
+        shared between threads.
+        '''
+        cascade = getattr(self._face_cascades, "cascade", None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(self._face_cascade_path)
+            self._face_cascades.cascade = cascade
+        return cascade
+
+    @staticmethod
+    def _face_detection_image(filepath):
+        '''
+        Grayscale image for face detection, no larger than
+        config.face_detection_max_side on its longer side.
+        '''
+        gray = decoded_image_cache.get_gray(filepath)
+        max_side = config.face_detection_max_side
+        if max_side > 0 and max(gray.shape) > max_side:
+            scale = max_side / max(gray.shape)
+            size = (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale)))
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return gray
 
     def _get_faces_count(self, filepath):
         '''
@@ -311,9 +582,8 @@ class BaseCompare:
         '''
         n_faces = random.random() * 10000 + 6  # Set to a value unlikely to match
         try:
-            gray = cv2.imread(filepath, 0)
-            faces = self._faceCascade.detectMultiScale(
-                gray,
+            faces = self._get_face_cascade().detectMultiScale(
+                self._face_detection_image(filepath),
                 scaleFactor=1.1,
                 minNeighbors=5,
                 flags=cv2.CASCADE_SCALE_IMAGE
@@ -324,6 +594,41 @@ class BaseCompare:
                 logger.error(e)
         return n_faces
 
+    def _get_faces_counts(self, files):
+        '''
+        Get the number of faces in each file. Counts are read from the faces
+        cache for files unchanged since they were counted, the others are
+        counted in parallel pipeline threads and added to the cache.
+        '''
+        faces_dict = self.compare_data.file_faces_dict
+        counts = [None] * len(files)
+        file_keys = {}
+        to_count = []
+        for i, f in enumerate(files):
+            try:
+                stat = os.stat(f)
+                file_key = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                file_key = None
+            # Entries are (mtime, size, count), older caches stored the count alone
+            entry = faces_dict.get(f) if faces_dict is not None else None
+            if file_key is not None and isinstance(entry, tuple) and entry[:2] == file_key:
+                counts[i] = entry[2]
+            else:
+                file_keys[f] = file_key
+                to_count.append(i)
+        if len(to_count) == 0:
+            return counts
+
+        stages = [PipelineStage("faces", self._get_faces_count, workers=self.pipeline_workers())]
+        results = self._run_pipeline(stages, [files[i] for i in to_count])
+        for i, (f, n_faces, error) in zip(to_count, results):
+            counts[i] = n_faces
+            if faces_dict is not None and file_keys[f] is not None:
+                faces_dict[f] = (*file_keys[f], n_faces)
+                self.compare_data.has_new_file_data = True
+        return counts
+
     def run(self):
         pass
 
@@ -342,6 +647,25 @@ class BaseCompare:
     def readd_files(self, filepaths=[]):
         pass
 
+    def _finish_comparison(self, store_checkpoints=False):
+        '''
+        Build the file groups from the pairs collected in the compare result
+        and write the group output.
+        '''
+        # Validate indices before accessing files_found
+        return_current_results, should_restart = self._validate_checkpoint_data()
+        if should_restart:
+            return self.run_comparison(store_checkpoints=store_checkpoints)
+        if return_current_results:
+            return (self.compare_result.files_grouped, self.compare_result.file_groups)
+
+        self.compare_result.build_groups(self.compare_data.files_found)
+        self.compare_result.finalize_group_result(store_checkpoints=store_checkpoints)
+        return (self.compare_result.files_grouped, self.compare_result.file_groups)
+
+    def get_probable_duplicates(self):
+        return self.compare_result.probable_duplicates
+
     def _validate_checkpoint_data(self):
         """
         Validates checkpoint data and handles restart if needed.
@@ -1,13 +1,16 @@
 import getopt
 import os
 import sys
+from contextlib import closing
 
 import numpy as np
 
 from compare.base_compare import BaseCompare, gather_files
 from compare.compare_args import CompareArgs
 from compare.compare_result import CompareResult
+from compare.embedding_precision import embedding_array, leading_rows
 from compare.model import embedding_similarity
+from compare.pipeline import PipelineStage
 from utils.config import config
 from utils.logging_setup import get_logger
 from utils.utils import Utils
@@ -20,9 +23,12 @@ class BaseCompareEmbedding(BaseCompare):
         super().__init__(args, gather_files_func)
         self.embedding_similarity_threshold = self.args.threshold
         self.settings_updated = False
-        self._probable_duplicates = []
-        self.segregation_map = {}
+        self._segregation_scores = None
+        self._segregation_files = None
         self.image_embeddings_func = None
+        self.image_embeddings_batch_func = None
+        self.image_preprocess_func = None
+        self.image_embeddings_preprocessed_func = None
         self.text_embeddings_func = None
         self.threshold_duplicate = None
         self.threshold_probable_match = None
@@ -31,6 +37,15 @@ class BaseCompareEmbedding(BaseCompare):
         self._file_embeddings = np.empty((0, 512))
         self._file_faces = np.empty((0))
 
+    @property
+    def _file_embeddings(self):
+        return self._file_embeddings_array.view()
+
+    @_file_embeddings.setter
+    def _file_embeddings(self, file_embeddings):
+        # Held at the configured precision, float16 or int8 views dequantize on access
+        self._file_embeddings_array = embedding_array(file_embeddings, config.embedding_precision)
+
     def get_similarity_threshold(self):
         return self.embedding_similarity_threshold
 
@@ -60,6 +75,9 @@ class BaseCompareEmbedding(BaseCompare):
         '''
         For all the found files in the base directory, either load the cached
         image data or extract new data and add it to the cache.
+
+        Uncached files are run through a pipeline so that later files are
+        decoded and preprocessed while earlier ones are being embedded.
         '''
         self.compare_data.load_data(overwrite=self.args.overwrite,
                                     compare_faces=self.compare_faces)
@@ -72,69 +90,93 @@ class BaseCompareEmbedding(BaseCompare):
             print("Gathering image data", end="", flush=True)
 
         counter = 0
+        found_files = []
+        file_data_dict = self.compare_data.file_data_dict
+        files_to_embed = (f for i, f in enumerate(self.files)
+                          if not Utils.is_invalid_file(f, i, self.is_run_search, self.args.inclusion_pattern))
+
+        with closing(self._run_pipeline(self._embedding_stages(), files_to_embed,
+                                        is_done=lambda f: f in file_data_dict)) as results:
+            for f, embedding, error in results:
+                # Files that fail to embed do not count toward the limit. Closing
+                # the results stops the pipeline, dropping files fed past the limit.
+                if counter > self.args.counter_limit:
+                    break
+                if f in file_data_dict:
+                    embedding = file_data_dict[f]
+                elif error is not None or embedding is None:
+                    if error is not None:
+                        self._log_embedding_error(f, error)
+                    continue
+                else:
+                    file_data_dict[f] = embedding
+                    self.compare_data.has_new_file_data = True
 
-        for f in self.files:
-            # Check for cancellation during data gathering
-            if self.is_cancelled():
-                self.raise_cancellation_exception()
-            
-            if Utils.is_invalid_file(f, counter, self.is_run_search, self.args.inclusion_pattern):
-                continue
+                counter += 1
+                self._file_embeddings_array.append(embedding)
+                self.compare_data.files_found.append(f)
+                found_files.append(f)
+                self._handle_progress(counter, self.max_files_processed_even)
 
-            if counter > self.args.counter_limit:
-                break
-
-            if f in self.compare_data.file_data_dict:
-                embedding = self.compare_data.file_data_dict[f]
-                if self.compare_faces:
-                    if f in self.compare_data.file_faces_dict:
-                        n_faces = self.compare_data.file_faces_dict[f]
-                    else:
-                        image_file_path = self.get_image_path(f)
-                        n_faces = self._get_faces_count(image_file_path)
-                        self.compare_data.file_faces_dict[f] = n_faces
-            else:
-                image_file_path = self.get_image_path(f)
-                try:
-                    embedding = self.image_embeddings_func(image_file_path)
-                except OSError as e:
-                    logger.error(f"{f} - {e}")
-                    continue
-                except ValueError:
-                    continue
-                except SyntaxError as e:
-                    if self.verbose:
-                        logger.error(f"{f} - {e}")
-                    # i.e. broken PNG file (bad header checksum in b'tEXt')
-                    continue
-                self.compare_data.file_data_dict[f] = embedding
-                if self.compare_faces:
-                    if f in self.compare_data.file_faces_dict:
-                        n_faces = self.compare_data.file_faces_dict[f]
-                    else:
-                        n_faces = self._get_faces_count(image_file_path)
-                        self.compare_data.file_faces_dict[f] = n_faces
-                self.compare_data.has_new_file_data = True
-
-            counter += 1
-            self._file_embeddings = np.vstack((self._file_embeddings, [embedding]))
-            if self.compare_faces:
-                self._file_faces = np.vstack((self._file_faces, [n_faces]))
-            self.compare_data.files_found.append(f)
-            self._handle_progress(counter, self.max_files_processed_even)
+        if self.compare_faces:
+            for n_faces in self._get_faces_counts(found_files):
+                self._file_faces_array.append(n_faces)
 
         # Save image file data
         self.compare_data.save_data(self.args.overwrite, verbose=self.verbose,
                                     compare_faces=self.compare_faces)
 
+    def _embedding_stages(self):
+        '''
+        Pipeline stages taking a file path to its image embedding. Modes that
+        expose preprocessing separately decode and preprocess images in
+        parallel threads ahead of a single batched model stage.
+        '''
+        if self.image_embeddings_batch_func is not None:
+            return [PipelineStage(
+                "embed",
+                lambda paths: self.image_embeddings_batch_func([self.get_image_path(p) for p in paths],
+                                                               config.embedding_batch_size),
+                batch_size=config.embedding_batch_size)]
+        if self.image_preprocess_func is not None:
+            return [self._decode_stage(),
+                    PipelineStage("preprocess", self.image_preprocess_func, workers=self.pipeline_workers()),
+                    PipelineStage("embed", self.image_embeddings_preprocessed_func,
+                                  batch_size=config.embedding_batch_size)]
+        return [PipelineStage("embed", lambda path: self.image_embeddings_func(self.get_image_path(path)))]
+
+    def _log_embedding_error(self, path, error):
+        if isinstance(error, OSError):
+            logger.error(f"{path} - {error}")
+        elif isinstance(error, SyntaxError):
+            # i.e. broken PNG file (bad header checksum in b'tEXt')
+            if self.verbose:
+                logger.error(f"{path} - {error}")
+        elif not isinstance(error, ValueError):
+            logger.error(f"{path} - {error}")
+
+    def _get_image_embeddings(self, file_paths):
+        '''
+        Get embeddings for the given files through the embedding pipeline.
+        Embeddings for unreadable images are returned as None.
+        '''
+        if len(file_paths) == 0:
+            return []
+        embeddings = []
+        for f, embedding, error in self._run_pipeline(self._embedding_stages(), file_paths):
+            if error is not None:
+                self._log_embedding_error(f, error)
+                embedding = None
+            embeddings.append(embedding)
+        return embeddings
+
     def _compute_embedding_diff(self, base_array, compare_array,
                                 return_diff_scores=False, threshold=None):
         '''
-        Perform an elementwise diff between two image color arrays using the
-        selected color difference algorithm.
+        Compute the similarity of each embedding in base_array to the
+        compare_array embedding with a single matrix-vector product.
         '''
-        vectorized = np.vectorize(np.dot, signature="(m),(n)->()")
-        simlarities = vectorized(base_array, compare_array)
+        simlarities = base_array @ np.asarray(compare_array, dtype=base_array.dtype)
         if threshold is None:
             similars = simlarities > self.embedding_similarity_threshold
         else:
@@ -161,37 +203,31 @@ class BaseCompareEmbedding(BaseCompare):
 
     def run_comparison(self, store_checkpoints=False):
         '''
-        Compare all found embeddings to each other using either matrix-based or
-        iterative comparison based on the use_matrix_comparison flag.
-
-        For matrix comparison:
-            Group the embeddings E = [X, Y, Z]
-            Calculate L2-norm: N = L2(E)
-            If available RAM, simply multiply the normalized matrix by its transpose:
-                S = N * N.T
-            Otherwise, use chunking to compute the similarity matrix.
-                S = concat(chunk(N) * N.T) for each chunk(N)
-            Extract similars from the upper triangle:
-                i, j = np.triu_indices_from(S, k=1)
-            Group the similars by their similarity.
-
-        For iterative comparison:
-            Compare all found image arrays to each other by starting with the
-            base numpy array containing all image data and moving each array to
-            the next index.
-
-            For example, if there are three images [X, Y, Z], there are two steps:
-                Step 1: [X, Y, Z] -> [Z, X, Y] (elementwise comparison)
-                Step 2: [X, Y, Z] -> [Y, Z, X] (elementwise comparison)
-                ^ At this point, all arrays have been compared.
-                  Note it is inefficient as pairs are compared twice.
-
-        files_grouped - Keys are the file indexes, values are tuple of the group index and diff score.
-        file_groups - Keys are the group indexes, values are dicts with keys as the file in the group, values the diff score
+        Compare all found embeddings to each other.
+
+        The upper triangle of the similarity matrix S = E * E.T is computed in
+        tiles: each block of rows is multiplied against blocks of columns from
+        the diagonal onward, so every pair is computed once with BLAS and only
+        pairs above the similarity threshold are kept. The pairs are streamed
+        into the compare result grouping one row block at a time, so the full
+        matrix is never held in memory. The use_matrix_comparison flag is no
+        longer needed as both comparison paths are served by the tiled engine.
+
+        If a completed result was stored for the directory and files have since
+        been added or removed, the stored pairs of removed files are dropped and
+        only the added files are compared to all files.
+
+        If embedding_ann_grouping is set and the library is large enough to
+        have an ANN index, pairs are found from approximate neighbours instead,
+        one index list at a time. This can miss pairs, so it is opt in.
+
+        files_grouped - Keys are the file indexes, values are tuple of the group index and best similarity.
+        file_groups - Keys are the group indexes, values are dicts with keys as the file in the group, values the best similarity
         '''
         overwrite = self.args.overwrite or not store_checkpoints
         logger.debug(f"Store checkpoints: {store_checkpoints}")
-        self.compare_result = CompareResult.load(self.base_dir, self.compare_data.files_found, overwrite=overwrite)
+        self.compare_result = CompareResult.load(self.base_dir, self.compare_data.files_found,
+                                                 overwrite=overwrite, incremental=True)
         if self.compare_result.is_complete:
             return (self.compare_result.files_grouped, self.compare_result.file_groups)
 
@@ -207,127 +243,82 @@ class BaseCompareEmbedding(BaseCompare):
         else:
             print("Identifying groups of similar image files", end="", flush=True)
 
-        if self.args.use_matrix_comparison:
-            similarity_matrix, _i, _j = self._compute_matrix_similarities()
-            for i, j in zip(_i, _j):
-                if i == j:  # exclude diagonal (self-comparisons)
-                    continue
-                base_index = i
-                diff_index = j
-                diff_score = similarity_matrix[base_index, diff_index]
-                if diff_score < self.embedding_similarity_threshold:
-                    continue
-                self._process_similarity_results(base_index, diff_index, diff_score)
-        else:
-            n_files_found_even = Utils.round_up(self.compare_data.n_files_found, 5)
-            if self.compare_result.i > 1:
-                self._handle_progress(self.compare_result.i, n_files_found_even, gathering_data=False)
-
-            if self.compare_data.n_files_found > 5000:
-                logger.warning("\nWARNING: Large image file set found, comparison between all"
-                                 + " images may take a while.\n")
-
-            for i in range(self.compare_data.n_files_found):
-                if i == 0:  # At this roll index the data would compare to itself
-                    continue
+        n_files = min(self.compare_data.n_files_found, len(self._file_embeddings))
+        faces = self._grouping_faces(n_files)
+        ann_index = self.compare_data.ann_index
+        if self.compare_result.pending_rows is not None:
+            # Files changed since the stored result, so only the added files are compared
+            if self.verbose:
+                logger.info(f"Comparing {len(self.compare_result.pending_rows)} added files to {n_files} files")
+            self._compare_added_files(self.compare_result.pending_rows)
+            self.compare_result.pending_rows = None
+        elif ann_index is not None and config.embedding_ann_grouping:
+            # Large libraries can opt in to grouping from approximate neighbours instead of all pairs
+            logger.warning(f"Grouping {n_files} files from approximate neighbours in an ANN index with "
+                           f"{ann_index.n_lists} lists, probing {config.embedding_ann_n_probe} lists per file. "
+                           "Pairs whose files fall in lists that are not probed are missed, "
+                           "raise embedding_ann_n_probe for higher recall.")
+            start_list = self.compare_result.ann_list if store_checkpoints else 0
+            last_checkpoint_list = start_list
+            for lists_done, pairs_i, pairs_j, similarities in ann_index.range_pairs(
+                    leading_rows(self._file_embeddings, n_files), self._grouping_threshold(),
+                    n_probe=config.embedding_ann_n_probe, faces=faces, start_list=start_list):
+                self.compare_result.add_pairs(pairs_i, pairs_j, similarities,
+                                              duplicates=similarities > self.threshold_duplicate)
                 if store_checkpoints:
-                    if i < self.compare_result.i:
-                        continue
-                    if i % 250 == 0 and i != self.compare_data.n_files_found and i > self.compare_result.i:
+                    self.compare_result.ann_list = lists_done
+                    if lists_done - last_checkpoint_list >= 100 and lists_done < ann_index.n_lists:
                         self.compare_result.store()
-                    self.compare_result.i = i
-                self._handle_progress(i, n_files_found_even, gathering_data=False)
-
-                similars, diff_scores = self._compute_iterative_similarities(i)
-                for base_index in similars[0]:
-                    diff_index = ((base_index - i) % self.compare_data.n_files_found)
-                    diff_score = diff_scores[base_index]
-                    self._process_similarity_results(base_index, diff_index, diff_score)
-
-        # Validate indices before accessing files_found
-        return_current_results, should_restart = self._validate_checkpoint_data()
-        if should_restart:
-            return self.run_comparison(store_checkpoints=store_checkpoints)
-        if return_current_results:
-            return (self.compare_result.files_grouped, self.compare_result.file_groups)
-
-        for file_index in self.compare_result.files_grouped:
-            _file = self.compare_data.files_found[file_index]
-            group_index, diff_score = self.compare_result.files_grouped[file_index]
-            file_group = self.compare_result.file_groups[group_index] if group_index in self.compare_result.file_groups else {}
-            file_group[_file] = diff_score
-            self.compare_result.file_groups[group_index] = file_group
+                        last_checkpoint_list = lists_done
+                if lists_done % 100 == 0:
+                    self._handle_progress(lists_done, ann_index.n_lists, gathering_data=False, force_update=True)
+        else:
+            for pairs_i, pairs_j, similarities in self._stream_similarity_pairs(
+                    leading_rows(self._file_embeddings, n_files), self._grouping_threshold(),
+                    faces=faces, store_checkpoints=store_checkpoints):
+                self.compare_result.add_pairs(pairs_i, pairs_j, similarities,
+                                              duplicates=similarities > self.threshold_duplicate)
 
-        self.compare_result.finalize_group_result()
-        return (self.compare_result.files_grouped, self.compare_result.file_groups)
+        return self._finish_comparison(store_checkpoints=store_checkpoints)
 
-    def _compute_matrix_similarities(self):
+    def _grouping_threshold(self):
         '''
-        Compute all pairwise similarities in one step using matrix multiplication.
-        Returns a tuple of (similarity_matrix, indices_i, indices_j) where indices
-        are the upper triangle indices of the matrix.
+        Similarity above which two files are grouped in a comparison.
         '''
-        similarity_matrix = BaseCompare.chunked_similarity_vectorized(self._file_embeddings, threshold=self.embedding_similarity_threshold)
-        _i, _j = np.triu_indices_from(similarity_matrix, k=1)
-        return similarity_matrix, _i, _j
+        return self.embedding_similarity_threshold
 
-    def _compute_iterative_similarities(self, i):
+    def _grouping_faces(self, n_files):
         '''
-        Compute similarities using iterative comparison with np.roll.
-        Returns a tuple of (similars, diff_scores) where similars is the array of
-        indices that meet the similarity threshold.
+        Face counts that grouped files must share, or None if faces are not compared.
         '''
-        compare_file_embeddings = np.roll(self._file_embeddings, i, 0)
-        color_similars = self._compute_embedding_diff(
-            self._file_embeddings, compare_file_embeddings, True)
-
-        if self.compare_faces:
-            compare_file_faces = np.roll(self._file_faces, i, 0)
-            face_comparisons = self._file_faces - compare_file_faces
-            face_similars = face_comparisons == 0
-            similars = np.nonzero(color_similars[0] * face_similars)
-        else:
-            similars = np.nonzero(color_similars[0])
-        
-        return similars, color_similars[1]
-
-    def _process_similarity_results(self, base_index, diff_index, diff_score):
-        '''
-        Process the results of a similarity comparison, updating the grouping
-        and duplicate detection.
-        '''
-        f1_grouped = base_index in self.compare_result.files_grouped
-        f2_grouped = diff_index in self.compare_result.files_grouped
-
-        if diff_score > self.threshold_duplicate:
-            base_file = self.compare_data.files_found[base_index]
-            diff_file = self.compare_data.files_found[diff_index]
-            if ((base_file, diff_file) not in self._probable_duplicates
-                    and (diff_file, base_file) not in self._probable_duplicates):
-                self._probable_duplicates.append((base_file, diff_file))
-
-        if not f1_grouped and not f2_grouped:
-            self.compare_result.files_grouped[base_index] = (self.compare_result.group_index, diff_score)
-            self.compare_result.files_grouped[diff_index] = (self.compare_result.group_index, diff_score)
-            self.compare_result.group_index += 1
-        elif f1_grouped:
-            existing_group_index, previous_diff_score = self.compare_result.files_grouped[base_index]
-            if previous_diff_score - self.threshold_group_cutoff > diff_score:
-                self.compare_result.files_grouped[base_index] = (self.compare_result.group_index, diff_score)
-                self.compare_result.files_grouped[diff_index] = (self.compare_result.group_index, diff_score)
-                self.compare_result.group_index += 1
-            else:
-                self.compare_result.files_grouped[diff_index] = (
-                    existing_group_index, diff_score)
-        else:
-            existing_group_index, previous_diff_score = self.compare_result.files_grouped[diff_index]
-            if previous_diff_score - self.threshold_group_cutoff > diff_score:
-                self.compare_result.files_grouped[base_index] = (self.compare_result.group_index, diff_score)
-                self.compare_result.files_grouped[diff_index] = (self.compare_result.group_index, diff_score)
-                self.compare_result.group_index += 1
-            else:
-                self.compare_result.files_grouped[base_index] = (existing_group_index, diff_score)
+        return self._file_faces[:n_files] if self.compare_faces else None
 
+    def _compare_added_files(self, rows):
+        '''
+        Compare the embeddings of the given rows to all found embeddings and
+        add the matching pairs to the compare result.
+        '''
+        n_files = min(len(self.compare_data.files_found), len(self._file_embeddings))
+        rows = rows[rows < n_files]
+        for pairs_i, pairs_j, similarities in BaseCompare.similarity_pairs_for_rows(
+                leading_rows(self._file_embeddings, n_files), rows, self._grouping_threshold(),
+                faces=self._grouping_faces(n_files)):
+            self.compare_result.add_pairs(pairs_i, pairs_j, similarities,
+                                          duplicates=similarities > self.threshold_duplicate)
+
+    def _update_groups_for_files(self):
+        '''
+        Update the groups of a completed comparison after files were removed
+        or readded, dropping the pairs of removed files and comparing only the
+        readded files.
+        '''
+        if self.is_run_search:
+            return
+        added_rows = self.compare_result.update_files(self.compare_data.files_found)
+        if added_rows is None:
+            return
+        self._compare_added_files(added_rows)
+        self.compare_result.build_groups(self.compare_data.files_found)
 
     def find_similars_to_image(self, search_path, search_file_index):
         '''
@@ -335,42 +326,24 @@ class BaseCompareEmbedding(BaseCompare):
         characteristics to the provide image.
         NOTE Legacy method to allow for compare_faces boolean to be respected.
         '''
-        files_grouped = {}
-        _files_found = list(self.compare_data.files_found)
-
         if self.verbose:
             logger.info("Identifying similar image files...")
-        _files_found.pop(search_file_index)
-        search_file_embedding = self._file_embeddings[search_file_index]
-        file_embeddings = np.delete(self._file_embeddings, search_file_index, 0)
-        embedding_similars = self._compute_embedding_diff(
-            file_embeddings, search_file_embedding, True)
-
-        if self.compare_faces:
-            search_file_faces = self._file_faces[search_file_index]
-            file_faces = np.delete(self._file_faces, search_file_index)
-            face_comparisons = file_faces - search_file_faces
-            face_similars = face_comparisons == 0
-            similars = np.nonzero(embedding_similars[0] * face_similars)
-        else:
-            similars = np.nonzero(embedding_similars[0])
+        _files_found = self.compare_data.files_found
+        similarities = self._compute_embedding_diff(
+            self._file_embeddings, self._file_embeddings[search_file_index], True)[1]
 
         if config.search_only_return_closest:
-            for _index in similars[0]:
-                files_grouped[_files_found[_index]] = embedding_similars[1][_index]
+            similars = similarities > self.embedding_similarity_threshold
+            if self.compare_faces:
+                similars &= self._file_faces == self._file_faces[search_file_index]
+            similars[search_file_index] = False
+            indexes = np.flatnonzero(similars)
             # Sort results by increasing difference score
-            self.compare_result.files_grouped = dict(sorted(files_grouped.items(), key=lambda item: item[1]))
+            indexes = indexes[np.argsort(similarities[indexes], kind="stable")]
         else:
-            temp = {}
-            count = 0
-            for i in range(len(_files_found)):
-                temp[_files_found[i]] = embedding_similars[1][i]
-            for file, similarity in dict(sorted(temp.items(), key=lambda item: item[1], reverse=True)).items():
-                if count == config.max_search_results:
-                    break
-                files_grouped[file] = similarity
-                count += 1
-            self.compare_result.files_grouped = dict(sorted(files_grouped.items(), key=lambda item: item[1], reverse=True))
+            candidates = np.delete(np.arange(len(similarities)), search_file_index)
+            indexes = BaseCompare.top_k_candidate_indices(similarities, candidates, config.max_search_results)
+        self.compare_result.files_grouped = {_files_found[i]: similarities[i] for i in indexes.tolist()}
 
         self.compare_result.finalize_search_result(
             self.search_file_path, verbose=self.verbose, is_embedding=True,
@@ -410,11 +383,12 @@ class BaseCompareEmbedding(BaseCompare):
                 raise AssertionError(
                     "Encountered an error accessing the provided file path in the file system.")
 
-            self._file_embeddings = np.insert(self._file_embeddings, 0, [embedding], 0)
+            self._file_embeddings_array.insert_first(embedding)
             if self.compare_faces:
                 n_faces = self._get_faces_count(search_file_path)
-                self._file_faces = np.insert(self._file_faces, 0, [n_faces], 0)
+                self._file_faces_array.insert_first(n_faces)
             self.compare_data.files_found.insert(0, search_file_path)
+            self._add_to_ann_index(embedding, 0, insert_first=True)
 
         files_grouped = self.find_similars_to_image(
             search_file_path, self.compare_data.files_found.index(search_file_path))
@@ -422,69 +396,82 @@ class BaseCompareEmbedding(BaseCompare):
         return files_grouped
 
     def _compute_multiembedding_diff(self, positive_embeddings=[], negative_embeddings=[], threshold=0.0):
-        files_grouped = {}
+        _files_found = self.compare_data.files_found
 
         if config.search_only_return_closest:
-            _files_found = list(self.compare_data.files_found)
-            embedding_similars = self._compute_embedding_diff(
-                self._file_embeddings, positive_embeddings[0], True, threshold=threshold)
-            similars = np.nonzero(embedding_similars[0])
-            for _index in similars[0]:
-                files_grouped[_files_found[_index]] = embedding_similars[1][_index]
+            similarities = self._compute_embedding_diff(
+                self._file_embeddings, positive_embeddings[0], True, threshold=threshold)[1]
+            indexes = np.flatnonzero(similarities > threshold)
             # Sort results by increasing difference score
-            self.compare_result.files_grouped = dict(sorted(files_grouped.items(), key=lambda item: item[1]))
+            indexes = indexes[np.argsort(similarities[indexes], kind="stable")]
+            self.compare_result.files_grouped = {_files_found[i]: similarities[i] for i in indexes.tolist()}
             return self.compare_result.files_grouped
 
         '''
-        Generate embedding_similars arrays for both positive and negative embedding
-        sets. For the positives, multiply the similarities together. For the negatives
-        successively divide the results from the positive multiplications. The end
-        result should reflect a combined similarity in the appropriate direction for
-        each set of requested text embeddings.
+        Score all positive and negative embeddings against the file embeddings
+        with a single matrix product. The combined score of each file is its
+        average similarity to the positive embeddings minus its average
+        similarity to the negative embeddings. Only the top results are sorted
+        and turned into file paths.
         '''
 
-        combined_similars = None
-        positive_similarities = []
-        negative_similarities = []
+        # With an ANN index only the nearest neighbours of the positive queries are scored
+        file_indexes = self._ann_candidates(positive_embeddings, config.max_search_results)
+        file_embeddings = self._file_embeddings if file_indexes is None else self._file_embeddings[file_indexes]
 
-        for p_emb in positive_embeddings:
-            embedding_similars = self._compute_embedding_diff(
-                self._file_embeddings, p_emb, True, threshold=threshold)
-            positive_similarities.append(embedding_similars[1])
+        n_positive = len(positive_embeddings)
+        queries = np.asarray(list(positive_embeddings) + list(negative_embeddings), dtype=file_embeddings.dtype)
+        similarities = file_embeddings @ queries.T
+        combined_scores = np.zeros(len(file_embeddings), dtype=similarities.dtype)
+        if n_positive > 0:
+            combined_scores += similarities[:, :n_positive].mean(axis=1)
+        if len(queries) > n_positive:
+            combined_scores -= similarities[:, n_positive:].mean(axis=1)
 
-        for n_emb in negative_embeddings:
-            embedding_similars = self._compute_embedding_diff(
-                self._file_embeddings, n_emb, True, threshold=threshold)
-            negative_similarities.append(embedding_similars[1])
-
-        avg_positive = np.mean(positive_similarities, axis=0) if positive_similarities else 0
-        avg_negative = np.mean(negative_similarities, axis=0) if negative_similarities else 0
-        combined_scores = avg_positive - avg_negative
-        sorted_indices = np.argsort(combined_scores)[::-1] # descending order
-        combined_similars = combined_scores[sorted_indices]
-
-        if combined_similars is None or len(combined_similars) == 0:
+        if len(combined_scores) == 0:
             raise Exception('No results found.')
 
-        logger.info(f"len files_found: {len(self.compare_data.files_found)}")
-        logger.info(f"len combined_similars: {len(combined_similars)}")
-
-        files_grouped = {}
-        temp = {}
-        count = 0
-        sorted_files = [self.compare_data.files_found[i] for i in sorted_indices]
-        sorted_scores = combined_scores[sorted_indices]
+        top_indexes = BaseCompare.top_k_indices(combined_scores, config.max_search_results)
+        combined_similars = combined_scores[top_indexes]
+        if file_indexes is not None:
+            top_indexes = file_indexes[top_indexes]
 
-        for file, score in zip(sorted_files, sorted_scores):
-            temp[file] = score
+        logger.info(f"len files_found: {len(_files_found)}")
+        logger.info(f"len combined_similars: {len(combined_scores)}")
 
-        for file, similarity in temp.items():  # Already in sorted order
-            if count == config.max_search_results:
-                break
-            files_grouped[file] = similarity
-            count += 1
+        self.compare_result.files_grouped = {_files_found[i]: score
+                                             for i, score in zip(top_indexes.tolist(), combined_similars)}
 
-        self.compare_result.files_grouped = files_grouped
+    def _ann_candidates(self, positive_embeddings, k):
+        '''
+        Indexes of the files found among the approximate nearest neighbours of
+        any of the positive embeddings, or None if there is no ANN index.
+        '''
+        ann_index = self.compare_data.ann_index
+        if ann_index is None or len(positive_embeddings) == 0:
+            return None
+        # Extra neighbours per query leave room for negative embeddings to reorder results
+        ids, _ = ann_index.search(np.asarray(positive_embeddings, dtype=np.float32), k * 4,
+                                  self._file_embeddings, n_probe=config.embedding_ann_n_probe)
+        return np.unique(ids[ids >= 0])
+
+    def _add_to_ann_index(self, embedding, file_index, insert_first=False):
+        ann_index = self.compare_data.ann_index
+        if ann_index is None:
+            return
+        if insert_first:
+            ann_index = ann_index.remap(np.arange(ann_index.n_indexed) + 1)
+        ann_index.add(np.asarray(embedding, dtype=np.float32).reshape(1, -1), [file_index])
+        self.compare_data.ann_index = ann_index
+
+    def _remove_from_ann_index(self, remove_indexes, n_files):
+        ann_index = self.compare_data.ann_index
+        if ann_index is None or len(remove_indexes) == 0:
+            return
+        keep = np.ones(n_files, dtype=bool)
+        keep[remove_indexes] = False
+        id_map = np.where(keep, np.cumsum(keep) - 1, -1)
+        self.compare_data.ann_index = ann_index.remap(id_map)
 
     def find_similars_to_embeddings(self, positive_embeddings, negative_embeddings):
         '''
@@ -551,41 +538,25 @@ class BaseCompareEmbedding(BaseCompare):
         Optionally we may want to find the matches that are most exclusive to the
         search text within the domain of the provided search presets.
         '''
-        files_grouped = {}
-        temp = {}
         embeddings = []
         search_text_index = config.text_embedding_search_presets.index(search_text)
-        count = 0
 
-        if len(self.segregation_map) == 0 or self.args.overwrite:  # TODO different boolean for this cache
+        if self._segregation_scores is None or self.args.overwrite:  # TODO different boolean for this cache
             for preset in config.text_embedding_search_presets:
                 self._tokenize_text(preset, embeddings)
+            similarities = self._file_embeddings @ np.asarray(embeddings, dtype=self._file_embeddings.dtype).T
+            self._segregation_scores = similarities / similarities.min(axis=0)
+            self._segregation_files = list(self.compare_data.files_found)
 
-            for f in self.compare_data.files_found:
-                self.segregation_map[f] = []
-
-            for embedding in embeddings:
-                embedding_similars = self._compute_embedding_diff(
-                    self._file_embeddings, embedding, True, threshold=threshold)
-                normalized = embedding_similars[1] / min(embedding_similars[1])
-                for i in range(len(normalized)):
-                    self.segregation_map[self.compare_data.files_found[i]].append(normalized[i])
-
-        for f, similarities in self.segregation_map.items():
-            max_similarity_index = similarities.index(max(similarities))
-            if search_text_index == max_similarity_index:
-                temp[f] = similarities[max_similarity_index]
+        # Files whose strongest preset match is the search text
+        segregated = np.flatnonzero(np.argmax(self._segregation_scores, axis=1) == search_text_index)
+        scores = self._segregation_scores[segregated, search_text_index]
 
         # TODO need some type of way to massage the results so that the clusters formed by the texts with
         # strong signals don't cannibalize the results from the other search terms
 
-        for file, similarity in dict(sorted(temp.items(), key=lambda item: item[1], reverse=True)).items():
-            if count == config.max_search_results:
-                break
-            files_grouped[file] = similarity
-            count += 1
-        files_grouped = dict(sorted(files_grouped.items(), key=lambda item: item[1], reverse=True))
-
+        top_indexes = BaseCompare.top_k_indices(scores, config.max_search_results)
+        files_grouped = {self._segregation_files[segregated[i]]: scores[i] for i in top_indexes.tolist()}
         return {0: files_grouped}
 
     def _tokenize_text(self, text, embeddings=[], descriptor="search text"):
@@ -618,9 +589,6 @@ class BaseCompareEmbedding(BaseCompare):
             raise AssertionError(
                 "Encountered an error accessing the provided file path in the file system.")
 
-    def get_probable_duplicates(self):
-        return self._probable_duplicates
-
     def remove_from_groups(self, removed_files=[]):
         # TODO technically it would be better to refresh the file and data lists every time a compare is done
         # If not, will need to add a way to re-add the removed file data in case the remove action was undone
@@ -630,35 +598,34 @@ class BaseCompareEmbedding(BaseCompare):
                 remove_indexes.append(self.compare_data.files_found.index(f))
         remove_indexes.sort()
 
-        if len(self._file_embeddings) > 0:
-            self._file_embeddings = np.delete(self._file_embeddings, remove_indexes, axis=0)
-        if len(self._file_faces) > 0:
-            self._file_faces = np.delete(self._file_faces, remove_indexes, axis=0)
+        self._remove_from_ann_index(remove_indexes, len(self.compare_data.files_found))
+        self._file_embeddings_array.delete(remove_indexes)
+        self._file_faces_array.delete(remove_indexes)
 
         for f in removed_files:
             if f in self.compare_data.files_found:
                 self.compare_data.files_found.remove(f)
 
+        self._update_groups_for_files()
+
     def readd_files(self, filepaths=[]):
-        readded_indexes = []
-        for f in filepaths:
-            if f not in self.compare_data.files_found:
-                readded_indexes.append(len(self.compare_data.files_found))
-                self.compare_data.files_found.append(f)
-                try:
-                    embedding = self.image_embeddings_func(f)
-                except OSError as e:
-                    logger.error(f"Error generating embedding from file {f}: {e}")
-                    continue
-                self.file_embeddings_dict[f] = embedding
-                self._file_embeddings = np.vstack((self._file_embeddings, [embedding]))
-                if self.compare_faces:
-                    n_faces = self.get_faces_count(f)
-                    self.compare_data.file_faces_dict = n_faces
-                    self._file_faces = np.vstack((self._file_faces, [n_faces]))
-                if self.verbose:
-                    logger.info(f"Readded file to compare: {f}")
+        filepaths = [f for f in filepaths if f not in self.compare_data.files_found]
+        embeddings = self._get_image_embeddings(filepaths)
+        for f, embedding in zip(filepaths, embeddings):
+            if embedding is None:
+                logger.error(f"Error generating embedding from file {f}")
+                continue
+            self.compare_data.files_found.append(f)
+            if self.compare_data.file_data_dict is not None:
+                self.compare_data.file_data_dict[f] = embedding
+            self._file_embeddings_array.append(embedding)
+            self._add_to_ann_index(embedding, len(self.compare_data.files_found) - 1)
+            if self.compare_faces:
+                self._file_faces_array.append(self._get_faces_counts([f])[0])
+            if self.verbose:
+                logger.info(f"Readded file to compare: {f}")
 
+        self._update_groups_for_files()
 
     @staticmethod
     def _get_text_embedding_from_cache(text, text_cache, text_embeddings_func):
@@ -33,6 +33,8 @@ class CompareArgs:
         self.match_dims = False
         self.verbose = True
         self.use_matrix_comparison = use_matrix_comparison
+        self.candidate_files = None  # set of files to restrict the comparison to, from a pre-filter mode
+        self.additional_dirs = []  # more directories to gather files from, for modes comparing across directories
         self.app_actions = app_actions
 
     def not_searching(self):
@@ -50,6 +52,8 @@ class CompareArgs:
                 or self.counter_limit != other.counter_limit
                 or self.inclusion_pattern != other.inclusion_pattern
                 or self.recursive != other.recursive
+                or self.candidate_files != other.candidate_files
+                or self.additional_dirs != other.additional_dirs
                 or (CompareMode.CLIP_EMBEDDING == self.compare_mode and self.compare_faces != other.compare_faces)
                 # Unfortunately, this boolean requires a separate method in the CompareEmbedding search case
                 or (not self.overwrite and other.overwrite))
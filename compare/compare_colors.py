@@ -1,20 +1,19 @@
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 import getopt
+import multiprocessing
 import os
 import sys
 
 import cv2
-import imageio
-import matplotlib.pyplot as plt
 import numpy as np
-from sklearn.cluster import KMeans
-from skimage.color import rgb2lab
 # from imutils import face_utils
 
 from compare.base_compare import BaseCompare, gather_files
 from compare.compare_args import CompareArgs
 from compare.compare_result import CompareResult
-from image.frame_cache import FrameCache
+from compare.growable_array import GrowableArray
+from image.decoded_image_cache import decoded_image_cache
 from utils.config import config
 from utils.constants import CompareMode
 from utils.logging_setup import get_logger
@@ -59,6 +58,8 @@ def get_image_thumb_colors(image, thumb_dim):
     '''
     Normalize and reduce the size of the image array, and return the colors in LAB
     '''
+    # Imported here so that importing the compare modes does not load skimage
+    from skimage.color import rgb2lab
     modified_image = cv2.resize(
         image, (thumb_dim, thumb_dim), interpolation=cv2.INTER_AREA)
     modified_image = modified_image.reshape(
@@ -70,6 +71,7 @@ def get_image_colors(image, clf, show_chart=False):
     '''
     Get the set of the most significant colors in the image array
     '''
+    from skimage.color import rgb2lab
     modified_image = cv2.resize(
         image, (300, 300), interpolation=cv2.INTER_AREA)
     modified_image = modified_image.reshape(
@@ -82,6 +84,7 @@ def get_image_colors(image, clf, show_chart=False):
                   for i in counts.keys()]
     if show_chart:
         hex_colors = [RGB2HEX(ordered_colors[i]) for i in counts.keys()]
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(8, 6))
         plt.pie(counts.values(), labels=hex_colors, colors=hex_colors)
     return lab_colors
@@ -133,25 +136,65 @@ def is_any_x_true_consecutive(bool_list, x_threshold):
     return 0
 
 
+def any_x_true_weighted(bool_array, x_threshold):
+    '''
+    Vectorized is_any_x_true_weighted over the last axis of a boolean array.
+    The counts in the loop never change, so the result only depends on the
+    threshold and whether there are any values.
+    '''
+    bool_array = np.asarray(bool_array)
+    result = 1 if bool_array.shape[-1] > 0 and x_threshold <= 0 else 0
+    return np.full(bool_array.shape[:-1], result, dtype=int)
+
+
+def any_x_true_consecutive(bool_array, x_threshold,
+                           consecutive_threshold=10, consecutive_run_threshold=10):
+    '''
+    Vectorized is_any_x_true_consecutive over the last axis of a boolean array.
+
+    The loop never resets its consecutive count, and both of its counts only
+    grow, so its early return is equivalent to checking the totals: the number
+    of true values, and the number of true values directly following another
+    true value, each of which adds one to the consecutive count.
+    '''
+    bool_array = np.asarray(bool_array, dtype=bool)
+    count_true = 1 + np.count_nonzero(bool_array, axis=-1)
+    consecutive_count_true = 1 + np.count_nonzero(bool_array[..., 1:] & bool_array[..., :-1], axis=-1)
+    consecutive_runs_true = np.maximum(consecutive_count_true - consecutive_threshold, 0)
+    return ((count_true > x_threshold)
+            & (consecutive_runs_true > consecutive_run_threshold)).astype(int)
+
+
 def get_image_array(filepath):
     '''
     If this is a GIF or video file, return the array from the first frame only.
 
-    If the image is grayscale, raise a ValueError. If the image has more
-    dimensions than standard RGB, reshape it to RGB.
+    If the image is grayscale, raise a ValueError. The image is read from the
+    shared decoded image cache, downscaled and converted to RGB.
     '''
-    try:
-        image = imageio.imread(filepath)
-    except Exception as e:
-        filepath = FrameCache.get_image_path(filepath)
-        image = imageio.imread(filepath)
-    image_shape = np.shape(image)
-    if (len(image_shape) < 3 or image_shape[0] < 1 or image_shape[1] < 1
-            or image_shape[2] < 1):
+    decoded = decoded_image_cache.get(filepath)
+    if decoded.is_grayscale or decoded.array.shape[0] < 1 or decoded.array.shape[1] < 1:
         raise ValueError
-    if image_shape[2] > 3:
-        image = image[:, :, 0:3]
-    return image
+    return decoded.array
+
+
+class ColorExtractionError(Exception):
+    pass
+
+
+def extract_image_colors(image_file_path, color_getter, modifier):
+    '''
+    Read the image and get its colors with the color getter. Runs in the
+    color extraction worker processes, so it only uses picklable arguments.
+
+    Errors reading the image are raised as is, errors getting the colors from
+    the image are raised as ColorExtractionError.
+    '''
+    image_array = get_image_array(image_file_path)
+    try:
+        return color_getter(image_array, modifier)
+    except ValueError as e:
+        raise ColorExtractionError(e)
 
 
 class CompareColors(BaseCompare):
@@ -159,6 +202,9 @@ class CompareColors(BaseCompare):
     THRESHHOLD_POTENTIAL_DUPLICATE = 50
     THRESHHOLD_PROBABLE_MATCH = 1000
     THRESHHOLD_GROUP_CUTOFF = 4500
+    # Columns per tile, and the maximum number of LAB values diffed at once per tile
+    COLOR_TILE_COLS = 512
+    COLOR_TILE_MAX_VALUES = 2 ** 22
 
     def __init__(self, args=CompareArgs(), use_thumb=True, gather_files_func=gather_files):
         self.use_thumb = use_thumb
@@ -173,20 +219,20 @@ class CompareColors(BaseCompare):
                 self.color_diff_threshold = 15
             self.modifier = self.thumb_dim
             self.color_getter = get_image_thumb_colors
-            self.color_diff_alg = is_any_x_true_consecutive
+            self.color_diff_alg = any_x_true_consecutive
         else:
             self.n_colors = 8
             self.colors_below_threshold = int(self.n_colors * 4 / 8)
             self.color_diff_threshold = self.args.threshold
             if self.color_diff_threshold is None:
                 self.color_diff_threshold = 15
+            from sklearn.cluster import KMeans
             self.modifier = KMeans(n_clusters=self.n_colors)
             self.color_getter = get_image_colors
-            self.color_diff_alg = is_any_x_true_weighted
+            self.color_diff_alg = any_x_true_weighted
         self._file_colors = np.empty((0, self.n_colors, 3))
         self._file_faces = np.empty((0))
         self.settings_updated = False
-        self._probable_duplicates = []
 
     def print_settings(self):
         logger.info("|--------------------------------------------------------------------|")
@@ -214,6 +260,16 @@ class CompareColors(BaseCompare):
         logger.info(f" overwrite image data: {self.args.overwrite}")
         logger.info("|--------------------------------------------------------------------|\n\n")
 
+    @property
+    def _file_colors(self):
+        return self._file_colors_array.view()
+
+    @_file_colors.setter
+    def _file_colors(self, file_colors):
+        # LAB colors are kept at full precision so that the integer deltaE
+        # thresholds are not shifted by rounding.
+        self._file_colors_array = GrowableArray.from_array(file_colors, dtype=np.float64)
+
     def get_similarity_threshold(self):
         return self.color_diff_threshold
 
@@ -236,122 +292,218 @@ class CompareColors(BaseCompare):
             print("Gathering image data", end="", flush=True)
 
         counter = 0
+        n_found_before = len(self.compare_data.files_found)
+        # Files are taken from the front of the pending queue in order, waiting
+        # for their colors to be extracted where needed
+        pending = deque()
+        max_in_flight = 1
+        executor = None
+        executor_created = False
 
-        for f in self.files:
-            if self.is_cancelled():
-                self.raise_cancellation_exception()
-            
-            if Utils.is_invalid_file(f, counter, self.is_run_search, self.args.inclusion_pattern):
-                continue
-
-            if counter > self.args.counter_limit:
-                break
+        try:
+            for f in self.files:
+                if self.is_cancelled():
+                    self.raise_cancellation_exception()
 
-            if f in self.compare_data.file_data_dict:
-                colors = self.compare_data.file_data_dict[f]
-                if self.compare_faces and f in self.compare_data.file_faces_dict:
-                    n_faces = self.compare_data.file_faces_dict[f]
-            else:
-                image_file_path = self.get_image_path(f)
-                try:
-                    image_array = get_image_array(image_file_path)
-                except OSError as e:
-                    logger.error(f"{f} - {e}")
-                    continue
-                except ValueError:
-                    continue
-                except SyntaxError as e:
-                    if self.verbose:
-                        logger.error(f"{f} - {e}")
-                    # i.e. broken PNG file (bad header checksum in b'tEXt')
+                if Utils.is_invalid_file(f, counter + len(pending), self.is_run_search, self.args.inclusion_pattern):
                     continue
 
-                try:
-                    colors = self.color_getter(image_array, self.modifier)
-                except ValueError as e:
-                    if self.verbose:
-                        logger.error(e)
-                        logger.error(f)
-                    continue
+                if counter + len(pending) > self.args.counter_limit:
+                    break
 
-                self.compare_data.file_data_dict[f] = colors
-                if self.compare_faces:
-                    if f in self.compare_data.file_faces_dict:
-                        n_faces = self.compare_data.file_faces_dict[f]
+                if f in self.compare_data.file_data_dict:
+                    pending.append((f, self.compare_data.file_data_dict[f], None))
+                else:
+                    if not executor_created:
+                        # The pool is only started once a file needs its colors extracted
+                        executor, max_in_flight = self._get_color_executor()
+                        executor_created = True
+                    image_file_path = self.get_image_path(f)
+                    if executor is None:
+                        pending.append((f, None, self._extract_colors_now(image_file_path)))
                     else:
-                        n_faces = self._get_faces_count(f)
-                        self.compare_data.file_faces_dict[f] = n_faces
+                        pending.append((f, None, executor.submit(
+                            extract_image_colors, image_file_path, self.color_getter, self.modifier)))
+
+                counter = self._add_pending_colors(pending, counter, max_in_flight)
+
+            counter = self._add_pending_colors(pending, counter, 0)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        if self.compare_faces:
+            for n_faces in self._get_faces_counts(self.compare_data.files_found[n_found_before:]):
+                self._file_faces_array.append(n_faces)
+
+        # Save image file data
+        self.compare_data.save_data(self.args.overwrite, verbose=self.verbose,
+                                    compare_faces=self.compare_faces)
+
+    def _get_color_executor(self):
+        '''
+        Create the process pool for color extraction. Returns None for the
+        executor if extraction should run in this process.
+        '''
+        n_workers = config.color_extraction_workers
+        if n_workers <= 0:
+            n_workers = max(1, (os.cpu_count() or 1) - 1)
+        if n_workers == 1:
+            return None, 1
+        if self.verbose:
+            logger.info(f"Extracting colors with {n_workers} worker processes")
+        # Spawned workers do not inherit the state of the app threads
+        executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"))
+        return executor, n_workers * 4
+
+    def _extract_colors_now(self, image_file_path):
+        '''
+        Extract colors in this process, returning a completed future.
+        '''
+        future = Future()
+        try:
+            future.set_result(extract_image_colors(image_file_path, self.color_getter, self.modifier))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _add_pending_colors(self, pending, counter, max_in_flight):
+        '''
+        Add the files at the front of the pending queue to the found file data
+        in order, as long as their colors are available. Waits for extraction
+        while more than max_in_flight files are pending. Files whose colors
+        could not be extracted are skipped.
+        '''
+        while len(pending) > 0:
+            f, colors, future = pending[0]
+            if future is not None and not future.done():
+                if len(pending) <= max_in_flight:
+                    break
+                while not future.done():
+                    if self.is_cancelled():
+                        self.raise_cancellation_exception()
+                    wait([future], timeout=0.5, return_when=FIRST_COMPLETED)
+            pending.popleft()
+
+            if future is not None:
+                colors = self._get_extracted_colors(f, future)
+                if colors is None:
+                    continue
+                self.compare_data.file_data_dict[f] = colors
                 self.compare_data.has_new_file_data = True
 
             counter += 1
-            self._file_colors = np.vstack((self._file_colors, [colors]))
-            if self.compare_faces:
-                self._file_faces = np.vstack((self._file_faces, [n_faces]))
+            self._file_colors_array.append(colors)
             self.compare_data.files_found.append(f)
             self._handle_progress(counter, self.max_files_processed_even)
+        return counter
 
-        # Save image file data
-        self.compare_data.save_data(self.args.overwrite, verbose=self.verbose,
-                                    compare_faces=self.compare_faces)
+    def _get_extracted_colors(self, f, future):
+        try:
+            return future.result()
+        except OSError as e:
+            logger.error(f"{f} - {e}")
+        except ValueError:
+            pass
+        except SyntaxError as e:
+            if self.verbose:
+                logger.error(f"{f} - {e}")
+            # i.e. broken PNG file (bad header checksum in b'tEXt')
+        except ColorExtractionError as e:
+            if self.verbose:
+                logger.error(e)
+                logger.error(f)
+        return None
 
     def _compute_color_diff(self, base_array, compare_array,
                             return_diff_scores=False):
         '''
         Perform an elementwise diff between two image color arrays using the
-        selected color difference algorithm.
+        selected color difference algorithm. The arrays are broadcast against
+        each other, the last two axes being the colors and their LAB values.
         '''
         lab_diff_squares = np.square(base_array - compare_array)
-        deltaE_cie76s = np.sqrt(np.sum(lab_diff_squares, 2)).astype(int)
-        similars = np.apply_along_axis(
-            self.color_diff_alg, 1, deltaE_cie76s < self.color_diff_threshold,
-            self.colors_below_threshold)
+        deltaE_cie76s = np.sqrt(np.sum(lab_diff_squares, -1)).astype(int)
+        similars = self.color_diff_alg(
+            deltaE_cie76s < self.color_diff_threshold, self.colors_below_threshold)
         if return_diff_scores:
-            return similars, np.sum(deltaE_cie76s, axis=1)
+            return similars, np.sum(deltaE_cie76s, axis=-1)
         else:
             return similars
 
+    def tiled_color_pairs(self, file_colors, faces=None, start_row=0, tile_rows=None):
+        '''
+        Compare every pair of file colors once by walking the upper triangle of
+        the pairs in blocks of rows and columns, where each tile of pairs is
+        diffed in one broadcast operation.
+        :param file_colors: N x n_colors x 3 numpy array of LAB colors.
+        :param faces: Optional array of N face counts; pairs must have equal counts.
+        :param start_row: Row to start from, used to resume from a checkpoint.
+        :param tile_rows: Optional override for the number of rows per block.
+        :returns: Generator of (row_end, pairs_i, pairs_j, diff_scores) per
+            row block, where i < j for every pair.
+        '''
+        n = len(file_colors)
+        if n < 2:
+            return
+        tile_cols = min(n, CompareColors.COLOR_TILE_COLS)
+        if tile_rows is None:
+            tile_rows = CompareColors.COLOR_TILE_MAX_VALUES // (tile_cols * self.n_colors * 3)
+        tile_rows = max(1, tile_rows)
+
+        for i_start in range(start_row, n, tile_rows):
+            i_end = min(i_start + tile_rows, n)
+            row_block = file_colors[i_start:i_end, None]
+            pairs_i = []
+            pairs_j = []
+            pairs_diff = []
+            for j_start in range(i_start, n, tile_cols):
+                j_end = min(j_start + tile_cols, n)
+                similars, diff_scores = self._compute_color_diff(
+                    row_block, file_colors[None, j_start:j_end], True)
+                mask = similars.astype(bool)
+                if j_start < i_end:
+                    # Tile overlaps the diagonal, keep the strict upper triangle only
+                    mask &= (np.arange(j_start, j_end)[None, :] > np.arange(i_start, i_end)[:, None])
+                if faces is not None:
+                    mask &= (faces[i_start:i_end, None] == faces[None, j_start:j_end])
+                local_i, local_j = np.nonzero(mask)
+                if len(local_i) == 0:
+                    continue
+                pairs_i.append(local_i + i_start)
+                pairs_j.append(local_j + j_start)
+                pairs_diff.append(diff_scores[local_i, local_j])
+            if len(pairs_i) == 0:
+                yield i_end, np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=int)
+            else:
+                yield i_end, np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_diff)
+
     def find_similars_to_image(self, search_path, search_file_index):
         '''
         Search the numpy array of all known image arrays for similar
         characteristics to the provide image.
         '''
-        files_grouped = {}
-        _files_found = list(self.compare_data.files_found)
-
         if self.verbose:
             logger.info("Identifying similar image files...")
-        _files_found.pop(search_file_index)
-        search_file_colors = self._file_colors[search_file_index]
-        file_colors = np.delete(self._file_colors, search_file_index, 0)
-        color_similars = self._compute_color_diff(
-            file_colors, search_file_colors, True)
-
-        if self.compare_faces:
-            search_file_faces = self._file_faces[search_file_index]
-            file_faces = np.delete(self._file_faces, search_file_index)
-            face_comparisons = file_faces - search_file_faces
-            face_similars = face_comparisons == 0
-            similars = np.nonzero(color_similars[0] * face_similars)
-        else:
-            similars = np.nonzero(color_similars[0])
-
+        _files_found = self.compare_data.files_found
+        color_similars, differences = self._compute_color_diff(
+            self._file_colors, self._file_colors[search_file_index], True)
         if config.search_only_return_closest:
-            for _index in similars[0]:
-                files_grouped[_files_found[_index]] = color_similars[1][_index]
+            similars = np.array(color_similars, dtype=bool)
+            if self.compare_faces:
+                similars &= self._file_faces == self._file_faces[search_file_index]
+            similars[search_file_index] = False
+            candidates = np.flatnonzero(similars)
+            k = len(candidates)
         else:
-            temp = {}
-            count = 0
-            for i in range(len(_files_found)):
-                temp[_files_found[i]] = color_similars[1][i]
-            for file, difference in dict(sorted(temp.items(), key=lambda item: item[1])).items():
-                if count == config.max_search_results:
-                    break
-                files_grouped[file] = difference
-                count += 1
+            candidates = np.delete(np.arange(len(differences)), search_file_index)
+            k = config.max_search_results
 
         # Sort results by increasing difference score
-        self.compare_result.files_grouped = dict(
-            sorted(files_grouped.items(), key=lambda item: item[1]))
+        top_indexes = BaseCompare.top_k_candidate_indices(
+            np.asarray(differences, dtype=np.float64), candidates, k, largest=False)
+        files_grouped = {_files_found[i]: differences[i] for i in top_indexes.tolist()}
+        self.compare_result.files_grouped = files_grouped
         self.compare_result.finalize_search_result(
             self.search_file_path, verbose=self.verbose, is_embedding=False,
             threshold_duplicate=CompareColors.THRESHHOLD_POTENTIAL_DUPLICATE,
@@ -398,8 +550,8 @@ class CompareColors(BaseCompare):
                 raise AssertionError(
                     "Encountered an error gathering colors from the file provided.")
             n_faces = self._get_faces_count(search_file_path)
-            self._file_colors = np.insert(self._file_colors, 0, [colors], 0)
-            self._file_faces = np.insert(self._file_faces, 0, [n_faces], 0)
+            self._file_colors_array.insert_first(colors)
+            self._file_faces_array.insert_first(n_faces)
             self.compare_data.files_found.insert(0, search_file_path)
 
         files_grouped = self.find_similars_to_image(
@@ -412,30 +564,18 @@ class CompareColors(BaseCompare):
 
     def run_comparison(self, store_checkpoints=False):
         '''
-        Compare all found image arrays to each other by starting with the
-        base numpy array containing all image data and moving each array to
-        the next index.
+        Compare all found image arrays to each other once, in blocks of pairs
+        from the upper triangle of the comparison matrix.
 
-        For example, if there are three images [X, Y, Z], there are two steps:
-            Step 1: [X, Y, Z] -> [Z, X, Y] (elementwise comparison)
-            Step 2: [X, Y, Z] -> [Y, Z, X] (elementwise comparison)
-            ^ At this point, all arrays have been compared.
-
-        files_grouped - Keys are the file indexes, values are tuple of the group index and diff score.
-        file_groups - Keys are the group indexes, values are dicts with keys as the file in the group, values the diff score
+        files_grouped - Keys are the file indexes, values are tuple of the group index and lowest diff score.
+        file_groups - Keys are the group indexes, values are dicts with keys as the file in the group, values the lowest diff score
         '''
         overwrite = self.args.overwrite or not store_checkpoints
         self.compare_result = CompareResult.load(
-            self.base_dir, self.compare_data.files_found, overwrite=overwrite)
+            self.base_dir, self.compare_data.files_found, overwrite=overwrite, higher_is_better=False)
         if self.compare_result.is_complete:
             return (self.compare_result.files_grouped, self.compare_result.file_groups)
-        n_files_found_even = Utils.round_up(self.compare_data.n_files_found, 5)
-        if self.compare_result.i > 1:
-            self._handle_progress(self.compare_result.i, n_files_found_even, gathering_data=False)
 
-        if self.compare_data.n_files_found > 5000:
-            logger.warning("\nWARNING: Large image file set found, comparison between all"
-                  + " images may take a while.\n")
         if self.verbose:
             logger.info("Identifying groups of similar image files...")
         else:
@@ -448,96 +588,17 @@ class CompareColors(BaseCompare):
         if self.compare_faces and len(self.compare_data.files_found) != len(self._file_faces):
             logger.error(f"Warning: Mismatch between files_found ({len(self.compare_data.files_found)}) and file_faces ({len(self._file_faces)})")
 
-        for i in range(self.compare_data.n_files_found):
-            if i == 0:  # At this roll index the data would compare to itself
-                continue
-            if store_checkpoints:
-                if i < self.compare_result.i:
-                    continue
-                if i % 250 == 0 and i != len(self.compare_data.files_found) and i > self.compare_result.i:
-                    self.compare_result.store()
-                self.compare_result.i = i
-            self._handle_progress(i, n_files_found_even, gathering_data=False)
+        file_colors = self._file_colors
+        faces = self._file_faces if self.compare_faces else None
+        for pairs_i, pairs_j, diff_scores in self._stream_tiled_pairs(
+                len(file_colors),
+                lambda start_row: self.tiled_color_pairs(file_colors, faces=faces, start_row=start_row),
+                store_checkpoints=store_checkpoints):
+            self.compare_result.add_pairs(
+                pairs_i, pairs_j, diff_scores,
+                duplicates=diff_scores < CompareColors.THRESHHOLD_POTENTIAL_DUPLICATE)
 
-            compare_file_colors = np.roll(self._file_colors, i, 0)
-            color_similars = self._compute_color_diff(
-                self._file_colors, compare_file_colors, True)
-
-            if self.compare_faces:
-                compare_file_faces = np.roll(self._file_faces, i, 0)
-                face_comparisons = self._file_faces - compare_file_faces
-                face_similars = face_comparisons == 0
-                similars = np.nonzero(color_similars[0] * face_similars)
-            else:
-                similars = np.nonzero(color_similars[0])
-
-            for base_index in similars[0]:
-                diff_index = ((base_index - i) %
-                              self.compare_data.n_files_found)
-                diff_score = color_similars[1][base_index]
-                f1_grouped = base_index in self.compare_result.files_grouped
-                f2_grouped = diff_index in self.compare_result.files_grouped
-
-                if diff_score < CompareColors.THRESHHOLD_POTENTIAL_DUPLICATE:
-                    base_file = self.compare_data.files_found[base_index]
-                    diff_file = self.compare_data.files_found[diff_index]
-                    if ((base_file, diff_file) not in self._probable_duplicates
-                            and (diff_file, base_file) not in self._probable_duplicates):
-                        self._probable_duplicates.append(
-                            (base_file, diff_file))
-
-                if not f1_grouped and not f2_grouped:
-                    self.compare_result.files_grouped[base_index] = (
-                        self.compare_result.group_index, diff_score)
-                    self.compare_result.files_grouped[diff_index] = (
-                        self.compare_result.group_index, diff_score)
-                    self.compare_result.group_index += 1
-                elif f1_grouped:
-                    existing_group_index, previous_diff_score = self.compare_result.files_grouped[
-                        base_index]
-                    if previous_diff_score - CompareColors.THRESHHOLD_GROUP_CUTOFF > diff_score:
-                        # logger.debug(f"Previous: {previous_diff_score} , New: {diff_score}")
-                        self.compare_result.files_grouped[base_index] = (
-                            self.compare_result.group_index, diff_score)
-                        self.compare_result.files_grouped[diff_index] = (
-                            self.compare_result.group_index, diff_score)
-                        self.compare_result.group_index += 1
-                    else:
-                        self.compare_result.files_grouped[diff_index] = (
-                            existing_group_index, diff_score)
-                else:
-                    existing_group_index, previous_diff_score = self.compare_result.files_grouped[
-                        diff_index]
-                    if previous_diff_score - CompareColors.THRESHHOLD_GROUP_CUTOFF > diff_score:
-                        # logger.debug(f"Previous: {previous_diff_score} , New: {diff_score}")
-                        self.compare_result.files_grouped[base_index] = (
-                            self.compare_result.group_index, diff_score)
-                        self.compare_result.files_grouped[diff_index] = (
-                            self.compare_result.group_index, diff_score)
-                        self.compare_result.group_index += 1
-                    else:
-                        self.compare_result.files_grouped[base_index] = (
-                            existing_group_index, diff_score)
-
-        # Validate indices before accessing files_found
-        return_current_results, should_restart = self._validate_checkpoint_data()
-        if should_restart:
-            return self.run_comparison(store_checkpoints=store_checkpoints)
-        if return_current_results:
-            return (self.compare_result.files_grouped, self.compare_result.file_groups)
-
-        for file_index in self.compare_result.files_grouped:
-            _file = self.compare_data.files_found[file_index]
-            group_index, diff_score = self.compare_result.files_grouped[file_index]
-            if group_index in self.compare_result.file_groups:
-                file_group = self.compare_result.file_groups[group_index]
-            else:
-                file_group = {}
-            file_group[_file] = diff_score
-            self.compare_result.file_groups[group_index] = file_group
-
-        self.compare_result.finalize_group_result()
-        return (self.compare_result.files_grouped, self.compare_result.file_groups)
+        return self._finish_comparison(store_checkpoints=store_checkpoints)
 
     def run(self, store_checkpoints=False):
         '''
@@ -552,9 +613,6 @@ class CompareColors(BaseCompare):
         return sorted(file_groups,
                       key=lambda group_index: len(file_groups[group_index]))
 
-    def get_probable_duplicates(self):
-        return self._probable_duplicates
-
     def remove_from_groups(self, removed_files=[]):
         # TODO technically it would be better to refresh the file and data lists every time a compare is done
         remove_indexes = []
@@ -563,12 +621,8 @@ class CompareColors(BaseCompare):
                 remove_indexes.append(self.compare_data.files_found.index(f))
         remove_indexes.sort()
 
-        if len(self._file_colors) > 0:
-            self._file_colors = np.delete(
-                self._file_colors, remove_indexes, axis=0)
-        if len(self._file_faces) > 0:
-            self._file_faces = np.delete(
-                self._file_faces, remove_indexes, axis=0)
+        self._file_colors_array.delete(remove_indexes)
+        self._file_faces_array.delete(remove_indexes)
 
         for f in removed_files:
             if f in self.compare_data.files_found:
@@ -2,7 +2,12 @@ import os
 import pickle
 import sys
 
-from utils.constants import CompareMode
+import numpy as np
+
+from compare.ann_index import IVFIndex
+from compare.feature_store import FeatureStore
+from utils.config import config
+from utils.constants import CompareMode, EmbeddingPrecision
 from utils.logging_setup import get_logger
 
 logger = get_logger("compare_data")
@@ -20,6 +25,8 @@ class CompareData:
     PROMPTS_EXACT_DATA = "image_prompts_exact.pkl"
     SIZE_DATA = "image_sizes.pkl"
     MODELS_DATA = "image_models.pkl"
+    HASH_DATA = "image_hashes.pkl"
+    FILE_HASHES_DATA = "file_hashes.pkl"
     THUMB_COLORS_DATA = "image_thumb_colors.pkl"
     TOP_COLORS_DATA = "image_top_colors.pkl"
     FACES_DATA = "image_faces.pkl"
@@ -71,11 +78,41 @@ class CompareData:
         elif mode == CompareMode.MODELS:
             self._file_data_filepath = os.path.join(
                 base_dir, CompareData.MODELS_DATA)
+        elif mode == CompareMode.PERCEPTUAL_HASH:
+            self._file_data_filepath = os.path.join(
+                base_dir, CompareData.HASH_DATA)
+        elif mode == CompareMode.EXACT_DUPLICATES:
+            self._file_data_filepath = os.path.join(
+                base_dir, CompareData.FILE_HASHES_DATA)
         else:
             raise Exception("Invalid mode")
 
+        # Fixed-size numeric features are kept in a memory-mapped store next to
+        # the legacy pickle, e.g. image_embeddings.npy + image_embeddings.index.pkl
+        self._feature_store_base = None
+        self._feature_store_dtype = np.float32
+        # Large embedding stores also get an IVF index for approximate nearest
+        # neighbour queries, persisted next to the store (image_embeddings.ivf.npz)
+        self._uses_ann_index = False
+        self.ann_index = None
+        if mode.is_embedding() and mode != CompareMode.PROMPTS:
+            self._feature_store_base = os.path.splitext(self._file_data_filepath)[0]
+            self._uses_ann_index = True
+            # Reduced precision embeddings are persisted as float16, int8 codes
+            # are only used in memory as the store holds a single dtype
+            if config.embedding_precision != EmbeddingPrecision.FLOAT32:
+                self._feature_store_dtype = np.float16
+        elif mode == CompareMode.COLOR_MATCHING and use_thumb:
+            self._feature_store_base = os.path.splitext(self._file_data_filepath)[0]
+            self._feature_store_dtype = np.float64
+
+    def uses_feature_store(self):
+        return self._feature_store_base is not None
+
     def load_data(self, overwrite=False, compare_faces=False):
-        if overwrite or not os.path.exists(self._file_data_filepath):
+        if self.uses_feature_store():
+            self._load_feature_store(overwrite, compare_faces)
+        elif overwrite or not os.path.exists(self._file_data_filepath):
             if not os.path.exists(self._file_data_filepath):
                 logger.info("Image data not found so creating new cache"
                       + " - this may take a while.")
@@ -86,16 +123,49 @@ class CompareData:
         else:
             with open(self._file_data_filepath, "rb") as f:
                 self.file_data_dict = pickle.load(f)
-            if compare_faces:
+            if compare_faces and os.path.exists(self._file_faces_filepath):
                 with open(self._file_faces_filepath, "rb") as f:
                     self.file_faces_dict = pickle.load(f)
             else:
                 self.file_faces_dict = {}
 
+    def _load_feature_store(self, overwrite=False, compare_faces=False):
+        store = FeatureStore(self._feature_store_base, dtype=self._feature_store_dtype)
+        if overwrite:
+            logger.info("Overwriting image data caches - this may take a while.")
+            store.clear()
+        elif FeatureStore.exists_at(self._feature_store_base):
+            store.open()
+            if store.dtype != np.dtype(self._feature_store_dtype):
+                logger.info(f"Converting image data cache from {store.dtype} to {np.dtype(self._feature_store_dtype)}")
+                store.convert(self._feature_store_dtype)
+                self.has_new_file_data = True
+        elif os.path.exists(self._file_data_filepath):
+            logger.info(f"Migrating image data cache to memory-mapped store: {self._file_data_filepath}")
+            with open(self._file_data_filepath, "rb") as f:
+                store.migrate_from_dict(pickle.load(f))
+        else:
+            logger.info("Image data not found so creating new cache"
+                  + " - this may take a while.")
+            store.clear()
+        self.file_data_dict = store
+        if compare_faces and not overwrite and os.path.exists(self._file_faces_filepath):
+            with open(self._file_faces_filepath, "rb") as f:
+                self.file_faces_dict = pickle.load(f)
+        else:
+            self.file_faces_dict = {}
+
     def save_data(self, overwrite=False, verbose=False, compare_faces=False):
         if self.has_new_file_data or overwrite:
-            with open(self._file_data_filepath, "wb") as store:
-                pickle.dump(self.file_data_dict, store)
+            if isinstance(self.file_data_dict, FeatureStore):
+                self.file_data_dict.flush()
+                self._update_ann_index(self.file_data_dict)
+                self.file_data_dict.close()
+                saved_data_filepath = self.file_data_dict.matrix_path
+            else:
+                saved_data_filepath = self._file_data_filepath
+                with open(self._file_data_filepath, "wb") as store:
+                    pickle.dump(self.file_data_dict, store)
             if compare_faces:
                 with open(self._file_faces_filepath, "wb") as store:
                     pickle.dump(self.file_faces_dict, store)
@@ -108,9 +178,11 @@ class CompareData:
                     logger.info("Overwrote any pre-existing image data at:")
                 else:
                     logger.info("Updated image data saved to: ")
-                logger.info(self._file_data_filepath)
+                logger.info(saved_data_filepath)
                 if compare_faces:
                     logger.info(self._file_faces_filepath)
+        elif isinstance(self.file_data_dict, FeatureStore):
+            self._update_ann_index(self.file_data_dict)
 
         self.n_files_found = len(self.files_found)
 
@@ -122,6 +194,42 @@ class CompareData:
             logger.info("Data from " + str(self.n_files_found)
                   + " files compiled for comparison.")
     
+    def _update_ann_index(self, store):
+        '''
+        Load the persisted IVF index for the store, rebuilding it if the store
+        was rewritten or has grown well past the data the index was trained on,
+        and index any rows added since it was saved. The index is then remapped
+        from store rows to positions in files_found.
+        '''
+        self.ann_index = None
+        if not self._uses_ann_index or len(self.files_found) < config.embedding_ann_min_files:
+            return
+        matrix = store.matrix
+        if matrix.ndim != 2 or len(matrix) == 0:
+            return
+        index_path = IVFIndex.path_for(self._feature_store_base)
+        index = None
+        if os.path.exists(index_path):
+            try:
+                index = IVFIndex.load(index_path)
+            except Exception as e:
+                logger.warning(f"Failed to load ANN index {index_path}, rebuilding: {e}")
+        if (index is None or index.generation != store.generation or index.dim != matrix.shape[1]
+                or index.pq_subspaces != config.embedding_ann_pq_subspaces
+                or index.n_trained * IVFIndex.RETRAIN_GROWTH < len(matrix)):
+            logger.info(f"Building ANN index for {len(matrix)} embeddings - this may take a while.")
+            index = IVFIndex(IVFIndex.n_lists_for(len(matrix)), pq_subspaces=config.embedding_ann_pq_subspaces)
+            index.train(matrix)
+            index.generation = store.generation
+        if index.n_indexed < len(matrix):
+            index.add(matrix[index.n_indexed:], np.arange(index.n_indexed, len(matrix)))
+            index.save(index_path)
+        rows = store.rows_for(self.files_found)
+        id_map = np.full(len(matrix), -1, dtype=np.int64)
+        found = rows >= 0
+        id_map[rows[found]] = np.flatnonzero(found)
+        self.ann_index = index.remap(id_map)
+
     def estimate_memory_size(self) -> int:
         """
         Estimate the memory size of this CompareData instance in bytes.
@@ -138,7 +246,9 @@ class CompareData:
             for file_path in self.files_found:
                 total_size += sys.getsizeof(file_path)
         # Size of file_data_dict (dictionary of embeddings)
-        if self.file_data_dict is not None:
+        if isinstance(self.file_data_dict, FeatureStore):
+            total_size += self.file_data_dict.estimate_memory_size()
+        elif self.file_data_dict is not None:
             total_size += sys.getsizeof(self.file_data_dict)
             # Estimate size of embeddings (each embedding is a list of floats)
             # CLIP embeddings are typically 512 floats = ~2KB per embedding
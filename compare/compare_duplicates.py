@@ -0,0 +1,340 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+
+import numpy as np
+from PIL import Image
+
+from compare.base_compare import BaseCompare, gather_files
+from compare.compare_args import CompareArgs
+from compare.compare_data import CompareData
+from compare.compare_result import CompareResult
+from image.image_dimensions import image_dimensions
+from utils.config import config
+from utils.constants import CompareMode
+from utils.logging_setup import get_logger
+from utils.translations import I18N
+from utils.utils import Utils
+
+_ = I18N._
+
+logger = get_logger("compare_duplicates")
+
+PARTIAL_HASH_BYTES = 64 * 1024
+
+
+def partial_file_hash(filepath, size, n_bytes=PARTIAL_HASH_BYTES):
+    '''
+    Hash of the first and last n_bytes of a file. Files of up to 2 * n_bytes
+    are hashed whole, so their partial hash is also their full hash.
+    '''
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        if size <= 2 * n_bytes:
+            sha256.update(f.read())
+        else:
+            sha256.update(f.read(n_bytes))
+            f.seek(-n_bytes, os.SEEK_END)
+            sha256.update(f.read(n_bytes))
+    return sha256.hexdigest()
+
+
+def full_file_hash(filepath):
+    with open(filepath, "rb") as f:
+        sha256 = hashlib.sha256()
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def pixel_hash(filepath):
+    '''
+    Hash of the decoded RGB pixels of an image, which is the same for copies
+    that differ only in their metadata or encoding.
+    '''
+    with Image.open(filepath) as img:
+        pixels = np.asarray(img.convert("RGB"))
+    sha256 = hashlib.sha256()
+    sha256.update(str(pixels.shape).encode())
+    sha256.update(pixels.tobytes())
+    return sha256.hexdigest()
+
+
+def _collisions(paths, keys):
+    '''
+    Lists of the paths that share a key with at least one other path. Paths
+    whose key is None are left out.
+    '''
+    buckets = {}
+    for path in paths:
+        key = keys[path]
+        if key is not None:
+            buckets.setdefault(key, []).append(path)
+    return [bucket for bucket in buckets.values() if len(bucket) > 1]
+
+
+def _cached_values(paths, entries, key, func, executor):
+    '''
+    Look up a cached value for each path, computing the missing values on the
+    executor. Values that could not be computed are None and not cached.
+    '''
+    missing = [path for path in paths if key not in entries[path]]
+
+    def compute(path):
+        try:
+            return func(path)
+        except Exception as e:
+            logger.error(f"{path} - {e}")
+            return None
+
+    for path, value in zip(missing, executor.map(compute, missing)):
+        if value is not None:
+            entries[path][key] = value
+    return {path: entries[path].get(key) for path in paths}
+
+
+def find_duplicate_groups(paths, entries, match_pixels=False, n_workers=None):
+    '''
+    Find groups of files with identical content.
+
+    Files are only read as far as needed to tell them apart: files with a
+    unique size are never opened, files whose first and last 64 KiB differ
+    are not read further, and only the remaining collisions are hashed in
+    full. If match_pixels is set, images that are not byte identical but
+    share their dimensions are also decoded and compared by pixel hash, to
+    find copies that differ only in their metadata.
+
+    :param entries: Cache of file data by path, each a dict with at least the
+        "size" of the file. Hashes computed here are added to it, so entries
+        must be discarded when a file's size or modification time changes.
+    :returns: List of groups, each a list of at least two paths.
+    '''
+    n_workers = n_workers or config.file_hash_workers
+    with ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
+        same_size = [path for bucket in _collisions(paths, {p: entries[p]["size"] for p in paths}) for path in bucket]
+        partial_hashes = _cached_values(
+            same_size, entries, "partial_hash",
+            lambda path: partial_file_hash(path, entries[path]["size"]), executor)
+        keys = {path: (entries[path]["size"], partial_hashes[path]) if partial_hashes[path] is not None else None
+                for path in same_size}
+        same_partial = [path for bucket in _collisions(same_size, keys) for path in bucket]
+        needs_full_hash = [path for path in same_partial if entries[path]["size"] > 2 * PARTIAL_HASH_BYTES]
+        full_hashes = _cached_values(needs_full_hash, entries, "full_hash", full_file_hash, executor)
+        for path in needs_full_hash:
+            keys[path] = (entries[path]["size"], full_hashes[path]) if full_hashes[path] is not None else None
+        groups = _collisions(same_partial, keys)
+
+        if match_pixels:
+            groups = _merge_pixel_groups(paths, entries, groups, executor)
+
+    return groups
+
+
+def _merge_pixel_groups(paths, entries, groups, executor):
+    '''
+    Join the byte identical groups and the remaining files whose decoded
+    pixels are identical. Each byte identical group is decoded only once.
+    '''
+    group_of = {}
+    for group_index, group in enumerate(groups):
+        for path in group:
+            group_of[path] = group_index
+    representatives = [path for path in paths if path not in group_of or groups[group_of[path]][0] == path]
+
+    # Read from the image headers and cached by the shared dimensions service
+    dimensions = dict(zip(representatives, executor.map(image_dimensions.get_dimensions, representatives)))
+    image_dimensions.flush()
+    same_dimensions = [path for bucket in _collisions(representatives, dimensions) for path in bucket]
+    pixel_hashes = _cached_values(same_dimensions, entries, "pixel_hash", pixel_hash, executor)
+
+    merged = []
+    merged_group_indexes = set()
+    for bucket in _collisions(same_dimensions, pixel_hashes):
+        merged_group = []
+        for path in bucket:
+            if path in group_of:
+                merged_group_indexes.add(group_of[path])
+                merged_group.extend(groups[group_of[path]])
+            else:
+                merged_group.append(path)
+        merged.append(merged_group)
+    merged.extend(group for group_index, group in enumerate(groups) if group_index not in merged_group_indexes)
+    return merged
+
+
+class CompareDuplicates(BaseCompare):
+    '''
+    Finds files with identical content, or with identical decoded pixels if
+    config.duplicates_match_pixels is set. Files are gathered from the base
+    directory and any additional directories in the args.
+    '''
+    COMPARE_MODE = CompareMode.EXACT_DUPLICATES
+    SEARCH_OUTPUT_FILE = "weidr_search_output.txt"
+    GROUPS_OUTPUT_FILE = "weidr_file_groups_output.txt"
+
+    def __init__(self, args=CompareArgs(), gather_files_func=gather_files):
+        super().__init__(args, gather_files_func)
+        self._duplicate_groups = []
+
+    def set_base_dir(self, base_dir):
+        '''
+        Set the base directory and prepare cache file references.
+        '''
+        self.base_dir = base_dir
+        self.search_output_path = os.path.join(base_dir, CompareDuplicates.SEARCH_OUTPUT_FILE)
+        self.groups_output_path = os.path.join(base_dir, CompareDuplicates.GROUPS_OUTPUT_FILE)
+        self.compare_data = CompareData(base_dir=base_dir, mode=CompareMode.EXACT_DUPLICATES)
+        self.compare_result = CompareResult(base_dir=base_dir, higher_is_better=False)
+
+    def get_files(self):
+        '''
+        Get all files in the base dir and the additional dirs as requested by
+        the parameters.
+        '''
+        super().get_files()
+        for extra_dir in self.args.additional_dirs:
+            extra_files = self.gather_files_func(
+                base_dir=extra_dir, exts=config.image_types, recursive=self.args.recursive,
+                include_videos=self.args.include_videos, include_gifs=self.args.include_gifs,
+                include_pdfs=self.args.include_pdfs)
+            known_files = set(self.files)
+            self.files.extend(sorted(f for f in extra_files if f not in known_files))
+        self.max_files_processed = min(self.args.counter_limit, len(self.files))
+        self.max_files_processed_even = Utils.round_up(self.max_files_processed, 200)
+
+    def print_settings(self):
+        logger.info("|--------------------------------------------------------------------|")
+        logger.info(" CONFIGURATION SETTINGS:")
+        logger.info(f" run search: {self.is_run_search}")
+        if self.is_run_search:
+            logger.info(f" search_file_path: {self.search_file_path}")
+        logger.info(f" comparison files base directory: {self.base_dir}")
+        logger.info(f" additional directories: {self.args.additional_dirs}")
+        logger.info(f" match decoded pixels: {config.duplicates_match_pixels}")
+        logger.info(f" max file process limit: {self.args.counter_limit}")
+        logger.info(f" max files processable: {self.max_files_processed}")
+        logger.info(f" recursive: {self.args.recursive}")
+        logger.info(f" file glob pattern: {self.args.inclusion_pattern}")
+        logger.info(f" file hashes filepath: {self.compare_data._file_data_filepath}")
+        logger.info(f" overwrite image data: {self.args.overwrite}")
+        logger.info("|--------------------------------------------------------------------|\n\n")
+
+    def get_similarity_threshold(self):
+        return 0
+
+    def get_data(self):
+        '''
+        Stat all found files, reusing the cached hashes of files whose size
+        and modification time are unchanged, and find the duplicate groups.
+        '''
+        self.compare_data.load_data(overwrite=self.args.overwrite)
+        entries = self.compare_data.file_data_dict
+
+        if self.verbose:
+            logger.info("Gathering file data...")
+        else:
+            print("Gathering file data", end="", flush=True)
+
+        counter = 0
+        for f in self.files:
+            if self.is_cancelled():
+                self.raise_cancellation_exception()
+            if Utils.is_invalid_file(f, counter, self.is_run_search, self.args.inclusion_pattern):
+                continue
+            if counter > self.args.counter_limit:
+                break
+            # Stat here rather than reusing the directory scan: a listing shared
+            # through directory_listing_cache stays valid while files in it are
+            # modified, so sizes from the scan could be out of date
+            try:
+                stat = os.stat(f)
+            except OSError as e:
+                logger.error(f"{f} - {e}")
+                continue
+            entry = entries.get(f)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+                entries[f] = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+                self.compare_data.has_new_file_data = True
+            counter += 1
+            self.compare_data.files_found.append(f)
+            self._handle_progress(counter, self.max_files_processed_even)
+
+        n_cached_values = sum(len(entries[f]) for f in self.compare_data.files_found)
+        self._duplicate_groups = find_duplicate_groups(
+            self.compare_data.files_found, entries, match_pixels=config.duplicates_match_pixels)
+        if sum(len(entries[f]) for f in self.compare_data.files_found) != n_cached_values:
+            self.compare_data.has_new_file_data = True
+        self.compare_data.save_data(self.args.overwrite, verbose=self.verbose)
+
+    def run_search(self):
+        '''
+        Find the duplicates of the search file.
+        '''
+        files_grouped = {0: {}}
+        for group in self._duplicate_groups:
+            if self.search_file_path in group:
+                files_grouped[0] = {f: 0 for f in group if f != self.search_file_path}
+        self.compare_result.files_grouped = files_grouped[0]
+        self.compare_result.finalize_search_result(
+            self.search_file_path, verbose=self.verbose, is_embedding=False,
+            threshold_duplicate=1, threshold_related=1)
+        return files_grouped
+
+    def find_similars_to_image(self, search_path, search_file_index):
+        return self.run_search()
+
+    def run_comparison(self, store_checkpoints=False):
+        '''
+        Group the files found to have identical content.
+        '''
+        self.compare_result = CompareResult.load(
+            self.base_dir, self.compare_data.files_found, overwrite=True, higher_is_better=False)
+        file_indexes = {f: i for i, f in enumerate(self.compare_data.files_found)}
+        for group in self._duplicate_groups:
+            indexes = sorted(file_indexes[f] for f in group)
+            for index1, index2 in zip(indexes[:-1], indexes[1:]):
+                self.compare_result.add_pair(index1, index2, 0, is_duplicate=True)
+        return self._finish_comparison(store_checkpoints=store_checkpoints)
+
+    def run(self, store_checkpoints=False):
+        '''
+        Runs the specified operation on this Compare.
+        '''
+        if self.is_run_search:
+            return self.run_search()
+        else:
+            return self.run_comparison(store_checkpoints=store_checkpoints)
+
+    def remove_from_groups(self, removed_files=[]):
+        removed = set(removed_files)
+        self.compare_data.files_found = [f for f in self.compare_data.files_found if f not in removed]
+        self.compare_data.n_files_found = len(self.compare_data.files_found)
+        groups = [[f for f in group if f not in removed] for group in self._duplicate_groups]
+        self._duplicate_groups = [group for group in groups if len(group) > 1]
+
+    @staticmethod
+    def is_related(image1, image2):
+        """
+        Determine relation by comparing file contents.
+        """
+        try:
+            size1 = os.path.getsize(image1)
+            size2 = os.path.getsize(image2)
+            if size1 == size2 and partial_file_hash(image1, size1) == partial_file_hash(image2, size2):
+                if size1 <= 2 * PARTIAL_HASH_BYTES or full_file_hash(image1) == full_file_hash(image2):
+                    return True
+            if config.duplicates_match_pixels:
+                dimensions1 = image_dimensions.get_dimensions(image1)
+                return dimensions1 is not None and dimensions1 == image_dimensions.get_dimensions(image2) \
+                    and pixel_hash(image1) == pixel_hash(image2)
+            return False
+        except OSError as e:
+            logger.error(f"{image1} or {image2} - {e}")
+            raise AssertionError(
+                "Encountered an error accessing the provided file paths in the file system.")
+        except Exception as e:
+            logger.error(e)
+            return False
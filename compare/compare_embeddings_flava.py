@@ -3,7 +3,8 @@ import numpy as np
 from compare.base_compare import gather_files
 from compare.base_compare_embedding import BaseCompareEmbedding, main
 from compare.compare_args import CompareArgs
-from compare.model import image_embeddings_flava, text_embeddings_flava
+from compare.model import image_embeddings_flava, image_embeddings_flava_preprocessed, image_preprocess_flava, text_embeddings_flava
+from compare.text_embedding_cache import TextEmbeddingCache
 from utils.config import config
 from utils.constants import CompareMode
 
@@ -13,7 +14,7 @@ class CompareEmbeddingFlava(BaseCompareEmbedding):
     THRESHHOLD_POTENTIAL_DUPLICATE = config.threshold_potential_duplicate_embedding
     THRESHHOLD_PROBABLE_MATCH = 0.98
     THRESHHOLD_GROUP_CUTOFF = 4500  # TODO fix this for Embedding case
-    TEXT_EMBEDDING_CACHE = {}
+    TEXT_EMBEDDING_CACHE = TextEmbeddingCache.for_model("flava")
     MULTI_EMBEDDING_CACHE = {} # keys are tuples of the filename + any text embedding search combination, values are combined similarity
 
     def __init__(self, args=CompareArgs(), gather_files_func=gather_files):
@@ -24,6 +25,8 @@ class CompareEmbeddingFlava(BaseCompareEmbedding):
         self.threshold_probable_match = CompareEmbeddingFlava.THRESHHOLD_PROBABLE_MATCH
         self.threshold_group_cutoff = CompareEmbeddingFlava.THRESHHOLD_GROUP_CUTOFF
         self.image_embeddings_func = image_embeddings_flava
+        self.image_preprocess_func = image_preprocess_flava
+        self.image_embeddings_preprocessed_func = image_embeddings_flava_preprocessed
         self.text_embeddings_func = text_embeddings_flava
         self.text_embedding_cache = CompareEmbeddingFlava.TEXT_EMBEDDING_CACHE
         self.multi_embedding_cache = CompareEmbeddingFlava.MULTI_EMBEDDING_CACHE
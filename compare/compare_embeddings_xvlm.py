@@ -3,7 +3,8 @@ import numpy as np
 from compare.base_compare import gather_files
 from compare.base_compare_embedding import BaseCompareEmbedding, main
 from compare.compare_args import CompareArgs
-from compare.model import xvlm_loaded, image_embeddings_xvlm, text_embeddings_xvlm
+from compare.model import is_xvlm_loaded, image_embeddings_xvlm, image_embeddings_xvlm_preprocessed, image_preprocess_xvlm, text_embeddings_xvlm
+from compare.text_embedding_cache import TextEmbeddingCache
 from utils.config import config
 from utils.constants import CompareMode
 
@@ -13,7 +14,7 @@ class CompareEmbeddingXVLM(BaseCompareEmbedding):
     THRESHHOLD_POTENTIAL_DUPLICATE = config.threshold_potential_duplicate_embedding
     THRESHHOLD_PROBABLE_MATCH = 0.98
     THRESHHOLD_GROUP_CUTOFF = 4500  # TODO fix this for Embedding case
-    TEXT_EMBEDDING_CACHE = {}
+    TEXT_EMBEDDING_CACHE = TextEmbeddingCache.for_model("xvlm", lambda: config.xvlm_model_size)
     MULTI_EMBEDDING_CACHE = {} # keys are tuples of the filename + any text embedding search combination, values are combined similarity
 
     def __init__(self, args=CompareArgs(), gather_files_func=gather_files):
@@ -24,12 +25,14 @@ class CompareEmbeddingXVLM(BaseCompareEmbedding):
         self.threshold_probable_match = CompareEmbeddingXVLM.THRESHHOLD_PROBABLE_MATCH
         self.threshold_group_cutoff = CompareEmbeddingXVLM.THRESHHOLD_GROUP_CUTOFF
         self.image_embeddings_func = image_embeddings_xvlm
+        self.image_preprocess_func = image_preprocess_xvlm
+        self.image_embeddings_preprocessed_func = image_embeddings_xvlm_preprocessed
         self.text_embeddings_func = text_embeddings_xvlm
         self.text_embedding_cache = CompareEmbeddingXVLM.TEXT_EMBEDDING_CACHE
         self.multi_embedding_cache = CompareEmbeddingXVLM.MULTI_EMBEDDING_CACHE
 
     def is_runnable(self):
-        return xvlm_loaded
+        return is_xvlm_loaded()
 
 
 if __name__ == "__main__":
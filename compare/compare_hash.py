@@ -0,0 +1,259 @@
+import os
+from contextlib import closing
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from compare.base_compare import BaseCompare, gather_files
+from compare.compare_args import CompareArgs
+from compare.compare_data import CompareData
+from compare.compare_result import CompareResult
+from compare.hash_index import MultiIndexHash, hamming_distances
+from compare.pipeline import PipelineStage
+from image.frame_cache import FrameCache
+from utils.config import config
+from utils.constants import CompareMode
+from utils.logging_setup import get_logger
+from utils.translations import I18N
+from utils.utils import Utils
+
+_ = I18N._
+
+logger = get_logger("compare_hash")
+
+
+def dhash_image(image: Image.Image, hash_size: int = 8) -> int:
+    '''
+    Difference hash of an image: the sign of the brightness gradient between
+    horizontally adjacent pixels of a (hash_size + 1) x hash_size grayscale
+    thumbnail, packed into a hash_size ** 2 bit integer.
+    '''
+    # Let JPEG decoding skip straight to a reduced scale
+    image.draft("L", (hash_size * 8, hash_size * 8))
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR),
+                        dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).reshape(-1)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def extract_hash_from_image(image_path: str) -> Optional[int]:
+    """
+    Compute the 64 bit difference hash of an image file.
+    Returns the hash or None if the image cannot be read.
+    """
+    try:
+        image_path = FrameCache.get_image_path(image_path)
+        with Image.open(image_path) as img:
+            return dhash_image(img)
+    except Exception as e:
+        logger.error(f"Error computing hash for {image_path}: {e}")
+        return None
+
+
+class CompareHash(BaseCompare):
+    '''
+    Finds visually identical or re-encoded copies by the Hamming distance
+    between 64 bit difference hashes. Groups are found with a multi-index hash
+    rather than by comparing every pair of files, and searches are a single
+    vectorized distance over all hashes, so this mode is cheap enough to use
+    as a pre-filter for the embedding modes.
+    '''
+    COMPARE_MODE = CompareMode.PERCEPTUAL_HASH
+    SEARCH_OUTPUT_FILE = "weidr_search_output.txt"
+    GROUPS_OUTPUT_FILE = "weidr_file_groups_output.txt"
+    HASH_DATA = "image_hashes.pkl"
+    THRESHOLD_POTENTIAL_DUPLICATE = 3
+
+    def __init__(self, args=CompareArgs(), gather_files_func=gather_files):
+        super().__init__(args, gather_files_func)
+        self.hash_distance_threshold = config.hash_distance_threshold
+        self._file_hashes = np.empty(0, dtype=np.uint64)
+        self.compare_data = CompareData(base_dir=self.base_dir, mode=CompareMode.PERCEPTUAL_HASH)
+        if hasattr(args, 'threshold'):
+            self.set_similarity_threshold(args.threshold)
+
+    def set_base_dir(self, base_dir):
+        '''
+        Set the base directory and prepare cache file references.
+        '''
+        self.base_dir = base_dir
+        self.search_output_path = os.path.join(base_dir, CompareHash.SEARCH_OUTPUT_FILE)
+        self.groups_output_path = os.path.join(base_dir, CompareHash.GROUPS_OUTPUT_FILE)
+        self.compare_data = CompareData(base_dir=base_dir, mode=CompareMode.PERCEPTUAL_HASH)
+        self.compare_result = CompareResult(base_dir=base_dir, higher_is_better=False)
+
+    def print_settings(self):
+        logger.info("|--------------------------------------------------------------------|")
+        logger.info(" CONFIGURATION SETTINGS:")
+        logger.info(f" run search: {self.is_run_search}")
+        if self.is_run_search:
+            logger.info(f" search_file_path: {self.search_file_path}")
+        logger.info(f" comparison files base directory: {self.base_dir}")
+        logger.info(f" hash distance threshold: {self.hash_distance_threshold}")
+        logger.info(f" max file process limit: {self.args.counter_limit}")
+        logger.info(f" max files processable for base dir: {self.max_files_processed}")
+        logger.info(f" recursive: {self.args.recursive}")
+        logger.info(f" file glob pattern: {self.args.inclusion_pattern}")
+        logger.info(f" include videos: {self.args.include_videos}")
+        logger.info(f" file hashes filepath: {self.compare_data._file_data_filepath}")
+        logger.info(f" overwrite image data: {self.args.overwrite}")
+        logger.info("|--------------------------------------------------------------------|\n\n")
+
+    def get_similarity_threshold(self):
+        return self.hash_distance_threshold
+
+    def set_similarity_threshold(self, threshold):
+        # The threshold is the maximum Hamming distance between hashes. Values
+        # carried over from the other modes' similarity scales are ignored.
+        try:
+            threshold = float(threshold)
+        except (TypeError, ValueError):
+            return
+        if threshold >= 0 and threshold.is_integer():
+            self.hash_distance_threshold = int(threshold)
+
+    def get_data(self):
+        '''
+        For all the found files in the base directory, either load the cached
+        hash or compute it and add it to the cache.
+        '''
+        self.compare_data.load_data(overwrite=self.args.overwrite)
+
+        if self.verbose:
+            logger.info("Gathering hash data...")
+        else:
+            print("Gathering hash data", end="", flush=True)
+
+        counter = 0
+        hashes = []
+        file_data_dict = self.compare_data.file_data_dict
+        files_to_hash = (f for i, f in enumerate(self.files)
+                         if not Utils.is_invalid_file(f, i, self.is_run_search, self.args.inclusion_pattern))
+
+        # Hashes are computed in parallel threads, results come back in file order
+        stages = [PipelineStage("hash", extract_hash_from_image, workers=self.pipeline_workers())]
+        with closing(self._run_pipeline(stages, files_to_hash, is_done=lambda f: f in file_data_dict)) as results:
+            for f, image_hash, error in results:
+                # Files that could not be hashed do not count toward the limit
+                if counter > self.args.counter_limit:
+                    break
+                if f in file_data_dict:
+                    image_hash = file_data_dict[f]
+                elif error is not None or image_hash is None:
+                    continue
+                else:
+                    file_data_dict[f] = image_hash
+                    self.compare_data.has_new_file_data = True
+
+                counter += 1
+                hashes.append(image_hash)
+                self.compare_data.files_found.append(f)
+                self._handle_progress(counter, self.max_files_processed_even)
+
+        self._file_hashes = np.array(hashes, dtype=np.uint64)
+        self.compare_data.save_data(self.args.overwrite, verbose=self.verbose)
+
+    def find_similars_to_image(self, search_path, search_file_index):
+        return self.search_multimodal()
+
+    def search_multimodal(self):
+        '''
+        Search for images whose hashes are within the distance threshold of
+        the search image's hash. Text search is not supported for this mode.
+        '''
+        files_grouped = {0: {}}
+        search_path = self.args.search_file_path
+        if search_path is None or search_path.strip() == "":
+            logger.error("Perceptual hash search requires a search image.")
+            return files_grouped
+
+        if search_path in self.compare_data.files_found:
+            search_index = self.compare_data.files_found.index(search_path)
+            search_hash = self._file_hashes[search_index]
+        else:
+            search_index = None
+            search_hash = extract_hash_from_image(search_path)
+            if search_hash is None:
+                logger.error(f"Could not compute hash for search image: {search_path}")
+                return files_grouped
+
+        distances = hamming_distances(self._file_hashes, np.uint64(search_hash))
+        if search_index is not None:
+            distances[search_index] = self.hash_distance_threshold + 1
+        matches = np.nonzero(distances <= self.hash_distance_threshold)[0]
+        matches = matches[np.argsort(distances[matches], kind="stable")]
+        if not config.search_only_return_closest:
+            matches = matches[:config.max_search_results]
+        files_grouped[0] = {self.compare_data.files_found[i]: int(distances[i]) for i in matches.tolist()}
+
+        self.compare_result.files_grouped = files_grouped[0]
+        self.compare_result.finalize_search_result(
+            search_path, verbose=self.verbose, is_embedding=False,
+            threshold_duplicate=CompareHash.THRESHOLD_POTENTIAL_DUPLICATE,
+            threshold_related=self.hash_distance_threshold + 1)
+        return files_grouped
+
+    def run_search(self):
+        return self.search_multimodal()
+
+    def run_comparison(self, store_checkpoints=False):
+        '''
+        Group all found files whose hashes are within the distance threshold.
+        '''
+        overwrite = self.args.overwrite or not store_checkpoints
+        self.compare_result = CompareResult.load(
+            self.base_dir, self.compare_data.files_found, overwrite=overwrite, higher_is_better=False)
+        if self.compare_result.is_complete:
+            return (self.compare_result.files_grouped, self.compare_result.file_groups)
+
+        if self.verbose:
+            logger.info("Identifying groups of files with similar hashes...")
+        else:
+            print("Identifying groups of files with similar hashes", end="", flush=True)
+
+        index = MultiIndexHash(self._file_hashes, self.hash_distance_threshold)
+        for indexes1, indexes2, distances in index.pairs():
+            if self.is_cancelled():
+                self.raise_cancellation_exception()
+            self.compare_result.add_pairs(
+                indexes1, indexes2, distances,
+                duplicates=distances < CompareHash.THRESHOLD_POTENTIAL_DUPLICATE)
+
+        return self._finish_comparison(store_checkpoints=store_checkpoints)
+
+    def run(self, store_checkpoints=False):
+        '''
+        Runs the specified operation on this Compare.
+        '''
+        if self.is_run_search:
+            return self.run_search()
+        else:
+            return self.run_comparison(store_checkpoints=store_checkpoints)
+
+    def remove_from_groups(self, removed_files=[]):
+        keep = [f not in removed_files for f in self.compare_data.files_found]
+        self._file_hashes = self._file_hashes[np.array(keep, dtype=bool)]
+        self.compare_data.files_found = [f for f, k in zip(self.compare_data.files_found, keep) if k]
+        self.compare_data.n_files_found = len(self.compare_data.files_found)
+
+    @staticmethod
+    def is_related(image1, image2):
+        """
+        Determine relation by the distance between the images' hashes.
+        """
+        try:
+            hash1 = extract_hash_from_image(image1)
+            hash2 = extract_hash_from_image(image2)
+        except OSError as e:
+            logger.error(f"{image1} or {image2} - {e}")
+            raise AssertionError(
+                "Encountered an error accessing the provided file paths in the file system.")
+        except Exception as e:
+            logger.error(e)
+            return False
+
+        if hash1 is None or hash2 is None:
+            return False
+
+        return int(hamming_distances(np.uint64(hash1), np.uint64(hash2))) <= config.hash_distance_threshold
@@ -1,10 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 from enum import Enum
 
+from compare.base_compare import BaseCompare, gather_files
 from compare.compare_wrapper import CompareWrapper
 from compare.compare_args import CompareArgs
+from compare.compare_models import extract_models_from_image, normalize_model_name
+from image.image_dimensions import image_dimensions
 from utils.config import config
 from utils.constants import CompareMode, Mode
 from utils.logging_setup import get_logger
@@ -46,6 +50,17 @@ class SizeFilter:
                 self.max_size is not None or 
                 self.exact_size is not None)
 
+    def matches(self, width: int, height: int) -> bool:
+        """Check if an image of the given dimensions passes the filter."""
+        if self.min_size is not None and (width < self.min_size[0] or height < self.min_size[1]):
+            return False
+        if self.max_size is not None and (width > self.max_size[0] or height > self.max_size[1]):
+            return False
+        if self.exact_size is not None and (abs(width - self.exact_size[0]) > self.tolerance
+                                            or abs(height - self.exact_size[1]) > self.tolerance):
+            return False
+        return True
+
 
 @dataclass
 class ModelFilter:
@@ -59,6 +74,18 @@ class ModelFilter:
         """Check if model filtering criteria is set."""
         return self.models is not None and len(self.models) > 0
 
+    def matches(self, models: List[str], loras: List[str]) -> bool:
+        """Check if an image using the given models and loras passes the filter."""
+        names = {normalize_model_name(m) for m in models}
+        if self.include_loras:
+            names.update(normalize_model_name(lora) for lora in loras)
+        wanted = [normalize_model_name(m) for m in self.models]
+        if self.match_any:
+            found = any(m in names for m in wanted)
+        else:
+            found = all(m in names for m in wanted)
+        return found if self.mode == 'include' else not found
+
 
 class CompareManager:
     """
@@ -66,6 +93,9 @@ class CompareManager:
     and composite comparison modes. Acts as the interface between App
     and CompareWrapper.
     """
+    # Cheap modes run before the others in composite search, and with AND
+    # logic restrict the files the others compare to the files they matched
+    PREFILTER_MODES = [CompareMode.SIZE, CompareMode.MODELS, CompareMode.PERCEPTUAL_HASH]
     
     def __init__(self, master=None, app_actions=None):
         self._master = master
@@ -339,6 +369,8 @@ class CompareManager:
             primary_mode = self.compare_mode
             if primary_mode == CompareMode.COLOR_MATCHING:
                 args.threshold = config.color_diff_threshold
+            elif primary_mode == CompareMode.PERCEPTUAL_HASH:
+                args.threshold = config.hash_distance_threshold
             else:
                 args.threshold = config.embedding_similarity_threshold
         
@@ -384,6 +416,8 @@ class CompareManager:
         # Threshold display depends on mode
         if self._primary_mode == CompareMode.COLOR_MATCHING:
             logger.info(f" color diff threshold: {args.threshold}")
+        elif self._primary_mode == CompareMode.PERCEPTUAL_HASH:
+            logger.info(f" hash distance threshold: {args.threshold}")
         else:
             logger.info(f" embedding similarity threshold: {args.threshold}")
         
@@ -751,6 +785,10 @@ class CompareManager:
     def _run_composite(self, args: CompareArgs):
         """
         Run composite comparison across multiple mode instances and combine results.
+
+        The base directory is scanned once and its listing shared by all the
+        modes. The size and model filters and the cheap pre-filter modes run
+        first, then the remaining modes run concurrently on the files left.
         """
         if not self._mode_configs:
             raise ValueError("No compare modes configured for composite search")
@@ -759,42 +797,22 @@ class CompareManager:
             f"Running composite comparison with {len(self._mode_configs)} instances..."
         )
         
-        # Run each enabled instance
-        instance_results: Dict[str, Dict[str, float]] = {}  # instance_id -> {file_path: score}
+        candidate_files = self._filter_candidate_files(args, self._gather_composite_files(args))
         
-        for instance_id, config in self._mode_configs.items():
-            if not config.enabled:
-                continue
-            
-            wrapper = self._ensure_wrapper(config.compare_mode)
-            
-            # Create instance-specific args
-            instance_args = args.clone()
-            instance_args.compare_mode = config.compare_mode
-            if config.threshold is not None:
-                instance_args.threshold = config.threshold
-            
-            # Apply instance-specific search text
-            if config.search_text:
-                instance_args.search_text = config.search_text
-            if config.search_text_negative:
-                instance_args.search_text_negative = config.search_text_negative
-            
-            # Run comparison
-            try:
-                wrapper.run(instance_args)
-                
-                # Extract results
-                # run_search() returns {0: {file_path: score}}
-                files_grouped = wrapper.files_grouped
-                if 0 in files_grouped:
-                    instance_results[instance_id] = files_grouped[0]
-                else:
-                    instance_results[instance_id] = {}
-                    
-            except Exception as e:
-                logger.error(f"Error running instance {instance_id} ({config.compare_mode.name}): {e}")
-                instance_results[instance_id] = {}
+        # Pre-filter modes run first. With AND logic a file has to match them,
+        # so the other modes only compare the files they matched.
+        enabled_instances = [(instance_id, config) for instance_id, config in self._mode_configs.items() if config.enabled]
+        prefilter_instances = [item for item in enabled_instances if item[1].compare_mode in CompareManager.PREFILTER_MODES]
+        other_instances = [item for item in enabled_instances if item[1].compare_mode not in CompareManager.PREFILTER_MODES]
+        
+        instance_results = self._run_instances_concurrently(prefilter_instances, args, candidate_files)
+        if self._combination_logic == CombinationLogic.AND:
+            for instance_id, config in prefilter_instances:
+                matched = set(instance_results[instance_id].keys())
+                candidate_files = matched if candidate_files is None else candidate_files & matched
+                logger.info(f"Pre-filter instance {instance_id} ({config.compare_mode.name}) passed {len(candidate_files)} candidate files")
+        
+        instance_results.update(self._run_instances_concurrently(other_instances, args, candidate_files))
         
         # Store individual results (convert to mode-based for backward compatibility)
         self._last_results = {}
@@ -837,6 +855,111 @@ class CompareManager:
         # Update primary wrapper with combined results
         self._apply_combined_results_to_primary()
     
+    def _gather_composite_files(self, args: CompareArgs) -> List[str]:
+        """
+        Scan the base directory once for every media type the modes may ask
+        for. The listing is kept by gather_files, so the modes gathering their
+        own files afterward reuse it instead of walking the directory again.
+        """
+        gather_files(base_dir=args.base_dir, exts=config.image_types, recursive=args.recursive,
+                     include_videos=True, include_gifs=True, include_pdfs=True)
+        return gather_files(base_dir=args.base_dir, exts=config.image_types, recursive=args.recursive,
+                            include_videos=args.include_videos, include_gifs=args.include_gifs,
+                            include_pdfs=args.include_pdfs)
+    
+    def _filter_candidate_files(self, args: CompareArgs, files: List[str]) -> Optional[Set[str]]:
+        """
+        Apply the size and model filters to the scanned files, reading the
+        image headers and metadata in parallel threads.
+        Returns the set of files passing the filters, or None if no filter is active.
+        """
+        size_filter = self._size_filter if self._size_filter and self._size_filter.is_active() else None
+        model_filter = self._model_filter if self._model_filter and self._model_filter.is_active() else None
+        if size_filter is None and model_filter is None:
+            return None
+        
+        def passes(file_path: str) -> bool:
+            if size_filter is not None:
+                dimensions = image_dimensions.get_dimensions(file_path, extract_frame=True)
+                if dimensions is None or not size_filter.matches(*dimensions):
+                    return False
+            if model_filter is not None:
+                if not model_filter.matches(*extract_models_from_image(file_path)):
+                    return False
+            return True
+        
+        with ThreadPoolExecutor(max_workers=BaseCompare.pipeline_workers()) as executor:
+            candidate_files = {f for f, passed in zip(files, executor.map(passes, files)) if passed}
+        image_dimensions.flush()
+        logger.info(f"Size and model filters passed {len(candidate_files)} of {len(files)} files")
+        return candidate_files
+    
+    def _run_instances_concurrently(self, instances: List[Tuple[str, CompareConfig]], args: CompareArgs,
+                                    candidate_files: Optional[Set[str]]) -> Dict[str, Dict[str, float]]:
+        """
+        Run mode instances concurrently, one thread per compare mode. Instances
+        of the same mode share a wrapper, so they run one after another.
+        Returns dict mapping instance_id -> {file_path: score}
+        """
+        if candidate_files is not None and len(candidate_files) == 0:
+            for instance_id, config in instances:
+                logger.info(f"Skipping instance {instance_id} ({config.compare_mode.name}), no files matched the pre-filters")
+            return {instance_id: {} for instance_id, _ in instances}
+        
+        instances_by_mode: Dict[CompareMode, List[Tuple[str, CompareConfig]]] = {}
+        for instance_id, config in instances:
+            instances_by_mode.setdefault(config.compare_mode, []).append((instance_id, config))
+        if not instances_by_mode:
+            return {}
+        
+        def run_mode(mode_instances):
+            return [(instance_id, self._run_instance(instance_id, config, args, candidate_files))
+                    for instance_id, config in mode_instances]
+        
+        instance_results: Dict[str, Dict[str, float]] = {}
+        with ThreadPoolExecutor(max_workers=len(instances_by_mode)) as executor:
+            for mode_results in executor.map(run_mode, instances_by_mode.values()):
+                instance_results.update(mode_results)
+        return instance_results
+    
+    def _run_instance(self, instance_id: str, config: CompareConfig, args: CompareArgs,
+                      candidate_files: Optional[Set[str]]) -> Dict[str, float]:
+        """
+        Run a single mode instance, restricted to the candidate files if set.
+        Returns dict mapping file_path -> score
+        """
+        wrapper = self._ensure_wrapper(config.compare_mode)
+        
+        # Create instance-specific args
+        instance_args = args.clone()
+        instance_args.compare_mode = config.compare_mode
+        if config.threshold is not None:
+            instance_args.threshold = config.threshold
+        if candidate_files is not None:
+            instance_args.candidate_files = set(candidate_files)
+            if instance_args.search_file_path is not None:
+                instance_args.candidate_files.add(instance_args.search_file_path)
+        
+        # Apply instance-specific search text
+        if config.search_text:
+            instance_args.search_text = config.search_text
+        if config.search_text_negative:
+            instance_args.search_text_negative = config.search_text_negative
+        
+        # Run comparison
+        try:
+            wrapper.run(instance_args)
+            
+            # Extract results
+            # run_search() returns {0: {file_path: score}}
+            files_grouped = wrapper.files_grouped
+            if 0 in files_grouped:
+                return files_grouped[0]
+            return {}
+        except Exception as e:
+            logger.error(f"Error running instance {instance_id} ({config.compare_mode.name}): {e}")
+            return {}
+    
     def _combine_results(self, mode_results: Dict[CompareMode, Dict[str, float]]) -> Dict[str, float]:
         """
         Combine results from multiple comparison modes.
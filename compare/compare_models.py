@@ -1,10 +1,13 @@
 import os
 from typing import List, Tuple
 
+import numpy as np
+
 from compare.base_compare import BaseCompare, gather_files
 from compare.compare_args import CompareArgs
 from compare.compare_data import CompareData
 from compare.compare_result import CompareResult
+from compare.signature_pairs import signature_pairs, sorted_unique_counts
 from image.image_data_extractor import image_data_extractor
 from utils.config import config
 from utils.constants import CompareMode
@@ -30,6 +33,14 @@ def extract_models_from_image(image_path: str) -> Tuple[List[str], List[str]]:
         return [], []
 
 
+def normalize_model_name(name: str) -> str:
+    """
+    Normalize a model or lora name so that the same file referenced with
+    different case, path separators or surrounding whitespace matches.
+    """
+    return name.strip().replace("\\", "/").lower()
+
+
 def model_similarity(models1: List[str], loras1: List[str], 
                      models2: List[str], loras2: List[str]) -> float:
     """
@@ -45,10 +56,10 @@ def model_similarity(models1: List[str], loras1: List[str],
         return 0.0  # Second has no models/loras
     
     # Convert to sets for comparison
-    models1_set = set(models1)
-    models2_set = set(models2)
-    loras1_set = set(loras1)
-    loras2_set = set(loras2)
+    models1_set = {normalize_model_name(m) for m in models1}
+    models2_set = {normalize_model_name(m) for m in models2}
+    loras1_set = {normalize_model_name(l) for l in loras1}
+    loras2_set = {normalize_model_name(l) for l in loras2}
     
     # Calculate model overlap
     model_intersection = len(models1_set & models2_set)
@@ -66,6 +77,87 @@ def model_similarity(models1: List[str], loras1: List[str],
     return combined_sim
 
 
+def _posting_pairs(postings, n_ids):
+    '''
+    Count the postings shared by each pair of ids.
+    :param postings: Lists of the ids containing each term.
+    :returns: (keys, counts) where each key is id1 * n_ids + id2 with id1 < id2.
+    '''
+    keys = []
+    for ids in postings:
+        if len(ids) > 1:
+            ids = np.sort(np.asarray(ids, dtype=np.int64))
+            rows, cols = np.triu_indices(len(ids), 1)
+            keys.append(ids[rows] * n_ids + ids[cols])
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return sorted_unique_counts(np.concatenate(keys))
+
+
+def model_similarity_pairs(file_models, threshold):
+    '''
+    Find the pairs of files whose model_similarity is at least the threshold,
+    without scoring pairs that share no model or lora.
+
+    Files with the same normalized models and loras are collapsed into one
+    signature, and an inverted index from each model and lora name to the
+    signatures using it gives the candidate pairs of signatures. Their
+    model and lora set overlaps are counted from the shared postings and
+    scored together as arrays. Pairs that share nothing score 0, so
+    thresholds above 0 find every matching pair.
+
+    The pairs are reduced by signature_pairs.
+    :param file_models: (models, loras) per file.
+    :returns: Generator of (indexes1, indexes2, similarities) arrays.
+    '''
+    signature_ids = {}
+    signature_files = []
+    for index, (models, loras) in enumerate(file_models):
+        signature = (frozenset(normalize_model_name(m) for m in models),
+                     frozenset(normalize_model_name(l) for l in loras))
+        if signature not in signature_ids:
+            signature_ids[signature] = len(signature_files)
+            signature_files.append([])
+        signature_files[signature_ids[signature]].append(index)
+    signatures = list(signature_ids)
+    n_signatures = len(signatures)
+
+    # Files with the same signature score 1.0 if they have no models or
+    # loras at all, otherwise the weights of the lists they have
+    self_similarities = np.array([
+        1.0 if not models and not loras else 0.7 * bool(models) + 0.3 * bool(loras)
+        for models, loras in signatures])
+
+    model_postings = {}
+    lora_postings = {}
+    for signature_id, (models, loras) in enumerate(signatures):
+        for model in models:
+            model_postings.setdefault(model, []).append(signature_id)
+        for lora in loras:
+            lora_postings.setdefault(lora, []).append(signature_id)
+    model_keys, model_shared = _posting_pairs(model_postings.values(), n_signatures)
+    lora_keys, lora_shared = _posting_pairs(lora_postings.values(), n_signatures)
+    keys = sorted_unique_counts(np.concatenate([model_keys, lora_keys]))[0]
+
+    def shared_counts(postings_keys, counts):
+        shared = np.zeros(len(keys), dtype=np.int64)
+        shared[np.searchsorted(keys, postings_keys)] = counts
+        return shared
+
+    def set_similarity(sizes, shared):
+        union = sizes[ids1] + sizes[ids2] - shared
+        return np.divide(shared, union, out=np.zeros(len(keys)), where=union > 0)
+
+    ids1, ids2 = keys // n_signatures, keys % n_signatures
+    model_sizes = np.array([len(models) for models, _ in signatures])
+    lora_sizes = np.array([len(loras) for _, loras in signatures])
+    similarities = (0.7 * set_similarity(model_sizes, shared_counts(model_keys, model_shared))
+                    + 0.3 * set_similarity(lora_sizes, shared_counts(lora_keys, lora_shared)))
+    matches = similarities >= threshold
+    yield from signature_pairs(signature_files, self_similarities, ids1[matches], ids2[matches],
+                               similarities[matches], threshold)
+
+
 class CompareModels(BaseCompare):
     COMPARE_MODE = CompareMode.MODELS
     SEARCH_OUTPUT_FILE = "weidr_search_output.txt"
@@ -77,6 +169,7 @@ class CompareModels(BaseCompare):
         super().__init__(args, gather_files_func)
         self.threshold_match = CompareModels.THRESHOLD_MATCH
         self.settings_updated = False
+        self._file_models = []
         # Initialize compare_data for model comparison
         self.compare_data = CompareData(base_dir=self.base_dir, mode=CompareMode.MODELS)
         # Set initial threshold from args
@@ -118,6 +211,7 @@ class CompareModels(BaseCompare):
         else:
             raise Exception("No gather files function found.")
         self.files.sort()
+        self._restrict_to_candidate_files()
         self.has_new_file_data = False
         self.max_files_processed = min(self.args.counter_limit, len(self.files))
         self.max_files_processed_even = Utils.round_up(self.max_files_processed, 200)
@@ -166,6 +260,7 @@ class CompareModels(BaseCompare):
             print("Gathering model data", end="", flush=True)
 
         counter = 0
+        self._file_models = []
 
         for f in self.files:
             if self.is_cancelled():
@@ -188,9 +283,10 @@ class CompareModels(BaseCompare):
 
             counter += 1
             self.compare_data.files_found.append(f)
+            self._file_models.append((models, loras))
             self._handle_progress(counter, self.max_files_processed_even)
 
-        # Save model data
+        # Save model data, after which file_data_dict may be released
         self.compare_data.save_data(self.args.overwrite, verbose=self.verbose)
 
     def find_similars_to_image(self, search_path, search_file_index):
@@ -203,26 +299,21 @@ class CompareModels(BaseCompare):
         if self.verbose:
             logger.info("Identifying similar model files...")
         
+        _file_models = list(self._file_models)
+
         # Get the search image's models
-        if search_path in self.compare_data.file_data_dict:
-            search_models_data = self.compare_data.file_data_dict[search_path]
-            search_models, search_loras = search_models_data if isinstance(search_models_data, tuple) and len(search_models_data) == 2 else ([], [])
+        if search_path in _files_found:
+            search_models, search_loras = _file_models[_files_found.index(search_path)]
         else:
             search_models, search_loras = extract_models_from_image(search_path)
-            self.compare_data.file_data_dict[search_path] = (search_models, search_loras)
 
         # Remove search file from comparison list
         if search_file_index < len(_files_found):
             _files_found.pop(search_file_index)
+            _file_models.pop(search_file_index)
 
         # Compare with all other files
-        for i, file_path in enumerate(_files_found):
-            if file_path in self.compare_data.file_data_dict:
-                file_models_data = self.compare_data.file_data_dict[file_path]
-                file_models, file_loras = file_models_data if isinstance(file_models_data, tuple) and len(file_models_data) == 2 else ([], [])
-            else:
-                continue  # Skip files without model data
-            
+        for file_path, (file_models, file_loras) in zip(_files_found, _file_models):
             # Calculate model similarity only
             similarity = model_similarity(
                 search_models, search_loras,
@@ -275,13 +366,7 @@ class CompareModels(BaseCompare):
 
         # Compute similarity against each file's stored models
         temp_scores = {}
-        for i, file_path in enumerate(self.compare_data.files_found):
-            if file_path in self.compare_data.file_data_dict:
-                file_models_data = self.compare_data.file_data_dict[file_path]
-                file_models, file_loras = file_models_data if isinstance(file_models_data, tuple) and len(file_models_data) == 2 else ([], [])
-            else:
-                continue
-            
+        for file_path, (file_models, file_loras) in zip(self.compare_data.files_found, self._file_models):
             if search_for_no_models:
                 # Search for images with no models/loras
                 if not file_models and not file_loras:
@@ -321,7 +406,8 @@ class CompareModels(BaseCompare):
 
     def run_comparison(self, store_checkpoints=False):
         '''
-        Compare all found models to each other.
+        Compare all found models to each other. Only files sharing a model or
+        lora are scored, see model_similarity_pairs.
         '''
         overwrite = self.args.overwrite or not store_checkpoints
         self.compare_result = CompareResult.load(
@@ -329,106 +415,17 @@ class CompareModels(BaseCompare):
         if self.compare_result.is_complete:
             return (self.compare_result.files_grouped, self.compare_result.file_groups)
 
-        n_files_found_even = Utils.round_up(self.compare_data.n_files_found, 5)
-        if self.compare_result.i > 1:
-            self._handle_progress(self.compare_result.i, n_files_found_even, gathering_data=False)
-
-        if self.compare_data.n_files_found > 5000:
-            logger.warning("\nWARNING: Large image file set found, comparison between all"
-                  + " images may take a while.\n")
         if self.verbose:
             logger.info("Identifying groups of similar model files...")
         else:
             print("Identifying groups of similar model files", end="", flush=True)
 
-        for i in range(self.compare_data.n_files_found):
-            if i == 0:  # Skip self-comparison
-                continue
-            if store_checkpoints:
-                if i < self.compare_result.i:
-                    continue
-                if i % 250 == 0 and i != len(self.compare_data.files_found) and i > self.compare_result.i:
-                    self.compare_result.store()
-                self.compare_result.i = i
-            self._handle_progress(i, n_files_found_even, gathering_data=False)
-
-            # Get models for current file
-            current_file = self.compare_data.files_found[i]
-            if current_file not in self.compare_data.file_data_dict:
-                continue
-            current_models_data = self.compare_data.file_data_dict[current_file]
-            current_models, current_loras = current_models_data if isinstance(current_models_data, tuple) and len(current_models_data) == 2 else ([], [])
-
-            # Compare with all other files
-            for j in range(i + 1, self.compare_data.n_files_found):
-                if self.is_cancelled():
-                    self.raise_cancellation_exception()
-                
-                compare_file = self.compare_data.files_found[j]
-                if compare_file not in self.compare_data.file_data_dict:
-                    continue
-                compare_models_data = self.compare_data.file_data_dict[compare_file]
-                compare_models, compare_loras = compare_models_data if isinstance(compare_models_data, tuple) and len(compare_models_data) == 2 else ([], [])
-
-                # Calculate model similarity only
-                similarity = model_similarity(
-                    current_models, current_loras,
-                    compare_models, compare_loras
-                )
-
-                # Group similar files
-                if similarity >= self.threshold_match:
-                    f1_grouped = i in self.compare_result.files_grouped
-                    f2_grouped = j in self.compare_result.files_grouped
-
-                    if not f1_grouped and not f2_grouped:
-                        self.compare_result.files_grouped[i] = (
-                            self.compare_result.group_index, similarity)
-                        self.compare_result.files_grouped[j] = (
-                            self.compare_result.group_index, similarity)
-                        self.compare_result.group_index += 1
-                    elif f1_grouped:
-                        existing_group_index, previous_similarity = self.compare_result.files_grouped[i]
-                        if similarity > previous_similarity:
-                            self.compare_result.files_grouped[i] = (
-                                self.compare_result.group_index, similarity)
-                            self.compare_result.files_grouped[j] = (
-                                self.compare_result.group_index, similarity)
-                            self.compare_result.group_index += 1
-                        else:
-                            self.compare_result.files_grouped[j] = (
-                                existing_group_index, similarity)
-                    else:
-                        existing_group_index, previous_similarity = self.compare_result.files_grouped[j]
-                        if similarity > previous_similarity:
-                            self.compare_result.files_grouped[i] = (
-                                self.compare_result.group_index, similarity)
-                            self.compare_result.files_grouped[j] = (
-                                self.compare_result.group_index, similarity)
-                            self.compare_result.group_index += 1
-                        else:
-                            self.compare_result.files_grouped[i] = (
-                                existing_group_index, similarity)
-
-        # Validate indices before accessing files_found
-        return_current_results, should_restart = self._validate_checkpoint_data()
-        if should_restart:
-            return self.run_comparison(store_checkpoints=store_checkpoints)
-        if return_current_results:
-            return (self.compare_result.files_grouped, self.compare_result.file_groups)
-
-        for file_index in self.compare_result.files_grouped:
-            _file = self.compare_data.files_found[file_index]
-            group_index, similarity = self.compare_result.files_grouped[file_index]
-            if group_index in self.compare_result.file_groups:
-                file_group = self.compare_result.file_groups[group_index]
-            else:
-                file_group = {}
-            file_group[_file] = similarity
-            self.compare_result.file_groups[group_index] = file_group
+        for indexes1, indexes2, similarities in model_similarity_pairs(self._file_models, self.threshold_match):
+            if self.is_cancelled():
+                self.raise_cancellation_exception()
+            self.compare_result.add_pairs(indexes1, indexes2, similarities)
 
-        self.compare_result.finalize_group_result()
-        return (self.compare_result.files_grouped, self.compare_result.file_groups)
+        return self._finish_comparison(store_checkpoints=store_checkpoints)
 
     def run(self, store_checkpoints=False):
         '''
@@ -456,8 +453,10 @@ class CompareModels(BaseCompare):
 
         for f in removed_files:
             if f in self.compare_data.files_found:
-                self.compare_data.files_found.remove(f)
-            if f in self.compare_data.file_data_dict:
+                index = self.compare_data.files_found.index(f)
+                self.compare_data.files_found.pop(index)
+                self._file_models.pop(index)
+            if self.compare_data.file_data_dict is not None and f in self.compare_data.file_data_dict:
                 del self.compare_data.file_data_dict[f]
 
     @staticmethod
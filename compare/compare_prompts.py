@@ -7,7 +7,8 @@ from compare.compare_args import CompareArgs
 from compare.compare_data import CompareData
 from compare.compare_result import CompareResult
 from compare.compare_prompts_exact import extract_prompts_from_image, _ensure_str
-from compare.model import text_embeddings_flava
+from compare.model import text_embeddings_flava, text_embeddings_flava_batch
+from compare.text_embedding_cache import TextEmbeddingCache
 from utils.config import config
 from utils.constants import CompareMode
 from utils.logging_setup import get_logger
@@ -19,6 +20,96 @@ _ = I18N._
 logger = get_logger("compare_prompts")
 
 
+# Prompts longer than this are truncated before they are encoded
+MAX_PROMPT_LENGTH = 2000
+FLAVA_EMBEDDING_SIZE = 768
+
+
+def _prepare_prompt(prompt):
+    prompt = _ensure_str(prompt)
+    if len(prompt) > MAX_PROMPT_LENGTH:
+        prompt = prompt[:MAX_PROMPT_LENGTH] + "..."
+    return prompt
+
+
+def _encode_texts(texts, text_cache):
+    """
+    Get FLAVA embeddings for a set of texts. Texts found in the persistent text
+    embedding cache are not encoded again, and the rest are encoded in batches
+    of config.embedding_batch_size and added to the cache with a single write.
+    Returns a dict of text -> embedding, without the texts that failed to encode.
+    """
+    embeddings = {}
+    missing = []
+    for text in texts:
+        if text in text_cache:
+            embeddings[text] = np.asarray(text_cache[text])
+        else:
+            missing.append(text)
+    if len(missing) == 0:
+        return embeddings
+
+    batch_size = max(1, config.embedding_batch_size)
+    encoded = {}
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        try:
+            batch_embeddings = text_embeddings_flava_batch(batch)
+        except Exception as e:
+            # Fall back to single texts so one bad text does not fail the batch
+            logger.warning(f"Batch prompt embedding failed, retrying prompts individually: {e}")
+            batch_embeddings = []
+            for text in batch:
+                try:
+                    batch_embeddings.append(text_embeddings_flava_batch([text])[0])
+                except Exception as e:
+                    logger.error(f"Error embedding prompt \"{text[:50]}\": {e}")
+                    batch_embeddings.append(None)
+        for text, embedding in zip(batch, batch_embeddings):
+            if embedding is not None:
+                encoded[text] = np.asarray(embedding)
+    if len(encoded) > 0:
+        text_cache.update(encoded)
+        embeddings.update(encoded)
+    return embeddings
+
+
+def prompt_embeddings(prompts_list, text_cache=None):
+    """
+    Convert (positive, negative) prompt pairs to embedding vectors using FLAVA,
+    each combined as (positive - 0.5 * negative).
+
+    Many images share their prompts, especially the negative prompt, so each
+    distinct prompt is only encoded once and the vectors are assembled from the
+    embeddings of the distinct prompts. Pairs with a prompt that could not be
+    encoded get a zero vector.
+
+    Args:
+        prompts_list: List of (positive, negative) prompt tuples
+        text_cache: Text embedding cache, by default the shared FLAVA cache
+    Returns:
+        List of embedding vectors aligned with prompts_list
+    """
+    if text_cache is None:
+        text_cache = TextEmbeddingCache.for_model("flava")
+    prepared = [(_prepare_prompt(positive), _prepare_prompt(negative)) for positive, negative in prompts_list]
+    unique_texts = list(dict.fromkeys(text for pair in prepared for text in pair))
+    try:
+        text_embeddings = _encode_texts(unique_texts, text_cache)
+    except Exception as e:
+        logger.error(f"Error embedding prompts: {e}")
+        text_embeddings = {}
+    embeddings = []
+    for positive, negative in prepared:
+        positive_embedding = text_embeddings.get(positive)
+        negative_embedding = text_embeddings.get(negative)
+        if positive_embedding is None or negative_embedding is None:
+            embeddings.append(np.zeros(FLAVA_EMBEDDING_SIZE))
+        else:
+            embeddings.append(positive_embedding - (0.5 * negative_embedding))
+    return embeddings
+
+
 def prompt_embedding_from_image(image_path):
     """
     Module-level helper to extract prompts and convert them to a single embedding
@@ -27,21 +118,11 @@ def prompt_embedding_from_image(image_path):
     try:
         positive_prompt, negative_prompt = extract_prompts_from_image(image_path)
         if positive_prompt is None and negative_prompt is None:
-            return np.zeros(768)
-
-        positive_prompt = _ensure_str(positive_prompt)
-        negative_prompt = _ensure_str(negative_prompt)
-        if len(positive_prompt) > 2000:
-            positive_prompt = positive_prompt[:2000] + "..."
-        if len(negative_prompt) > 2000:
-            negative_prompt = negative_prompt[:2000] + "..."
-
-        positive_embedding = np.array(text_embeddings_flava(positive_prompt))
-        negative_embedding = np.array(text_embeddings_flava(negative_prompt))
-        return positive_embedding - (0.5 * negative_embedding)
+            return np.zeros(FLAVA_EMBEDDING_SIZE)
+        return prompt_embeddings([(positive_prompt, negative_prompt)])[0]
     except Exception as e:
         logger.error(f"Error extracting prompt embedding from {image_path}: {e}")
-        return np.zeros(768)
+        return np.zeros(FLAVA_EMBEDDING_SIZE)
 
 
 class ComparePrompts(BaseCompareEmbedding):
@@ -52,7 +133,7 @@ class ComparePrompts(BaseCompareEmbedding):
     THRESHHOLD_POTENTIAL_DUPLICATE = 0.95  # High similarity threshold for prompts
     THRESHHOLD_PROBABLE_MATCH = 0.85
     THRESHHOLD_GROUP_CUTOFF = 0.75
-    TEXT_EMBEDDING_CACHE = {}
+    TEXT_EMBEDDING_CACHE = TextEmbeddingCache.for_model("flava")
     MULTI_EMBEDDING_CACHE = {}  # keys are tuples of the filename + any text embedding search combination, values are combined similarity
 
     def __init__(self, args=CompareArgs(), gather_files_func=gather_files):
@@ -65,7 +146,6 @@ class ComparePrompts(BaseCompareEmbedding):
         self.text_embeddings_func = text_embeddings_flava
         self.text_embedding_cache = ComparePrompts.TEXT_EMBEDDING_CACHE
         self.multi_embedding_cache = ComparePrompts.MULTI_EMBEDDING_CACHE
-        self._probable_duplicates = []
         self.settings_updated = False
         self.compare_data = CompareData(base_dir=self.base_dir, mode=CompareMode.PROMPTS)
         
@@ -109,6 +189,7 @@ class ComparePrompts(BaseCompareEmbedding):
         else:
             raise Exception("No gather files function found.")
         self.files.sort()
+        self._restrict_to_candidate_files()
         self.has_new_file_data = False
         self.max_files_processed = min(self.args.counter_limit, len(self.files))
         self.max_files_processed_even = Utils.round_up(self.max_files_processed, 200)
@@ -151,6 +232,8 @@ class ComparePrompts(BaseCompareEmbedding):
             print("Gathering prompt data", end="", flush=True)
 
         counter = 0
+        files_with_prompts = []
+        prompts_list = []
 
         for f in self.files:
             # Check for cancellation during data gathering
@@ -177,16 +260,18 @@ class ComparePrompts(BaseCompareEmbedding):
                 self.compare_data.has_new_file_data = True
 
             counter += 1
-            # Convert prompts to embeddings using the centralized method
-            try:
-                prompt_embedding = prompt_embedding_from_image(f)
-                self._file_embeddings = np.vstack((self._file_embeddings, [prompt_embedding]))
-                self.compare_data.files_found.append(f)
-                self._handle_progress(counter, self.max_files_processed_even)
-            except Exception as e:
-                if self.verbose:
-                    logger.warning(f"Skipping file {f} due to embedding error: {e}")
-                continue
+            files_with_prompts.append(f)
+            prompts_list.append(prompts)
+
+        if self.is_cancelled():
+            self.raise_cancellation_exception()
+
+        # Distinct prompts are encoded once for all the files sharing them
+        embeddings = prompt_embeddings(prompts_list, self.text_embedding_cache)
+        for count, (f, prompt_embedding) in enumerate(zip(files_with_prompts, embeddings), start=1):
+            self._file_embeddings_array.append(prompt_embedding)
+            self.compare_data.files_found.append(f)
+            self._handle_progress(count, self.max_files_processed_even)
 
         # Save prompt data
         self.compare_data.save_data(self.args.overwrite, verbose=self.verbose)
@@ -204,36 +289,25 @@ class ComparePrompts(BaseCompareEmbedding):
         '''
         Search for images with similar prompts to the provided image.
         '''
-        files_grouped = {}
-        _files_found = list(self.compare_data.files_found)
-
         if self.verbose:
             logger.info("Identifying similar prompt files...")
-        _files_found.pop(search_file_index)
-        search_file_embedding = self._file_embeddings[search_file_index]
-        file_embeddings = np.delete(self._file_embeddings, search_file_index, 0)
-        embedding_similars = self._compute_embedding_diff(
-            file_embeddings, search_file_embedding, True)
-
-        similars = np.nonzero(embedding_similars[0])
+        _files_found = self.compare_data.files_found
+        similars, similarities = self._compute_embedding_diff(
+            self._file_embeddings, self._file_embeddings[search_file_index], True)
 
         if config.search_only_return_closest:
-            for _index in similars[0]:
-                files_grouped[_files_found[_index]] = embedding_similars[1][_index]
+            similars = np.array(similars, dtype=bool)
+            similars[search_file_index] = False
+            candidates = np.flatnonzero(similars)
+            k = len(candidates)
         else:
-            temp = {}
-            count = 0
-            for i in range(len(_files_found)):
-                temp[_files_found[i]] = embedding_similars[1][i]
-            for file, similarity in dict(sorted(temp.items(), key=lambda item: item[1], reverse=True)).items():
-                if count == config.max_search_results:
-                    break
-                files_grouped[file] = similarity
-                count += 1
+            candidates = np.delete(np.arange(len(similarities)), search_file_index)
+            k = config.max_search_results
 
         # Sort results by decreasing similarity score
-        self.compare_result.files_grouped = dict(
-            sorted(files_grouped.items(), key=lambda item: item[1], reverse=True))
+        top_indexes = BaseCompareEmbedding.top_k_candidate_indices(similarities, candidates, k)
+        files_grouped = {_files_found[i]: similarities[i] for i in top_indexes.tolist()}
+        self.compare_result.files_grouped = files_grouped
         self.compare_result.finalize_search_result(
             self.search_file_path, verbose=self.verbose, is_embedding=True,
             threshold_duplicate=self.threshold_duplicate,
@@ -268,12 +342,13 @@ class ComparePrompts(BaseCompareEmbedding):
                 if positive_prompt is None and negative_prompt is None:
                     raise AssertionError("No prompt data found in the provided image. This image may not contain prompt metadata.")
                 
-                # Generate embedding for the search image using the centralized method
-                search_embedding = prompt_embedding_from_image(search_file_path)
+                # Generate embedding for the search image from the extracted prompts
+                search_embedding = prompt_embeddings(
+                    [(positive_prompt, negative_prompt)], self.text_embedding_cache)[0]
                 
                 # Add to the beginning of our data; keep cache in sync only if still in memory
                 # (save_data() clears file_data_dict to free memory after persist)
-                self._file_embeddings = np.insert(self._file_embeddings, 0, [search_embedding], 0)
+                self._file_embeddings_array.insert_first(search_embedding)
                 self.compare_data.files_found.insert(0, search_file_path)
                 if self.compare_data.file_data_dict is not None:
                     self.compare_data.file_data_dict[search_file_path] = (positive_prompt, negative_prompt)
@@ -303,99 +378,33 @@ class ComparePrompts(BaseCompareEmbedding):
         '''
         overwrite = self.args.overwrite or not store_checkpoints
         self.compare_result = CompareResult.load(
-            self.base_dir, self.compare_data.files_found, overwrite=overwrite)
+            self.base_dir, self.compare_data.files_found, overwrite=overwrite, incremental=True)
         if self.compare_result.is_complete:
             return (self.compare_result.files_grouped, self.compare_result.file_groups)
 
-        n_files_found_even = Utils.round_up(self.compare_data.n_files_found, 5)
-        if self.compare_result.i > 1:
-            self._handle_progress(self.compare_result.i, n_files_found_even, gathering_data=False)
-
-        if self.compare_data.n_files_found > 5000:
-            logger.warning("\nWARNING: Large image file set found, comparison between all"
-                  + " images may take a while.\n")
         if self.verbose:
             logger.info("Identifying groups of similar prompt files...")
         else:
             print("Identifying groups of similar prompt files", end="", flush=True)
 
-        for i in range(self.compare_data.n_files_found):
-            if i == 0:  # Skip self-comparison
-                continue
-            if store_checkpoints:
-                if i < self.compare_result.i:
-                    continue
-                if i % 250 == 0 and i != len(self.compare_data.files_found) and i > self.compare_result.i:
-                    self.compare_result.store()
-                self.compare_result.i = i
-            self._handle_progress(i, n_files_found_even, gathering_data=False)
-
-            compare_file_embeddings = np.roll(self._file_embeddings, i, 0)
-            embedding_similars = self._compute_embedding_diff(
-                self._file_embeddings, compare_file_embeddings, True)
-            similars = np.nonzero(embedding_similars[0])
-
-            for base_index in similars[0]:
-                diff_index = ((base_index - i) % self.compare_data.n_files_found)
-                similarity = embedding_similars[1][base_index]
-                f1_grouped = base_index in self.compare_result.files_grouped
-                f2_grouped = diff_index in self.compare_result.files_grouped
-
-                if similarity > self.threshold_duplicate:
-                    base_file = self.compare_data.files_found[base_index]
-                    diff_file = self.compare_data.files_found[diff_index]
-                    if ((base_file, diff_file) not in self._probable_duplicates
-                            and (diff_file, base_file) not in self._probable_duplicates):
-                        self._probable_duplicates.append((base_file, diff_file))
-
-                if not f1_grouped and not f2_grouped:
-                    self.compare_result.files_grouped[base_index] = (
-                        self.compare_result.group_index, similarity)
-                    self.compare_result.files_grouped[diff_index] = (
-                        self.compare_result.group_index, similarity)
-                    self.compare_result.group_index += 1
-                elif f1_grouped:
-                    existing_group_index, previous_similarity = self.compare_result.files_grouped[base_index]
-                    if similarity - previous_similarity > self.threshold_group_cutoff:
-                        self.compare_result.files_grouped[base_index] = (
-                            self.compare_result.group_index, similarity)
-                        self.compare_result.files_grouped[diff_index] = (
-                            self.compare_result.group_index, similarity)
-                        self.compare_result.group_index += 1
-                    else:
-                        self.compare_result.files_grouped[diff_index] = (
-                            existing_group_index, similarity)
-                else:
-                    existing_group_index, previous_similarity = self.compare_result.files_grouped[diff_index]
-                    if similarity - previous_similarity > self.threshold_group_cutoff:
-                        self.compare_result.files_grouped[base_index] = (
-                            self.compare_result.group_index, similarity)
-                        self.compare_result.files_grouped[diff_index] = (
-                            self.compare_result.group_index, similarity)
-                        self.compare_result.group_index += 1
-                    else:
-                        self.compare_result.files_grouped[base_index] = (
-                            existing_group_index, similarity)
-
-        # Validate indices before accessing files_found
-        return_current_results, should_restart = self._validate_checkpoint_data()
-        if should_restart:
-            return self.run_comparison(store_checkpoints=store_checkpoints)
-        if return_current_results:
-            return (self.compare_result.files_grouped, self.compare_result.file_groups)
+        if self.compare_result.pending_rows is not None:
+            # Files changed since the stored result, so only the added files are compared
+            self._compare_added_files(self.compare_result.pending_rows)
+            self.compare_result.pending_rows = None
+        else:
+            for pairs_i, pairs_j, similarities in self._stream_similarity_pairs(
+                    self._file_embeddings, self._grouping_threshold(), store_checkpoints=store_checkpoints):
+                self.compare_result.add_pairs(pairs_i, pairs_j, similarities,
+                                              duplicates=similarities > self.threshold_duplicate)
 
-        for file_index in self.compare_result.files_grouped:
-            _file = self.compare_data.files_found[file_index]
-            group_index, similarity = self.compare_result.files_grouped[file_index]
-            if group_index in self.compare_result.file_groups:
-                file_group = self.compare_result.file_groups[group_index]
-            else:
-                file_group = {}
-            file_group[_file] = similarity
-            self.compare_result.file_groups[group_index] = file_group
+        return self._finish_comparison(store_checkpoints=store_checkpoints)
 
-        self.compare_result.finalize_group_result()
-        return (self.compare_result.files_grouped, self.compare_result.file_groups)
+    def _grouping_threshold(self):
+        # Prompts are only grouped when they are near duplicates
+        return self.threshold_duplicate
+
+    def _grouping_faces(self, n_files):
+        return None
 
     def run(self, store_checkpoints=False):
         '''
@@ -406,9 +415,6 @@ class ComparePrompts(BaseCompareEmbedding):
         else:
             return self.run_comparison(store_checkpoints=store_checkpoints)
 
-    def get_probable_duplicates(self):
-        return self._probable_duplicates
-    
     def remove_from_groups(self, removed_files=[]):
         # TODO technically it would be better to refresh the file and data lists every time a compare is done
         remove_indexes = []
@@ -417,13 +423,14 @@ class ComparePrompts(BaseCompareEmbedding):
                 remove_indexes.append(self.compare_data.files_found.index(f))
         remove_indexes.sort()
 
-        if len(self._file_embeddings) > 0:
-            self._file_embeddings = np.delete(self._file_embeddings, remove_indexes, axis=0)
+        self._file_embeddings_array.delete(remove_indexes)
 
         for f in removed_files:
             if f in self.compare_data.files_found:
                 self.compare_data.files_found.remove(f)
 
+        self._update_groups_for_files()
+
     @staticmethod
     def is_related(image1, image2):
         return BaseCompareEmbedding.is_related(
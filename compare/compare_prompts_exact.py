@@ -1,11 +1,17 @@
 import os
 import re
-from typing import List, Tuple, Optional, Any
+import sys
+from functools import lru_cache
+from typing import List, NamedTuple, Tuple, Optional, Any
+
+import numpy as np
 
 from compare.base_compare import BaseCompare, gather_files
 from compare.compare_args import CompareArgs
 from compare.compare_data import CompareData
 from compare.compare_result import CompareResult
+from compare.minhash_lsh import MinHashLSH
+from compare.signature_pairs import signature_pairs, sorted_unique_counts
 from image.image_data_extractor import ImageDataExtractor
 from utils.config import config
 from utils.constants import CompareMode
@@ -81,9 +87,15 @@ def extract_prompts_from_image(image_path):
         logger.error(f"Error extracting prompt from {image_path}: {e}")
         return None, None
 
-def _levenshtein_distance(s1: str, s2: str) -> int:
+def _levenshtein_distance(s1: str, s2: str, max_distance: Optional[int] = None) -> int:
+    """
+    Edit distance between two strings. If max_distance is given, stops early
+    and returns max_distance + 1 once the distance is known to exceed it.
+    """
     if len(s1) < len(s2):
-        return _levenshtein_distance(s2, s1)
+        return _levenshtein_distance(s2, s1, max_distance)
+    if max_distance is not None and len(s1) - len(s2) > max_distance:
+        return max_distance + 1
     if len(s2) == 0:
         return len(s1)
     previous_row = list(range(len(s2) + 1))
@@ -94,6 +106,8 @@ def _levenshtein_distance(s1: str, s2: str) -> int:
             deletions = current_row[j] + 1
             substitutions = previous_row[j] + (c1 != c2)
             current_row.append(min(insertions, deletions, substitutions))
+        if max_distance is not None and min(current_row) > max_distance:
+            return max_distance + 1
         previous_row = current_row
     return previous_row[-1]
 
@@ -109,14 +123,13 @@ def _compute_fuzzy_word_similarity(words1: set, words2: set) -> float:
                     substring_matches.add((w1, w2))
 
     for w1 in words1:
+        if w1 in exact_matches or len(w1) < 3:
+            continue
         for w2 in words2:
-            if w1 != w2 and w1 not in exact_matches and w2 not in exact_matches:
-                is_substring_match = any((w1 in w2 or w2 in w1) for w1_check, w2_check in substring_matches 
-                                       if (w1_check == w1 and w2_check == w2) or (w1_check == w2 and w2_check == w1))
-                if not is_substring_match and len(w1) >= 3 and len(w2) >= 3:
-                    distance = _levenshtein_distance(w1, w2)
-                    if distance <= 2:
-                        fuzzy_matches.add((w1, w2))
+            if w1 != w2 and w2 not in exact_matches and len(w2) >= 3:
+                is_substring_match = (w1, w2) in substring_matches or (w2, w1) in substring_matches
+                if not is_substring_match and _levenshtein_distance(w1, w2, max_distance=2) <= 2:
+                    fuzzy_matches.add((w1, w2))
 
     exact_score = len(exact_matches)
     substring_score = len(substring_matches) * 0.8
@@ -127,43 +140,186 @@ def _compute_fuzzy_word_similarity(words1: set, words2: set) -> float:
 
     return total_matches / total_words if total_words > 0 else 0.0
 
-def compute_text_similarity(text1: str, text2: str) -> float:
-    text1 = _ensure_str(text1)
-    text2 = _ensure_str(text2)
-    if not text1 or not text2:
+
+class PromptTokens(NamedTuple):
+    """A prompt tokenized once for compute_text_similarity."""
+    text: str  # Lowercased and stripped
+    is_empty: bool
+    elements: frozenset
+    words: frozenset
+
+
+def _split_structured_elements(text):
+    elements = []
+    for separator in [',', '\n', '\r\n']:
+        elements.extend([elem.strip() for elem in text.split(separator)])
+    return [elem for elem in elements if elem]
+
+
+@lru_cache(maxsize=65536)
+def tokenize_prompt(text: str) -> PromptTokens:
+    """
+    Tokenize a prompt into its structured elements and words, interned so
+    that prompts sharing them compare by identity. Cached, since the same
+    prompts are compared against many others.
+    """
+    text_lower = text.lower().strip()
+    return PromptTokens(
+        text=text_lower,
+        is_empty=not text,
+        elements=frozenset(sys.intern(elem) for elem in _split_structured_elements(text_lower)),
+        words=frozenset(sys.intern(word) for word in text_lower.split()))
+
+
+def prompt_tokens_similarity(tokens1: PromptTokens, tokens2: PromptTokens, fuzzy: bool = True) -> float:
+    """
+    compute_text_similarity for tokenized prompts. If fuzzy is False, prompts
+    sharing no element score 0.0 instead of up to 0.7 for fuzzy word matches.
+    """
+    if tokens1.is_empty or tokens2.is_empty:
         return 0.0
-    text1_lower = text1.lower().strip()
-    text2_lower = text2.lower().strip()
-    if text1_lower == text2_lower:
+    if tokens1.text == tokens2.text:
         return 1.0
-    if text1_lower in text2_lower or text2_lower in text1_lower:
+    if tokens1.text in tokens2.text or tokens2.text in tokens1.text:
         return 0.9
 
-    def split_structured_elements(text):
-        elements = []
-        for separator in [',', '\n', '\r\n']:
-            elements.extend([elem.strip() for elem in text.split(separator)])
-        return [elem for elem in elements if elem]
-
-    elements1 = set(split_structured_elements(text1_lower))
-    elements2 = set(split_structured_elements(text2_lower))
+    elements1 = tokens1.elements
+    elements2 = tokens2.elements
     if elements1 and elements2:
-        element_intersection = elements1.intersection(elements2)
-        element_union = elements1.union(elements2)
-        element_similarity = len(element_intersection) / len(element_union) if element_union else 0.0
-        if element_similarity > 0:
-            if len(element_intersection) >= 2:
+        n_shared = len(elements1 & elements2)
+        if n_shared > 0:
+            element_similarity = n_shared / (len(elements1) + len(elements2) - n_shared)
+            if n_shared >= 2:
                 element_similarity = min(0.95, element_similarity * 1.3)
             return element_similarity
 
-    words1 = set(text1_lower.split())
-    words2 = set(text2_lower.split())
-    if not words1 or not words2:
+    if not fuzzy or not tokens1.words or not tokens2.words:
         return 0.0
-    fuzzy_similarity = _compute_fuzzy_word_similarity(words1, words2)
+    fuzzy_similarity = _compute_fuzzy_word_similarity(tokens1.words, tokens2.words)
     return min(0.7, fuzzy_similarity)
 
 
+def compute_text_similarity(text1: str, text2: str) -> float:
+    return prompt_tokens_similarity(tokenize_prompt(_ensure_str(text1)), tokenize_prompt(_ensure_str(text2)))
+
+
+def _substring_candidates(texts: List[Optional[str]]):
+    """
+    Pairs of texts where one contains the other, which compute_text_similarity
+    scores 0.9 however different their lengths.
+
+    The word runs of a text other than its first and last are whole runs of
+    any text containing it, so its rarest such run narrows the texts to check.
+    Texts of fewer than three runs are searched for in all texts joined.
+    :param texts: Lowercased texts, or None for texts not to pair.
+    :returns: (ids1, ids2) arrays with ids1 < ids2.
+    """
+    runs = [None if text is None else re.findall(r"\w+", text) for text in texts]
+    postings = {}
+    for text_id, text_runs in enumerate(runs):
+        if text_runs is not None:
+            for run in set(text_runs):
+                postings.setdefault(run, []).append(text_id)
+    ids = [text_id for text_id, text in enumerate(texts) if text is not None]
+    corpus = "\x00".join(texts[text_id] for text_id in ids)
+    corpus_starts = np.cumsum([0] + [len(texts[text_id]) + 1 for text_id in ids[:-1]])
+
+    pairs = set()
+    for text_id, text in enumerate(texts):
+        if text is None:
+            continue
+        if text == "":
+            # An empty stripped text is contained in every other text
+            containing = ids
+        elif len(runs[text_id]) >= 3:
+            rarest = min(runs[text_id][1:-1], key=lambda run: len(postings[run]))
+            containing = [other for other in postings[rarest]
+                          if len(texts[other]) > len(text) and text in texts[other]]
+        else:
+            containing = set()
+            position = corpus.find(text)
+            while position != -1:
+                containing.add(ids[int(np.searchsorted(corpus_starts, position, side="right")) - 1])
+                position = corpus.find(text, position + 1)
+        for other in containing:
+            if other != text_id:
+                pairs.add((min(text_id, other), max(text_id, other)))
+    pairs = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def prompt_similarity_pairs(positive_texts: List[str], negative_texts: List[str], threshold: float):
+    """
+    Find the pairs of files whose combined prompt similarity, weighted 0.7 for
+    the positive and 0.3 for the negative prompts, is at least the threshold.
+
+    Files with the same prompts are collapsed, and the candidate pairs are
+    the positive prompts containing one another and those found by MinHash
+    LSH over the elements and words of the positive prompts, which are then
+    scored exactly. As the negative prompts add at most 0.3, a matching pair
+    needs a positive similarity of (threshold - 0.3) / 0.7, and the LSH
+    bands are chosen so that pairs whose token sets are similar enough to
+    reach it through shared elements are candidates with 98% probability.
+    Pairs matching only through fuzzy word matches, which only reach the
+    thresholds of 0.79 or below, may be missed. At thresholds of 0.3 or
+    below every pair is scored. The pairs are reduced by signature_pairs.
+    :returns: Generator of (indexes1, indexes2, similarities) arrays.
+    """
+    signature_ids = {}
+    signature_files = []
+    for index, (positive, negative) in enumerate(zip(positive_texts, negative_texts)):
+        signature = (tokenize_prompt(_ensure_str(positive)), tokenize_prompt(_ensure_str(negative)))
+        if signature not in signature_ids:
+            signature_ids[signature] = len(signature_files)
+            signature_files.append([])
+        signature_files[signature_ids[signature]].append(index)
+    signatures = list(signature_ids)
+    n_signatures = len(signatures)
+
+    def similarity(id1, id2):
+        '''
+        Combined similarity of two signatures, skipping fuzzy word matches
+        where they cannot reach the threshold, so that only scores below it
+        may be lower than compute_text_similarity gives.
+        '''
+        positive1, negative1 = signatures[id1]
+        positive2, negative2 = signatures[id2]
+        positive = prompt_tokens_similarity(positive1, positive2, fuzzy=0.7 * 0.7 + 0.3 >= threshold)
+        negative = prompt_tokens_similarity(negative1, negative2, fuzzy=positive * 0.7 + 0.7 * 0.3 >= threshold)
+        return positive * 0.7 + negative * 0.3
+
+    self_similarities = [similarity(i, i) for i in range(n_signatures)]
+
+    min_positive_similarity = (threshold - 0.3) / 0.7
+    if min_positive_similarity <= 0:
+        ids1, ids2 = np.triu_indices(n_signatures, 1)
+    else:
+        vocabulary = {}
+        token_sets = []
+        for positive, _negative in signatures:
+            # Elements and words are kept apart by the element flag
+            tokens = [vocabulary.setdefault((True, elem), len(vocabulary)) for elem in positive.elements]
+            tokens += [vocabulary.setdefault((False, word), len(vocabulary)) for word in positive.words]
+            token_sets.append(tokens)
+        # Shared elements give at most 1.3 times their Jaccard similarity,
+        # and the words of slightly different elements still overlap
+        min_jaccard = max(0.1, min(1.0, 0.8 * min_positive_similarity / 1.3))
+        lsh = MinHashLSH(token_sets)
+        lsh_ids1, lsh_ids2 = lsh.candidate_pairs(MinHashLSH.rows_per_band_for(min_jaccard))
+        substring_ids1, substring_ids2 = _substring_candidates(
+            [None if positive.is_empty else positive.text for positive, _negative in signatures])
+        keys = np.concatenate([lsh_ids1 * n_signatures + lsh_ids2,
+                               substring_ids1 * n_signatures + substring_ids2])
+        keys = sorted_unique_counts(keys)[0]
+        ids1, ids2 = keys // n_signatures, keys % n_signatures
+
+    similarities = np.array([similarity(id1, id2) for id1, id2 in zip(ids1.tolist(), ids2.tolist())],
+                            dtype=np.float64)
+    matches = similarities >= threshold
+    yield from signature_pairs(signature_files, self_similarities, ids1[matches], ids2[matches],
+                               similarities[matches], threshold)
+
+
 class ComparePromptsExact(BaseCompare):
     COMPARE_MODE = CompareMode.PROMPTS_EXACT
     SEARCH_OUTPUT_FILE = "weidr_search_output.txt"
@@ -178,7 +334,6 @@ class ComparePromptsExact(BaseCompare):
         self.threshold_duplicate = ComparePromptsExact.THRESHHOLD_POTENTIAL_DUPLICATE
         self.threshold_probable_match = ComparePromptsExact.THRESHHOLD_PROBABLE_MATCH
         self.threshold_group_cutoff = ComparePromptsExact.THRESHHOLD_GROUP_CUTOFF
-        self._probable_duplicates = []
         self.settings_updated = False
         # Initialize compare_data for prompt comparison
         self.compare_data = CompareData(base_dir=self.base_dir, mode=CompareMode.PROMPTS_EXACT)
@@ -223,6 +378,7 @@ class ComparePromptsExact(BaseCompare):
         else:
             raise Exception("No gather files function found.")
         self.files.sort()
+        self._restrict_to_candidate_files()
         self.has_new_file_data = False
         self.max_files_processed = min(self.args.counter_limit, len(self.files))
         self.max_files_processed_even = Utils.round_up(self.max_files_processed, 200)
@@ -532,7 +688,8 @@ class ComparePromptsExact(BaseCompare):
 
     def run_comparison(self, store_checkpoints=False):
         '''
-        Compare all found prompt texts to each other using exact text matching.
+        Compare all found prompt texts to each other using exact text matching,
+        scoring only the candidate pairs found by prompt_similarity_pairs.
         Uses in-memory _file_pos_texts / _file_neg_texts (aligned with files_found), not
         file_data_dict, because save_data() clears file_data_dict to free memory after persist.
         '''
@@ -547,110 +704,26 @@ class ComparePromptsExact(BaseCompare):
         if self.compare_result.is_complete:
             return (self.compare_result.files_grouped, self.compare_result.file_groups)
 
-        n_files_found_even = Utils.round_up(self.compare_data.n_files_found, 5)
-        if self.compare_result.i > 1:
-            self._handle_progress(self.compare_result.i, n_files_found_even, gathering_data=False)
-
-        if self.compare_data.n_files_found > 5000:
-            logger.warning("\nWARNING: Large image file set found, comparison between all"
-                  + " images may take a while.\n")
         if self.verbose:
             logger.info("Identifying groups of similar prompt files using exact text matching...")
         else:
             print("Identifying groups of similar prompt files using exact text matching", end="", flush=True)
 
-        for i in range(self.compare_data.n_files_found):
-            if i == 0:  # Skip self-comparison
-                continue
-            if store_checkpoints:
-                if i < self.compare_result.i:
-                    continue
-                if i % 250 == 0 and i != len(self.compare_data.files_found) and i > self.compare_result.i:
-                    self.compare_result.store()
-                self.compare_result.i = i
-            self._handle_progress(i, n_files_found_even, gathering_data=False)
-
-            # Get prompts from in-memory arrays (same pattern as embedding mode using _file_embeddings)
-            if i >= len(self._file_pos_texts) or i >= len(self._file_neg_texts):
-                continue
-            current_positive = self._file_pos_texts[i]
-            current_negative = self._file_neg_texts[i]
-
-            # Compare with all other files
-            for j in range(i + 1, self.compare_data.n_files_found):
-                if self.is_cancelled():
-                    self.raise_cancellation_exception()
-                
-                if j >= len(self._file_pos_texts) or j >= len(self._file_neg_texts):
-                    continue
-                compare_positive = self._file_pos_texts[j]
-                compare_negative = self._file_neg_texts[j]
-
-                # Calculate similarity
-                positive_similarity = compute_text_similarity(current_positive, compare_positive)
-                negative_similarity = compute_text_similarity(current_negative, compare_negative)
-                combined_similarity = (positive_similarity * 0.7) + (negative_similarity * 0.3)
-
-                if combined_similarity >= self.threshold_duplicate:
-                    base_file = self.compare_data.files_found[i]
-                    diff_file = self.compare_data.files_found[j]
-                    if ((base_file, diff_file) not in self._probable_duplicates
-                            and (diff_file, base_file) not in self._probable_duplicates):
-                        self._probable_duplicates.append((base_file, diff_file))
-
-                # Group similar files
-                if combined_similarity >= self.threshold_probable_match:
-                    f1_grouped = i in self.compare_result.files_grouped
-                    f2_grouped = j in self.compare_result.files_grouped
-
-                    if not f1_grouped and not f2_grouped:
-                        self.compare_result.files_grouped[i] = (
-                            self.compare_result.group_index, combined_similarity)
-                        self.compare_result.files_grouped[j] = (
-                            self.compare_result.group_index, combined_similarity)
-                        self.compare_result.group_index += 1
-                    elif f1_grouped:
-                        existing_group_index, previous_similarity = self.compare_result.files_grouped[i]
-                        if combined_similarity - previous_similarity > self.threshold_group_cutoff:
-                            self.compare_result.files_grouped[i] = (
-                                self.compare_result.group_index, combined_similarity)
-                            self.compare_result.files_grouped[j] = (
-                                self.compare_result.group_index, combined_similarity)
-                            self.compare_result.group_index += 1
-                        else:
-                            self.compare_result.files_grouped[j] = (
-                                existing_group_index, combined_similarity)
-                    else:
-                        existing_group_index, previous_similarity = self.compare_result.files_grouped[j]
-                        if combined_similarity - previous_similarity > self.threshold_group_cutoff:
-                            self.compare_result.files_grouped[i] = (
-                                self.compare_result.group_index, combined_similarity)
-                            self.compare_result.files_grouped[j] = (
-                                self.compare_result.group_index, combined_similarity)
-                            self.compare_result.group_index += 1
-                        else:
-                            self.compare_result.files_grouped[i] = (
-                                existing_group_index, combined_similarity)
-
-        # Validate indices before accessing files_found
-        return_current_results, should_restart = self._validate_checkpoint_data()
-        if should_restart:
-            return self.run_comparison(store_checkpoints=store_checkpoints)
-        if return_current_results:
-            return (self.compare_result.files_grouped, self.compare_result.file_groups)
-
-        for file_index in self.compare_result.files_grouped:
-            _file = self.compare_data.files_found[file_index]
-            group_index, similarity = self.compare_result.files_grouped[file_index]
-            if group_index in self.compare_result.file_groups:
-                file_group = self.compare_result.file_groups[group_index]
-            else:
-                file_group = {}
-            file_group[_file] = similarity
-            self.compare_result.file_groups[group_index] = file_group
-
-        self.compare_result.finalize_group_result()
-        return (self.compare_result.files_grouped, self.compare_result.file_groups)
+        for indexes1, indexes2, similarities in prompt_similarity_pairs(
+                self._file_pos_texts, self._file_neg_texts, self.threshold_probable_match):
+            if self.is_cancelled():
+                self.raise_cancellation_exception()
+            self.compare_result.add_pairs(indexes1, indexes2, similarities,
+                                          duplicates=similarities >= self.threshold_duplicate)
+        if self.threshold_duplicate < self.threshold_probable_match:
+            # Duplicates below the grouping threshold are marked without grouping them
+            for indexes1, indexes2, similarities in prompt_similarity_pairs(
+                    self._file_pos_texts, self._file_neg_texts, self.threshold_duplicate):
+                for index1, index2, similarity in zip(indexes1.tolist(), indexes2.tolist(), similarities.tolist()):
+                    if similarity < self.threshold_probable_match:
+                        self.compare_result.grouping.add_duplicate(index1, index2)
+
+        return self._finish_comparison(store_checkpoints=store_checkpoints)
 
     def run(self, store_checkpoints=False):
         '''
@@ -669,9 +742,6 @@ class ComparePromptsExact(BaseCompare):
         else:
             return self.run_comparison(store_checkpoints=store_checkpoints)
 
-    def get_probable_duplicates(self):
-        return self._probable_duplicates
-    
     def remove_from_groups(self, removed_files=[]):
         # TODO technically it would be better to refresh the file and data lists every time a compare is done
         remove_indexes = []
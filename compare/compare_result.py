@@ -1,6 +1,8 @@
 import os
 import pickle
 
+import numpy as np
+
 from utils.logging_setup import get_logger
 from utils.translations import I18N
 from utils.utils import Utils
@@ -9,12 +11,283 @@ _ = I18N._
 logger = get_logger("compare_result")
 
 
+class DisjointSetGrouping:
+    '''
+    Builds file groups from a stream of matching pairs of file indexes.
+
+    Files are joined with a disjoint-set (union-find) structure using path
+    compression and union by size, so a pair is grouped in near constant time
+    regardless of how many pairs have been seen. The best score seen for each
+    file and for each group is tracked, where "best" is the highest similarity
+    or the lowest diff score depending on higher_is_better. Probable duplicate
+    pairs are registered in a set keyed by (lower index, higher index).
+    '''
+
+    def __init__(self, higher_is_better=True):
+        self.higher_is_better = higher_is_better
+        self._parent = {}
+        self._size = {}
+        self._scores = {}
+        self._group_scores = {}
+        self._duplicates = set()
+
+    def __len__(self):
+        return len(self._parent)
+
+    def __contains__(self, index):
+        return index in self._parent
+
+    def _is_better(self, score, previous_score):
+        return score > previous_score if self.higher_is_better else score < previous_score
+
+    def find(self, index):
+        parent = self._parent
+        root = index
+        while parent[root] != root:
+            root = parent[root]
+        while parent[index] != root:
+            parent[index], index = root, parent[index]
+        return root
+
+    def _add(self, index, score):
+        if index not in self._parent:
+            self._parent[index] = index
+            self._size[index] = 1
+            self._scores[index] = score
+            self._group_scores[index] = score
+        elif self._is_better(score, self._scores[index]):
+            self._scores[index] = score
+
+    def add_pair(self, index1, index2, score, is_duplicate=False):
+        '''
+        Join the groups of two matching files.
+        '''
+        self._add(index1, score)
+        self._add(index2, score)
+        root = self._union(index1, index2)
+        if self._is_better(score, self._group_scores[root]):
+            self._group_scores[root] = score
+        if is_duplicate:
+            self.add_duplicate(index1, index2)
+
+    def _union(self, index1, index2):
+        root1 = self.find(index1)
+        root2 = self.find(index2)
+        if root1 != root2:
+            if self._size[root1] < self._size[root2]:
+                root1, root2 = root2, root1
+            self._parent[root2] = root1
+            self._size[root1] += self._size.pop(root2)
+            group_score = self._group_scores.pop(root2)
+            if self._is_better(group_score, self._group_scores[root1]):
+                self._group_scores[root1] = group_score
+        return root1
+
+    def add_pairs(self, indexes1, indexes2, scores, duplicates=None):
+        '''
+        Join the groups of each pair of matching files from aligned sequences
+        or arrays. duplicates is an optional boolean mask of the same length.
+        '''
+        indexes1 = np.asarray(indexes1)
+        indexes2 = np.asarray(indexes2)
+        for index1, index2, score in zip(indexes1.tolist(), indexes2.tolist(), np.asarray(scores).tolist()):
+            self.add_pair(index1, index2, score)
+        if duplicates is not None:
+            duplicates = np.asarray(duplicates, dtype=bool)
+            for index1, index2 in zip(indexes1[duplicates].tolist(), indexes2[duplicates].tolist()):
+                self.add_duplicate(index1, index2)
+
+    def add_duplicate(self, index1, index2):
+        self._duplicates.add((index1, index2) if index1 < index2 else (index2, index1))
+
+    def max_index(self):
+        return max(self._parent) if len(self._parent) > 0 else -1
+
+    def score(self, index):
+        return self._scores[index]
+
+    def group_score(self, index):
+        return self._group_scores[self.find(index)]
+
+    def _group_indexes(self):
+        '''
+        Number the groups in order of their lowest file index.
+        '''
+        group_indexes = {}
+        for index in sorted(self._parent):
+            root = self.find(index)
+            if root not in group_indexes:
+                group_indexes[root] = len(group_indexes)
+        return group_indexes
+
+    def files_grouped(self):
+        '''
+        Keys are the file indexes, values are tuple of the group index and the
+        best score of the file.
+        '''
+        group_indexes = self._group_indexes()
+        return {index: (group_indexes[self.find(index)], self._scores[index])
+                for index in sorted(self._parent)}
+
+    def group_scores(self):
+        '''
+        Keys are the group indexes, values the best score within the group.
+        '''
+        return {group_index: self._group_scores[root]
+                for root, group_index in self._group_indexes().items()}
+
+    def duplicate_pairs(self):
+        return sorted(self._duplicates)
+
+    @staticmethod
+    def from_files_grouped(files_grouped, higher_is_better=True):
+        '''
+        Rebuild the grouping from a legacy files_grouped dict of file index to
+        (group index, score).
+        '''
+        grouping = DisjointSetGrouping(higher_is_better=higher_is_better)
+        first_in_group = {}
+        for index, (group_index, score) in files_grouped.items():
+            grouping._add(index, score)
+            if group_index in first_in_group:
+                grouping._union(first_in_group[group_index], index)
+            else:
+                first_in_group[group_index] = index
+        return grouping
+
+    def __getstate__(self):
+        # Store flat arrays rather than dicts of python ints, which pickle to
+        # several times the size for large groupings
+        members = np.array(sorted(self._parent), dtype=np.int64)
+        roots = np.array([self.find(index) for index in members.tolist()], dtype=np.int64)
+        group_roots = np.array(list(self._group_scores.keys()), dtype=np.int64)
+        duplicates = np.array(sorted(self._duplicates), dtype=np.int64).reshape(-1, 2)
+        return {
+            "higher_is_better": self.higher_is_better,
+            "members": members,
+            "roots": roots,
+            "scores": np.array([self._scores[index] for index in members.tolist()], dtype=np.float64),
+            "group_roots": group_roots,
+            "group_scores": np.array(list(self._group_scores.values()), dtype=np.float64),
+            "duplicates": duplicates,
+        }
+
+    def __setstate__(self, state):
+        self.higher_is_better = state["higher_is_better"]
+        members = state["members"].tolist()
+        roots = state["roots"].tolist()
+        self._parent = dict(zip(members, roots))
+        self._size = {}
+        for root in roots:
+            self._size[root] = self._size.get(root, 0) + 1
+        self._scores = dict(zip(members, state["scores"].tolist()))
+        self._group_scores = dict(zip(state["group_roots"].tolist(), state["group_scores"].tolist()))
+        self._duplicates = set(map(tuple, state["duplicates"].tolist()))
+
+
+class PairGraph:
+    '''
+    The matching pairs of a comparison, held as aligned arrays of file
+    indexes, scores and duplicate flags together with the list of files the
+    indexes refer to.
+
+    The graph is stored next to the compare result so that when files are
+    added to or removed from the directory, the pairs of removed files can be
+    dropped and only the new files compared, instead of comparing all pairs
+    again. files is None if the graph does not cover a known list of files.
+    '''
+    GRAPH_FILENAME = "weidr_pair_graph.npz"
+
+    def __init__(self, files=None):
+        self.files = None if files is None else list(files)
+        self._chunks = []
+        self._pending = []
+
+    def __len__(self):
+        return len(self.arrays()[0])
+
+    def add_pair(self, index1, index2, score, is_duplicate=False):
+        self._pending.append((index1, index2, score, is_duplicate))
+
+    def add_pairs(self, indexes1, indexes2, scores, duplicates=None):
+        indexes1 = np.asarray(indexes1, dtype=np.int64)
+        if len(indexes1) == 0:
+            return
+        if duplicates is None:
+            duplicates = np.zeros(len(indexes1), dtype=bool)
+        self._flush_pending()
+        self._chunks.append((indexes1,
+                             np.asarray(indexes2, dtype=np.int64),
+                             np.asarray(scores, dtype=np.float64),
+                             np.asarray(duplicates, dtype=bool)))
+
+    def _flush_pending(self):
+        if len(self._pending) == 0:
+            return
+        indexes1, indexes2, scores, duplicates = zip(*self._pending)
+        self._pending = []
+        self._chunks.append((np.array(indexes1, dtype=np.int64),
+                             np.array(indexes2, dtype=np.int64),
+                             np.array(scores, dtype=np.float64),
+                             np.array(duplicates, dtype=bool)))
+
+    def arrays(self):
+        '''
+        Returns the tuple of (indexes1, indexes2, scores, duplicates) arrays of all pairs.
+        '''
+        self._flush_pending()
+        if len(self._chunks) == 0:
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                    np.empty(0, dtype=np.float64), np.empty(0, dtype=bool))
+        if len(self._chunks) > 1:
+            self._chunks = [tuple(np.concatenate(arrays) for arrays in zip(*self._chunks))]
+        return self._chunks[0]
+
+    def remap(self, files):
+        '''
+        Renumber the pairs for a new list of files, dropping the pairs of any
+        files no longer present.
+        :returns: Sorted array of the indexes of files not yet in the graph.
+        '''
+        new_indexes = {f: index for index, f in enumerate(files)}
+        id_map = np.array([new_indexes.get(f, -1) for f in self.files], dtype=np.int64)
+        indexes1, indexes2, scores, duplicates = self.arrays()
+        if len(indexes1) > 0:
+            indexes1 = id_map[indexes1]
+            indexes2 = id_map[indexes2]
+            keep = (indexes1 >= 0) & (indexes2 >= 0)
+            self._chunks = [(indexes1[keep], indexes2[keep], scores[keep], duplicates[keep])]
+        is_new = np.ones(len(files), dtype=bool)
+        is_new[id_map[id_map >= 0]] = False
+        self.files = list(files)
+        return np.flatnonzero(is_new)
+
+    def to_grouping(self, higher_is_better=True):
+        grouping = DisjointSetGrouping(higher_is_better=higher_is_better)
+        indexes1, indexes2, scores, duplicates = self.arrays()
+        grouping.add_pairs(indexes1, indexes2, scores, duplicates=duplicates)
+        return grouping
+
+    def save(self, path):
+        indexes1, indexes2, scores, duplicates = self.arrays()
+        with open(path, "wb") as f:
+            np.savez(f, files=np.array(self.files, dtype=str), indexes1=indexes1,
+                     indexes2=indexes2, scores=scores, duplicates=duplicates)
+
+    @staticmethod
+    def load(path):
+        with np.load(path, allow_pickle=False) as data:
+            graph = PairGraph(data["files"].tolist())
+            graph.add_pairs(data["indexes1"], data["indexes2"], data["scores"], duplicates=data["duplicates"])
+        return graph
+
+
 class CompareResult:
     SEARCH_OUTPUT_FILE = "weidr_search_output.txt"
     GROUPS_OUTPUT_FILE = "weidr_file_groups_output.txt"
     RESULT_FILENAME = "weidr_result.pkl"
 
-    def __init__(self, base_dir=".", files=[]):
+    def __init__(self, base_dir=".", files=[], higher_is_better=True):
         self.base_dir = base_dir
         self.search_output_path = os.path.join(
             base_dir, CompareResult.SEARCH_OUTPUT_FILE)
@@ -24,8 +297,58 @@ class CompareResult:
         self.file_groups = {}
         self.files_grouped = {}
         self.group_index = 0
+        self.grouping = DisjointSetGrouping(higher_is_better=higher_is_better)
+        self.probable_duplicates = []
         self.is_complete = False
         self.i = 1  # start at 1 because index 0 is identity comparison roll index
+        self.tile_row = 0  # next row (block) for the row-wise all-pairs comparisons
+        self.ann_list = 0  # next list for the approximate comparison from the ANN index
+        self.pair_graph = PairGraph(files)
+        self.pending_rows = None  # indexes of files added since the pairs were found
+
+    def add_pair(self, index1, index2, score, is_duplicate=False):
+        self.grouping.add_pair(index1, index2, score, is_duplicate=is_duplicate)
+        self.pair_graph.add_pair(index1, index2, score, is_duplicate=is_duplicate)
+
+    def add_pairs(self, indexes1, indexes2, scores, duplicates=None):
+        self.grouping.add_pairs(indexes1, indexes2, scores, duplicates=duplicates)
+        self.pair_graph.add_pairs(indexes1, indexes2, scores, duplicates=duplicates)
+
+    def update_files(self, files):
+        '''
+        Update the result for files added to or removed from the compared
+        files. The pairs of removed files are dropped and the grouping is
+        rebuilt from the remaining pairs, so only the added files need to be
+        compared.
+
+        Returns the indexes of the added files, or None if the result has no
+        pair graph of the compared files to update.
+        '''
+        if self.pair_graph.files is None or len(self.pair_graph.files) == 0:
+            return None
+        new_rows = self.pair_graph.remap(files)
+        self.grouping = self.pair_graph.to_grouping(higher_is_better=self.grouping.higher_is_better)
+        self._dir_files_hash = CompareResult.hash_dir_files(files)
+        return new_rows
+
+    def build_groups(self, files):
+        '''
+        Set files_grouped, file_groups and probable_duplicates from the pairs
+        collected in the grouping.
+
+        files_grouped - Keys are the file indexes, values are tuple of the group index and score.
+        file_groups - Keys are the group indexes, values are dicts with keys as the file in the group, values the score
+        '''
+        self.files_grouped = self.grouping.files_grouped()
+        self.file_groups = {}
+        for file_index, (group_index, score) in self.files_grouped.items():
+            if group_index not in self.file_groups:
+                self.file_groups[group_index] = {}
+            self.file_groups[group_index][files[file_index]] = score
+        self.group_index = len(self.file_groups)
+        self.probable_duplicates = [(files[index1], files[index2])
+                                    for index1, index2 in self.grouping.duplicate_pairs()]
+        return (self.files_grouped, self.file_groups)
 
     def finalize_search_result(self, search_path, args=None, verbose=False, threshold_duplicate=0.99, threshold_related=0.95, is_embedding=False):
         if len(self.files_grouped) > 0:
@@ -120,11 +443,24 @@ class CompareResult:
         return sorted(file_groups,
                       key=lambda group_index: len(file_groups[group_index]))
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The pair graph is stored separately, see store()
+        del state["pair_graph"]
+        if len(self.grouping) > 0:
+            # Groups are rebuilt from the grouping on load
+            state["files_grouped"] = {}
+            state["file_groups"] = {}
+            state["probable_duplicates"] = []
+        return state
+
     def store(self):
         save_path = CompareResult.cache_path(self.base_dir)
         with open(save_path, "wb") as f:
             pickle.dump(self, f)
             logger.info(f"Stored compare result: {save_path}")
+        if self.pair_graph.files is not None:
+            self.pair_graph.save(CompareResult.graph_path(self.base_dir))
 
     def equals_hash(self, files):
         return self._dir_files_hash == CompareResult.hash_dir_files(files)
@@ -133,6 +469,10 @@ class CompareResult:
     def cache_path(base_dir):
         return os.path.join(base_dir, CompareResult.RESULT_FILENAME)
 
+    @staticmethod
+    def graph_path(base_dir):
+        return os.path.join(base_dir, PairGraph.GRAPH_FILENAME)
+
     @staticmethod
     def hash_dir_files(files):
         hash_list = []
@@ -146,32 +486,66 @@ class CompareResult:
         Returns True if all indices are valid, False otherwise.
         """
         valid_indices = [idx for idx in self.files_grouped if idx < len(files)]
-        if len(valid_indices) != len(self.files_grouped):
+        valid_grouping = self.grouping.max_index() < len(files)
+        if len(valid_indices) != len(self.files_grouped) or not valid_grouping:
             logger.error("Warning: Checkpoint data contains invalid indices. Discarding checkpoint data.")
             return False
         return True
 
     @staticmethod
-    def load(base_dir, files, overwrite=False):
+    def load(base_dir, files, overwrite=False, higher_is_better=True, incremental=False):
+        '''
+        Load the stored compare result for the base dir. If incremental is set
+        and the files have changed since a completed result was stored, the
+        result is updated for the changed files and its pending_rows set to
+        the indexes of the files that still need to be compared.
+        '''
         if overwrite:
-            return CompareResult(base_dir, files)
+            return CompareResult(base_dir, files, higher_is_better=higher_is_better)
         cache_path = CompareResult.cache_path(base_dir)
         if not os.path.exists(cache_path):
             logger.info(f"No checkpoint found for {base_dir} - creating new compare result cache.")
-            return CompareResult(base_dir, files)
+            return CompareResult(base_dir, files, higher_is_better=higher_is_better)
         cached = None
         try:
             with open(cache_path, "rb") as f:
                 cached = pickle.load(f)
         except Exception:
             logger.error(f"Failed to load compare result from base dir {base_dir}")
-            return CompareResult(base_dir, files)
+            return CompareResult(base_dir, files, higher_is_better=higher_is_better)
+        cached.pair_graph = PairGraph()
+        graph_path = CompareResult.graph_path(base_dir)
+        if os.path.exists(graph_path):
+            try:
+                cached.pair_graph = PairGraph.load(graph_path)
+            except Exception as e:
+                logger.error(f"Failed to load pair graph from base dir {base_dir}: {e}")
+        if not hasattr(cached, "pending_rows"):
+            cached.pending_rows = None
         if not cached.equals_hash(files):
-            raise ValueError(f"{cache_path} does not match {files}")
+            new_rows = cached.update_files(files) if incremental and cached.is_complete else None
+            if new_rows is None:
+                raise ValueError(f"{cache_path} does not match {files}")
+            logger.info(f"Updating compare result for changed files, {len(new_rows)} new files to compare")
+            cached.pending_rows = new_rows
+            cached.is_complete = False
+
+        if not hasattr(cached, "tile_row"):
+            cached.tile_row = 0
+        if not hasattr(cached, "ann_list"):
+            cached.ann_list = 0
+        if not hasattr(cached, "grouping"):
+            # Results stored before pairs were grouped with a disjoint set
+            cached.grouping = DisjointSetGrouping.from_files_grouped(
+                cached.files_grouped, higher_is_better=higher_is_better)
+            cached.probable_duplicates = []
 
         # Validate that all indices in files_grouped are valid
         if not cached.validate_indices(files):
-            return CompareResult(base_dir, files)
+            return CompareResult(base_dir, files, higher_is_better=higher_is_better)
+
+        if cached.is_complete and len(cached.grouping) > 0:
+            cached.build_groups(files)
 
         logger.info(f"Loaded compare result: {cache_path}")
         return cached
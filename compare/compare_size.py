@@ -2,13 +2,14 @@ import os
 import re
 from typing import Tuple, Optional
 
-from PIL import Image
+import numpy as np
 
 from compare.base_compare import BaseCompare, gather_files
 from compare.compare_args import CompareArgs
 from compare.compare_data import CompareData
 from compare.compare_result import CompareResult
-from image.frame_cache import FrameCache
+from compare.signature_pairs import signature_pairs
+from image.image_dimensions import image_dimensions
 from utils.config import config
 from utils.constants import CompareMode
 from utils.logging_setup import get_logger
@@ -25,13 +26,10 @@ def extract_size_from_image(image_path: str) -> Optional[Tuple[int, int]]:
     Extract width and height from an image file.
     Returns (width, height) tuple or None if extraction fails.
     """
-    try:
-        image_path = FrameCache.get_image_path(image_path)
-        with Image.open(image_path) as img:
-            return img.size  # Returns (width, height)
-    except Exception as e:
-        logger.error(f"Error extracting size from {image_path}: {e}")
-        return None
+    size = image_dimensions.get_dimensions(image_path, extract_frame=True)
+    if size is None:
+        logger.error(f"Error extracting size from {image_path}")
+    return size
 
 
 def parse_size_search(search_text: str) -> Optional[Tuple[int, int]]:
@@ -85,6 +83,121 @@ def size_similarity(size1: Tuple[int, int], size2: Tuple[int, int], tolerance: i
     return 0.0
 
 
+def _window_pairs(sorted_values, window):
+    '''
+    Pairs of positions i < j in a sorted array with values[j] - values[i]
+    within the window, each found by bisecting for the end of its window.
+    '''
+    ends = np.searchsorted(sorted_values, sorted_values + window, side="right")
+    counts = ends - np.arange(len(sorted_values)) - 1
+    total = int(counts.sum())
+    positions1 = np.repeat(np.arange(len(sorted_values)), counts)
+    positions2 = positions1 + 1 + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return positions1, positions2
+
+
+class SizeIndex:
+    '''
+    Index of image sizes for finding the sizes within a pixel tolerance or an
+    aspect ratio tolerance of each other in n log n time.
+
+    Files are bucketed by exact size, and the distinct sizes are sorted by
+    width and by aspect ratio, so that the sizes within a tolerance of any
+    size are found by bisecting the sorted arrays for its window.
+    '''
+    def __init__(self, sizes):
+        sizes = np.asarray(sizes, dtype=np.int64).reshape(-1, 2)
+        # Sorting the sizes packed into one key orders them by width, then height
+        keys = (sizes[:, 0] << 32) | sizes[:, 1]
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bucket_starts = np.flatnonzero(np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]])) \
+            if len(keys) > 0 else np.empty(0, dtype=np.int64)
+        self.sizes = sizes[order[bucket_starts]]
+        self.size_files = [bucket.tolist() for bucket in np.split(order, bucket_starts[1:])] if len(keys) > 0 else []
+        self.widths = self.sizes[:, 0]
+        self._log_aspect_ratios = np.log(np.maximum(self.sizes[:, 0], 1) / np.maximum(self.sizes[:, 1], 1))
+        self._aspect_order = np.argsort(self._log_aspect_ratios, kind="stable")
+        self._sorted_log_aspect_ratios = self._log_aspect_ratios[self._aspect_order]
+
+    @staticmethod
+    def _max_width_difference(tolerance, threshold):
+        # size_similarity is at least the threshold only if the width and height
+        # differences add up to at most 2 * tolerance * (1 - threshold)
+        if tolerance <= 0:
+            return 0
+        return min(tolerance, int(2 * tolerance * (1 - threshold)) + 1)
+
+    @staticmethod
+    def _tolerance_scores(sizes1, sizes2, tolerance):
+        '''
+        size_similarity of aligned arrays of sizes, which are within tolerance.
+        '''
+        if tolerance == 0:
+            return np.ones(len(sizes1))
+        differences = np.abs(sizes1 - sizes2) / max(tolerance, 1)
+        return ((1.0 - differences[:, 0]) + (1.0 - differences[:, 1])) / 2.0
+
+    def pairs(self, tolerance, threshold, aspect_ratio_tolerance=0.0):
+        '''
+        Pairs of distinct sizes matching within the pixel tolerance, or with
+        aspect ratios within the aspect ratio tolerance if it is above 0.
+        :returns: (ids1, ids2, scores) arrays indexing sizes, with ids1 < ids2.
+        '''
+        positions1, positions2 = _window_pairs(self.widths, self._max_width_difference(tolerance, threshold))
+        sizes1, sizes2 = self.sizes[positions1], self.sizes[positions2]
+        matches = np.abs(sizes1[:, 1] - sizes2[:, 1]) <= tolerance
+        positions1, positions2 = positions1[matches], positions2[matches]
+        scores = self._tolerance_scores(sizes1[matches], sizes2[matches], tolerance)
+        matches = scores >= threshold
+        ids1, ids2, scores = positions1[matches], positions2[matches], scores[matches]
+
+        if aspect_ratio_tolerance > 0 and len(self.sizes) > 1:
+            positions1, positions2 = _window_pairs(self._sorted_log_aspect_ratios, np.log1p(aspect_ratio_tolerance))
+            aspect_ids1, aspect_ids2 = self._aspect_order[positions1], self._aspect_order[positions2]
+            aspect_scores = np.exp(-(self._sorted_log_aspect_ratios[positions2] - self._sorted_log_aspect_ratios[positions1]))
+            ids1 = np.concatenate([ids1, np.minimum(aspect_ids1, aspect_ids2)])
+            ids2 = np.concatenate([ids2, np.maximum(aspect_ids1, aspect_ids2)])
+            scores = np.concatenate([scores, aspect_scores])
+            # Keep the best score of pairs matching both ways
+            order = np.lexsort((-scores, ids2, ids1))
+            ids1, ids2, scores = ids1[order], ids2[order], scores[order]
+            first = np.ones(len(ids1), dtype=bool)
+            first[1:] = (ids1[1:] != ids1[:-1]) | (ids2[1:] != ids2[:-1])
+            ids1, ids2, scores = ids1[first], ids2[first], scores[first]
+        return ids1, ids2, scores
+
+    def matching(self, size, tolerance, threshold, aspect_ratio_tolerance=0.0):
+        '''
+        Range query for the sizes matching a size, which need not be indexed,
+        as in pairs.
+        :returns: (ids, scores) arrays indexing sizes.
+        '''
+        size = np.array(size, dtype=np.int64)
+        max_difference = self._max_width_difference(tolerance, threshold)
+        start = np.searchsorted(self.widths, size[0] - max_difference, side="left")
+        end = np.searchsorted(self.widths, size[0] + max_difference, side="right")
+        ids = np.arange(start, end)
+        ids = ids[np.abs(self.sizes[ids, 1] - size[1]) <= tolerance]
+        scores = self._tolerance_scores(self.sizes[ids], size[None, :], tolerance)
+        matches = scores >= threshold
+        ids, scores = ids[matches], scores[matches]
+
+        if aspect_ratio_tolerance > 0:
+            log_aspect_ratio = np.log(max(size[0], 1) / max(size[1], 1))
+            window = np.log1p(aspect_ratio_tolerance)
+            start = np.searchsorted(self._sorted_log_aspect_ratios, log_aspect_ratio - window, side="left")
+            end = np.searchsorted(self._sorted_log_aspect_ratios, log_aspect_ratio + window, side="right")
+            aspect_ids = self._aspect_order[start:end]
+            aspect_scores = np.exp(-np.abs(self._log_aspect_ratios[aspect_ids] - log_aspect_ratio))
+            best = dict(zip(aspect_ids.tolist(), aspect_scores.tolist()))
+            for size_id, score in zip(ids.tolist(), scores.tolist()):
+                best[size_id] = max(score, best.get(size_id, 0.0))
+            ids = np.array(list(best.keys()), dtype=np.int64)
+            scores = np.array(list(best.values()), dtype=np.float64)
+        return ids, scores
+
+
 class CompareSize(BaseCompare):
     COMPARE_MODE = CompareMode.SIZE
     SEARCH_OUTPUT_FILE = "weidr_search_output.txt"
@@ -96,7 +209,10 @@ class CompareSize(BaseCompare):
         super().__init__(args, gather_files_func)
         self.threshold_match = CompareSize.THRESHOLD_MATCH
         self.threshold_tolerance = 0  # Pixel tolerance for size matching
+        self.aspect_ratio_tolerance = config.size_aspect_ratio_tolerance
         self.settings_updated = False
+        self._file_sizes = []
+        self._size_index = None
         # Initialize compare_data for size comparison
         self.compare_data = CompareData(base_dir=self.base_dir, mode=CompareMode.SIZE)
         # Set initial tolerance from args
@@ -138,6 +254,7 @@ class CompareSize(BaseCompare):
         else:
             raise Exception("No gather files function found.")
         self.files.sort()
+        self._restrict_to_candidate_files()
         self.has_new_file_data = False
         self.max_files_processed = min(self.args.counter_limit, len(self.files))
         self.max_files_processed_even = Utils.round_up(self.max_files_processed, 200)
@@ -195,6 +312,7 @@ class CompareSize(BaseCompare):
             print("Gathering size data", end="", flush=True)
 
         counter = 0
+        self._file_sizes = []
 
         for f in self.files:
             if self.is_cancelled():
@@ -220,51 +338,37 @@ class CompareSize(BaseCompare):
 
             counter += 1
             self.compare_data.files_found.append(f)
+            self._file_sizes.append(tuple(size))
             self._handle_progress(counter, self.max_files_processed_even)
 
-        # Save size data
+        image_dimensions.flush()
+        self._size_index = SizeIndex(self._file_sizes)
+        # Save size data, after which file_data_dict may be released
         self.compare_data.save_data(self.args.overwrite, verbose=self.verbose)
 
     def find_similars_to_image(self, search_path, search_file_index):
         '''
         Search for images with similar sizes to the provided image.
         '''
-        files_grouped = {}
         _files_found = list(self.compare_data.files_found)
 
         if self.verbose:
             logger.info("Identifying similar size files...")
         
         # Get the search image's size
-        if search_path in self.compare_data.file_data_dict:
-            search_size = self.compare_data.file_data_dict[search_path]
+        if search_path in _files_found:
+            search_size = self._file_sizes[_files_found.index(search_path)]
         else:
             search_size = extract_size_from_image(search_path)
             if search_size is None:
                 if self.verbose:
                     logger.warning(f"Could not extract size from search image {search_path}")
                 return {0: {}}
-            self.compare_data.file_data_dict[search_path] = search_size
 
-        # Remove search file from comparison list
+        files_grouped = self._matching_files(search_size)
+        # Remove search file from the results
         if search_file_index < len(_files_found):
-            _files_found.pop(search_file_index)
-
-        # Use tolerance from set_similarity_threshold
-        tolerance = getattr(self, 'threshold_tolerance', 0)
-
-        # Compare with all other files
-        for file_path in _files_found:
-            if file_path in self.compare_data.file_data_dict:
-                file_size = self.compare_data.file_data_dict[file_path]
-            else:
-                continue  # Skip files without size data
-            
-            # Calculate similarity score
-            similarity = size_similarity(search_size, file_size, tolerance=tolerance)
-            
-            if similarity >= self.threshold_match:
-                files_grouped[file_path] = similarity
+            files_grouped.pop(_files_found[search_file_index], None)
 
         # Sort results by decreasing similarity score
         self.compare_result.files_grouped = dict(
@@ -303,21 +407,8 @@ class CompareSize(BaseCompare):
             logger.error("No size search criteria provided. Use search_file_path or search_text with size format.")
             return files_grouped
 
-        # Use tolerance from set_similarity_threshold
-        tolerance = getattr(self, 'threshold_tolerance', 0)
-
-        # Compute similarity against each file's stored size
-        temp_scores = {}
-        for file_path in self.compare_data.files_found:
-            if file_path in self.compare_data.file_data_dict:
-                file_size = self.compare_data.file_data_dict[file_path]
-            else:
-                continue
-            
-            similarity = size_similarity(search_size, file_size, tolerance=tolerance)
-            
-            if similarity >= self.threshold_match:
-                temp_scores[file_path] = similarity
+        # Range query for the sizes matching the search size
+        temp_scores = self._matching_files(search_size)
 
         # Order and cap results
         sorted_items = sorted(temp_scores.items(), key=lambda item: item[1], reverse=True)
@@ -339,14 +430,52 @@ class CompareSize(BaseCompare):
             threshold_related=self.threshold_match)
         return files_grouped
 
+    def _get_size_index(self):
+        if self._size_index is None:
+            self._size_index = SizeIndex(self._file_sizes)
+        return self._size_index
+
+    def _matching_files(self, search_size):
+        '''
+        Files with sizes matching the search size, with their similarity scores.
+        '''
+        size_index = self._get_size_index()
+        size_ids, scores = size_index.matching(
+            search_size, self.threshold_tolerance, self.threshold_match, self.aspect_ratio_tolerance)
+        files_found = self.compare_data.files_found
+        return {files_found[index]: score
+                for size_id, score in zip(size_ids.tolist(), scores.tolist())
+                for index in size_index.size_files[size_id]}
+
     def run_search(self):
         return self.search_multimodal()
 
     def run_comparison(self, store_checkpoints=False):
         '''
-        Group comparison is not supported for size comparison.
+        Group all found files by exact size, joining the sizes within the pixel
+        tolerance and, if configured, the aspect ratio tolerance of each other.
         '''
-        raise Exception("Group comparison is not supported for size comparison mode. Use search mode instead.")
+        overwrite = self.args.overwrite or not store_checkpoints
+        self.compare_result = CompareResult.load(
+            self.base_dir, self.compare_data.files_found, overwrite=overwrite)
+        if self.compare_result.is_complete:
+            return (self.compare_result.files_grouped, self.compare_result.file_groups)
+
+        if self.verbose:
+            logger.info("Identifying groups of files with matching sizes...")
+        else:
+            print("Identifying groups of files with matching sizes", end="", flush=True)
+
+        size_index = self._get_size_index()
+        ids1, ids2, scores = size_index.pairs(
+            self.threshold_tolerance, self.threshold_match, self.aspect_ratio_tolerance)
+        for indexes1, indexes2, similarities in signature_pairs(
+                size_index.size_files, np.ones(len(size_index.sizes)), ids1, ids2, scores, self.threshold_match):
+            if self.is_cancelled():
+                self.raise_cancellation_exception()
+            self.compare_result.add_pairs(indexes1, indexes2, similarities)
+
+        return self._finish_comparison(store_checkpoints=store_checkpoints)
 
     def run(self, store_checkpoints=False):
         '''
@@ -366,8 +495,11 @@ class CompareSize(BaseCompare):
     def remove_from_groups(self, removed_files=[]):
         for f in removed_files:
             if f in self.compare_data.files_found:
-                self.compare_data.files_found.remove(f)
-            if f in self.compare_data.file_data_dict:
+                index = self.compare_data.files_found.index(f)
+                self.compare_data.files_found.pop(index)
+                self._file_sizes.pop(index)
+                self._size_index = None
+            if self.compare_data.file_data_dict is not None and f in self.compare_data.file_data_dict:
                 del self.compare_data.file_data_dict[f]
 
     @staticmethod
@@ -14,6 +14,8 @@ from compare.compare_prompts import ComparePrompts
 from compare.compare_prompts_exact import ComparePromptsExact
 from compare.compare_size import CompareSize
 from compare.compare_models import CompareModels
+from compare.compare_hash import CompareHash
+from compare.compare_duplicates import CompareDuplicates
 from compare.classifier_actions_manager import ClassifierActionsManager
 from files.marked_files import MarkedFiles
 from utils.config import config
@@ -393,6 +395,10 @@ class CompareWrapper:
             self._compare = CompareSize(args)
         elif self.compare_mode == CompareMode.MODELS:
             self._compare = CompareModels(args)
+        elif self.compare_mode == CompareMode.PERCEPTUAL_HASH:
+            self._compare = CompareHash(args)
+        elif self.compare_mode == CompareMode.EXACT_DUPLICATES:
+            self._compare = CompareDuplicates(args)
         else:
             raise Exception(f"Unhandled compare mode: {self.compare_mode}")
 
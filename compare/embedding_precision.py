@@ -0,0 +1,224 @@
+import numpy as np
+
+from compare.base_compare import BaseCompare
+from compare.compare_result import DisjointSetGrouping
+from compare.growable_array import GrowableArray
+from utils.constants import EmbeddingPrecision
+from utils.logging_setup import get_logger
+
+logger = get_logger("embedding_precision")
+
+
+def quantize_int8(embeddings):
+    '''
+    Quantize embeddings to int8 codes with a float32 scale per vector, so that
+    embedding ~= codes * scale.
+    :returns: Tuple of (codes, scales).
+    '''
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=-1) / 127.0
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(embeddings / scales[..., None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+class QuantizedEmbeddings:
+    '''
+    Read-only view of embeddings stored at reduced precision. Indexing returns
+    float32 rows, so the tiled similarity engines and search dequantize one
+    block at a time and the full float32 matrix is never held in memory.
+    '''
+    # Rows dequantized per block in a full matrix product
+    BLOCK_ROWS = 65536
+
+    def __init__(self, codes, scales=None):
+        self.codes = codes
+        self.scales = scales
+        self.dtype = np.dtype(np.float32)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def ndim(self):
+        return self.codes.ndim
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        rows = self.codes[key].astype(np.float32)
+        if self.scales is not None:
+            scales = self.scales[key]
+            rows *= scales[..., None] if np.ndim(scales) > 0 else scales
+        return rows
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+    def __matmul__(self, other):
+        other = np.asarray(other, dtype=np.float32)
+        if len(self) <= QuantizedEmbeddings.BLOCK_ROWS:
+            return self[:] @ other
+        return np.concatenate([self[start:start + QuantizedEmbeddings.BLOCK_ROWS] @ other
+                               for start in range(0, len(self), QuantizedEmbeddings.BLOCK_ROWS)])
+
+
+class QuantizedGrowableArray:
+    '''
+    GrowableArray for embeddings stored as float16, or as int8 codes with a
+    float32 scale per row. view() returns a QuantizedEmbeddings.
+    '''
+
+    def __init__(self, precision, row_shape=None):
+        self.precision = EmbeddingPrecision.get(precision)
+        if self.precision == EmbeddingPrecision.INT8:
+            self._codes = GrowableArray(row_shape, dtype=np.int8)
+            self._scales = GrowableArray((), dtype=np.float32)
+        else:
+            self._codes = GrowableArray(row_shape, dtype=np.float16)
+            self._scales = None
+
+    @staticmethod
+    def from_array(array, precision):
+        array = np.asarray(array, dtype=np.float32)
+        growable = QuantizedGrowableArray(precision, row_shape=array.shape[1:])
+        growable.extend(array)
+        return growable
+
+    def __len__(self):
+        return len(self._codes)
+
+    def _encode(self, rows):
+        if self._scales is None:
+            return rows, None
+        return quantize_int8(rows)
+
+    def view(self):
+        return QuantizedEmbeddings(self._codes.view(), None if self._scales is None else self._scales.view())
+
+    def append(self, row):
+        codes, scale = self._encode(np.asarray(row, dtype=np.float32))
+        self._codes.append(codes)
+        if self._scales is not None:
+            self._scales.append(scale)
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=np.float32)
+        if len(rows) == 0:
+            return
+        codes, scales = self._encode(rows)
+        self._codes.extend(codes)
+        if self._scales is not None:
+            self._scales.extend(scales)
+
+    def insert_first(self, row):
+        codes, scale = self._encode(np.asarray(row, dtype=np.float32))
+        self._codes.insert_first(codes)
+        if self._scales is not None:
+            self._scales.insert_first(scale)
+
+    def delete(self, indexes):
+        self._codes.delete(indexes)
+        if self._scales is not None:
+            self._scales.delete(indexes)
+
+
+def leading_rows(embeddings, n):
+    '''
+    The first n rows of the embeddings. Reduced precision embeddings stay
+    quantized, so the comparison engines dequantize one block at a time.
+    '''
+    if isinstance(embeddings, QuantizedEmbeddings):
+        return QuantizedEmbeddings(embeddings.codes[:n], None if embeddings.scales is None else embeddings.scales[:n])
+    return embeddings[:n]
+
+
+def embedding_array(array, precision=EmbeddingPrecision.FLOAT32):
+    '''
+    Wrap an array of embeddings in a growable array at the given precision.
+    '''
+    if EmbeddingPrecision.get(precision) == EmbeddingPrecision.FLOAT32:
+        return GrowableArray.from_array(array)
+    return QuantizedGrowableArray.from_array(array, precision)
+
+
+def _pairs(embeddings, threshold):
+    pairs = {}
+    for _, pairs_i, pairs_j, similarities in BaseCompare.tiled_similarity_pairs(embeddings, threshold):
+        pairs.update(zip(zip(pairs_i.tolist(), pairs_j.tolist()), similarities.tolist()))
+    return pairs
+
+
+def _group_members(pairs):
+    grouping = DisjointSetGrouping()
+    for (i, j), similarity in pairs.items():
+        grouping.add_pair(i, j, similarity)
+    members = {}
+    for index in grouping.files_grouped():
+        members.setdefault(grouping.find(index), set()).add(index)
+    return {index: frozenset(group) for group in members.values() for index in group}
+
+
+def evaluate_precision(embeddings, precision, threshold, k=10, n_queries=200, max_files=20000, seed=0):
+    '''
+    Report how comparison and search results change when the given float32
+    embeddings are stored at a reduced precision.
+
+    Up to max_files embeddings are sampled. Grouping is compared by the pairs
+    found above the threshold and by the files whose group members change.
+    Search is compared by the recall of the float32 top-k results for a
+    sample of the embeddings used as queries.
+    :returns: Dict of the evaluation results.
+    '''
+    precision = EmbeddingPrecision.get(precision)
+    rng = np.random.default_rng(seed)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if len(embeddings) > max_files:
+        embeddings = embeddings[np.sort(rng.choice(len(embeddings), max_files, replace=False))]
+    n = len(embeddings)
+    reduced = embedding_array(embeddings, precision).view()
+
+    exact_pairs = _pairs(embeddings, threshold)
+    reduced_pairs = _pairs(reduced, threshold)
+    n_common = len(exact_pairs.keys() & reduced_pairs.keys())
+    exact_groups = _group_members(exact_pairs)
+    reduced_groups = _group_members(reduced_pairs)
+    n_changed = sum(1 for index in exact_groups.keys() | reduced_groups.keys()
+                    if exact_groups.get(index) != reduced_groups.get(index))
+
+    k = min(k, n)
+    queries = rng.choice(n, min(n_queries, n), replace=False) if n > 0 else np.empty(0, dtype=np.int64)
+    recalls = []
+    max_error = 0.0
+    for query in queries.tolist():
+        exact_scores = embeddings @ embeddings[query]
+        reduced_scores = reduced @ embeddings[query]
+        max_error = max(max_error, float(np.abs(exact_scores - reduced_scores).max()))
+        exact_top = np.argpartition(-exact_scores, k - 1)[:k]
+        reduced_top = np.argpartition(-reduced_scores, k - 1)[:k]
+        recalls.append(len(np.intersect1d(exact_top, reduced_top)) / k)
+
+    report = {
+        "precision": precision.value,
+        "n_files": n,
+        "bytes_per_embedding": reduced.nbytes / n if n > 0 else 0,
+        "float32_bytes_per_embedding": embeddings.shape[1] * 4 if n > 0 else 0,
+        "pairs_float32": len(exact_pairs),
+        "pairs_reduced": len(reduced_pairs),
+        "pair_recall": n_common / len(exact_pairs) if len(exact_pairs) > 0 else 1.0,
+        "pair_precision": n_common / len(reduced_pairs) if len(reduced_pairs) > 0 else 1.0,
+        "files_regrouped": n_changed,
+        "top_k": k,
+        "top_k_recall": float(np.mean(recalls)) if len(recalls) > 0 else 1.0,
+        "max_similarity_error": max_error,
+    }
+    logger.info(f"Embedding precision {precision.value} on {n} files: "
+                f"pair recall {report['pair_recall']:.4f}, pair precision {report['pair_precision']:.4f}, "
+                f"{n_changed} files regrouped, top-{k} recall {report['top_k_recall']:.4f}")
+    return report
@@ -7,7 +7,7 @@ import numpy as np
 
 from compare.base_compare import gather_files
 from compare.compare_data import CompareData
-from compare.model import image_embeddings_clip
+from compare.model import image_embeddings_clip, image_embeddings_clip_batch
 from utils.app_info_cache import app_info_cache
 from utils.config import config
 from utils.constants import CompareMode
@@ -134,27 +134,34 @@ class EmbeddingPrototype:
         # Get cache for this directory
         cache = EmbeddingPrototype._get_cache_for_directory(directory_path)
         
-        for i, image_path in enumerate(image_files):
-            try:
-                if image_path in cache.file_data_dict:
-                    embedding = cache.file_data_dict[image_path]
-                else:
-                    # Compute embedding if not cached
-                    embedding = image_embeddings_clip(image_path)
+        batch_size = max(1, config.embedding_batch_size)
+        for start in range(0, len(image_files), batch_size):
+            batch_paths = image_files[start:start + batch_size]
+            uncached_paths = [p for p in batch_paths if p not in cache.file_data_dict]
+            if len(uncached_paths) > 0:
+                try:
+                    new_embeddings = image_embeddings_clip_batch(uncached_paths, batch_size)
+                except Exception as e:
+                    logger.error(f"Error calculating embeddings for batch in {directory_path}: {e}")
+                    new_embeddings = [None] * len(uncached_paths)
+                for image_path, embedding in zip(uncached_paths, new_embeddings):
+                    if embedding is None:
+                        logger.error(f"Error calculating embedding for {image_path}")
+                        failed_count += 1
+                        continue
                     cache.file_data_dict[image_path] = embedding
                     # Add to files_found if not already present (needed for save_data validation)
                     if image_path not in cache.files_found:
                         cache.files_found.append(image_path)
                     cache.has_new_file_data = True
-                
-                embeddings.append(embedding)
-                
-                if notify_callback and (i + 1) % 10 == 0:
-                    notify_callback(_("Processed {0}/{1} images...").format(i + 1, len(image_files)))
-            except Exception as e:
-                logger.error(f"Error calculating embedding for {image_path}: {e}")
-                failed_count += 1
-                continue
+            
+            for image_path in batch_paths:
+                if image_path in cache.file_data_dict:
+                    embeddings.append(cache.file_data_dict[image_path])
+            
+            n_processed = min(start + batch_size, len(image_files))
+            if notify_callback and n_processed // 10 > start // 10:
+                notify_callback(_("Processed {0}/{1} images...").format(n_processed, len(image_files)))
         
         if not embeddings:
             logger.error(f"Failed to calculate embeddings for any images in {directory_path}")
@@ -270,54 +277,69 @@ class EmbeddingPrototype:
             - embeddings_array: Numpy array of shape (n_valid_images, embedding_dim)
             - valid_image_paths: List of image paths that successfully had embeddings computed
         """
-        from compare.model import image_embeddings_clip
         embeddings = []
         valid_image_paths = []
         directories_with_new_data = set()
         previous_directory = None
         cache = None
-        
-        for i, (image_path, base_directory) in enumerate(image_paths_with_dirs):
+        batch_size = max(1, config.embedding_batch_size)
+        n_processed = 0
+        
+        # Split the list into runs of consecutive images from the same directory
+        # so that uncached embeddings can be computed in batches per cache
+        runs = []
+        for image_path, base_directory in image_paths_with_dirs:
+            if len(runs) == 0 or runs[-1][0] != base_directory:
+                runs.append((base_directory, []))
+            runs[-1][1].append(image_path)
+        
+        for base_directory, image_paths in runs:
             try:
                 # Get cache for the base directory
-                if base_directory != previous_directory:
-                    if cache is not None:
-                        # Save cache and remove from memory to allow garbage collection
-                        try:
-                            cache.save_data(overwrite=False, verbose=False)
-                        except Exception as e:
-                            logger.warning(f"Error saving cache for {previous_directory}: {e}")
-                        cache.has_new_file_data = False
-                        EmbeddingPrototype._remove_cache_from_memory(previous_directory)
-                    cache = EmbeddingPrototype._get_cache_for_directory(base_directory)
+                if cache is not None:
+                    # Save cache and remove from memory to allow garbage collection
+                    try:
+                        cache.save_data(overwrite=False, verbose=False)
+                    except Exception as e:
+                        logger.warning(f"Error saving cache for {previous_directory}: {e}")
+                    cache.has_new_file_data = False
+                    EmbeddingPrototype._remove_cache_from_memory(previous_directory)
+                cache = EmbeddingPrototype._get_cache_for_directory(base_directory)
                 previous_directory = base_directory
-                
-                # # Construct full path if image_path is relative
-                # if not os.path.isabs(image_path):
-                #     full_path = os.path.join(base_directory, image_path)
-                # else:
-                full_path = image_path
-                
-                if full_path in cache.file_data_dict:
-                    embedding = cache.file_data_dict[full_path]
-                else:
-                    # Compute embedding if not cached
-                    embedding = image_embeddings_clip(full_path)
-                    cache.file_data_dict[full_path] = embedding
-                    # Add to files_found if not already present (needed for save_data validation)
-                    if full_path not in cache.files_found:
-                        cache.files_found.append(full_path)
-                    cache.has_new_file_data = True
-                    directories_with_new_data.add(base_directory)
-                
-                embeddings.append(embedding)
-                valid_image_paths.append(full_path)
-                
-                if notify_callback and (i + 1) % 1000 == 0:
-                    notify_callback(_("Computed embeddings for {0}/{1} images...").format(i + 1, len(image_paths_with_dirs)))
             except Exception as e:
-                logger.error(f"Error calculating embedding for {image_path}: {e}")
+                logger.error(f"Error loading embedding cache for {base_directory}: {e}")
+                cache = None
                 continue
+            
+            for start in range(0, len(image_paths), batch_size):
+                batch_paths = image_paths[start:start + batch_size]
+                uncached_paths = [p for p in batch_paths if p not in cache.file_data_dict]
+                if len(uncached_paths) > 0:
+                    try:
+                        new_embeddings = image_embeddings_clip_batch(uncached_paths, batch_size)
+                    except Exception as e:
+                        logger.error(f"Error calculating embeddings for batch in {base_directory}: {e}")
+                        new_embeddings = [None] * len(uncached_paths)
+                    for full_path, embedding in zip(uncached_paths, new_embeddings):
+                        if embedding is None:
+                            logger.error(f"Error calculating embedding for {full_path}")
+                            continue
+                        cache.file_data_dict[full_path] = embedding
+                        # Add to files_found if not already present (needed for save_data validation)
+                        if full_path not in cache.files_found:
+                            cache.files_found.append(full_path)
+                        cache.has_new_file_data = True
+                        directories_with_new_data.add(base_directory)
+                
+                for full_path in batch_paths:
+                    if full_path in cache.file_data_dict:
+                        embeddings.append(cache.file_data_dict[full_path])
+                        valid_image_paths.append(full_path)
+                
+                previous_n_processed = n_processed
+                n_processed += len(batch_paths)
+                if notify_callback and n_processed // 1000 > previous_n_processed // 1000:
+                    notify_callback(_("Computed embeddings for {0}/{1} images...").format(n_processed, len(image_paths_with_dirs)))
         
         # Save caches for directories with new data and remove from memory
         for directory in directories_with_new_data:
@@ -0,0 +1,402 @@
+import os
+import pickle
+import struct
+import sys
+import uuid
+
+import numpy as np
+
+from compare.growable_array import GrowableArray
+from utils.logging_setup import get_logger
+
+logger = get_logger("feature_store")
+
+
+class FeatureStore:
+    '''
+    Memory-mapped columnar store for fixed-size per-file features such as
+    embeddings and thumb colors. Behaves like the dict of path -> features that
+    CompareData used to pickle, but rows are read from a memory-mapped matrix
+    without copying and new rows are appended without rewriting the file.
+
+    A store at base path "<dir>/image_embeddings" consists of:
+        image_embeddings.npy        - feature matrix, one row per entry
+        image_embeddings.index.pkl  - append-only log of index records
+                                      (path, row, mtime, size)
+
+    The mtime and size of each file are recorded when its row is written. A
+    row is only treated as cached if the file still has the same mtime and
+    size, so files that are edited in place are processed again.
+
+    Row numbers are stable until the store is rewritten. Each rewrite records
+    a new generation id, so data keyed by row number (such as the ANN index)
+    can tell when it needs to be rebuilt.
+    '''
+    VERSION = 1
+    MATRIX_EXT = ".npy"
+    INDEX_EXT = ".index.pkl"
+    # Fixed header length so the row count can be rewritten in place on append
+    HEADER_LEN = 128
+    # Rewrite the store when fewer than half of the rows are still referenced
+    COMPACT_MIN_ROWS = 1000
+
+    def __init__(self, base_path, dtype=np.float32, validate_mtimes=True):
+        self.matrix_path = base_path + FeatureStore.MATRIX_EXT
+        self.index_path = base_path + FeatureStore.INDEX_EXT
+        self.dtype = np.dtype(dtype)
+        self.validate_mtimes = validate_mtimes
+        self._row_shape = None
+        self._n_rows = 0
+        self._matrix = None
+        self._index = {}
+        self._mtimes = GrowableArray((), dtype=np.float64)
+        self._sizes = GrowableArray((), dtype=np.int64)
+        self._pending = {}
+        self._deleted = set()
+        self._rewrite = False
+        self.generation = None
+
+    @staticmethod
+    def exists_at(base_path):
+        return os.path.exists(base_path + FeatureStore.INDEX_EXT)
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime, stat.st_size
+        except (OSError, ValueError, TypeError):
+            return 0.0, -1
+
+    # Dict interface
+
+    def __contains__(self, path):
+        if path in self._pending:
+            return True
+        row = self._index.get(path)
+        if row is None:
+            return False
+        if self.validate_mtimes and self._sizes.view()[row] >= 0:
+            mtime, size = FeatureStore._stat(path)
+            # Missing files are treated as cached, as with the pickle caches
+            if size >= 0 and (size != self._sizes.view()[row] or mtime != self._mtimes.view()[row]):
+                return False
+        return True
+
+    def __getitem__(self, path):
+        if path in self._pending:
+            return self._pending[path][0]
+        return self.matrix[self._index[path]]
+
+    def __setitem__(self, path, features):
+        features = np.asarray(features, dtype=self.dtype)
+        mtime, size = FeatureStore._stat(path) if self.validate_mtimes else (0.0, -1)
+        self._pending[path] = (features, mtime, size)
+        self._deleted.discard(path)
+
+    def __delitem__(self, path):
+        found = False
+        if path in self._pending:
+            del self._pending[path]
+            found = True
+        if path in self._index:
+            del self._index[path]
+            self._deleted.add(path)
+            found = True
+        if not found:
+            raise KeyError(path)
+
+    def __len__(self):
+        return len(self._index) + len([p for p in self._pending if p not in self._index])
+
+    def __iter__(self):
+        yield from self._index
+        for path in self._pending:
+            if path not in self._index:
+                yield path
+
+    def keys(self):
+        return list(iter(self))
+
+    def items(self):
+        for path in self:
+            yield path, self[path]
+
+    def get(self, path, default=None):
+        return self[path] if path in self else default
+
+    @property
+    def matrix(self):
+        '''
+        Zero-copy view of all persisted rows, including rows no longer
+        referenced by the index.
+        '''
+        if self._matrix is None:
+            if self._n_rows == 0 or not os.path.exists(self.matrix_path):
+                return np.empty((0,) + (self._row_shape or ()), dtype=self.dtype)
+            self._matrix = np.lib.format.open_memmap(self.matrix_path, mode="r")
+        return self._matrix
+
+    def rows_for(self, paths):
+        '''
+        Return the persisted row numbers for the given paths, -1 if not stored.
+        '''
+        return np.array([self._index.get(path, -1) for path in paths], dtype=np.int64)
+
+    # Persistence
+
+    def open(self):
+        '''
+        Read the index log and the matrix header. Matrix rows are only mapped
+        into memory when accessed.
+        '''
+        self.close()
+        self._index = {}
+        self._mtimes = GrowableArray((), dtype=np.float64)
+        self._sizes = GrowableArray((), dtype=np.int64)
+        self._pending = {}
+        self._deleted = set()
+        self._rewrite = False
+        self._n_rows = 0
+        self._row_shape = None
+        self.generation = None
+
+        if os.path.exists(self.matrix_path):
+            with open(self.matrix_path, "rb") as f:
+                np.lib.format.read_magic(f)
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            self.dtype = dtype
+            self._n_rows = shape[0]
+            self._row_shape = tuple(shape[1:])
+
+        with open(self.index_path, "rb") as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError) as e:
+                    # An interrupted write can leave a partial record at the end of the log
+                    logger.warning(f"Ignoring truncated feature store index record in {self.index_path}: {e}")
+                    break
+                self._apply_record(record)
+
+        # Drop index entries pointing past the matrix (write interrupted before the header update)
+        invalid_paths = [path for path, row in self._index.items() if row >= self._n_rows]
+        for path in invalid_paths:
+            del self._index[path]
+
+    def _apply_record(self, record):
+        if "version" in record:
+            self.generation = record.get("generation")
+            return
+        if "deleted" in record:
+            for path in record["deleted"]:
+                self._index.pop(path, None)
+            return
+        rows = record.get("rows")
+        if rows is None:
+            return
+        mtimes = record["mtimes"]
+        sizes = record["sizes"]
+        n_known = len(self._mtimes)
+        max_row = int(np.max(rows)) if len(rows) > 0 else -1
+        if max_row >= n_known:
+            # Rows are written in order, so the columns only ever grow at the end
+            self._mtimes.extend(np.zeros(max_row + 1 - n_known))
+            self._sizes.extend(np.full(max_row + 1 - n_known, -1))
+        self._mtimes.view()[rows] = mtimes
+        self._sizes.view()[rows] = sizes
+        self._index.update(zip(record["paths"], rows.tolist()))
+
+    def clear(self):
+        '''
+        Drop all entries. The files are rewritten on the next flush.
+        '''
+        self.close()
+        self._index = {}
+        self._mtimes = GrowableArray((), dtype=np.float64)
+        self._sizes = GrowableArray((), dtype=np.int64)
+        self._pending = {}
+        self._deleted = set()
+        self._n_rows = 0
+        self._rewrite = True
+
+    def close(self):
+        self._matrix = None
+
+    def convert(self, dtype):
+        '''
+        Change the dtype of the stored rows. The store is rewritten with the
+        new dtype on the next flush.
+        '''
+        dtype = np.dtype(dtype)
+        if dtype == self.dtype:
+            return
+        self.dtype = dtype
+        self._pending = {path: (np.asarray(features, dtype=dtype), mtime, size)
+                         for path, (features, mtime, size) in self._pending.items()}
+        self._rewrite = True
+
+    def has_changes(self):
+        return self._rewrite or len(self._pending) > 0 or len(self._deleted) > 0
+
+    def flush(self):
+        '''
+        Persist pending changes. New rows are appended to the matrix and index
+        log. The store is only rewritten when cleared, when the row shape
+        changes, or when most of the rows are no longer referenced.
+        '''
+        if not self.has_changes():
+            return
+        pending_shapes = {features.shape for features, _, _ in self._pending.values()}
+        if len(pending_shapes) > 1:
+            raise ValueError(f"Inconsistent feature shapes for store {self.matrix_path}: {pending_shapes}")
+        pending_shape = next(iter(pending_shapes)) if len(pending_shapes) == 1 else None
+
+        if pending_shape is not None and self._row_shape is not None and pending_shape != self._row_shape and len(self._index) > 0:
+            logger.warning(f"Feature shape changed from {self._row_shape} to {pending_shape}, dropping existing rows in {self.matrix_path}")
+            self._index = {}
+            self._rewrite = True
+
+        n_live = len(self._index) + len(self._pending)
+        if (not self._rewrite and self._n_rows > FeatureStore.COMPACT_MIN_ROWS
+                and self._n_rows + len(self._pending) > 2 * n_live):
+            self._rewrite = True
+
+        if self._rewrite or not os.path.exists(self.matrix_path) or not os.path.exists(self.index_path):
+            self._write_all(pending_shape)
+        else:
+            self._append()
+        self._pending = {}
+        self._deleted = set()
+        self._rewrite = False
+
+    def _pending_arrays(self):
+        paths = list(self._pending.keys())
+        if len(paths) == 0:
+            return paths, None, np.empty(0), np.empty(0, dtype=np.int64)
+        features = np.stack([self._pending[p][0] for p in paths]).astype(self.dtype, copy=False)
+        mtimes = np.array([self._pending[p][1] for p in paths], dtype=np.float64)
+        sizes = np.array([self._pending[p][2] for p in paths], dtype=np.int64)
+        return paths, features, mtimes, sizes
+
+    def _append(self):
+        paths, features, mtimes, sizes = self._pending_arrays()
+        records = []
+        if len(self._deleted) > 0:
+            records.append({"deleted": list(self._deleted)})
+        if len(paths) > 0:
+            if self._row_shape is None:
+                self._row_shape = tuple(features.shape[1:])
+            rows = np.arange(self._n_rows, self._n_rows + len(paths), dtype=np.int64)
+            self.close()
+            with open(self.matrix_path, "r+b") as f:
+                f.seek(FeatureStore.HEADER_LEN + self._n_rows * self._row_nbytes())
+                f.write(np.ascontiguousarray(features).tobytes())
+                f.seek(0)
+                self._write_header(f, self._n_rows + len(paths))
+            self._n_rows += len(paths)
+            records.append({"paths": paths, "rows": rows, "mtimes": mtimes, "sizes": sizes})
+        with open(self.index_path, "ab") as f:
+            for record in records:
+                pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for record in records:
+            self._apply_record(record)
+
+    def _write_all(self, pending_shape):
+        '''
+        Write the live rows and any pending rows to new files, replacing the
+        existing store.
+        '''
+        live_paths = [p for p in self._index if p not in self._pending]
+        live_rows = np.array([self._index[p] for p in live_paths], dtype=np.int64)
+        pending_paths, pending_features, pending_mtimes, pending_sizes = self._pending_arrays()
+
+        if self._row_shape is None or len(live_paths) == 0:
+            self._row_shape = pending_shape if pending_shape is not None else self._row_shape
+        if self._row_shape is None:
+            self._row_shape = ()
+
+        paths = live_paths + pending_paths
+        n_rows = len(paths)
+        mtimes = np.concatenate((self._mtimes.view()[live_rows], pending_mtimes)) if len(live_paths) > 0 else pending_mtimes
+        sizes = np.concatenate((self._sizes.view()[live_rows], pending_sizes)) if len(live_paths) > 0 else pending_sizes
+
+        tmp_matrix_path = self.matrix_path + ".tmp"
+        tmp_index_path = self.index_path + ".tmp"
+        with open(tmp_matrix_path, "wb") as f:
+            self._write_header(f, n_rows)
+            if len(live_paths) > 0:
+                source = self.matrix
+                # Copy in chunks to keep the resident set bounded
+                for start in range(0, len(live_rows), 65536):
+                    f.write(np.ascontiguousarray(source[live_rows[start:start + 65536]], dtype=self.dtype).tobytes())
+            if pending_features is not None:
+                f.write(np.ascontiguousarray(pending_features).tobytes())
+        with open(tmp_index_path, "wb") as f:
+            generation = uuid.uuid4().hex
+            pickle.dump({"version": FeatureStore.VERSION, "generation": generation}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump({"paths": paths, "rows": np.arange(n_rows, dtype=np.int64),
+                         "mtimes": mtimes, "sizes": sizes}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.close()
+        os.replace(tmp_matrix_path, self.matrix_path)
+        os.replace(tmp_index_path, self.index_path)
+
+        self._n_rows = n_rows
+        self.generation = generation
+        self._index = {path: row for row, path in enumerate(paths)}
+        self._mtimes = GrowableArray.from_array(mtimes, dtype=np.float64)
+        self._sizes = GrowableArray.from_array(sizes, dtype=np.int64)
+
+    def _row_nbytes(self):
+        return int(np.prod(self._row_shape, dtype=np.int64)) * self.dtype.itemsize
+
+    def _write_header(self, f, n_rows):
+        header = {"descr": np.lib.format.dtype_to_descr(self.dtype),
+                  "fortran_order": False,
+                  "shape": (n_rows,) + tuple(self._row_shape)}
+        header_len = FeatureStore.HEADER_LEN - 10  # magic (6) + version (2) + length (2)
+        header_bytes = repr(header).encode("latin1")
+        if len(header_bytes) >= header_len:
+            raise ValueError(f"Feature store header too long: {header_bytes}")
+        f.write(np.lib.format.magic(1, 0))
+        f.write(struct.pack("<H", header_len))
+        f.write(header_bytes.ljust(header_len - 1) + b"\n")
+
+    def migrate_from_dict(self, data_dict):
+        '''
+        Populate an empty store from a legacy pickled dict of path -> features.
+        Entries that cannot be stored as fixed-size rows are skipped.
+        '''
+        self.clear()
+        row_shape = None
+        n_skipped = 0
+        for path, features in data_dict.items():
+            try:
+                features = np.asarray(features, dtype=self.dtype)
+            except (ValueError, TypeError):
+                n_skipped += 1
+                continue
+            if row_shape is None:
+                row_shape = features.shape
+            elif features.shape != row_shape:
+                n_skipped += 1
+                continue
+            self[path] = features
+        self.flush()
+        if n_skipped > 0:
+            logger.warning(f"Skipped {n_skipped} entries with invalid features while migrating to {self.matrix_path}")
+
+    def estimate_memory_size(self) -> int:
+        '''
+        Estimate the memory held by the index and pending rows in bytes. Mapped
+        matrix pages are managed by the OS and not counted.
+        '''
+        total_size = sys.getsizeof(self._index)
+        for path in self._index:
+            total_size += sys.getsizeof(path)
+        total_size += self._mtimes.view().nbytes + self._sizes.view().nbytes
+        for path, (features, _, _) in self._pending.items():
+            total_size += sys.getsizeof(path) + features.nbytes
+        return total_size
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class GrowableArray:
+    '''
+    Array-backed accumulator for per-file compare data (embeddings, colors,
+    face counts). Rows are written into a preallocated buffer that grows
+    geometrically, so appending n rows costs amortized O(n) instead of the
+    O(n^2) copying of repeated np.vstack calls.
+
+    view() returns the filled rows without copying. The view is only valid
+    until the next append that needs to grow the buffer.
+    '''
+    GROWTH_FACTOR = 1.5
+    MIN_CAPACITY = 256
+
+    def __init__(self, row_shape=None, dtype=np.float32, capacity=0):
+        self.dtype = np.dtype(dtype)
+        # If row_shape is None it will be set from the first row added
+        self.row_shape = None if row_shape is None else tuple(row_shape)
+        self._size = 0
+        self._data = None
+        if self.row_shape is not None:
+            self._data = np.empty((capacity,) + self.row_shape, dtype=self.dtype)
+
+    @staticmethod
+    def from_array(array, dtype=np.float32):
+        '''
+        Wrap an existing array. No copy is made if the array is already
+        C-contiguous with the requested dtype.
+        '''
+        array = np.ascontiguousarray(array, dtype=dtype)
+        if array.ndim == 0:
+            array = array.reshape(0)
+        growable = GrowableArray(array.shape[1:], dtype=dtype)
+        growable._data = array
+        growable._size = len(array)
+        return growable
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return 0 if self._data is None else len(self._data)
+
+    def view(self):
+        if self._data is None:
+            return np.empty((0,), dtype=self.dtype)
+        return self._data[:self._size]
+
+    def reserve(self, capacity):
+        '''
+        Ensure the buffer can hold at least capacity rows without growing.
+        '''
+        if capacity <= self.capacity:
+            return
+        data = np.empty((capacity,) + self.row_shape, dtype=self.dtype)
+        if self._size > 0:
+            data[:self._size] = self._data[:self._size]
+        self._data = data
+
+    def _ensure_capacity(self, n_rows, row_shape):
+        if self.row_shape is None:
+            self.row_shape = tuple(row_shape)
+        elif tuple(row_shape) != self.row_shape:
+            if self._size > 0:
+                raise ValueError(f"Row shape {tuple(row_shape)} does not match existing row shape {self.row_shape}")
+            # Nothing stored yet, so the placeholder shape can be replaced
+            self.row_shape = tuple(row_shape)
+            self._data = None
+        required = self._size + n_rows
+        if required > self.capacity:
+            self.reserve(max(required, int(self.capacity * GrowableArray.GROWTH_FACTOR), GrowableArray.MIN_CAPACITY))
+
+    def append(self, row):
+        row = np.asarray(row, dtype=self.dtype)
+        self._ensure_capacity(1, row.shape)
+        self._data[self._size] = row
+        self._size += 1
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self.dtype)
+        if len(rows) == 0:
+            return
+        self._ensure_capacity(len(rows), rows.shape[1:])
+        self._data[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+    def insert_first(self, row):
+        '''
+        Insert a row at index 0, shifting the existing rows within the buffer.
+        '''
+        row = np.asarray(row, dtype=self.dtype)
+        self._ensure_capacity(1, row.shape)
+        if self._size > 0:
+            self._data[1:self._size + 1] = self._data[:self._size]
+        self._data[0] = row
+        self._size += 1
+
+    def delete(self, indexes):
+        '''
+        Remove the rows at the given indexes in place, preserving row order.
+        '''
+        if self._size == 0 or len(indexes) == 0:
+            return
+        keep = np.ones(self._size, dtype=bool)
+        keep[np.asarray(indexes, dtype=np.intp)] = False
+        kept = self._data[:self._size][keep]
+        self._data[:len(kept)] = kept
+        self._size = len(kept)
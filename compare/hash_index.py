@@ -0,0 +1,157 @@
+import numpy as np
+
+HASH_BITS = 64
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(hashes, other):
+    '''
+    Hamming distances between 64 bit hashes stored as uint64, broadcasting
+    other against hashes.
+    '''
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.asarray(other, dtype=np.uint64))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor).astype(np.int64)
+    xor = np.ascontiguousarray(xor)
+    return _POPCOUNT_TABLE[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+
+class MultiIndexHash:
+    '''
+    Multi-index hashing (Norouzi et al.) for finding all pairs of 64 bit hashes
+    within a Hamming radius without comparing every pair.
+
+    The hash bits are split into n_substrings disjoint substrings. Two hashes
+    within distance radius differ in at most radius // n_substrings bits on at
+    least one substring, so for each substring the hashes are sorted by their
+    substring value and each hash only probes the substring values within
+    that distance of its own. Identical hashes are collapsed before probing,
+    so large sets of exact duplicates do not inflate the buckets.
+    '''
+    CHUNK_ROWS = 65536
+    MAX_SUBSTRINGS = 8
+
+    def __init__(self, hashes, radius, n_substrings=None):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        self.radius = int(radius)
+        self.unique_hashes, self.inverse = np.unique(hashes, return_inverse=True)
+        self.inverse = self.inverse.reshape(-1)
+        if n_substrings is None:
+            n_substrings = MultiIndexHash.n_substrings_for(len(self.unique_hashes), self.radius)
+        self.n_substrings = int(n_substrings)
+        self.substring_radius = self.radius // self.n_substrings
+        widths = [HASH_BITS // self.n_substrings + (1 if k < HASH_BITS % self.n_substrings else 0)
+                  for k in range(self.n_substrings)]
+        self._offsets = np.cumsum([0] + widths[:-1]).tolist()
+        self._widths = widths
+        self._substrings = [self._substring(self.unique_hashes, k) for k in range(self.n_substrings)]
+        self._orders = [np.argsort(substrings, kind="stable") for substrings in self._substrings]
+        self._sorted = [substrings[order] for substrings, order in zip(self._substrings, self._orders)]
+
+    @staticmethod
+    def n_substrings_for(n_hashes, radius):
+        '''
+        Substrings of about log2(n) bits keep the buckets near one hash each,
+        and more than radius + 1 substrings does not reduce the probing.
+        '''
+        n_substrings = int(round(HASH_BITS / max(np.log2(max(n_hashes, 2)), 1)))
+        return max(1, min(n_substrings, radius + 1, MultiIndexHash.MAX_SUBSTRINGS))
+
+    def _substring(self, hashes, k):
+        mask = np.uint64((1 << self._widths[k]) - 1)
+        return (hashes >> np.uint64(self._offsets[k])) & mask
+
+    def _flip_masks(self, k):
+        '''
+        All values of at most substring_radius set bits within substring k.
+        '''
+        masks = np.zeros(1, dtype=np.uint64)
+        for _ in range(self.substring_radius):
+            bits = np.uint64(1) << np.arange(self._widths[k], dtype=np.uint64)
+            masks = np.unique(np.concatenate([masks, np.bitwise_or(masks[:, None], bits[None, :]).reshape(-1)]))
+        return masks
+
+    def _probe(self, k, query_ids, query_values):
+        '''
+        Ids of the indexed hashes whose substring k equals one of query_values,
+        aligned with the query ids.
+        '''
+        sorted_values = self._sorted[k]
+        lo = np.searchsorted(sorted_values, query_values, side="left")
+        hi = np.searchsorted(sorted_values, query_values, side="right")
+        counts = hi - lo
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        starts = np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        return np.repeat(query_ids, counts), self._orders[k][starts]
+
+    def _within_earlier_substring(self, ids_a, ids_b, k):
+        '''
+        Whether each pair already matched on a substring before k, where it
+        will have been reported.
+        '''
+        found = np.zeros(len(ids_a), dtype=bool)
+        for earlier in range(k):
+            distances = hamming_distances(self._substrings[earlier][ids_a], self._substrings[earlier][ids_b])
+            found |= distances <= self.substring_radius
+        return found
+
+    def unique_pairs(self):
+        '''
+        Pairs of distinct unique hashes within the radius, each reported once.
+        :returns: Generator of (ids_a, ids_b, distances) arrays with ids_a < ids_b,
+            indexing unique_hashes.
+        '''
+        n = len(self.unique_hashes)
+        for k in range(self.n_substrings):
+            masks = self._flip_masks(k)
+            for start in range(0, n, MultiIndexHash.CHUNK_ROWS):
+                query_ids = np.arange(start, min(start + MultiIndexHash.CHUNK_ROWS, n))
+                for mask in masks:
+                    ids_a, ids_b = self._probe(k, query_ids, self._substrings[k][query_ids] ^ mask)
+                    keep = ids_a < ids_b
+                    ids_a, ids_b = ids_a[keep], ids_b[keep]
+                    keep = ~self._within_earlier_substring(ids_a, ids_b, k)
+                    ids_a, ids_b = ids_a[keep], ids_b[keep]
+                    distances = hamming_distances(self.unique_hashes[ids_a], self.unique_hashes[ids_b])
+                    keep = distances <= self.radius
+                    if np.any(keep):
+                        yield ids_a[keep], ids_b[keep], distances[keep]
+
+    def duplicate_pairs(self):
+        '''
+        Pairs chaining together the indexes that share a hash, which join the
+        same groups as every pair among them.
+        :returns: (indexes1, indexes2) arrays of indexes into the hashes.
+        '''
+        order = np.argsort(self.inverse, kind="stable")
+        same = self.inverse[order[1:]] == self.inverse[order[:-1]]
+        return order[:-1][same], order[1:][same]
+
+    def representatives(self):
+        '''
+        First index into the hashes of each unique hash.
+        '''
+        first = np.full(len(self.unique_hashes), len(self.inverse), dtype=np.int64)
+        np.minimum.at(first, self.inverse, np.arange(len(self.inverse)))
+        return first
+
+    def pairs(self):
+        '''
+        Pairs of indexes into the hashes within the radius, reduced so that
+        grouping them joins the same groups as grouping every such pair: hashes
+        shared by several indexes are chained with distance 0, and distinct
+        hashes are joined through their first index.
+        :returns: Generator of (indexes1, indexes2, distances) arrays.
+        '''
+        duplicates1, duplicates2 = self.duplicate_pairs()
+        if len(duplicates1) > 0:
+            yield duplicates1, duplicates2, np.zeros(len(duplicates1), dtype=np.int64)
+        representatives = self.representatives()
+        for ids_a, ids_b, distances in self.unique_pairs():
+            indexes1 = representatives[ids_a]
+            indexes2 = representatives[ids_b]
+            swap = indexes1 > indexes2
+            yield np.where(swap, indexes2, indexes1), np.where(swap, indexes1, indexes2), distances
@@ -0,0 +1,96 @@
+import numpy as np
+
+from compare.signature_pairs import sorted_unique_counts
+
+_MERSENNE_61 = (1 << 61) - 1
+
+
+class MinHashLSH:
+    '''
+    MinHash signatures of sets of integer tokens with locality sensitive
+    hashing by banding, for finding the pairs of sets likely to have a
+    Jaccard similarity above a target without comparing every pair.
+
+    Each permutation hashes the tokens with a random multiply-shift hash and
+    keeps the minimum, so two sets agree on a permutation with probability
+    equal to their Jaccard similarity. The signatures are split into bands of
+    rows_per_band permutations and sets agreeing on all rows of any band are
+    candidates, which a pair with similarity s is with probability
+    1 - (1 - s ** rows_per_band) ** n_bands.
+    '''
+    N_PERMUTATIONS = 128
+    MIN_PROBABILITY = 0.98
+
+    def __init__(self, token_sets, n_permutations=N_PERMUTATIONS, seed=0):
+        '''
+        :param token_sets: Sequences of non-negative integer tokens, one per set.
+        '''
+        self.n_permutations = int(n_permutations)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2**63, self.n_permutations, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 2**63, self.n_permutations, dtype=np.uint64)
+        lengths = np.array([len(tokens) for tokens in token_sets], dtype=np.int64)
+        self.has_tokens = lengths > 0
+        self.signatures = self._signatures(token_sets, lengths)
+
+    def _signatures(self, token_sets, lengths):
+        signatures = np.full((len(lengths), self.n_permutations), np.iinfo(np.uint32).max, dtype=np.uint32)
+        if not np.any(self.has_tokens):
+            return signatures
+        tokens = np.concatenate([np.asarray(tokens, dtype=np.uint64) for tokens in token_sets if len(tokens) > 0])
+        starts = (np.cumsum(lengths) - lengths)[self.has_tokens]
+        for k in range(self.n_permutations):
+            hashes = ((tokens * self._a[k] + self._b[k]) >> np.uint64(32)).astype(np.uint32)
+            signatures[self.has_tokens, k] = np.minimum.reduceat(hashes, starts)
+        return signatures
+
+    @staticmethod
+    def rows_per_band_for(jaccard, n_permutations=N_PERMUTATIONS, min_probability=MIN_PROBABILITY):
+        '''
+        The most rows per band, giving the fewest false candidates, for which
+        a pair with the given Jaccard similarity is still a candidate with at
+        least min_probability.
+        '''
+        for rows in range(n_permutations, 1, -1):
+            n_bands = n_permutations // rows
+            if 1 - (1 - jaccard ** rows) ** n_bands >= min_probability:
+                return rows
+        return 1
+
+    def candidate_pairs(self, rows_per_band):
+        '''
+        Pairs of sets agreeing on all rows of at least one band, each reported
+        once. Empty sets are never candidates.
+        :returns: (ids1, ids2) arrays with ids1 < ids2.
+        '''
+        n_sets = len(self.signatures)
+        ids = np.flatnonzero(self.has_tokens)
+        keys = []
+        for start in range(0, self.n_permutations - rows_per_band + 1, rows_per_band):
+            band = self.signatures[ids, start:start + rows_per_band].astype(np.uint64)
+            band_keys = np.zeros(len(ids), dtype=np.uint64)
+            for row in range(rows_per_band):
+                band_keys = band_keys * np.uint64(_MERSENNE_61) + band[:, row]
+            keys.extend(_bucket_pairs(ids, band_keys, n_sets))
+        if len(keys) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        keys = sorted_unique_counts(np.concatenate(keys))[0]
+        return keys // n_sets, keys % n_sets
+
+
+def _bucket_pairs(ids, bucket_keys, n_ids):
+    '''
+    Pairs of ids sharing a bucket key, as id1 * n_ids + id2 with id1 < id2.
+    Buckets of the same size are expanded together.
+    '''
+    order = np.argsort(bucket_keys, kind="stable")
+    sorted_keys = bucket_keys[order]
+    starts = np.flatnonzero(np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]]))
+    sizes = np.diff(np.append(starts, len(sorted_keys)))
+    pairs = []
+    for size in np.unique(sizes[sizes > 1]).tolist():
+        members = ids[order[starts[sizes == size][:, None] + np.arange(size)]]
+        rows, cols = np.triu_indices(size, 1)
+        ids1, ids2 = members[:, rows].reshape(-1), members[:, cols].reshape(-1)
+        pairs.append(np.minimum(ids1, ids2) * n_ids + np.maximum(ids1, ids2))
+    return pairs
@@ -1,32 +1,64 @@
-from PIL import Image
-import torch
-import clip
-from transformers import AutoModel, AutoProcessor, FlavaProcessor, FlavaModel, AlignProcessor, AlignModel
+import threading
 
-from image.frame_cache import FrameCache
+from image.decoded_image_cache import decoded_image_cache
 from utils.config import config
+from utils.lazy_import import lazy_import
 from utils.logging_setup import get_logger
 
 logger = get_logger("model")
 
+# The ML libraries take several seconds to import, so they are only loaded
+# once a model is first used rather than when the app starts
+torch = lazy_import("torch")
+clip = lazy_import("clip")
+transformers = lazy_import("transformers")
+
 # XVLM may not be loaded if the config.json file is not updated
 # or if the model files are not downloaded
-xvlm_loaded = False
-
-if config.xvlm_loc is not None:
-    logger.info(f"Loading XVLM modules from {config.xvlm_loc}")
-    try:
-        import sys
-        from transformers import BertTokenizer, BertModel
-        from torchvision import transforms
-        sys.path.insert(0, config.xvlm_loc)
-        from models.xvlm import XVLMBase
-        logger.info("XVLM modules loaded")
-        xvlm_loaded = True
-    except Exception as e:
-        logger.error(f"Error loading XVLM modules: {e}")
-
-device = "cuda" if torch.cuda.is_available() else "cpu"
+_xvlm_loaded = None
+_xvlm_load_lock = threading.Lock()
+BertTokenizer = None
+transforms = None
+XVLMBase = None
+
+
+def is_xvlm_loaded():
+    '''
+    Load the XVLM modules from config.xvlm_loc on first call.
+    :returns: True if the modules are available.
+    '''
+    global _xvlm_loaded, BertTokenizer, transforms, XVLMBase
+    if _xvlm_loaded is None:
+        with _xvlm_load_lock:
+            if _xvlm_loaded is None:
+                _xvlm_loaded = False
+                if config.xvlm_loc is not None:
+                    logger.info(f"Loading XVLM modules from {config.xvlm_loc}")
+                    try:
+                        import sys
+                        from transformers import BertTokenizer
+                        from torchvision import transforms
+                        sys.path.insert(0, config.xvlm_loc)
+                        from models.xvlm import XVLMBase
+                        logger.info("XVLM modules loaded")
+                        _xvlm_loaded = True
+                    except Exception as e:
+                        logger.error(f"Error loading XVLM modules: {e}")
+    return _xvlm_loaded
+
+
+_device = None
+
+
+def _get_device():
+    global _device
+    if _device is None:
+        _device = "cuda" if torch.cuda.is_available() else "cpu"
+    return _device
+
+# Preprocessing runs in several pipeline threads, which must not load the
+# processors more than once
+_preprocess_load_lock = threading.Lock()
 
 # Lazy initialization variables for CLIP
 _clip_model = None
@@ -58,55 +90,63 @@ _laion_processor = None
 def _get_clip_model():
     global _clip_model
     if _clip_model is None:
-        _clip_model, _ = clip.load(config.clip_model, device=device)
+        _clip_model, _ = clip.load(config.clip_model, device=_get_device())
     return _clip_model
 
 def _get_clip_preprocess():
     global _clip_preprocess
     if _clip_preprocess is None:
-        _, _clip_preprocess = clip.load(config.clip_model, device=device)
+        with _preprocess_load_lock:
+            if _clip_preprocess is None:
+                _, _clip_preprocess = clip.load(config.clip_model, device=_get_device())
     return _clip_preprocess
 
 def _get_siglip_model():
     global _siglip_model
     if _siglip_model is None:
         if config.siglip_enable_large_model:
-            _siglip_model = AutoModel.from_pretrained("google/siglip-large-patch16-384", torch_dtype=torch.float16).to(device)
+            _siglip_model = transformers.AutoModel.from_pretrained("google/siglip-large-patch16-384", torch_dtype=torch.float16).to(_get_device())
         else:
-            _siglip_model = AutoModel.from_pretrained("google/siglip-base-patch16-224").to(device)
+            _siglip_model = transformers.AutoModel.from_pretrained("google/siglip-base-patch16-224").to(_get_device())
     return _siglip_model
 
 def _get_siglip_processor():
     global _siglip_processor
     if _siglip_processor is None:
-        if config.siglip_enable_large_model:
-            _siglip_processor = AutoProcessor.from_pretrained("google/siglip-large-patch16-384", torch_dtype=torch.float16)
-        else:
-            _siglip_processor = AutoProcessor.from_pretrained("google/siglip-base-patch16-224")
+        with _preprocess_load_lock:
+            if _siglip_processor is None:
+                if config.siglip_enable_large_model:
+                    _siglip_processor = transformers.AutoProcessor.from_pretrained("google/siglip-large-patch16-384", torch_dtype=torch.float16)
+                else:
+                    _siglip_processor = transformers.AutoProcessor.from_pretrained("google/siglip-base-patch16-224")
     return _siglip_processor
 
 def _get_flava_model():
     global _flava_model
     if _flava_model is None:
-        _flava_model = FlavaModel.from_pretrained("facebook/flava-full").to(device)
+        _flava_model = transformers.FlavaModel.from_pretrained("facebook/flava-full").to(_get_device())
     return _flava_model
 
 def _get_flava_processor():
     global _flava_processor
     if _flava_processor is None:
-        _flava_processor = FlavaProcessor.from_pretrained("facebook/flava-full")
+        with _preprocess_load_lock:
+            if _flava_processor is None:
+                _flava_processor = transformers.FlavaProcessor.from_pretrained("facebook/flava-full")
     return _flava_processor
 
 def _get_align_model():
     global _align_model
     if _align_model is None:
-        _align_model = AlignModel.from_pretrained("kakaobrain/align-base").to(device)
+        _align_model = transformers.AlignModel.from_pretrained("kakaobrain/align-base").to(_get_device())
     return _align_model
 
 def _get_align_processor():
     global _align_processor
     if _align_processor is None:
-        _align_processor = AlignProcessor.from_pretrained("kakaobrain/align-base")
+        with _preprocess_load_lock:
+            if _align_processor is None:
+                _align_processor = transformers.AlignProcessor.from_pretrained("kakaobrain/align-base")
     return _align_processor
 
 # Define preset configs for 4m/16m (extracted from YAMLs)
@@ -142,7 +182,7 @@ def _get_xvlm_model():
         checkpoint = torch.load(config.xvlm_model_loc, map_location='cpu')
         _xvlm_model.load_state_dict(checkpoint['model'], strict=False)
         _xvlm_model.eval()
-        _xvlm_model = _xvlm_model.to(device)
+        _xvlm_model = _xvlm_model.to(_get_device())
     return _xvlm_model
 
 def _get_xvlm_tokenizer():
@@ -154,30 +194,34 @@ def _get_xvlm_tokenizer():
 def _get_xvlm_img_transform():
     global _xvlm_img_transform
     if _xvlm_img_transform is None:
-        _xvlm_img_transform = transforms.Compose([
-            transforms.Resize((384, 384)),
-            transforms.ToTensor(),
-            transforms.Normalize((0.48145466, 0.4578275, 0.40821073), 
-                               (0.26862954, 0.26130258, 0.27577711))
-        ])
+        with _preprocess_load_lock:
+            if _xvlm_img_transform is None:
+                _xvlm_img_transform = transforms.Compose([
+                    transforms.Resize((384, 384)),
+                    transforms.ToTensor(),
+                    transforms.Normalize((0.48145466, 0.4578275, 0.40821073), 
+                                       (0.26862954, 0.26130258, 0.27577711))
+                ])
     return _xvlm_img_transform
 
 def _get_laion_model():
     global _laion_model
     if _laion_model is None:
         if config.laion_enable_half_precision:
-            _laion_model = AutoModel.from_pretrained("laion/CLIP-ViT-H-14-laion2B-s32B-b79K", torch_dtype=torch.float16).to(device)
+            _laion_model = transformers.AutoModel.from_pretrained("laion/CLIP-ViT-H-14-laion2B-s32B-b79K", torch_dtype=torch.float16).to(_get_device())
         else:
-            _laion_model = AutoModel.from_pretrained("laion/CLIP-ViT-H-14-laion2B-s32B-b79K").to(device)
+            _laion_model = transformers.AutoModel.from_pretrained("laion/CLIP-ViT-H-14-laion2B-s32B-b79K").to(_get_device())
     return _laion_model
 
 def _get_laion_processor():
     global _laion_processor
     if _laion_processor is None:
-        if config.laion_enable_half_precision:
-            _laion_processor = AutoProcessor.from_pretrained("laion/CLIP-ViT-H-14-laion2B-s32B-b79K", torch_dtype=torch.float16)
-        else:
-            _laion_processor = AutoProcessor.from_pretrained("laion/CLIP-ViT-H-14-laion2B-s32B-b79K")
+        with _preprocess_load_lock:
+            if _laion_processor is None:
+                if config.laion_enable_half_precision:
+                    _laion_processor = transformers.AutoProcessor.from_pretrained("laion/CLIP-ViT-H-14-laion2B-s32B-b79K", torch_dtype=torch.float16)
+                else:
+                    _laion_processor = transformers.AutoProcessor.from_pretrained("laion/CLIP-ViT-H-14-laion2B-s32B-b79K")
     return _laion_processor
 
 
@@ -195,13 +239,7 @@ def embedding_similarity(embedding0, embedding1):
 # CLIP embeddings
 
 def image_embeddings_clip(image_path):
-    try:
-        with Image.open(image_path) as pil_img:
-            image = _get_clip_preprocess()(pil_img).unsqueeze(0).to(device)
-    except Exception as e:
-        image_path = FrameCache.get_image_path(image_path)
-        with Image.open(image_path) as pil_img:
-            image = _get_clip_preprocess()(pil_img).unsqueeze(0).to(device)
+    image = _get_clip_preprocess()(_open_rgb_image(image_path)).unsqueeze(0).to(_get_device())
     with torch.no_grad():
         embedding = _get_clip_model().encode_image(image)
         embedding /= embedding.norm(dim=-1, keepdim=True)
@@ -209,7 +247,7 @@ def image_embeddings_clip(image_path):
 
 
 def text_embeddings_clip(text):
-    tokens = clip.tokenize([text]).to(device)
+    tokens = clip.tokenize([text]).to(_get_device())
     with torch.no_grad():
         embedding = _get_clip_model().encode_text(tokens).float()
         embedding /= embedding.norm(dim=-1, keepdim=True)
@@ -219,14 +257,8 @@ def text_embeddings_clip(text):
 # SigLIP embeddings
 
 def image_embeddings_siglip(image_path):
-    try:
-        with Image.open(image_path) as pil_img:
-            # Process image with SIGLIP processor
-            inputs = _get_siglip_processor()(images=pil_img, return_tensors="pt").to(device)
-    except Exception as e:
-        image_path = FrameCache.get_image_path(image_path)
-        with Image.open(image_path) as pil_img:
-            inputs = _get_siglip_processor()(images=pil_img, return_tensors="pt").to(device)
+    # Process image with SIGLIP processor
+    inputs = _get_siglip_processor()(images=_open_rgb_image(image_path), return_tensors="pt").to(_get_device())
     
     with torch.no_grad():
         # Get image features using SIGLIP model
@@ -237,7 +269,7 @@ def image_embeddings_siglip(image_path):
 
 def text_embeddings_siglip(text):
     # Process text with SIGLIP processor
-    inputs = _get_siglip_processor()(text=[text], padding="max_length", return_tensors="pt").to(device)
+    inputs = _get_siglip_processor()(text=[text], padding="max_length", return_tensors="pt").to(_get_device())
     
     with torch.no_grad():
         # Get text features using SIGLIP model
@@ -250,18 +282,8 @@ def text_embeddings_siglip(text):
 # FLAVA embeddings
 
 def image_embeddings_flava(image_path):
-    try:
-        with Image.open(image_path) as img:
-            image = img.convert("RGB")
-            # Process image with FLAVA processor
-            inputs = _get_flava_processor()(images=image, return_tensors="pt").to(device)
-            image.close()
-    except Exception as e:
-        image_path = FrameCache.get_image_path(image_path)
-        with Image.open(image_path) as img:
-            image = img.convert("RGB")
-            inputs = _get_flava_processor()(images=image, return_tensors="pt").to(device)
-            image.close()
+    # Process image with FLAVA processor
+    inputs = _get_flava_processor()(images=_open_rgb_image(image_path), return_tensors="pt").to(_get_device())
     
     with torch.no_grad():
         # Get image features using FLAVA model
@@ -273,7 +295,7 @@ def image_embeddings_flava(image_path):
 
 def text_embeddings_flava(text):
     # Process text with FLAVA processor
-    inputs = _get_flava_processor()(text=[text], return_tensors="pt", padding=True).to(device)
+    inputs = _get_flava_processor()(text=[text], return_tensors="pt", padding=True).to(_get_device())
     
     with torch.no_grad():
         # Get text features using FLAVA model
@@ -287,18 +309,8 @@ def text_embeddings_flava(text):
 # ALIGN embeddings
 
 def image_embeddings_align(image_path):
-    try:
-        with Image.open(image_path) as img:
-            image = img.convert("RGB")
-            # Process image with ALIGN processor
-            inputs = _get_align_processor()(images=image, return_tensors="pt").to(device)
-            image.close()
-    except Exception as e:
-        image_path = FrameCache.get_image_path(image_path)
-        with Image.open(image_path) as img:
-            image = img.convert("RGB")
-            inputs = _get_align_processor()(images=image, return_tensors="pt").to(device)
-            image.close()
+    # Process image with ALIGN processor
+    inputs = _get_align_processor()(images=_open_rgb_image(image_path), return_tensors="pt").to(_get_device())
     
     with torch.no_grad():
         # Get image features using ALIGN model
@@ -311,7 +323,7 @@ def image_embeddings_align(image_path):
 
 def text_embeddings_align(text):
     # Process text with ALIGN processor
-    inputs = _get_align_processor()(text=text, return_tensors="pt").to(device)
+    inputs = _get_align_processor()(text=text, return_tensors="pt").to(_get_device())
     
     with torch.no_grad():
         # Get text features using ALIGN model
@@ -325,18 +337,8 @@ def text_embeddings_align(text):
 # X-VLM embeddings
 
 def image_embeddings_xvlm(image_path):
-    try:
-        with Image.open(image_path) as img:
-            image = img.convert("RGB")
-            # Process image with XVLM transform
-            image_tensor = _get_xvlm_img_transform()(image).unsqueeze(0).to(device)
-            image.close()
-    except Exception as e:
-        image_path = FrameCache.get_image_path(image_path)
-        with Image.open(image_path) as img:
-            image = img.convert("RGB")
-            image_tensor = _get_xvlm_img_transform()(image).unsqueeze(0).to(device)
-            image.close()
+    # Process image with XVLM transform
+    image_tensor = _get_xvlm_img_transform()(_open_rgb_image(image_path)).unsqueeze(0).to(_get_device())
     
     with torch.no_grad():
         # Get image features using XVLM model
@@ -349,7 +351,7 @@ def image_embeddings_xvlm(image_path):
 
 def text_embeddings_xvlm(text):
     # Process text with XVLM tokenizer
-    inputs = _get_xvlm_tokenizer()(text, return_tensors='pt', padding=True, truncation=True).to(device)
+    inputs = _get_xvlm_tokenizer()(text, return_tensors='pt', padding=True, truncation=True).to(_get_device())
     
     with torch.no_grad():
         # Get text features using XVLM model
@@ -363,18 +365,8 @@ def text_embeddings_xvlm(text):
 # LAION embeddings
 
 def image_embeddings_laion(image_path):
-    try:
-        with Image.open(image_path) as img:
-            image = img.convert("RGB")
-            # Process image with LAION processor
-            inputs = _get_laion_processor()(images=image, return_tensors="pt").to(device)
-            image.close()
-    except Exception as e:
-        image_path = FrameCache.get_image_path(image_path)
-        with Image.open(image_path) as img:
-            image = img.convert("RGB")
-            inputs = _get_laion_processor()(images=image, return_tensors="pt").to(device)
-            image.close()
+    # Process image with LAION processor
+    inputs = _get_laion_processor()(images=_open_rgb_image(image_path), return_tensors="pt").to(_get_device())
     
     with torch.no_grad():
         # Get image features using LAION model
@@ -385,7 +377,7 @@ def image_embeddings_laion(image_path):
 
 def text_embeddings_laion(text):
     # Process text with LAION processor
-    inputs = _get_laion_processor()(text=[text], padding="max_length", return_tensors="pt").to(device)
+    inputs = _get_laion_processor()(text=[text], padding="max_length", return_tensors="pt").to(_get_device())
     
     with torch.no_grad():
         # Get text features using LAION model
@@ -393,3 +385,197 @@ def text_embeddings_laion(text):
         # Normalize the embeddings
         outputs = outputs / outputs.norm(dim=-1, keepdim=True)
         return outputs.tolist()[0]
+
+
+# Batched image embeddings
+#
+# Running one forward pass per image is dominated by per-call overhead,
+# especially on CPU. The *_batch functions below load a batch of images,
+# run a single forward pass for the batch and return a list aligned with
+# the input paths. Unreadable images are returned as None rather than
+# failing the rest of the batch.
+
+def _open_rgb_image(image_path):
+    # Decoded once for all the modes reading the same file
+    return decoded_image_cache.get_image(image_path)
+
+
+def _embed_image_batches(image_paths, batch_size, embed_images_func):
+    image_paths = list(image_paths)
+    if batch_size is None or batch_size < 1:
+        batch_size = max(1, config.embedding_batch_size)
+    embeddings = [None] * len(image_paths)
+    for start in range(0, len(image_paths), batch_size):
+        indexes = []
+        images = []
+        for index in range(start, min(start + batch_size, len(image_paths))):
+            try:
+                images.append(_open_rgb_image(image_paths[index]))
+                indexes.append(index)
+            except Exception as e:
+                logger.error(f"{image_paths[index]} - {e}")
+        if len(images) == 0:
+            continue
+        try:
+            batch_embeddings = embed_images_func(images)
+        except Exception as e:
+            # Fall back to single images so one bad image does not fail the batch
+            logger.warning(f"Batch embedding failed, retrying images individually: {e}")
+            batch_embeddings = []
+            for index, image in zip(indexes, images):
+                try:
+                    batch_embeddings.append(embed_images_func([image])[0])
+                except Exception as e:
+                    logger.error(f"{image_paths[index]} - {e}")
+                    batch_embeddings.append(None)
+        finally:
+            for image in images:
+                image.close()
+        for index, embedding in zip(indexes, batch_embeddings):
+            embeddings[index] = embedding
+    return embeddings
+
+
+# Preprocessing and model passes are split so that compares can preprocess
+# images in parallel pipeline threads while the model runs on a batch. The
+# image_preprocess_* functions turn an RGB image into a model input tensor and
+# the image_embeddings_*_preprocessed functions embed a list of such tensors.
+
+def _pixel_values(processor, image):
+    return processor(images=image, return_tensors="pt")["pixel_values"][0]
+
+
+def image_preprocess_clip(image):
+    return _get_clip_preprocess()(image)
+
+
+def image_embeddings_clip_preprocessed(tensors):
+    image_input = torch.stack(tensors).to(_get_device())
+    with torch.no_grad():
+        embeddings = _get_clip_model().encode_image(image_input)
+        embeddings /= embeddings.norm(dim=-1, keepdim=True)
+        return embeddings.tolist()
+
+
+def _clip_embed_images(images):
+    return image_embeddings_clip_preprocessed([image_preprocess_clip(image) for image in images])
+
+
+def image_embeddings_clip_batch(image_paths, batch_size=None):
+    return _embed_image_batches(image_paths, batch_size, _clip_embed_images)
+
+
+def image_preprocess_siglip(image):
+    return _pixel_values(_get_siglip_processor(), image)
+
+
+def image_embeddings_siglip_preprocessed(tensors):
+    with torch.no_grad():
+        outputs = _get_siglip_model().get_image_features(pixel_values=torch.stack(tensors).to(_get_device()))
+        outputs = outputs / outputs.norm(dim=-1, keepdim=True)
+        return outputs.tolist()
+
+
+def _siglip_embed_images(images):
+    return image_embeddings_siglip_preprocessed([image_preprocess_siglip(image) for image in images])
+
+
+def image_embeddings_siglip_batch(image_paths, batch_size=None):
+    return _embed_image_batches(image_paths, batch_size, _siglip_embed_images)
+
+
+def image_preprocess_flava(image):
+    return _pixel_values(_get_flava_processor(), image)
+
+
+def image_embeddings_flava_preprocessed(tensors):
+    with torch.no_grad():
+        outputs = _get_flava_model().get_image_features(pixel_values=torch.stack(tensors).to(_get_device()))
+        # Same token as the single image path: [B, seq, 768] → [B, 768]
+        image_embeds = outputs[:, 0, :]
+        image_embeds = image_embeds / image_embeds.norm(dim=-1, keepdim=True)
+        return image_embeds.tolist()
+
+
+def _flava_embed_images(images):
+    return image_embeddings_flava_preprocessed([image_preprocess_flava(image) for image in images])
+
+
+def image_embeddings_flava_batch(image_paths, batch_size=None):
+    return _embed_image_batches(image_paths, batch_size, _flava_embed_images)
+
+
+def image_preprocess_align(image):
+    return _pixel_values(_get_align_processor(), image)
+
+
+def image_embeddings_align_preprocessed(tensors):
+    with torch.no_grad():
+        outputs = _get_align_model().get_image_features(pixel_values=torch.stack(tensors).to(_get_device()))
+        outputs = outputs / outputs.norm(dim=-1, keepdim=True)
+        return outputs.tolist()
+
+
+def _align_embed_images(images):
+    return image_embeddings_align_preprocessed([image_preprocess_align(image) for image in images])
+
+
+def image_embeddings_align_batch(image_paths, batch_size=None):
+    return _embed_image_batches(image_paths, batch_size, _align_embed_images)
+
+
+def image_preprocess_xvlm(image):
+    return _get_xvlm_img_transform()(image)
+
+
+def image_embeddings_xvlm_preprocessed(tensors):
+    image_tensor = torch.stack(tensors).to(_get_device())
+    with torch.no_grad():
+        image_embeds = _get_xvlm_model().vision_encoder(image_tensor)
+        image_feats = _get_xvlm_model().vision_proj(image_embeds[:, 0, :])
+        image_feats = image_feats / image_feats.norm(dim=-1, keepdim=True)
+        return image_feats.tolist()
+
+
+def _xvlm_embed_images(images):
+    return image_embeddings_xvlm_preprocessed([image_preprocess_xvlm(image) for image in images])
+
+
+def image_embeddings_xvlm_batch(image_paths, batch_size=None):
+    return _embed_image_batches(image_paths, batch_size, _xvlm_embed_images)
+
+
+def image_preprocess_laion(image):
+    return _pixel_values(_get_laion_processor(), image)
+
+
+def image_embeddings_laion_preprocessed(tensors):
+    with torch.no_grad():
+        outputs = _get_laion_model().get_image_features(pixel_values=torch.stack(tensors).to(_get_device()))
+        outputs = outputs / outputs.norm(dim=-1, keepdim=True)
+        return outputs.tolist()
+
+
+def _laion_embed_images(images):
+    return image_embeddings_laion_preprocessed([image_preprocess_laion(image) for image in images])
+
+
+def image_embeddings_laion_batch(image_paths, batch_size=None):
+    return _embed_image_batches(image_paths, batch_size, _laion_embed_images)
+
+
+# Batched text embeddings
+
+def text_embeddings_flava_batch(texts):
+    '''
+    Embed a list of texts with a single FLAVA forward pass, returning a list
+    aligned with the texts. Padding is masked, so each embedding matches the
+    one from text_embeddings_flava.
+    '''
+    inputs = _get_flava_processor()(text=list(texts), return_tensors="pt", padding=True).to(_get_device())
+    with torch.no_grad():
+        outputs = _get_flava_model().get_text_features(**inputs)
+        # Same token as the single text path: [B, seq, 768] → [B, 768]
+        text_embeds = outputs[:, 0, :]
+        text_embeds = text_embeds / text_embeds.norm(dim=-1, keepdim=True)
+        return text_embeds.tolist()
@@ -0,0 +1,250 @@
+import queue
+import threading
+import time
+
+from utils.logging_setup import get_logger
+
+logger = get_logger("pipeline")
+
+_END = object()
+# Seconds between checks for cancellation while waiting on a queue
+_POLL_SECONDS = 0.1
+
+
+class PipelineStage:
+    '''
+    One stage of a StagedPipeline.
+    :param name: Name of the stage, used for the timings.
+    :param func: Function applied to the output of the previous stage, or to a
+        list of outputs if batch_size is set, in which case it returns a list of
+        results in the same order.
+    :param workers: Number of threads running the stage.
+    :param batch_size: If above 0, the stage is run on batches of up to this
+        many items.
+    '''
+
+    def __init__(self, name, func, workers=1, batch_size=0):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.batch_size = int(batch_size)
+
+
+class _Item:
+    __slots__ = ("index", "item", "value", "error")
+
+    def __init__(self, index, item, value, error=None):
+        self.index = index
+        self.item = item
+        self.value = value
+        self.error = error
+
+
+class StagedPipeline:
+    '''
+    Runs items through a sequence of stages, each in its own threads, with
+    bounded queues between the stages so that a slow stage holds back the ones
+    before it instead of letting their outputs pile up in memory. Stages run
+    concurrently, so for example images are decoded and preprocessed while a
+    previous batch is passed through a model.
+
+    Results are yielded in the order of the items. An item whose stage raised
+    skips the later stages and is yielded with the exception. If a batch stage
+    raises, the items of the batch are retried one at a time so one bad item
+    does not fail the rest.
+
+    The busy time of each stage, summed over its threads, is kept in
+    stage_seconds, and the wall time of the last run in total_seconds.
+    '''
+
+    def __init__(self, stages, queue_size=64, is_cancelled=None):
+        '''
+        :param stages: List of PipelineStage.
+        :param queue_size: Maximum number of items waiting between two stages.
+        :param is_cancelled: Optional function returning True once the run
+            should stop, after which no more results are yielded.
+        '''
+        self.stages = list(stages)
+        self.queue_size = max(1, int(queue_size))
+        self.is_cancelled = is_cancelled
+        self.stage_seconds = {stage.name: 0.0 for stage in self.stages}
+        self.stage_items = {stage.name: 0 for stage in self.stages}
+        self.total_seconds = 0.0
+        self._timing_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._feed_error = None
+
+    def _put(self, q, value):
+        while not self._stop_event.is_set():
+            try:
+                q.put(value, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self._stop_event.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return _END
+
+    def _record(self, stage, seconds, n_items):
+        with self._timing_lock:
+            self.stage_seconds[stage.name] += seconds
+            self.stage_items[stage.name] += n_items
+
+    def _apply(self, stage, items):
+        '''
+        Run a stage on a list of items, batched or one at a time.
+        '''
+        pending = [item for item in items if item.error is None]
+        if len(pending) == 0:
+            return
+        start = time.perf_counter()
+        if stage.batch_size > 0:
+            try:
+                results = stage.func([item.value for item in pending])
+                if len(results) != len(pending):
+                    raise ValueError(f"Stage {stage.name} returned {len(results)} results for {len(pending)} items")
+                for item, result in zip(pending, results):
+                    item.value = result
+            except Exception as e:
+                if len(pending) > 1:
+                    logger.warning(f"Batch failed in stage {stage.name}, retrying items individually: {e}")
+                for item in pending:
+                    try:
+                        item.value = stage.func([item.value])[0]
+                    except Exception as item_error:
+                        item.error = item_error
+                        item.value = None
+        else:
+            for item in pending:
+                try:
+                    item.value = stage.func(item.value)
+                except Exception as e:
+                    item.error = e
+                    item.value = None
+        self._record(stage, time.perf_counter() - start, len(pending))
+
+    def _run_stage(self, stage, in_queue, out_queue, finished):
+        '''
+        Worker loop of one thread of a stage. The last thread of a stage to
+        finish passes the end of the items on to the next stage.
+        '''
+        while not self._stop_event.is_set():
+            item = self._get(in_queue)
+            if item is _END:
+                break
+            items = [item]
+            ended = False
+            while len(items) < stage.batch_size:
+                item = self._get(in_queue)
+                if item is _END:
+                    ended = True
+                    break
+                items.append(item)
+            self._apply(stage, items)
+            for item in items:
+                if not self._put(out_queue, item):
+                    return
+            if ended:
+                break
+        with finished["lock"]:
+            finished["count"] += 1
+            is_last = finished["count"] == stage.workers
+        if is_last:
+            for _ in range(finished["next_workers"]):
+                self._put(out_queue, _END)
+        else:
+            # Let the other threads of the stage see the end of the items
+            self._put(in_queue, _END)
+
+    def _feed(self, items, is_done, first_queue, out_queue):
+        try:
+            for index, item in enumerate(items):
+                if self._stop_event.is_set():
+                    return
+                if is_done is not None and is_done(item):
+                    # Already has a result, pass it straight to the output
+                    if not self._put(out_queue, _Item(index, item, item)):
+                        return
+                elif not self._put(first_queue, _Item(index, item, item)):
+                    return
+        except Exception as e:
+            # Raised to the caller once the items fed so far are done
+            self._feed_error = e
+        self._put(first_queue, _END)
+
+    def _cancelled(self):
+        return self.is_cancelled is not None and self.is_cancelled()
+
+    def run(self, items, is_done=None):
+        '''
+        Run the items through the stages.
+        :param items: Iterable of items, consumed lazily by a feeder thread.
+        :param is_done: Optional function returning True for items that do not
+            need to be run through the stages, yielded as their own result.
+        :returns: Generator of (item, result, error) in the order of the items,
+            where error is the exception raised for the item or None.
+        '''
+        if len(self.stages) == 0:
+            raise ValueError("A pipeline needs at least one stage")
+        start = time.perf_counter()
+        self._stop_event.clear()
+        self._feed_error = None
+        queues = [queue.Queue(maxsize=max(self.queue_size, 2 * stage.batch_size)) for stage in self.stages]
+        out_queue = queue.Queue(maxsize=self.queue_size)
+        queues.append(out_queue)
+        threads = []
+        for stage_index, stage in enumerate(self.stages):
+            # The output queue is read by the caller, which needs a single end marker
+            next_workers = self.stages[stage_index + 1].workers if stage_index + 1 < len(self.stages) else 1
+            finished = {"lock": threading.Lock(), "count": 0, "next_workers": next_workers}
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._run_stage, args=(stage, queues[stage_index], queues[stage_index + 1], finished),
+                    name=f"pipeline_{stage.name}", daemon=True))
+        feeder = threading.Thread(target=self._feed, args=(items, is_done, queues[0], out_queue),
+                                  name="pipeline_feed", daemon=True)
+        threads.append(feeder)
+        for thread in threads:
+            thread.start()
+
+        next_index = 0
+        waiting = {}
+        try:
+            while True:
+                if self._cancelled():
+                    return
+                try:
+                    item = out_queue.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    break
+                waiting[item.index] = item
+                while next_index in waiting:
+                    if self._cancelled():
+                        return
+                    item = waiting.pop(next_index)
+                    next_index += 1
+                    yield item.item, item.value, item.error
+            if self._feed_error is not None:
+                raise self._feed_error
+        finally:
+            self._stop_event.set()
+            for thread in threads:
+                thread.join()
+            self.total_seconds = time.perf_counter() - start
+
+    def timings_summary(self):
+        '''
+        Text describing the busy time of each stage and the total wall time.
+        '''
+        stage_texts = [f"{stage.name} {self.stage_seconds[stage.name]:.2f}s "
+                       f"({self.stage_items[stage.name]} items, {stage.workers} threads)"
+                       for stage in self.stages]
+        return f"{', '.join(stage_texts)}; total {self.total_seconds:.2f}s"
@@ -0,0 +1,69 @@
+import numpy as np
+
+PAIRS_CHUNK = 65536
+
+
+def signature_pairs(signature_files, self_scores, ids1, ids2, scores, threshold):
+    '''
+    Expand matching pairs of signatures, each shared by one or more files, into
+    pairs of files reduced so that grouping them joins the same groups, with
+    the same best score per file, as grouping every matching pair of files.
+
+    Files of a signature are chained if they match each other, which requires
+    that no other signature scores higher with them. Otherwise each is paired
+    with the first file of every matching signature.
+    :param signature_files: Lists of the file indexes with each signature.
+    :param self_scores: Score of two files with the same signature, per signature.
+    :param ids1, ids2, scores: Arrays of the matching pairs of signatures.
+    :returns: Generator of (indexes1, indexes2, scores) arrays with indexes1 < indexes2.
+    '''
+    chained = np.asarray(self_scores) >= threshold
+    for signature_id, indexes in enumerate(signature_files):
+        if chained[signature_id] and len(indexes) > 1:
+            indexes = np.array(indexes, dtype=np.int64)
+            yield indexes[:-1], indexes[1:], np.full(len(indexes) - 1, self_scores[signature_id], dtype=np.float64)
+
+    # Files of each signature to pair with the first file of a matching one
+    member_lists = [indexes[:1] if chained[signature_id] else indexes
+                    for signature_id, indexes in enumerate(signature_files)]
+    member_counts = np.array([len(members) for members in member_lists], dtype=np.int64)
+    member_starts = np.cumsum(member_counts) - member_counts
+    members = np.array([index for members in member_lists for index in members], dtype=np.int64)
+    first_files = members[member_starts] if len(members) > 0 else members
+
+    def expand(ids, skip_first):
+        '''
+        Repeat each position for each member of its signature.
+        :returns: (positions, member indexes) arrays.
+        '''
+        counts = member_counts[ids] - skip_first
+        total = int(counts.sum())
+        starts = np.repeat(member_starts[ids] + skip_first - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        return np.repeat(np.arange(len(ids)), counts), members[starts]
+
+    ids1 = np.asarray(ids1, dtype=np.int64)
+    ids2 = np.asarray(ids2, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    for start in range(0, len(ids1), PAIRS_CHUNK):
+        chunk1, chunk2 = ids1[start:start + PAIRS_CHUNK], ids2[start:start + PAIRS_CHUNK]
+        chunk_scores = scores[start:start + PAIRS_CHUNK]
+        # The first file of each signature is paired with every member of the
+        # other, and the other members of the first with its first file
+        positions2, indexes2 = expand(chunk2, 0)
+        positions1, indexes1 = expand(chunk1, 1)
+        indexes_a = np.concatenate([first_files[chunk1][positions2], first_files[chunk2][positions1]])
+        indexes_b = np.concatenate([indexes2, indexes1])
+        yield (np.minimum(indexes_a, indexes_b), np.maximum(indexes_a, indexes_b),
+               np.concatenate([chunk_scores[positions2], chunk_scores[positions1]]))
+
+
+def sorted_unique_counts(keys):
+    '''
+    Unique values of an integer array with their counts, by sorting, which is
+    faster than np.unique for large arrays of pair keys.
+    '''
+    keys = np.sort(keys)
+    if len(keys) == 0:
+        return keys, np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return keys[starts], np.diff(np.append(starts, len(keys)))
@@ -0,0 +1,277 @@
+import atexit
+import os
+import pickle
+import re
+import threading
+import time
+
+import numpy as np
+
+from compare.feature_store import FeatureStore
+from utils.config import config
+from utils.logging_setup import get_logger
+
+logger = get_logger("text_embedding_cache")
+
+
+class _FileLock:
+    '''
+    Lock file held while a process writes to a shared cache. Locks left behind
+    by a process that exited without releasing them are removed once stale.
+    '''
+
+    def __init__(self, path, timeout_seconds, stale_seconds):
+        self.path = path
+        self.timeout_seconds = timeout_seconds
+        self.stale_seconds = stale_seconds
+        self.acquired = False
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout_seconds
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                self.acquired = True
+                return True
+            except FileExistsError:
+                pass
+            except OSError as e:
+                logger.error(f"Failed to create lock file {self.path}: {e}")
+                return False
+            try:
+                if time.time() - os.path.getmtime(self.path) > self.stale_seconds:
+                    logger.warning(f"Removing stale lock file {self.path}")
+                    os.remove(self.path)
+                    continue
+            except OSError:
+                # Released between the two calls
+                continue
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.acquired:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.acquired = False
+
+
+class TextEmbeddingCache:
+    '''
+    Persistent cache of text embeddings for one embedding model, shared across
+    sessions and app windows. Behaves like the dict of text -> embedding that
+    the compare classes used to keep in memory, so search presets, prevalidation
+    texts and classifier action texts are only encoded once.
+
+    Embeddings are stored per model variant in a FeatureStore at
+    "<cache dir>/text_embeddings/<model id>_<variant>", so rows are read from a
+    memory-mapped matrix and nothing is loaded until the cache is first used.
+    Last use times are kept next to the store in "<base>.lru.pkl", and the least
+    recently used texts are evicted when the store grows beyond
+    config.text_embedding_cache_max_entries.
+
+    Writes are made under a lock file. If another process has written to the
+    store since it was loaded, it is reloaded before new texts are appended, and
+    a lookup that misses checks for such writes before the text is encoded.
+    '''
+    DIR_NAME = "text_embeddings"
+    LRU_EXT = ".lru.pkl"
+    LOCK_EXT = ".lock"
+    LOCK_TIMEOUT_SECONDS = 10
+    STALE_LOCK_SECONDS = 60
+    _caches = {}
+    _caches_lock = threading.Lock()
+
+    def __init__(self, model_id, variant_func=None, cache_dir=None):
+        self.model_id = model_id
+        self.variant_func = variant_func
+        self.cache_dir = cache_dir
+        self._lock = threading.RLock()
+        self._store = None
+        self._base_path = None
+        self._index_stat = None
+        self._pending = {}
+        self._last_used = {}
+        self._lru_dirty = False
+        self._exit_registered = False
+
+    @staticmethod
+    def for_model(model_id, variant_func=None):
+        '''
+        Return the cache shared by all compare instances for the given model.
+        :param model_id: Name of the embedding model.
+        :param variant_func: Optional function returning the configured model
+            variant, so that embeddings from different variants are kept apart.
+        '''
+        with TextEmbeddingCache._caches_lock:
+            cache = TextEmbeddingCache._caches.get(model_id)
+            if cache is None:
+                cache = TextEmbeddingCache(model_id, variant_func)
+                TextEmbeddingCache._caches[model_id] = cache
+            return cache
+
+    @staticmethod
+    def default_cache_dir():
+        root = os.environ.get("WEIDR_CACHE_DIR") or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return os.path.join(root, TextEmbeddingCache.DIR_NAME)
+
+    def _get_base_path(self):
+        variant = "default" if self.variant_func is None else str(self.variant_func())
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{self.model_id}_{variant}")
+        cache_dir = self.cache_dir or TextEmbeddingCache.default_cache_dir()
+        return os.path.join(cache_dir, name)
+
+    def _ensure_open(self):
+        base_path = self._get_base_path()
+        if self._store is not None and base_path == self._base_path:
+            return self._store
+        if self._store is not None:
+            # The model variant changed, persist the state of the previous store
+            self.flush()
+        os.makedirs(os.path.dirname(base_path), exist_ok=True)
+        self._base_path = base_path
+        self._store = FeatureStore(base_path, validate_mtimes=False)
+        self._pending = {}
+        self._last_used = {}
+        self._lru_dirty = False
+        self._reload()
+        if not self._exit_registered:
+            atexit.register(self.flush)
+            self._exit_registered = True
+        return self._store
+
+    def _stat_index(self):
+        try:
+            stat = os.stat(self._store.index_path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _is_stale(self):
+        return self._stat_index() != self._index_stat
+
+    def _reload(self):
+        if FeatureStore.exists_at(self._base_path):
+            try:
+                self._store.open()
+            except (OSError, ValueError, pickle.UnpicklingError) as e:
+                logger.warning(f"Failed to load text embedding cache {self._base_path}, starting a new cache: {e}")
+                self._store.clear()
+        self._index_stat = self._stat_index()
+        for text, last_used in self._read_lru().items():
+            if last_used > self._last_used.get(text, 0.0):
+                self._last_used[text] = last_used
+
+    def _read_lru(self):
+        try:
+            with open(self._base_path + TextEmbeddingCache.LRU_EXT, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError) as e:
+            logger.warning(f"Ignoring invalid text embedding cache access times for {self._base_path}: {e}")
+            return {}
+
+    def _write_lru(self):
+        lru_path = self._base_path + TextEmbeddingCache.LRU_EXT
+        last_used = {text: self._last_used.get(text, 0.0) for text in self._store.keys()}
+        with open(lru_path + ".tmp", "wb") as f:
+            pickle.dump(last_used, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(lru_path + ".tmp", lru_path)
+
+    def _evict(self):
+        max_entries = config.text_embedding_cache_max_entries
+        n_excess = len(self._store) - max_entries
+        if max_entries <= 0 or n_excess <= 0:
+            return
+        evicted = sorted(self._store.keys(), key=lambda text: self._last_used.get(text, 0.0))[:n_excess]
+        for text in evicted:
+            del self._store[text]
+            self._last_used.pop(text, None)
+        logger.debug(f"Evicted {len(evicted)} least recently used text embeddings from {self._base_path}")
+
+    # Dict interface
+
+    def __contains__(self, text):
+        with self._lock:
+            store = self._ensure_open()
+            if text in self._pending or text in store:
+                return True
+            # Another window may have encoded the text since the store was loaded
+            if self._is_stale():
+                self._reload()
+                return text in store
+            return False
+
+    def __getitem__(self, text):
+        with self._lock:
+            store = self._ensure_open()
+            embedding = self._pending[text] if text in self._pending else np.array(store[text])
+            self._last_used[text] = time.time()
+            self._lru_dirty = True
+            return embedding
+
+    def __setitem__(self, text, embedding):
+        with self._lock:
+            self._ensure_open()
+            self._pending[text] = np.asarray(embedding, dtype=np.float32)
+            self._last_used[text] = time.time()
+            self._lru_dirty = True
+            self.flush()
+
+    def update(self, embeddings):
+        '''
+        Add many text embeddings at once, written to disk in a single flush.
+        :param embeddings: Dict of text -> embedding.
+        '''
+        with self._lock:
+            self._ensure_open()
+            now = time.time()
+            for text, embedding in embeddings.items():
+                self._pending[text] = np.asarray(embedding, dtype=np.float32)
+                self._last_used[text] = now
+            self._lru_dirty = True
+            self.flush()
+
+    def __len__(self):
+        with self._lock:
+            store = self._ensure_open()
+            return len(store) + len([text for text in self._pending if text not in store])
+
+    def get(self, text, default=None):
+        with self._lock:
+            return self[text] if text in self else default
+
+    def flush(self):
+        '''
+        Write new embeddings and last use times to disk, evicting the least
+        recently used texts if the cache is over its size limit. If the lock
+        cannot be acquired the changes are kept and written on a later flush.
+        '''
+        with self._lock:
+            if self._store is None or (len(self._pending) == 0 and not self._lru_dirty):
+                return
+            with _FileLock(self._base_path + TextEmbeddingCache.LOCK_EXT,
+                           TextEmbeddingCache.LOCK_TIMEOUT_SECONDS,
+                           TextEmbeddingCache.STALE_LOCK_SECONDS) as acquired:
+                if not acquired:
+                    logger.warning(f"Could not acquire text embedding cache lock for {self._base_path}")
+                    return
+                if self._is_stale():
+                    self._reload()
+                for text, embedding in self._pending.items():
+                    if text not in self._store:
+                        self._store[text] = embedding
+                self._evict()
+                try:
+                    self._store.flush()
+                    self._write_lru()
+                except (OSError, ValueError) as e:
+                    logger.error(f"Failed to store text embedding cache {self._base_path}: {e}")
+                    return
+                self._index_stat = self._stat_index()
+                self._pending = {}
+                self._lru_dirty = False
@@ -0,0 +1,141 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from utils.logging_setup import get_logger
+
+logger = get_logger("directory_listing")
+
+
+def _is_hidden(name: str) -> bool:
+    return name.startswith(".")
+
+
+def walk_files(directory: str, suffixes: Iterable[str], recursive: bool = True, skip_hidden: bool = False,
+               dir_mtimes: Optional[Dict[str, int]] = None,
+               stop_event: Optional[threading.Event] = None) -> Iterator[str]:
+    """
+    Yield the files in a directory with one of the given extensions, lazily and
+    in a single pass over the tree. Symlinked directories are not followed.
+
+    Args:
+        directory: Directory to scan
+        suffixes: File extensions to include, matched case-insensitively
+        recursive: Whether to scan subdirectories
+        skip_hidden: Whether to skip files and directories starting with "."
+        dir_mtimes: If given, filled with the modification time of each scanned
+            directory, taken before it was scanned
+        stop_event: If given and set, the walk stops early
+    """
+    suffixes = frozenset(suffix.lower() for suffix in suffixes)
+    to_scan = [directory]
+    while to_scan:
+        if stop_event is not None and stop_event.is_set():
+            return
+        current_dir = to_scan.pop()
+        try:
+            if dir_mtimes is not None:
+                dir_mtimes[current_dir] = os.stat(current_dir).st_mtime_ns
+            with os.scandir(current_dir) as it:
+                for entry in it:
+                    if skip_hidden and _is_hidden(entry.name):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            to_scan.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) \
+                            and os.path.splitext(entry.name)[1].lower() in suffixes:
+                        yield entry.path
+        except PermissionError:
+            logger.warning(f"Permission denied: {current_dir}")
+        except OSError as e:
+            logger.debug(f"Failed to scan {current_dir}: {e}")
+
+
+class _Listing:
+    def __init__(self, directory, recursive, suffixes, skip_hidden, files, dir_mtimes):
+        self.directory = directory
+        self.recursive = recursive
+        self.suffixes = suffixes
+        self.skip_hidden = skip_hidden
+        self.files = files
+        self.dir_mtimes = dir_mtimes
+
+
+class DirectoryListingCache:
+    """
+    Most recent directory listings made by file browsers and compares, so that
+    a directory that was just listed is not walked again.
+
+    A listing is reused only while the modification time of every directory
+    it scanned is unchanged, which holds as long as no entries have been added
+    to, removed from or renamed in any of them.
+    """
+    MAX_LISTINGS = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listings: "OrderedDict[str, _Listing]" = OrderedDict()
+
+    @staticmethod
+    def _key(directory: str) -> str:
+        return directory.rstrip("/\\") or directory
+
+    def store(self, directory: str, recursive: bool, suffixes: Iterable[str], files: List[str],
+              dir_mtimes: Dict[str, int], skip_hidden: bool = False) -> None:
+        """
+        Store a complete listing of a directory made by walk_files.
+        """
+        listing = _Listing(directory, recursive, frozenset(suffix.lower() for suffix in suffixes),
+                           skip_hidden, list(files), dict(dir_mtimes))
+        key = DirectoryListingCache._key(directory)
+        with self._lock:
+            self._listings.pop(key, None)
+            self._listings[key] = listing
+            while len(self._listings) > DirectoryListingCache.MAX_LISTINGS:
+                self._listings.popitem(last=False)
+
+    def get(self, directory: str, recursive: bool, suffixes: Iterable[str],
+            skip_hidden: bool = False) -> Optional[List[str]]:
+        """
+        Get the files in a directory with one of the given extensions from a
+        stored listing, if one covering the request is still valid.
+
+        Returns:
+            List of file paths in walk order, or None if no listing can be used.
+        """
+        suffixes = frozenset(suffix.lower() for suffix in suffixes)
+        key = DirectoryListingCache._key(directory)
+        with self._lock:
+            listing = self._listings.get(key)
+        if listing is None or (recursive and not listing.recursive) or not suffixes <= listing.suffixes \
+                or (listing.skip_hidden and not skip_hidden):
+            return None
+        for scanned_dir, mtime in listing.dir_mtimes.items():
+            try:
+                if os.stat(scanned_dir).st_mtime_ns != mtime:
+                    return None
+            except OSError:
+                return None
+
+        files = []
+        base_length = len(os.path.join(listing.directory, ""))
+        for path in listing.files:
+            if os.path.splitext(path)[1].lower() not in suffixes:
+                continue
+            if not recursive or (skip_hidden and not listing.skip_hidden):
+                relative_parts = path[base_length:].replace("\\", "/").split("/")
+                if not recursive and len(relative_parts) > 1:
+                    continue
+                if skip_hidden and not listing.skip_hidden and any(_is_hidden(part) for part in relative_parts):
+                    continue
+            files.append(path)
+        return files
+
+    def clear(self) -> None:
+        with self._lock:
+            self._listings.clear()
+
+
+directory_listing_cache = DirectoryListingCache()
@@ -7,7 +7,9 @@ import threading
 from time import sleep
 from typing import Dict, List, Optional
 
+from files.directory_listing import directory_listing_cache, walk_files
 from files.sortable_file import SortableFile
+from image.image_dimensions import image_dimensions
 from utils.config import config
 from utils.constants import Sort, SortBy, Direction
 from utils.logging_setup import get_logger
@@ -724,32 +726,26 @@ class FileBrowser:
         """
         allowed_extensions = set(config.file_types)
         batch: List[str] = []
-        to_scan = [self.directory]
         seen_paths = set(self.filepaths)
         stop_event = self._incremental_stop_event
-        while to_scan and not stop_event.is_set():
-            current_dir = to_scan.pop()
-            self._incremental_scanned_dirs += 1
-            try:
-                with os.scandir(current_dir) as entries:
-                    for entry in entries:
-                        if stop_event.is_set():
-                            break
-                        if self.recursive and entry.is_dir(follow_symlinks=False):
-                            to_scan.append(entry.path)
-                        elif entry.is_file(follow_symlinks=False):
-                            ext = os.path.splitext(entry.name)[1].lower()
-                            if ext in allowed_extensions and entry.path not in seen_paths:
-                                batch.append(entry.path)
-                                seen_paths.add(entry.path)
-                                self._incremental_files_discovered += 1
-                                if len(batch) >= self._incremental_batch_size:
-                                    self._merge_incremental_batch(batch)
-                                    batch = []
-            except PermissionError:
-                continue
-            except OSError:
-                continue
+        dir_mtimes: Dict[str, int] = {}
+        listed_files: List[str] = []
+        for path in walk_files(self.directory, allowed_extensions, recursive=self.recursive,
+                               dir_mtimes=dir_mtimes, stop_event=stop_event):
+            if stop_event.is_set():
+                break
+            self._incremental_scanned_dirs = len(dir_mtimes)
+            listed_files.append(path)
+            if path not in seen_paths:
+                batch.append(path)
+                seen_paths.add(path)
+                self._incremental_files_discovered += 1
+                if len(batch) >= self._incremental_batch_size:
+                    self._merge_incremental_batch(batch)
+                    batch = []
+        self._incremental_scanned_dirs = len(dir_mtimes)
+        if not stop_event.is_set():
+            directory_listing_cache.store(self.directory, self.recursive, allowed_extensions, listed_files, dir_mtimes)
 
         if batch and not stop_event.is_set():
             self._merge_incremental_batch(batch)
@@ -846,6 +842,10 @@ class FileBrowser:
             elif self.sort_by == SortBy.RELATED_IMAGE:
                 sortable_files.sort(key=lambda sf: sf.get_related_image_or_self(), reverse=reverse)
 
+            if self.sort_by in (SortBy.IMAGE_PIXELS, SortBy.IMAGE_HEIGHT, SortBy.IMAGE_WIDTH):
+                # Persist dimensions read for the sort so the next one only reads file stats
+                image_dimensions.flush()
+
         # Return either SortableFile objects or filepaths
         if return_sortable_files:
             return sortable_files
@@ -884,20 +884,11 @@ class FileBrowser:
                     files.extend(glob.glob(os.path.join(self.directory, _ + "*" + ext), recursive=self.recursive))
         else:
             with Utils.file_operation_lock:
-                to_scan = [self.directory]
-                while to_scan:
-                    current_dir = to_scan.pop()
-                    try:
-                        with os.scandir(current_dir) as it:
-                            for entry in it:
-                                if entry.is_dir(follow_symlinks=False) and self.recursive:
-                                    to_scan.append(entry.path)
-                                elif entry.is_file(follow_symlinks=False):
-                                    ext = os.path.splitext(entry.name)[1].lower()
-                                    if ext in allowed_extensions:
-                                        files.append(entry.path)
-                    except PermissionError:
-                        logger.warning(f"Permission denied: {current_dir}")
+                dir_mtimes: Dict[str, int] = {}
+                listed_files = list(walk_files(self.directory, allowed_extensions, recursive=self.recursive,
+                                               dir_mtimes=dir_mtimes))
+            files.extend(listed_files)
+            directory_listing_cache.store(self.directory, self.recursive, allowed_extensions, listed_files, dir_mtimes)
 
     def count_files_by_type_in_directory(self, recursive: bool = True) -> Dict[str, int]:
         """
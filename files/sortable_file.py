@@ -1,10 +1,8 @@
 from datetime import datetime
 import os
 
-from PIL import Image
-
-from image.frame_cache import FrameCache
 from image.image_data_extractor import image_data_extractor
+from image.image_dimensions import image_dimensions
 
 class SortableFile:
     def __init__(self, full_file_path):
@@ -75,14 +73,7 @@ class SortableFile:
         Returns (width, height) tuple or None if not an image or dimensions can't be determined.
         """
         if self._image_dimensions is None:
-            try:
-                self._image_dimensions = Image.open(self.full_file_path).size
-            except Exception:
-                try:
-                    image_path = FrameCache.get_image_path(self.full_file_path)
-                    self._image_dimensions = Image.open(image_path).size
-                except Exception:
-                    self._image_dimensions = (0, 0)
+            self._image_dimensions = image_dimensions.get_dimensions(self.full_file_path, extract_frame=True) or (0, 0)
         return self._image_dimensions
 
     def get_image_pixels(self):
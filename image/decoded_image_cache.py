@@ -0,0 +1,179 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils.config import config
+from utils.logging_setup import get_logger
+
+logger = get_logger("decoded_image_cache")
+
+# Modes decoded to a single channel, which color matching cannot use
+_GRAYSCALE_MODES = frozenset(["1", "L", "I", "F", "I;16", "I;16B", "I;16L", "I;16N"])
+
+
+class DecodedImage:
+    """
+    An image decoded for analysis, as a read-only RGB uint8 array.
+
+    Attributes:
+        array: Array of shape (height, width, 3)
+        source_mode: PIL mode of the file before conversion to RGB
+        source_size: (width, height) of the file before downscaling
+    """
+    __slots__ = ("array", "source_mode", "source_size")
+
+    def __init__(self, array: np.ndarray, source_mode: str, source_size: Tuple[int, int]):
+        self.array = array
+        self.source_mode = source_mode
+        self.source_size = source_size
+
+    @property
+    def is_grayscale(self) -> bool:
+        return self.source_mode in _GRAYSCALE_MODES
+
+    def to_pil(self) -> Image.Image:
+        return Image.fromarray(self.array, "RGB")
+
+    def gray(self) -> np.ndarray:
+        """Single channel uint8 array, weighted as by cv2 and PIL."""
+        return np.asarray(self.to_pil().convert("L"))
+
+
+def _scaled_size(size: Tuple[int, int], shorter_side: int) -> Tuple[int, int]:
+    scale = shorter_side / min(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def decode_image(path: str, shorter_side: int = 0) -> DecodedImage:
+    """
+    Decode an image file to RGB, downscaled so that its shorter side is at most
+    the given size. JPEG files are decoded at a reduced scale where possible,
+    which is much faster than decoding at full size and downscaling.
+
+    Args:
+        path: Path to an image file readable by PIL
+        shorter_side: Maximum length of the shorter side, 0 for full size
+    """
+    with Image.open(path) as img:
+        source_mode, source_size = img.mode, img.size
+        if shorter_side > 0 and min(img.size) > shorter_side:
+            scale = shorter_side / min(img.size)
+            # The draft is never smaller than the requested size
+            img.draft("RGB", (math.ceil(img.size[0] * scale), math.ceil(img.size[1] * scale)))
+        rgb = img.convert("RGB")
+    if shorter_side > 0 and min(rgb.size) > shorter_side:
+        rgb = rgb.resize(_scaled_size(rgb.size, shorter_side), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    array = np.asarray(rgb)
+    array.flags.writeable = False
+    return DecodedImage(array, source_mode, source_size)
+
+
+class DecodedImageCache:
+    """
+    Recently decoded images shared by the analysis modes, so that a file read
+    by several of them (embedding models, color matching, face detection and
+    image classifiers) is only decoded once.
+
+    Images are stored downscaled to config.decoded_image_size on their shorter
+    side and the cache holds up to config.decoded_image_cache_mb of them,
+    dropping the least recently used first. An image is decoded again if its
+    file has changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int, int], DecodedImage]]" = OrderedDict()
+        self._n_bytes = 0
+        self._loading: Dict[str, threading.Event] = {}
+
+    @staticmethod
+    def _max_bytes() -> int:
+        return max(0, config.decoded_image_cache_mb) * 1024 * 1024
+
+    def get(self, path: str) -> DecodedImage:
+        """
+        Get a file decoded for analysis. Files PIL cannot read, such as videos,
+        are decoded from their first frame extracted by FrameCache.
+
+        Raises:
+            OSError or ValueError if the file cannot be decoded.
+        """
+        stat = os.stat(path)
+        shorter_side = max(0, config.decoded_image_size)
+        key = (stat.st_mtime_ns, stat.st_size, shorter_side)
+        while True:
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is not None and entry[0] == key:
+                    self._entries.move_to_end(path)
+                    return entry[1]
+                loading = self._loading.get(path)
+                if loading is None:
+                    loading = threading.Event()
+                    self._loading[path] = loading
+                    break
+            # Another thread is decoding the same file, use its result
+            loading.wait()
+
+        try:
+            decoded = self._decode(path, shorter_side)
+            self._store(path, key, decoded)
+            return decoded
+        finally:
+            with self._lock:
+                del self._loading[path]
+            loading.set()
+
+    @staticmethod
+    def _decode(path: str, shorter_side: int) -> DecodedImage:
+        try:
+            return decode_image(path, shorter_side)
+        except Exception:
+            from image.frame_cache import FrameCache
+            image_path = FrameCache.get_image_path(path)
+            if image_path == path:
+                raise
+            return decode_image(image_path, shorter_side)
+
+    def _store(self, path: str, key: Tuple[int, int, int], decoded: DecodedImage) -> None:
+        max_bytes = DecodedImageCache._max_bytes()
+        n_bytes = decoded.array.nbytes
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self._n_bytes -= previous[1].array.nbytes
+            if n_bytes > max_bytes:
+                return
+            self._entries[path] = (key, decoded)
+            self._n_bytes += n_bytes
+            while self._n_bytes > max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._n_bytes -= dropped.array.nbytes
+
+    def get_array(self, path: str) -> np.ndarray:
+        """Read-only RGB uint8 array of shape (height, width, 3)."""
+        return self.get(path).array
+
+    def get_image(self, path: str) -> Image.Image:
+        """RGB PIL image, not shared with other callers."""
+        return self.get(path).to_pil()
+
+    def get_gray(self, path: str) -> np.ndarray:
+        """Single channel uint8 array of shape (height, width)."""
+        return self.get(path).gray()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+decoded_image_cache = DecodedImageCache()
@@ -4,11 +4,11 @@ from enum import Enum
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
-from PIL import Image
 
 from utils.config import config
 from utils.logging_setup import get_logger
 
+from image.decoded_image_cache import decoded_image_cache
 from image.image_classifier_model_config import ImageClassifierModelConfig
 
 logger = get_logger("image_classifier")
@@ -305,11 +305,10 @@ class H5ImageClassifier(BaseImageClassifier):
     def preprocess_image(self, image_path: str) -> np.ndarray:
         """Preprocess image with safety checks"""
         try:
-            with Image.open(image_path) as img:
-                img = img.convert('RGB')
-                img = img.resize(self.input_shape)
-                img_array = np.array(img, dtype=np.float32) / 255.0
-                return np.expand_dims(img_array, axis=0)
+            img = decoded_image_cache.get_image(image_path)
+            img = img.resize(self.input_shape)
+            img_array = np.array(img, dtype=np.float32) / 255.0
+            return np.expand_dims(img_array, axis=0)
         except Exception as e:
             raise ValueError(f"Image processing failed: {str(e)}")
 
@@ -732,18 +731,17 @@ class PyTorchImageClassifier(BaseImageClassifier):
             raise ValueError("Model not loaded")
         
         try:
-            with Image.open(image_path) as img:
-                img = img.convert('RGB')
-                if self.use_transformers_auto_model:
-                    if self.processor is None:
-                        raise ValueError("Transformers processor is not initialized")
-                    inputs = self.processor(images=img, return_tensors="pt")
-                    import torch
-                    return {k: v.to(self.device) if isinstance(v, torch.Tensor) else v for k, v in inputs.items()}
-                tensor = self.transform(img)
-                # Add batch dimension
-                tensor = tensor.unsqueeze(0).to(self.device)
-                return tensor
+            img = decoded_image_cache.get_image(image_path)
+            if self.use_transformers_auto_model:
+                if self.processor is None:
+                    raise ValueError("Transformers processor is not initialized")
+                inputs = self.processor(images=img, return_tensors="pt")
+                import torch
+                return {k: v.to(self.device) if isinstance(v, torch.Tensor) else v for k, v in inputs.items()}
+            tensor = self.transform(img)
+            # Add batch dimension
+            tensor = tensor.unsqueeze(0).to(self.device)
+            return tensor
         except Exception as e:
             raise ValueError(f"Image processing failed: {str(e)}")
     
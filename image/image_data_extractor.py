@@ -7,6 +7,7 @@ import sys
 
 from PIL import Image
 
+from image.image_dimensions import image_dimensions
 from utils.config import config
 from utils.logging_setup import get_logger
 from utils.translations import I18N
@@ -45,19 +46,23 @@ class ImageDataExtractor:
     def __init__(self):
         pass
 
+    @staticmethod
+    def _get_dimensions(image_path):
+        dimensions = image_dimensions.get_dimensions(image_path)
+        if dimensions is None:
+            raise ValueError(f"Unable to read image dimensions: {image_path}")
+        return dimensions
+
     def is_xl(self, image_path):
-        with Image.open(image_path) as img:
-            width, height = img.size
+        width, height = self._get_dimensions(image_path)
         return width > 768 and height > 768
 
     def equals_resolution(self, image_path, ex_width=512, ex_height=512):
-        with Image.open(image_path) as img:
-            width, height = img.size
+        width, height = self._get_dimensions(image_path)
         return width == ex_width and height == ex_height
 
     def higher_than_resolution(self, image_path, max_width=512, max_height=512, inclusive=True):
-        with Image.open(image_path) as img:
-            width, height = img.size
+        width, height = self._get_dimensions(image_path)
         if max_width:
             if inclusive:
                 if max_width > width:
@@ -73,8 +78,7 @@ class ImageDataExtractor:
         return True
 
     def lower_than_resolution(self, image_path, max_width=512, max_height=512, inclusive=True):
-        with Image.open(image_path) as img:
-            width, height = img.size
+        width, height = self._get_dimensions(image_path)
         if max_width:
             if inclusive:
                 if max_width < width:
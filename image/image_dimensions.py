@@ -0,0 +1,414 @@
+import atexit
+import os
+import pickle
+import struct
+import threading
+import time
+import warnings
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from utils.config import config
+from utils.logging_setup import get_logger
+from utils.pillow_plugins import ensure_pillow_plugins_registered
+
+logger = get_logger("image_dimensions")
+
+# Result stored for files whose dimensions could not be read by any means
+_UNREADABLE = (0, 0)
+
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_ISOBMFF_BRANDS = frozenset([b"avif", b"avis", b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1"])
+# Largest box read into memory while looking for the item properties
+_MAX_META_BOX_SIZE = 1 << 24
+
+
+def _read_png(f, head: bytes) -> Optional[Tuple[int, int]]:
+    if head[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", head[16:24])
+
+
+def _read_gif(f, head: bytes) -> Optional[Tuple[int, int]]:
+    # Logical screen size, as reported by PIL
+    return struct.unpack("<HH", head[6:10])
+
+
+def _read_bmp(f, head: bytes) -> Optional[Tuple[int, int]]:
+    header_size = struct.unpack("<I", head[14:18])[0]
+    if header_size == 12:
+        return struct.unpack("<HH", head[18:22])
+    width, height = struct.unpack("<ii", head[18:26])
+    return width, abs(height)
+
+
+def _read_webp(f, head: bytes) -> Optional[Tuple[int, int]]:
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        if head[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        if head[20] != 0x2F:
+            return None
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+
+def _read_jpeg(f, head: bytes) -> Optional[Tuple[int, int]]:
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xFF":
+            byte = f.read(1)
+        while byte == b"\xFF":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0xD9 or marker == 0xDA:
+            # End of image or start of scan before any frame header
+            return None
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Markers without a length
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            frame_header = f.read(5)
+            if len(frame_header) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame_header[1:5])
+            return (width, height) if height > 0 else None
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _read_tiff(f, head: bytes) -> Optional[Tuple[int, int]]:
+    endian = "<" if head[:2] == b"II" else ">"
+    if struct.unpack(endian + "H", head[2:4])[0] != 42:
+        # BigTIFF and other variants are left to PIL
+        return None
+    f.seek(struct.unpack(endian + "I", head[4:8])[0])
+    n_entries_bytes = f.read(2)
+    if len(n_entries_bytes) < 2:
+        return None
+    n_entries = struct.unpack(endian + "H", n_entries_bytes)[0]
+    entries = f.read(12 * n_entries)
+    width = height = None
+    for start in range(0, len(entries) - 11, 12):
+        tag, value_type = struct.unpack(endian + "HH", entries[start:start + 4])
+        if tag not in (256, 257):
+            continue
+        if value_type == 3:
+            value = struct.unpack(endian + "H", entries[start + 8:start + 10])[0]
+        elif value_type == 4:
+            value = struct.unpack(endian + "I", entries[start + 8:start + 12])[0]
+        else:
+            return None
+        if tag == 256:
+            width = value
+        else:
+            height = value
+    return (width, height) if width and height else None
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None):
+    """
+    Yield (type, payload start, payload end) of the ISO base media boxes in data.
+    """
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[start:start + 8])
+        header_size = 8
+        if size == 1:
+            if start + 16 > end:
+                return
+            size = struct.unpack(">Q", data[start + 8:start + 16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - start
+        if size < header_size or start + size > end:
+            return
+        yield box_type, start + header_size, start + size
+        start += size
+
+
+def _read_meta_box(f) -> Optional[bytes]:
+    f.seek(0)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            return None
+        if size < header_size:
+            return None
+        if box_type == b"meta":
+            if size > _MAX_META_BOX_SIZE:
+                return None
+            data = f.read(size - header_size)
+            return data if len(data) == size - header_size else None
+        f.seek(size - header_size, os.SEEK_CUR)
+
+
+def _read_heif(f, head: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Size of the primary item of an AVIF or HEIF file from its image spatial
+    extents property. Files rotating or mirroring the primary item are left to
+    PIL, since whether the transform is applied depends on the decoder.
+    """
+    meta = _read_meta_box(f)
+    if meta is None:
+        return None
+    # The meta box is a full box, skip its version and flags
+    boxes = {box_type: (start, end) for box_type, start, end in _iter_boxes(meta, 4)}
+    if b"pitm" not in boxes or b"iprp" not in boxes:
+        return None
+    start, _ = boxes[b"pitm"]
+    version = meta[start]
+    primary_id = struct.unpack(">H" if version == 0 else ">I", meta[start + 4:start + (6 if version == 0 else 8)])[0]
+
+    properties = []
+    associations = {}
+    for box_type, start, end in _iter_boxes(meta, *boxes[b"iprp"]):
+        if box_type == b"ipco":
+            properties = [(property_type, property_start)
+                          for property_type, property_start, _ in _iter_boxes(meta, start, end)]
+        elif box_type == b"ipma":
+            version, flags = meta[start], int.from_bytes(meta[start + 1:start + 4], "big")
+            entry_count = struct.unpack(">I", meta[start + 4:start + 8])[0]
+            position = start + 8
+            for _ in range(entry_count):
+                if version == 0:
+                    item_id = struct.unpack(">H", meta[position:position + 2])[0]
+                    position += 2
+                else:
+                    item_id = struct.unpack(">I", meta[position:position + 4])[0]
+                    position += 4
+                n_associations = meta[position]
+                position += 1
+                indexes = []
+                for _ in range(n_associations):
+                    if flags & 1:
+                        indexes.append(struct.unpack(">H", meta[position:position + 2])[0] & 0x7FFF)
+                        position += 2
+                    else:
+                        indexes.append(meta[position] & 0x7F)
+                        position += 1
+                associations[item_id] = indexes
+
+    size = None
+    for index in associations.get(primary_id, []):
+        if index == 0 or index > len(properties):
+            continue
+        property_type, property_start = properties[index - 1]
+        if property_type in (b"irot", b"imir"):
+            return None
+        if property_type == b"ispe":
+            # Skip the version and flags of the full box
+            size = struct.unpack(">II", meta[property_start + 4:property_start + 12])
+    return size
+
+
+def read_header_dimensions(path: str) -> Optional[Tuple[int, int]]:
+    """
+    Read the dimensions of an image from its header without decoding it.
+
+    Supports PNG, JPEG, GIF, WebP, BMP, TIFF, AVIF and HEIF files, identified by
+    their signatures rather than their extensions.
+
+    Returns:
+        (width, height) tuple, or None if the format is not supported or the
+        header could not be parsed.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(32)
+            if len(head) < 26:
+                return None
+            if head.startswith(b"\x89PNG\r\n\x1a\n"):
+                reader = _read_png
+            elif head.startswith(b"\xFF\xD8"):
+                reader = _read_jpeg
+            elif head[:6] in (b"GIF87a", b"GIF89a"):
+                reader = _read_gif
+            elif head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                reader = _read_webp
+            elif head[:2] == b"BM":
+                reader = _read_bmp
+            elif head[:4] in (b"II*\x00", b"MM\x00*"):
+                reader = _read_tiff
+            elif head[4:8] == b"ftyp" and (head[8:12] in _ISOBMFF_BRANDS or head[16:20] in _ISOBMFF_BRANDS):
+                reader = _read_heif
+            else:
+                return None
+            dimensions = reader(f, head)
+    except (OSError, struct.error, IndexError, ValueError) as e:
+        logger.debug(f"Failed to read image header of {path}: {e}")
+        return None
+    if dimensions is None or dimensions[0] <= 0 or dimensions[1] <= 0:
+        return None
+    return int(dimensions[0]), int(dimensions[1])
+
+
+def _open_dimensions(path: str) -> Optional[Tuple[int, int]]:
+    ensure_pillow_plugins_registered()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            with Image.open(path) as img:
+                return img.size
+    except Exception:
+        return None
+
+
+def _frame_dimensions(path: str) -> Optional[Tuple[int, int]]:
+    from image.frame_cache import FrameCache
+    try:
+        image_path = FrameCache.get_image_path(path)
+    except Exception as e:
+        logger.debug(f"Failed to get image frame for {path}: {e}")
+        return None
+    if image_path == path:
+        return None
+    return read_header_dimensions(image_path) or _open_dimensions(image_path)
+
+
+class ImageDimensions:
+    """
+    Shared service reading image dimensions from file headers, falling back to
+    PIL for formats without a header parser.
+
+    Results are memoized by path and validated against the modification time
+    and size of the file, so that unchanged files are never opened again. The
+    memo is persisted to "<cache dir>/image_dimensions.pkl", written at most
+    every FLUSH_INTERVAL_SECONDS while new dimensions are read and on exit.
+    """
+    FILE_NAME = "image_dimensions.pkl"
+    FLUSH_INTERVAL_SECONDS = 30
+
+    def __init__(self, cache_path: Optional[str] = None):
+        self.cache_path = cache_path
+        self._lock = threading.RLock()
+        self._entries: Optional[Dict[str, Tuple[int, int, Optional[Tuple[int, int]]]]] = None
+        self._changed = {}
+        self._cache_stat = None
+        self._last_flush = time.monotonic()
+        self._exit_registered = False
+
+    @staticmethod
+    def default_cache_path() -> str:
+        root = os.environ.get("WEIDR_CACHE_DIR") or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return os.path.join(root, ImageDimensions.FILE_NAME)
+
+    def _get_cache_path(self) -> str:
+        return self.cache_path or ImageDimensions.default_cache_path()
+
+    def _stat_cache(self):
+        try:
+            stat = os.stat(self._get_cache_path())
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _read_cache(self) -> Dict:
+        try:
+            with open(self._get_cache_path(), "rb") as f:
+                entries = pickle.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError) as e:
+            logger.warning(f"Ignoring invalid image dimensions cache {self._get_cache_path()}: {e}")
+            return {}
+
+    def _ensure_loaded(self) -> Dict:
+        if self._entries is None:
+            self._cache_stat = self._stat_cache()
+            self._entries = self._read_cache()
+            if not self._exit_registered:
+                atexit.register(self.flush)
+                self._exit_registered = True
+        return self._entries
+
+    def get_dimensions(self, path: str, extract_frame: bool = False) -> Optional[Tuple[int, int]]:
+        """
+        Get the dimensions of an image file.
+
+        Args:
+            path: Path to the media file
+            extract_frame: If the file is not an image readable by PIL, read the
+                dimensions of its first frame extracted by FrameCache, as for
+                videos, PDFs and SVGs.
+
+        Returns:
+            (width, height) tuple, or None if the dimensions could not be read.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._ensure_loaded().get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            dimensions = entry[2]
+            if dimensions is not None or not extract_frame:
+                return None if dimensions == _UNREADABLE else dimensions
+        else:
+            dimensions = read_header_dimensions(path) or _open_dimensions(path)
+        if dimensions is None and extract_frame:
+            dimensions = _frame_dimensions(path) or _UNREADABLE
+        with self._lock:
+            entry = (stat.st_mtime_ns, stat.st_size, dimensions)
+            self._entries[path] = entry
+            self._changed[path] = entry
+            if time.monotonic() - self._last_flush > ImageDimensions.FLUSH_INTERVAL_SECONDS:
+                self.flush()
+        return None if dimensions == _UNREADABLE else dimensions
+
+    def flush(self) -> None:
+        """
+        Write newly read dimensions to the cache file, keeping those written by
+        other processes since it was loaded and dropping the oldest entries if
+        the cache is over config.image_dimensions_cache_max_entries.
+        """
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if len(self._changed) == 0:
+                return
+            if self._stat_cache() != self._cache_stat:
+                self._entries = self._read_cache()
+            # Reinsert changed entries so that the least recently read are dropped first
+            for path, entry in self._changed.items():
+                self._entries.pop(path, None)
+                self._entries[path] = entry
+            n_excess = len(self._entries) - config.image_dimensions_cache_max_entries
+            if config.image_dimensions_cache_max_entries > 0 and n_excess > 0:
+                for path in list(self._entries)[:n_excess]:
+                    del self._entries[path]
+            cache_path = self._get_cache_path()
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                with open(cache_path + ".tmp", "wb") as f:
+                    pickle.dump(self._entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(cache_path + ".tmp", cache_path)
+            except OSError as e:
+                logger.error(f"Failed to store image dimensions cache {cache_path}: {e}")
+                return
+            self._cache_stat = self._stat_cache()
+            self._changed = {}
+
+
+image_dimensions = ImageDimensions()
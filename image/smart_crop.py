@@ -2,8 +2,6 @@ import os
 import sys
 from typing import Tuple, Union, Dict, List
 import numpy as np
-from scipy import ndimage
-from sklearn.cluster import KMeans
 from PIL import ImageChops
 from PIL import Image
 from PIL.Image import Image as PilImage
@@ -20,6 +18,9 @@ def detect_edges_sobel(im: PilImage) -> PilImage:
     Use Sobel edge detection to identify potential division lines.
     This would help catch gradient borders and more subtle divisions.
     """
+    # Imported here so that opening the app does not load scipy
+    from scipy import ndimage
+
     # Convert to grayscale
     gray = im.convert('L')
     gray_array = np.array(gray)
@@ -62,6 +63,7 @@ def analyze_color_clusters(im: PilImage) -> np.ndarray:
     pixels = img_array.reshape(-1, 3)
     
     # Perform clustering
+    from sklearn.cluster import KMeans
     kmeans = KMeans(n_clusters=5, random_state=42)
     kmeans.fit(pixels)
     
@@ -0,0 +1,125 @@
+"""
+Benchmark IVF ANN index recall and speed against exact embedding search.
+
+No UI. Generates N synthetic clustered unit embeddings, builds the IVF index
+used for large embedding caches, then reports for each n_probe:
+  - recall@k of search against exact top-k by inner product, and query time
+  - recall of the grouping pairs above a similarity threshold (range_pairs)
+    against exact pairs, and the time to find them
+
+Usage (from repository root):
+  python tests/benchmark_ann_index.py
+  python tests/benchmark_ann_index.py --n 500000 --dim 512 --probes 8 16 32 64
+  python tests/benchmark_ann_index.py --pq 64
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+import numpy as np  # noqa: E402
+
+from compare.ann_index import IVFIndex  # noqa: E402
+
+
+def _embeddings(n, dim, n_clusters, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, n_clusters, n)]
+    embeddings += 1.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    # Near-duplicates spread through the set so that the grouping threshold has pairs to find
+    n_dupes = n // 50
+    sources = rng.choice(n, n_dupes, replace=False)
+    targets = rng.choice(n, n_dupes, replace=False)
+    embeddings[targets] = embeddings[sources] + 0.01 * rng.standard_normal((n_dupes, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+def _exact_top_k(embeddings, queries, k):
+    sims = queries @ embeddings.T
+    top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    return top
+
+
+def _exact_pairs(embeddings, threshold, block=2048):
+    pairs = set()
+    for start in range(0, len(embeddings), block):
+        sims = embeddings[start:start + block] @ embeddings.T
+        rows, cols = np.nonzero(sims > threshold)
+        rows += start
+        keep = rows < cols
+        pairs.update(zip(rows[keep].tolist(), cols[keep].tolist()))
+    return pairs
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="Number of embeddings")
+    parser.add_argument("--dim", type=int, default=512, help="Embedding dimension")
+    parser.add_argument("--clusters", type=int, default=1000, help="Number of synthetic clusters")
+    parser.add_argument("--queries", type=int, default=200, help="Number of search queries")
+    parser.add_argument("--k", type=int, default=50, help="Neighbours per query")
+    parser.add_argument("--probes", type=int, nargs="+", default=[8, 16, 32, 64], help="n_probe values to test")
+    parser.add_argument("--pq", type=int, default=0, help="PQ subspaces (0 to disable)")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Grouping similarity threshold")
+    parser.add_argument("--pairs-n", type=int, default=20000, help="Embeddings used for the grouping pair recall (0 to skip)")
+    args = parser.parse_args(argv)
+
+    embeddings = _embeddings(args.n, args.dim, args.clusters)
+    queries = embeddings[np.random.default_rng(1).choice(args.n, args.queries, replace=False)]
+
+    start = time.perf_counter()
+    index = IVFIndex(IVFIndex.n_lists_for(args.n), pq_subspaces=args.pq)
+    index.train(embeddings)
+    train_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    index.add(embeddings, np.arange(args.n))
+    add_seconds = time.perf_counter() - start
+    print(f"{args.n} x {args.dim}, {index.n_lists} lists, PQ subspaces {args.pq}: "
+          f"train {train_seconds:.2f}s, add {add_seconds:.2f}s")
+
+    start = time.perf_counter()
+    exact = _exact_top_k(embeddings, queries, args.k)
+    exact_ms = (time.perf_counter() - start) * 1000 / args.queries
+    print(f"exact search: {exact_ms:.2f} ms/query")
+    print(f"{'n_probe':>8}  {'recall@' + str(args.k):>10}  {'ms/query':>9}")
+    for n_probe in args.probes:
+        start = time.perf_counter()
+        ids, _ = index.search(queries, args.k, embeddings, n_probe=n_probe)
+        ms = (time.perf_counter() - start) * 1000 / args.queries
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(ids.tolist(), exact.tolist())])
+        print(f"{n_probe:>8}  {recall:>10.3f}  {ms:>9.2f}")
+
+    if args.pairs_n > 0:
+        subset = embeddings[:args.pairs_n]
+        pair_index = IVFIndex(IVFIndex.n_lists_for(len(subset)), pq_subspaces=args.pq)
+        pair_index.train(subset)
+        pair_index.add(subset, np.arange(len(subset)))
+        start = time.perf_counter()
+        expected = _exact_pairs(subset, args.threshold)
+        exact_seconds = time.perf_counter() - start
+        print(f"\ngrouping pairs above {args.threshold} in {len(subset)} embeddings: "
+              f"{len(expected)} exact pairs in {exact_seconds:.2f}s")
+        print(f"{'n_probe':>8}  {'recall':>10}  {'seconds':>9}")
+        for n_probe in args.probes:
+            start = time.perf_counter()
+            found = set()
+            for _, pairs_i, pairs_j, _ in pair_index.range_pairs(subset, args.threshold, n_probe=n_probe):
+                found.update(zip(pairs_i.tolist(), pairs_j.tolist()))
+            seconds = time.perf_counter() - start
+            recall = len(found & expected) / max(1, len(expected))
+            print(f"{n_probe:>8}  {recall:>10.3f}  {seconds:>9.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Benchmark embedding cache load time and memory: legacy pickle vs memory-mapped store.
+
+No UI. Writes a synthetic cache of N embeddings in both formats to a temporary
+directory, then loads each format in a fresh subprocess and reports the load
+time, the time to read every row, and the resident set size afterwards.
+
+Usage (from repository root):
+  python tests/benchmark_compare_data_load.py
+  python tests/benchmark_compare_data_load.py --n 300000 --dim 768
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+import numpy as np  # noqa: E402
+import psutil  # noqa: E402
+
+from compare.feature_store import FeatureStore  # noqa: E402
+
+
+def _write_caches(directory, n, dim):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((n, dim)).astype(np.float32)
+    paths = [os.path.join(directory, f"image_{i:07d}.png") for i in range(n)]
+    # Legacy format: dict of path -> list of floats
+    with open(os.path.join(directory, "image_embeddings.pkl"), "wb") as f:
+        pickle.dump({p: e.tolist() for p, e in zip(paths, embeddings)}, f)
+    store = FeatureStore(os.path.join(directory, "image_embeddings"))
+    store.clear()
+    for p, e in zip(paths, embeddings):
+        store[p] = e
+    store.flush()
+    return paths
+
+
+def _measure(kind, directory):
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    start = time.perf_counter()
+    if kind == "pickle":
+        with open(os.path.join(directory, "image_embeddings.pkl"), "rb") as f:
+            data = pickle.load(f)
+    else:
+        data = FeatureStore(os.path.join(directory, "image_embeddings"), validate_mtimes=False)
+        data.open()
+    load_seconds = time.perf_counter() - start
+    rss_loaded = process.memory_info().rss
+
+    start = time.perf_counter()
+    total = 0.0
+    for path in data:
+        total += float(data[path][0])
+    read_seconds = time.perf_counter() - start
+    rss_read = process.memory_info().rss
+    mb = 1024 * 1024
+    print(f"{kind:>8}  {load_seconds:>9.3f}  {read_seconds:>9.3f}  "
+          f"{(rss_loaded - rss_before) / mb:>12.1f}  {(rss_read - rss_before) / mb:>12.1f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="Number of cached embeddings")
+    parser.add_argument("--dim", type=int, default=512, help="Embedding dimension")
+    parser.add_argument("--measure", choices=("pickle", "store"), help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        _measure(args.measure, args.dir)
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="weidr_bench_") as directory:
+        print(f"Writing {args.n} x {args.dim} embeddings...")
+        _write_caches(directory, args.n, args.dim)
+        for name in ("image_embeddings.pkl", "image_embeddings.npy", "image_embeddings.index.pkl"):
+            size_mb = os.path.getsize(os.path.join(directory, name)) / (1024 * 1024)
+            print(f"  {name}: {size_mb:.1f} MB")
+        print(f"{'format':>8}  {'load (s)':>9}  {'read (s)':>9}  {'RSS load MB':>12}  {'RSS read MB':>12}")
+        for kind in ("pickle", "store"):
+            # Fresh interpreter per format so RSS is not shared between runs
+            subprocess.run([sys.executable, __file__, "--measure", kind, "--dir", directory], check=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Benchmark batched image embedding throughput for the embedding compare modes.
+
+No UI. Gathers images from a directory and embeds the same sample with each
+requested batch size, reporting images/sec so the per-call overhead of the
+single image path can be compared against batched forward passes.
+
+Usage (from repository root):
+  python tests/benchmark_embedding_batch.py ./folder
+  python tests/benchmark_embedding_batch.py ./folder --model siglip --batch-sizes 1 8 32 --limit 200
+  python tests/benchmark_embedding_batch.py ./folder --model laion --recursive
+
+The first batch size is preceded by a warmup call so that model loading is not
+counted against it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+from compare.base_compare import gather_files  # noqa: E402
+from compare import model  # noqa: E402
+
+_MODELS = ("clip", "siglip", "flava", "align", "xvlm", "laion")
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directory of images to embed")
+    parser.add_argument("--model", choices=_MODELS, default="clip")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--limit", type=int, default=256, help="Maximum number of images to embed per run")
+    parser.add_argument("--recursive", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    files = sorted(gather_files(args.directory, recursive=args.recursive,
+                                include_videos=False, include_gifs=False, include_pdfs=False))
+    files = files[:args.limit]
+    if not files:
+        print(f"No images found in {args.directory}")
+        return 1
+
+    batch_func = getattr(model, f"image_embeddings_{args.model}_batch")
+    print(f"Model: {args.model}  device: {model.device}  images: {len(files)}")
+
+    # Warmup: load the model and processor outside of the timed runs
+    batch_func(files[:1], 1)
+
+    print(f"{'batch size':>10}  {'seconds':>10}  {'images/sec':>10}  {'failed':>6}")
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        embeddings = batch_func(files, batch_size)
+        elapsed = time.perf_counter() - start
+        n_failed = sum(1 for embedding in embeddings if embedding is None)
+        n_embedded = len(embeddings) - n_failed
+        rate = n_embedded / elapsed if elapsed > 0 else float("inf")
+        print(f"{batch_size:>10}  {elapsed:>10.2f}  {rate:>10.1f}  {n_failed:>6}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
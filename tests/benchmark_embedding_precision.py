@@ -0,0 +1,100 @@
+"""
+Evaluate reduced precision embedding storage against float32 on your own data.
+
+No UI. Loads the cached embeddings of a directory (or generates synthetic
+clustered embeddings if no directory is given), then reports for float16 and
+int8 embeddings:
+  - memory per embedding
+  - recall and precision of the grouping pairs above the similarity threshold,
+    and the number of files whose group members change
+  - recall@k of search against float32 top-k results
+  - the largest similarity error
+
+Run the comparison once with embedding_precision set to float32 so that the
+cached embeddings are float32 - a float16 cache is used as the reference as is.
+
+Usage (from repository root):
+  python tests/benchmark_embedding_precision.py --dir /path/to/images
+  python tests/benchmark_embedding_precision.py --dir /path/to/images --mode SIGLIP_EMBEDDING --threshold 0.85
+  python tests/benchmark_embedding_precision.py --n 50000 --dim 1024
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(_REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(_REPO_ROOT))
+
+import numpy as np  # noqa: E402
+
+from compare.compare_data import CompareData  # noqa: E402
+from compare.embedding_precision import evaluate_precision  # noqa: E402
+from compare.feature_store import FeatureStore  # noqa: E402
+from utils.constants import CompareMode, EmbeddingPrecision  # noqa: E402
+
+
+def _embeddings(n, dim, n_clusters, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, n_clusters, n)]
+    embeddings += 1.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    n_dupes = n // 50
+    sources = rng.choice(n, n_dupes, replace=False)
+    targets = rng.choice(n, n_dupes, replace=False)
+    embeddings[targets] = embeddings[sources] + 0.01 * rng.standard_normal((n_dupes, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+def _stored_embeddings(base_dir, mode):
+    compare_data = CompareData(base_dir=base_dir, mode=mode)
+    if not compare_data.uses_feature_store() or not FeatureStore.exists_at(compare_data._feature_store_base):
+        raise SystemExit(f"No cached embeddings found for {mode.name} in {base_dir}")
+    store = FeatureStore(compare_data._feature_store_base)
+    store.open()
+    rows = store.rows_for(store.keys())
+    if store.dtype != np.float32:
+        print(f"Cached embeddings are {store.dtype}, results are relative to {store.dtype} not float32")
+    return np.asarray(store.matrix[np.sort(rows)], dtype=np.float32)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=None, help="Directory with cached embeddings")
+    parser.add_argument("--mode", default=CompareMode.CLIP_EMBEDDING.name, help="Embedding compare mode of the cache")
+    parser.add_argument("--n", type=int, default=20000, help="Number of synthetic embeddings")
+    parser.add_argument("--dim", type=int, default=512, help="Synthetic embedding dimension")
+    parser.add_argument("--clusters", type=int, default=500, help="Number of synthetic clusters")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Grouping similarity threshold")
+    parser.add_argument("--k", type=int, default=50, help="Search results per query")
+    parser.add_argument("--queries", type=int, default=200, help="Number of search queries")
+    parser.add_argument("--max-files", type=int, default=20000, help="Embeddings sampled for the evaluation")
+    args = parser.parse_args(argv)
+
+    if args.dir is not None:
+        embeddings = _stored_embeddings(args.dir, CompareMode.get(args.mode))
+    else:
+        embeddings = _embeddings(args.n, args.dim, args.clusters)
+    print(f"{len(embeddings)} x {embeddings.shape[1]} embeddings, threshold {args.threshold}")
+
+    print(f"{'precision':>9}  {'bytes':>6}  {'pair recall':>11}  {'pair prec':>9}  {'regrouped':>9}  "
+          f"{'recall@' + str(args.k):>9}  {'max error':>9}  {'seconds':>7}")
+    for precision in (EmbeddingPrecision.FLOAT16, EmbeddingPrecision.INT8):
+        start = time.perf_counter()
+        report = evaluate_precision(embeddings, precision, args.threshold, k=args.k,
+                                    n_queries=args.queries, max_files=args.max_files)
+        seconds = time.perf_counter() - start
+        print(f"{report['precision']:>9}  {report['bytes_per_embedding']:>6.0f}  {report['pair_recall']:>11.4f}  "
+              f"{report['pair_precision']:>9.4f}  {report['files_regrouped']:>9}  {report['top_k_recall']:>9.4f}  "
+              f"{report['max_similarity_error']:>9.5f}  {seconds:>7.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
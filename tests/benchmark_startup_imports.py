@@ -0,0 +1,132 @@
+"""
+Benchmark app startup import time against a budget.
+
+No UI is shown. Imports the modules loaded when app_qt.py starts in a fresh
+interpreter with `python -X importtime`, reports the total import time and the
+slowest imports, and fails if the time is over budget or if a heavy ML library
+(torch, transformers, sklearn...) was imported. These libraries should only be
+loaded once a compare, prevalidation or classifier runs.
+
+If PySide6 is installed the app window module is imported as app_qt.py does,
+otherwise the non-Qt modules it imports on startup are measured.
+
+Usage (from repository root):
+  python tests/benchmark_startup_imports.py
+  python tests/benchmark_startup_imports.py --budget-ms 3000 --top 30
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+
+# Imported on startup when PySide6 is available
+APP_MODULES = ["ui.app_window.app_window"]
+
+# Non-Qt modules imported by the app window and its controllers on startup
+STARTUP_MODULES = [
+    "compare.compare_manager",
+    "compare.classifier_actions_manager",
+    "compare.lookahead",
+    "files.file_browser",
+    "files.marked_files",
+    "image.image_classifier_manager",
+    "image.image_data_extractor",
+    "image.image_ops",
+    "image.smart_crop",
+]
+
+# Libraries which take seconds to import and must not be loaded on startup
+HEAVY_MODULES = ["torch", "clip", "transformers", "sklearn", "skimage", "matplotlib",
+                 "scipy", "tensorflow", "keras"]
+
+DEFAULT_BUDGET_MS = 3000
+
+# Prefixes the heavy modules printed by the measured interpreter, which may
+# print other messages while importing
+_HEAVY_MARKER = "heavy modules: "
+
+
+def _has_pyside6() -> bool:
+    result = subprocess.run([sys.executable, "-c", "import PySide6"], capture_output=True)
+    return result.returncode == 0
+
+
+def _startup_env(directory: str) -> dict:
+    env = os.environ.copy()
+    env["PYTHONPATH"] = str(_REPO_ROOT) + os.pathsep + env.get("PYTHONPATH", "")
+    # Keep the measured run from writing to the user's cache and configs
+    env.setdefault("WEIDR_CACHE_DIR", os.path.join(directory, "cache"))
+    env.setdefault("WEIDR_CONFIGS_DIR", os.path.join(directory, "configs"))
+    os.makedirs(env["WEIDR_CACHE_DIR"], exist_ok=True)
+    os.makedirs(env["WEIDR_CONFIGS_DIR"], exist_ok=True)
+    return env
+
+
+def measure_imports(modules: list[str]) -> tuple[dict[str, int], list[str]]:
+    """
+    Import modules in a fresh interpreter with -X importtime.
+
+    Returns:
+        Cumulative import time in microseconds of each top level import, and
+        the heavy modules that were loaded
+    """
+    code = "\n".join([f"import {module}" for module in modules] + [
+        "import sys",
+        f"print('{_HEAVY_MARKER}' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))",
+    ])
+    with tempfile.TemporaryDirectory(prefix="weidr_startup_") as directory:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=str(_REPO_ROOT),
+                                env=_startup_env(directory), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import startup modules:\n{result.stderr[-2000:]}")
+    heavy_line = [line for line in result.stdout.splitlines() if line.startswith(_HEAVY_MARKER)][-1]
+    heavy_loaded = [m for m in heavy_line[len(_HEAVY_MARKER):].split(",") if m]
+    cumulative_us = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            # Header line
+            continue
+        # Nested imports are indented further than top level imports
+        if not name.startswith("  "):
+            cumulative_us[name.strip()] = int(cumulative)
+    return cumulative_us, heavy_loaded
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=int, default=DEFAULT_BUDGET_MS, help="Maximum total import time")
+    parser.add_argument("--top", type=int, default=20, help="Number of slowest imports to list")
+    parser.add_argument("--no-qt", action="store_true", help="Measure the non-Qt startup modules only")
+    args = parser.parse_args(argv)
+
+    modules = STARTUP_MODULES if args.no_qt or not _has_pyside6() else APP_MODULES + STARTUP_MODULES
+    cumulative_us, heavy_loaded = measure_imports(modules)
+    total_ms = sum(cumulative_us.values()) / 1000
+    print(f"Imported {', '.join(modules)}")
+    print(f"{'import':<60}  {'ms':>8}")
+    for name, us in sorted(cumulative_us.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<60}  {us / 1000:>8.1f}")
+    print(f"Total {total_ms:.1f} ms, budget {args.budget_ms} ms")
+
+    failed = False
+    if heavy_loaded:
+        print(f"FAIL: heavy modules imported on startup: {', '.join(heavy_loaded)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL: startup imports took {total_ms:.1f} ms, over the budget of {args.budget_ms} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Tests for compare/ann_index.py and the CompareData integration.
+
+Covers:
+  - recall of IVF search against exact search, with and without PQ codes
+  - range pairs against brute force pairs above a threshold
+  - incremental add, remap and save / load round-trip (uses tmp_path)
+  - index build, reuse and rebuild next to the feature store
+  - embedding grouping from the index is opt in and resumes from list checkpoints (requires torch)
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from compare.ann_index import IVFIndex
+from compare.compare_args import CompareArgs
+from compare.compare_data import CompareData
+from utils.config import config
+from utils.constants import CompareMode
+
+
+def _clustered(n, d, n_clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, d))
+    vectors = centers[rng.integers(0, n_clusters, n)] + 0.3 * rng.standard_normal((n, d))
+    vectors = vectors.astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _build(vectors, n_lists=16, pq_subspaces=0):
+    index = IVFIndex(n_lists, pq_subspaces=pq_subspaces)
+    index.train(vectors)
+    index.add(vectors, np.arange(len(vectors)))
+    return index
+
+
+def _recall(index, vectors, queries, k, n_probe):
+    ids, _ = index.search(queries, k, vectors, n_probe=n_probe)
+    exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    return np.mean([len(set(a) & set(b)) / k for a, b in zip(ids.tolist(), exact.tolist())])
+
+
+class TestSearch:
+    def test_recall(self):
+        vectors = _clustered(2000, 32)
+        index = _build(vectors)
+        assert _recall(index, vectors, vectors[:50], 10, n_probe=4) > 0.9
+
+    def test_all_lists_probed_is_exact(self):
+        vectors = _clustered(500, 16)
+        index = _build(vectors, n_lists=8)
+        assert _recall(index, vectors, vectors[:20], 10, n_probe=8) == 1.0
+
+    def test_scores_descending(self):
+        vectors = _clustered(300, 16)
+        index = _build(vectors, n_lists=4)
+        ids, scores = index.search(vectors[:3], 5, vectors, n_probe=4)
+        assert np.all(np.diff(scores, axis=1) <= 0)
+        np.testing.assert_allclose(scores, np.take_along_axis(vectors[:3] @ vectors.T, ids, axis=1), rtol=1e-5)
+
+    def test_padding_when_fewer_than_k(self):
+        vectors = _clustered(5, 8)
+        index = _build(vectors, n_lists=1)
+        ids, scores = index.search(vectors[:1], 10, vectors, n_probe=1)
+        assert (ids[0, 5:] == -1).all()
+        assert np.isneginf(scores[0, 5:]).all()
+
+    def test_product_quantized_recall(self):
+        vectors = _clustered(3000, 32)
+        index = _build(vectors, pq_subspaces=16)
+        assert _recall(index, vectors, vectors[:50], 10, n_probe=4) > 0.85
+
+    def test_pq_requires_divisible_dimension(self):
+        with pytest.raises(ValueError):
+            IVFIndex(4, pq_subspaces=3).train(_clustered(100, 16))
+
+
+class TestRangePairs:
+    def test_matches_brute_force_when_all_lists_probed(self):
+        vectors = _clustered(300, 16)
+        index = _build(vectors, n_lists=6)
+        sims = vectors @ vectors.T
+        expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(sims > 0.9, k=1)))}
+        found = set()
+        for _, pairs_i, pairs_j, similarities in index.range_pairs(vectors, 0.9, n_probe=6):
+            assert (pairs_i < pairs_j).all()
+            assert (similarities > 0.9).all()
+            found.update(zip(pairs_i.tolist(), pairs_j.tolist()))
+        assert found == expected
+
+    def test_resume_from_list(self):
+        vectors = _clustered(300, 16)
+        index = _build(vectors, n_lists=6)
+        full = list(index.range_pairs(vectors, 0.8, n_probe=2))
+        resumed = list(index.range_pairs(vectors, 0.8, n_probe=2, start_list=4))
+        assert [lists_done for lists_done, _, _, _ in resumed] == [5, 6]
+        for (_, *expected), (_, *result) in zip(full[4:], resumed):
+            for expected_array, result_array in zip(expected, result):
+                np.testing.assert_array_equal(result_array, expected_array)
+
+    def test_face_filter(self):
+        vectors = _clustered(200, 16)
+        faces = np.arange(200) % 2
+        index = _build(vectors, n_lists=4)
+        for _, pairs_i, pairs_j, _ in index.range_pairs(vectors, 0.5, n_probe=4, faces=faces):
+            assert (faces[pairs_i] == faces[pairs_j]).all()
+
+
+class TestUpdates:
+    def test_incremental_add_matches_bulk(self):
+        vectors = _clustered(600, 16)
+        bulk = _build(vectors, n_lists=8)
+        incremental = IVFIndex(8)
+        incremental.train(vectors)
+        incremental.add(vectors[:400], np.arange(400))
+        incremental.add(vectors[400:], np.arange(400, 600))
+        assert incremental.n_indexed == 600
+        ids_bulk, _ = bulk.search(vectors[:10], 5, vectors, n_probe=3)
+        ids_incremental, _ = incremental.search(vectors[:10], 5, vectors, n_probe=3)
+        np.testing.assert_array_equal(ids_bulk, ids_incremental)
+
+    def test_remap_drops_and_renumbers(self):
+        vectors = _clustered(100, 8)
+        index = _build(vectors, n_lists=4)
+        id_map = np.full(100, -1)
+        id_map[50:] = np.arange(50)
+        remapped = index.remap(id_map)
+        assert len(remapped) == 50
+        ids, _ = remapped.search(vectors[60:61], 1, vectors[50:], n_probe=4)
+        assert ids[0, 0] == 10
+
+    def test_save_and_load(self, tmp_path):
+        vectors = _clustered(400, 16)
+        index = _build(vectors, n_lists=8, pq_subspaces=4)
+        index.generation = "abc"
+        path = IVFIndex.path_for(str(tmp_path / "image_embeddings"))
+        index.save(path)
+        loaded = IVFIndex.load(path)
+        assert loaded.generation == "abc"
+        assert loaded.n_indexed == 400
+        np.testing.assert_array_equal(loaded.search(vectors[:5], 5, vectors, n_probe=2)[0],
+                                      index.search(vectors[:5], 5, vectors, n_probe=2)[0])
+
+
+class TestCompareDataIndex:
+    def _save(self, tmp_path, vectors):
+        data = CompareData(base_dir=str(tmp_path), mode=CompareMode.CLIP_EMBEDDING)
+        data.load_data()
+        for i, vector in enumerate(vectors):
+            path = str(tmp_path / f"{i}.png")
+            data.file_data_dict[path] = vector
+            data.files_found.append(path)
+        data.has_new_file_data = True
+        data.save_data()
+        return data
+
+    def test_index_built_above_min_files(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config, "embedding_ann_min_files", 100)
+        data = self._save(tmp_path, _clustered(300, 16))
+        assert data.ann_index is not None
+        assert len(data.ann_index) == 300
+        assert (tmp_path / ("image_embeddings" + IVFIndex.INDEX_EXT)).exists()
+
+    def test_no_index_below_min_files(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config, "embedding_ann_min_files", 1000)
+        data = self._save(tmp_path, _clustered(300, 16))
+        assert data.ann_index is None
+
+    def test_index_ids_follow_files_found(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config, "embedding_ann_min_files", 100)
+        vectors = _clustered(300, 16)
+        self._save(tmp_path, vectors)
+
+        # Reload with a subset of the files in a different order
+        data = CompareData(base_dir=str(tmp_path), mode=CompareMode.CLIP_EMBEDDING)
+        data.load_data()
+        order = np.arange(299, 99, -1)
+        data.files_found = [str(tmp_path / f"{i}.png") for i in order.tolist()]
+        data.save_data()
+        assert len(data.ann_index) == 200
+        ids, _ = data.ann_index.search(vectors[order[:5]], 1, vectors[order], n_probe=data.ann_index.n_lists)
+        assert ids[:, 0].tolist() == [0, 1, 2, 3, 4]
+
+    def test_rewritten_store_rebuilds_index(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config, "embedding_ann_min_files", 100)
+        data = self._save(tmp_path, _clustered(300, 16))
+        generation = data.ann_index.generation
+        data = CompareData(base_dir=str(tmp_path), mode=CompareMode.CLIP_EMBEDDING)
+        data.load_data(overwrite=True)
+        for i, vector in enumerate(_clustered(200, 16, seed=1)):
+            data.file_data_dict[str(tmp_path / f"n{i}.png")] = vector
+            data.files_found.append(str(tmp_path / f"n{i}.png"))
+        data.has_new_file_data = True
+        data.save_data()
+        assert data.ann_index.generation != generation
+        assert len(data.ann_index) == 200
+
+
+class TestAnnGrouping:
+    @pytest.fixture
+    def make_compare(self, tmp_path):
+        pytest.importorskip("torch")
+        from compare.base_compare_embedding import BaseCompareEmbedding
+        vectors = _clustered(600, 16)
+        index = _build(vectors, n_lists=210)
+
+        def make_compare(name="run"):
+            base_dir = tmp_path / name
+            base_dir.mkdir(exist_ok=True)
+            files = [str(base_dir / f"{i}.png") for i in range(len(vectors))]
+            compare = BaseCompareEmbedding(CompareArgs(base_dir=str(base_dir), compare_faces=False))
+            compare.verbose = False
+            compare.embedding_similarity_threshold = 0.9
+            compare.threshold_duplicate = 0.99
+            compare._file_embeddings = vectors.copy()
+            compare.compare_data = SimpleNamespace(files_found=list(files), n_files_found=len(files), ann_index=index)
+            return compare
+        return make_compare
+
+    def _pairs(self, compare):
+        indexes1, indexes2, _, _ = compare.compare_result.pair_graph.arrays()
+        return set(zip(indexes1.tolist(), indexes2.tolist()))
+
+    def test_exact_grouping_by_default(self, make_compare, monkeypatch):
+        import compare.base_compare_embedding as base_compare_embedding
+        monkeypatch.setattr(base_compare_embedding.config, "embedding_ann_grouping", False)
+        monkeypatch.setattr(base_compare_embedding.config, "embedding_ann_n_probe", 1)
+        compare = make_compare()
+        compare.run_comparison()
+        vectors = compare._file_embeddings
+        expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(vectors @ vectors.T > 0.9, k=1)))}
+        assert self._pairs(compare) == expected
+
+    def test_resumes_from_checkpoint(self, make_compare, monkeypatch):
+        import compare.base_compare_embedding as base_compare_embedding
+        monkeypatch.setattr(base_compare_embedding.config, "embedding_ann_grouping", True)
+        monkeypatch.setattr(base_compare_embedding.config, "embedding_ann_n_probe", 2)
+        uninterrupted = make_compare("uninterrupted")
+        uninterrupted.run_comparison()
+        expected = self._pairs(uninterrupted)
+
+        compare = make_compare()
+        range_pairs = IVFIndex.range_pairs
+        start_lists = []
+
+        def interrupted_range_pairs(index, *args, **kwargs):
+            start_lists.append(kwargs["start_list"])
+            for result in range_pairs(index, *args, **kwargs):
+                if result[0] > 150 and len(start_lists) == 1:
+                    raise KeyboardInterrupt
+                yield result
+
+        monkeypatch.setattr(IVFIndex, "range_pairs", interrupted_range_pairs)
+        with pytest.raises(KeyboardInterrupt):
+            compare.run_comparison(store_checkpoints=True)
+        resumed = make_compare()
+        resumed.run_comparison(store_checkpoints=True)
+        assert start_lists == [0, 100]
+        assert self._pairs(resumed) == expected
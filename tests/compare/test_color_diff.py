@@ -0,0 +1,138 @@
+"""
+Tests for the vectorized color difference kernel in CompareColors.
+
+Covers:
+  - any_x_true_consecutive / any_x_true_weighted match the per-row loop functions
+  - tiled upper triangle pairs match the pairs found by the original np.roll comparison
+  - run_comparison groups files identically to the original algorithm, with and without faces
+"""
+
+import numpy as np
+import pytest
+
+from compare.compare_args import CompareArgs
+from compare.compare_colors import (
+    CompareColors, any_x_true_consecutive, any_x_true_weighted,
+    is_any_x_true_consecutive, is_any_x_true_weighted)
+from utils.constants import CompareMode
+
+
+def _random_bools(rng, n_rows, n_cols):
+    # Mix of densities and clustered runs so both counts cross their thresholds
+    density = rng.uniform(0, 1, (n_rows, 1))
+    bools = rng.uniform(0, 1, (n_rows, n_cols)) < density
+    run_starts = rng.integers(0, n_cols, n_rows)
+    run_lengths = rng.integers(0, 40, n_rows)
+    cols = np.arange(n_cols)[None, :]
+    bools |= (cols >= run_starts[:, None]) & (cols < (run_starts + run_lengths)[:, None])
+    return bools
+
+
+def _file_colors(rng, n_files, n_colors):
+    '''
+    LAB colors for groups of files that differ from their group base by noise
+    of varying size, so that some pairs are near the thresholds.
+    '''
+    n_bases = max(1, n_files // 5)
+    bases = rng.uniform([0, -60, -60], [100, 60, 60], (n_bases, n_colors, 3))
+    noise_scale = rng.uniform(0, 6, (n_files, 1, 1))
+    colors = bases[rng.integers(0, n_bases, n_files)] + rng.normal(0, 1, (n_files, n_colors, 3)) * noise_scale
+    return colors
+
+
+def _compare(tmp_path, colors, faces=None):
+    args = CompareArgs(base_dir=str(tmp_path), compare_mode=CompareMode.COLOR_MATCHING,
+                       compare_faces=faces is not None)
+    compare = CompareColors(args, use_thumb=True)
+    compare.verbose = False
+    compare.compare_data.files_found = [str(tmp_path / f"{i:03d}.png") for i in range(len(colors))]
+    compare.compare_data.n_files_found = len(colors)
+    compare._file_colors = colors
+    if faces is not None:
+        compare._file_faces = faces
+    return compare
+
+
+def _roll_pairs(compare):
+    '''
+    Pairs found by the original comparison, rolling the colors by one index
+    per step and applying the loop function to each row.
+    '''
+    colors = compare._file_colors
+    n = len(colors)
+    pairs = {}
+    for i in range(1, n):
+        deltaE_cie76s = np.sqrt(np.sum(np.square(colors - np.roll(colors, i, 0)), 2)).astype(int)
+        similars = np.apply_along_axis(
+            is_any_x_true_consecutive, 1, deltaE_cie76s < compare.color_diff_threshold,
+            compare.colors_below_threshold)
+        if compare.compare_faces:
+            similars = similars * (compare._file_faces - np.roll(compare._file_faces, i, 0) == 0)
+        diff_scores = np.sum(deltaE_cie76s, axis=1)
+        for base_index in np.nonzero(similars)[0].tolist():
+            other_index = (base_index - i) % n
+            pairs[(min(base_index, other_index), max(base_index, other_index))] = int(diff_scores[base_index])
+    return pairs
+
+
+def _partition(file_groups):
+    return {frozenset(group.keys()) for group in file_groups.values()}
+
+
+class TestColorDiffAlgs:
+    @pytest.mark.parametrize("x_threshold", [0, 5, 50, 112, 200])
+    def test_consecutive_matches_loop(self, x_threshold):
+        rng = np.random.default_rng(x_threshold)
+        bools = _random_bools(rng, 400, 225)
+        expected = np.array([is_any_x_true_consecutive(row, x_threshold) for row in bools])
+        result = any_x_true_consecutive(bools, x_threshold)
+        assert result.tolist() == expected.tolist()
+        assert 0 < expected.sum() < len(expected) or x_threshold == 200
+
+    def test_consecutive_over_leading_axes(self):
+        rng = np.random.default_rng(1)
+        bools = _random_bools(rng, 60, 225).reshape(6, 10, 225)
+        expected = any_x_true_consecutive(bools.reshape(60, 225), 112).reshape(6, 10)
+        assert any_x_true_consecutive(bools, 112).tolist() == expected.tolist()
+
+    @pytest.mark.parametrize("x_threshold", [-1, 0, 4])
+    def test_weighted_matches_loop(self, x_threshold):
+        bools = _random_bools(np.random.default_rng(2), 50, 8)
+        expected = [is_any_x_true_weighted(row, x_threshold) for row in bools]
+        assert any_x_true_weighted(bools, x_threshold).tolist() == expected
+
+
+class TestTiledColorComparison:
+    @pytest.mark.parametrize("tile_cols", [7, 512])
+    def test_pairs_match_roll(self, tmp_path, monkeypatch, tile_cols):
+        monkeypatch.setattr(CompareColors, "COLOR_TILE_COLS", tile_cols)
+        compare = _compare(tmp_path, _file_colors(np.random.default_rng(3), 57, 225))
+        expected = _roll_pairs(compare)
+        pairs = {}
+        for _, pairs_i, pairs_j, diff_scores in compare.tiled_color_pairs(compare._file_colors, tile_rows=5):
+            assert np.all(pairs_i < pairs_j)
+            pairs.update(zip(zip(pairs_i.tolist(), pairs_j.tolist()), diff_scores.tolist()))
+        assert len(expected) > 0
+        assert pairs == expected
+
+    @pytest.mark.parametrize("with_faces", [False, True])
+    def test_grouping_matches_roll(self, tmp_path, with_faces):
+        rng = np.random.default_rng(4)
+        colors = _file_colors(rng, 64, 225)
+        faces = rng.integers(0, 2, len(colors)) if with_faces else None
+
+        reference = _compare(tmp_path, colors, faces)
+        reference.compare_result = reference.compare_result.load(
+            str(tmp_path), reference.compare_data.files_found, overwrite=True, higher_is_better=False)
+        for (i, j), diff_score in _roll_pairs(reference).items():
+            reference.compare_result.add_pair(
+                i, j, diff_score, is_duplicate=diff_score < CompareColors.THRESHHOLD_POTENTIAL_DUPLICATE)
+        expected_grouped, expected_groups = reference._finish_comparison()
+
+        compare = _compare(tmp_path, colors, faces)
+        files_grouped, file_groups = compare.run_comparison()
+
+        assert len(expected_groups) > 0
+        assert _partition(file_groups) == _partition(expected_groups)
+        assert {f: score for f, (_, score) in files_grouped.items()} == \
+            {f: score for f, (_, score) in expected_grouped.items()}
@@ -0,0 +1,88 @@
+"""
+Tests for the parallel color extraction in CompareColors.get_data.
+
+Covers:
+  - worker pool results match in-process extraction, in files_found order
+  - unreadable and grayscale images are skipped
+  - cached colors are used without extraction
+  - cancellation while extracting (uses tmp_path)
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from compare.base_compare import CompareCancelled
+from compare.compare_args import CompareArgs
+from compare.compare_colors import CompareColors
+from utils.constants import CompareMode
+
+
+def _write_images(tmp_path, n):
+    rng = np.random.default_rng(0)
+    files = []
+    for i in range(n):
+        path = str(tmp_path / f"{i:03d}.png")
+        Image.fromarray(rng.integers(0, 256, (20, 20, 3), dtype=np.uint8)).save(path)
+        files.append(path)
+    grayscale = str(tmp_path / "gray.png")
+    Image.fromarray(np.zeros((20, 20), dtype=np.uint8)).save(grayscale)
+    broken = str(tmp_path / "broken.png")
+    with open(broken, "wb") as f:
+        f.write(b"not an image")
+    return sorted(files + [grayscale, broken])
+
+
+def _compare(tmp_path, files, workers, monkeypatch):
+    import compare.compare_colors as compare_colors
+    monkeypatch.setattr(compare_colors.config, "color_extraction_workers", workers)
+    args = CompareArgs(base_dir=str(tmp_path), compare_mode=CompareMode.COLOR_MATCHING, compare_faces=False)
+    compare = CompareColors(args, use_thumb=True)
+    compare.verbose = False
+    compare.files = list(files)
+    compare.max_files_processed_even = len(files)
+    return compare
+
+
+class TestParallelExtraction:
+    def test_pool_matches_serial(self, tmp_path, monkeypatch):
+        files = _write_images(tmp_path, 12)
+        serial = _compare(tmp_path, files, 1, monkeypatch)
+        serial.get_data()
+
+        (tmp_path / "image_thumb_colors.npy").unlink()
+        (tmp_path / "image_thumb_colors.index.pkl").unlink()
+        parallel = _compare(tmp_path, files, 3, monkeypatch)
+        parallel.get_data()
+
+        assert parallel.compare_data.files_found == serial.compare_data.files_found
+        assert len(parallel.compare_data.files_found) == 12
+        assert str(tmp_path / "gray.png") not in parallel.compare_data.files_found
+        np.testing.assert_array_equal(parallel._file_colors, serial._file_colors)
+
+    def test_cached_colors_reused(self, tmp_path, monkeypatch):
+        files = _write_images(tmp_path, 4)
+        first = _compare(tmp_path, files, 1, monkeypatch)
+        first.get_data()
+
+        cached = _compare(tmp_path, files, 2, monkeypatch)
+        monkeypatch.setattr(cached, "_get_color_executor", lambda: pytest.fail("No extraction expected"))
+        cached.files = first.compare_data.files_found
+        cached.get_data()
+        np.testing.assert_array_equal(cached._file_colors, first._file_colors)
+
+    def test_cancel_during_extraction(self, tmp_path, monkeypatch):
+        files = _write_images(tmp_path, 6)
+        compare = _compare(tmp_path, files, 2, monkeypatch)
+        submitted = []
+
+        def get_image_path(f):
+            submitted.append(f)
+            if len(submitted) == 3:
+                compare.cancel()
+            return f
+
+        monkeypatch.setattr(compare, "get_image_path", get_image_path)
+        with pytest.raises(CompareCancelled):
+            compare.get_data()
+        assert len(submitted) == 3
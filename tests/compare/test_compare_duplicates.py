@@ -0,0 +1,167 @@
+"""
+Tests for exact duplicate detection (compare/compare_duplicates.py).
+
+Covers:
+  - files are grouped by content, including large files differing only past the
+    partial hash and small files hashed whole
+  - files with a unique size are never opened, and only collisions are read in full
+  - cached hashes are reused without reading the files again
+  - pixel matching groups images that differ only in metadata, decoding each
+    byte identical group once and reading dimensions from the shared service
+  - CompareDuplicates groups files across directories and searches for duplicates
+"""
+
+import builtins
+import os
+
+import numpy as np
+import pytest
+from PIL import Image, PngImagePlugin
+
+import compare.compare_duplicates as compare_duplicates
+from compare.compare_args import CompareArgs
+from compare.compare_duplicates import PARTIAL_HASH_BYTES, CompareDuplicates, find_duplicate_groups
+from utils.constants import CompareMode
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def _entries(paths):
+    return {path: {"size": os.path.getsize(path), "mtime": os.stat(path).st_mtime_ns} for path in paths}
+
+
+def _partition(groups):
+    return {frozenset(group) for group in groups}
+
+
+@pytest.fixture
+def read_counter(monkeypatch):
+    '''
+    Count the bytes read from each file opened by compare_duplicates.
+    '''
+    bytes_read = {}
+
+    class CountingFile:
+        def __init__(self, f, path):
+            self._f = f
+            self._path = path
+            bytes_read.setdefault(path, 0)
+
+        def read(self, *args):
+            data = self._f.read(*args)
+            bytes_read[self._path] += len(data)
+            return data
+
+        def __getattr__(self, name):
+            return getattr(self._f, name)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self._f.close()
+
+    monkeypatch.setattr(compare_duplicates, "open",
+                        lambda path, mode="r": CountingFile(builtins.open(path, mode), path), raising=False)
+    return bytes_read
+
+
+def _image_pair_with_metadata(tmp_path):
+    pixels = np.random.default_rng(0).integers(0, 256, (20, 30, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels)
+    plain = str(tmp_path / "plain.png")
+    image.save(plain)
+    info = PngImagePlugin.PngInfo()
+    info.add_text("parameters", "a prompt")
+    tagged = str(tmp_path / "tagged.png")
+    image.save(tagged, pnginfo=info)
+    return plain, tagged
+
+
+class TestFindDuplicateGroups:
+    def test_groups_and_bytes_read(self, tmp_path, read_counter):
+        rng = np.random.default_rng(0)
+        large = rng.integers(0, 256, 4 * PARTIAL_HASH_BYTES, dtype=np.uint8).tobytes()
+        middle_changed = bytearray(large)
+        middle_changed[2 * PARTIAL_HASH_BYTES] ^= 1
+        small = rng.integers(0, 256, 1000, dtype=np.uint8).tobytes()
+        paths = [
+            _write(tmp_path / "large1", large),
+            _write(tmp_path / "large2", large),
+            _write(tmp_path / "large_middle_changed", bytes(middle_changed)),
+            _write(tmp_path / "large_end_changed", large[:-1] + bytes([large[-1] ^ 1])),
+            _write(tmp_path / "small1", small),
+            _write(tmp_path / "small2", small),
+            _write(tmp_path / "small_changed", small[:-1] + bytes([small[-1] ^ 1])),
+            _write(tmp_path / "unique_size", small + b"x"),
+        ]
+        groups = find_duplicate_groups(paths, _entries(paths), n_workers=3)
+        assert _partition(groups) == {frozenset(paths[:2]), frozenset(paths[4:6])}
+
+        assert paths[7] not in read_counter
+        assert read_counter[paths[3]] == 2 * PARTIAL_HASH_BYTES
+        for path in paths[:3]:
+            assert read_counter[path] == 2 * PARTIAL_HASH_BYTES + len(large)
+        for path in paths[4:7]:
+            assert read_counter[path] == len(small)
+
+    def test_cached_hashes_reused(self, tmp_path, read_counter):
+        data = b"\x01" * (3 * PARTIAL_HASH_BYTES)
+        paths = [_write(tmp_path / f"{i}", data) for i in range(3)]
+        entries = _entries(paths)
+        assert len(find_duplicate_groups(paths, entries)) == 1
+        read_counter.clear()
+        assert _partition(find_duplicate_groups(paths, entries)) == {frozenset(paths)}
+        assert read_counter == {}
+
+    def test_pixel_matching(self, tmp_path, monkeypatch):
+        plain, tagged = _image_pair_with_metadata(tmp_path)
+        plain_copy = _write(tmp_path / "plain_copy.png", open(plain, "rb").read())
+        other = str(tmp_path / "other.png")
+        Image.new("RGB", (30, 20)).save(other)
+        paths = [plain, tagged, plain_copy, other]
+        assert _partition(find_duplicate_groups(paths, _entries(paths))) == {frozenset([plain, plain_copy])}
+
+        decoded = []
+        measured = []
+        pixel_hash = compare_duplicates.pixel_hash
+        get_dimensions = compare_duplicates.image_dimensions.get_dimensions
+        monkeypatch.setattr(compare_duplicates, "pixel_hash", lambda path: decoded.append(path) or pixel_hash(path))
+        monkeypatch.setattr(compare_duplicates.image_dimensions, "get_dimensions",
+                            lambda path: measured.append(path) or get_dimensions(path))
+        groups = find_duplicate_groups(paths, _entries(paths), match_pixels=True)
+        assert _partition(groups) == {frozenset([plain, tagged, plain_copy])}
+        assert sorted(decoded) == sorted([plain, tagged, other])
+        # Dimensions come from the shared header-only service, once per byte identical group
+        assert sorted(measured) == sorted([plain, tagged, other])
+
+
+class TestCompareDuplicates:
+    def _compare(self, base_dir, additional_dirs=(), search_file_path=None):
+        args = CompareArgs(base_dir=str(base_dir), compare_mode=CompareMode.EXACT_DUPLICATES,
+                           search_file_path=search_file_path)
+        args.additional_dirs = [str(d) for d in additional_dirs]
+        compare = CompareDuplicates(args)
+        compare.verbose = False
+        compare.get_files()
+        compare.get_data()
+        return compare
+
+    def test_groups_across_directories_and_search(self, tmp_path):
+        base_dir = tmp_path / "base"
+        other_dir = tmp_path / "other"
+        base_dir.mkdir()
+        other_dir.mkdir()
+        plain, tagged = _image_pair_with_metadata(base_dir)
+        copy = _write(other_dir / "copy.png", open(plain, "rb").read())
+
+        _, file_groups = self._compare(base_dir, [other_dir]).run()
+        assert {frozenset(group) for group in file_groups.values()} == {frozenset([plain, copy])}
+
+        compare = self._compare(base_dir, [other_dir], search_file_path=copy)
+        assert not compare.compare_data.has_new_file_data
+        assert compare.run() == {0: {plain: 0}}
@@ -0,0 +1,212 @@
+"""
+Tests for the perceptual hash compare mode (compare/compare_hash.py, compare/hash_index.py).
+
+Covers:
+  - hamming_distances matches a per-pair bit count, with and without np.bitwise_count
+  - MultiIndexHash finds exactly the pairs within the radius, each once, for
+    several radii and substring counts
+  - reduced pairs group files identically to all pairs, with repeated hashes
+  - difference hashes of re-encoded and resized copies are near, of different images far
+  - CompareHash groups and searches image files in tmp_path
+  - CompareManager runs the hash mode first as a pre-filter with AND logic
+"""
+
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from compare.compare_args import CompareArgs
+from compare.compare_hash import CompareHash, dhash_image
+from compare.compare_manager import CombinationLogic, CompareManager
+from compare.compare_result import DisjointSetGrouping
+from compare.hash_index import MultiIndexHash, hamming_distances
+from utils.constants import CompareMode
+
+
+def _random_hashes(rng, n_hashes, n_bases=20, max_flips=10):
+    '''
+    Hashes near a few base hashes, differing from their base in up to
+    max_flips random bits, so that many pairs are near any radius.
+    '''
+    bases = rng.integers(0, 2**63, n_bases, dtype=np.uint64) * np.uint64(2) + rng.integers(0, 2, n_bases, dtype=np.uint64)
+    hashes = bases[rng.integers(0, n_bases, n_hashes)]
+    for i in range(n_hashes):
+        for bit in rng.choice(64, rng.integers(0, max_flips + 1), replace=False):
+            hashes[i] ^= np.uint64(1) << np.uint64(bit)
+    return hashes
+
+
+def _brute_pairs(hashes, radius):
+    pairs = {}
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            distance = bin(int(hashes[i]) ^ int(hashes[j])).count("1")
+            if distance <= radius:
+                pairs[(i, j)] = distance
+    return pairs
+
+
+def _partition(grouping):
+    groups = {}
+    for index, (group_index, _) in grouping.files_grouped().items():
+        groups.setdefault(group_index, set()).add(index)
+    return {frozenset(group) for group in groups.values()}
+
+
+def _image(seed, size=(96, 64)):
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (4, 6, 3), dtype=np.uint8)
+    return Image.fromarray(coarse).resize(size, Image.Resampling.BICUBIC)
+
+
+class TestHammingDistances:
+    @pytest.mark.parametrize("use_bitwise_count", [True, False])
+    def test_matches_bit_count(self, monkeypatch, use_bitwise_count):
+        if not use_bitwise_count:
+            monkeypatch.delattr(np, "bitwise_count", raising=False)
+        rng = np.random.default_rng(0)
+        a = _random_hashes(rng, 200)
+        b = _random_hashes(rng, 200)
+        expected = [bin(int(x) ^ int(y)).count("1") for x, y in zip(a, b)]
+        assert hamming_distances(a, b).tolist() == expected
+        assert hamming_distances(a, b[:1]).tolist() == [bin(int(x) ^ int(b[0])).count("1") for x in a]
+
+
+class TestMultiIndexHash:
+    @pytest.mark.parametrize("radius,n_substrings", [(0, None), (4, None), (6, 3), (10, 4), (12, 5), (2, 1)])
+    def test_unique_pairs_match_brute_force(self, radius, n_substrings):
+        hashes = np.unique(_random_hashes(np.random.default_rng(radius), 300))
+        index = MultiIndexHash(hashes, radius, n_substrings=n_substrings)
+        pairs = {}
+        for ids_a, ids_b, distances in index.unique_pairs():
+            for pair, distance in zip(zip(ids_a.tolist(), ids_b.tolist()), distances.tolist()):
+                assert pair not in pairs
+                pairs[pair] = distance
+        expected = _brute_pairs(index.unique_hashes, radius)
+        assert len(expected) > 0 or radius == 0
+        assert pairs == expected
+
+    def test_pairs_group_like_all_pairs(self):
+        rng = np.random.default_rng(1)
+        hashes = _random_hashes(rng, 200, max_flips=4)
+        # Repeat some hashes so that several indexes share them
+        hashes[rng.integers(0, 200, 60)] = hashes[rng.integers(0, 200, 60)]
+
+        expected = DisjointSetGrouping(higher_is_better=False)
+        for (i, j), distance in _brute_pairs(hashes, 5).items():
+            expected.add_pair(i, j, distance)
+        grouping = DisjointSetGrouping(higher_is_better=False)
+        for indexes1, indexes2, distances in MultiIndexHash(hashes, 5).pairs():
+            assert np.all(indexes1 < indexes2)
+            grouping.add_pairs(indexes1, indexes2, distances)
+
+        assert _partition(grouping) == _partition(expected)
+        assert {i: grouping.score(i) for i in range(len(hashes)) if i in grouping} == \
+            {i: expected.score(i) for i in range(len(hashes)) if i in expected}
+
+
+class TestDifferenceHash:
+    def test_copies_near_and_different_images_far(self, tmp_path):
+        image = _image(0)
+        image.save(tmp_path / "original.png")
+        image.save(tmp_path / "copy.jpg", quality=60)
+        with Image.open(tmp_path / "original.png") as original, Image.open(tmp_path / "copy.jpg") as copy:
+            original_hash = dhash_image(original)
+            copy_hash = dhash_image(copy)
+        resized_hash = dhash_image(image.resize((192, 128)))
+        other_hash = dhash_image(_image(1))
+        assert hamming_distances(np.uint64(original_hash), np.uint64(copy_hash)) <= 4
+        assert hamming_distances(np.uint64(original_hash), np.uint64(resized_hash)) <= 4
+        assert hamming_distances(np.uint64(original_hash), np.uint64(other_hash)) > 10
+
+
+def _write_images(tmp_path):
+    '''
+    Two images with a re-encoded and a resized copy each, and one unrelated image.
+    '''
+    files = []
+    for seed in (0, 1):
+        image = _image(seed)
+        for name, copy in (("a.png", image), ("b.jpg", image), ("c.png", image.resize((192, 128)))):
+            path = str(tmp_path / f"{seed}{name}")
+            copy.save(path)
+            files.append(path)
+    path = str(tmp_path / "2unrelated.png")
+    _image(2).save(path)
+    files.append(path)
+    return sorted(files)
+
+
+def _compare(tmp_path, search_file_path=None):
+    args = CompareArgs(base_dir=str(tmp_path), compare_mode=CompareMode.PERCEPTUAL_HASH,
+                       search_file_path=search_file_path, compare_threshold="6")
+    compare = CompareHash(args)
+    compare.verbose = False
+    compare.get_files()
+    compare.get_data()
+    return compare
+
+
+class TestCompareHash:
+    def test_groups_copies(self, tmp_path):
+        files = _write_images(tmp_path)
+        _, file_groups = _compare(tmp_path).run()
+        groups = {frozenset(group.keys()) for group in file_groups.values()}
+        assert groups == {frozenset(f for f in files if f.startswith(str(tmp_path / str(seed))))
+                          for seed in (0, 1)}
+
+    def test_search_and_cached_hashes(self, tmp_path):
+        files = _write_images(tmp_path)
+        search_file = str(tmp_path / "1a.png")
+        _compare(tmp_path)
+        compare = _compare(tmp_path, search_file_path=search_file)
+        assert not compare.compare_data.has_new_file_data
+        files_grouped = compare.run()
+        assert set(files_grouped[0]) == {str(tmp_path / "1b.jpg"), str(tmp_path / "1c.png")}
+        assert all(distance <= 6 for distance in files_grouped[0].values())
+
+    def test_threshold(self, tmp_path):
+        compare = CompareHash(CompareArgs(base_dir=str(tmp_path), compare_threshold=0.9))
+        assert compare.get_similarity_threshold() == 6
+        compare.set_similarity_threshold("3")
+        assert compare.get_similarity_threshold() == 3
+
+
+class _FakeWrapper:
+    def __init__(self, results, runs):
+        self.results = results
+        self.runs = runs
+        self.files_grouped = {}
+
+    def run(self, args):
+        self.runs.append((args.compare_mode, args.candidate_files))
+        candidates = args.candidate_files
+        self.files_grouped = {0: {f: score for f, score in self.results.items()
+                                  if candidates is None or f in candidates}}
+
+
+class TestHashPreFilter:
+    def _manager(self, logic):
+        manager = CompareManager(app_actions=MagicMock())
+        manager.set_primary_mode(CompareMode.CLIP_EMBEDDING)
+        manager.add_mode(CompareMode.PERCEPTUAL_HASH)
+        manager.set_combination_logic(logic)
+        runs = []
+        manager._wrappers[CompareMode.CLIP_EMBEDDING] = _FakeWrapper({"a": 0.95, "b": 0.92, "c": 0.91}, runs)
+        manager._wrappers[CompareMode.PERCEPTUAL_HASH] = _FakeWrapper({"b": 2, "c": 5, "d": 1}, runs)
+        return manager, runs
+
+    def test_and_restricts_later_modes(self):
+        manager, runs = self._manager(CombinationLogic.AND)
+        manager._run_composite(CompareArgs(search_file_path="s"))
+        assert runs == [(CompareMode.PERCEPTUAL_HASH, None),
+                        (CompareMode.CLIP_EMBEDDING, {"b", "c", "d", "s"})]
+        assert set(manager._combined_results) == {"b", "c"}
+
+    def test_or_does_not_restrict(self):
+        manager, runs = self._manager(CombinationLogic.OR)
+        manager._run_composite(CompareArgs(search_file_path="s"))
+        assert runs[1] == (CompareMode.CLIP_EMBEDDING, None)
+        assert set(manager._combined_results) == {"a", "b", "c", "d"}
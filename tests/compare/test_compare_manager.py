@@ -0,0 +1,109 @@
+"""
+Tests for composite runs in compare/compare_manager.py.
+
+Covers:
+  - SizeFilter and ModelFilter matching
+  - the base directory is walked once per composite run
+  - the size and model filters restrict the files every mode compares
+  - pre-filter modes run concurrently, before the other modes
+"""
+
+import threading
+from unittest.mock import MagicMock
+
+from PIL import Image
+
+import compare.base_compare as base_compare
+import compare.compare_manager as compare_manager
+from compare.compare_args import CompareArgs
+from compare.compare_manager import CombinationLogic, CompareManager, ModelFilter, SizeFilter
+from files.directory_listing import directory_listing_cache
+from utils.constants import CompareMode
+
+
+class _FakeWrapper:
+    def __init__(self, results, runs, barrier=None):
+        self.results = results
+        self.runs = runs
+        self.barrier = barrier
+        self.files_grouped = {}
+
+    def run(self, args):
+        if self.barrier is not None:
+            # Only passes once the other pre-filter mode is running too
+            self.barrier.wait()
+        self.runs.append((args.compare_mode, args.candidate_files))
+        candidates = args.candidate_files
+        self.files_grouped = {0: {f: score for f, score in self.results.items()
+                                  if candidates is None or f in candidates}}
+
+
+def _manager(modes, logic=CombinationLogic.AND):
+    manager = CompareManager(app_actions=MagicMock())
+    manager.set_primary_mode(modes[0])
+    for mode in modes[1:]:
+        manager.add_mode(mode)
+    manager.set_combination_logic(logic)
+    return manager
+
+
+class TestFilters:
+    def test_size_filter(self):
+        assert SizeFilter(min_size=(100, 50)).matches(100, 50)
+        assert not SizeFilter(min_size=(100, 50)).matches(99, 500)
+        assert not SizeFilter(max_size=(100, 50)).matches(100, 51)
+        assert SizeFilter(exact_size=(64, 64), tolerance=2).matches(66, 62)
+        assert not SizeFilter(exact_size=(64, 64)).matches(65, 64)
+
+    def test_model_filter(self):
+        models, loras = ["Models\\SDXL.safetensors"], ["detail"]
+        assert ModelFilter(models=["models/sdxl.safetensors"]).matches(models, loras)
+        assert ModelFilter(models=["models/sdxl.safetensors", "detail"]).matches(models, loras)
+        assert not ModelFilter(models=["models/sdxl.safetensors", "detail"], include_loras=False).matches(models, loras)
+        assert ModelFilter(models=["other", "detail"], match_any=True).matches(models, loras)
+        assert not ModelFilter(models=["detail"], mode="exclude").matches(models, loras)
+
+
+class TestCompositeRun:
+    def test_single_walk_and_filters(self, tmp_path, monkeypatch):
+        directory_listing_cache.clear()
+        base_dir = tmp_path / "images"
+        base_dir.mkdir()
+        for name, size in [("small.png", (10, 10)), ("large.png", (200, 100)), ("wide.png", (300, 50))]:
+            Image.new("RGB", size).save(base_dir / name)
+        walks = []
+        walk_files = base_compare.walk_files
+        monkeypatch.setattr(base_compare, "walk_files", lambda *a, **kw: walks.append(a[0]) or walk_files(*a, **kw))
+        monkeypatch.setattr(compare_manager, "extract_models_from_image",
+                            lambda path: (["sdxl"] if "wide" not in path else ["sd15"], []))
+
+        manager = _manager([CompareMode.CLIP_EMBEDDING, CompareMode.SIZE])
+        manager.set_size_filter(SizeFilter(min_size=(50, 50)))
+        manager.set_model_filter(ModelFilter(models=["SDXL"]))
+        runs = []
+        all_files = {str(base_dir / name): 1.0 for name in ("small.png", "large.png", "wide.png")}
+        manager._wrappers[CompareMode.CLIP_EMBEDDING] = _FakeWrapper(all_files, runs)
+        manager._wrappers[CompareMode.SIZE] = _FakeWrapper(all_files, runs)
+
+        args = CompareArgs(base_dir=str(base_dir))
+        manager._run_composite(args)
+        # Modes gathering their own files are served from the shared listing
+        base_compare.gather_files(base_dir=str(base_dir), exts=[".png"], recursive=args.recursive)
+        assert walks == [str(base_dir)]
+        large = {str(base_dir / "large.png")}
+        assert runs == [(CompareMode.SIZE, large), (CompareMode.CLIP_EMBEDDING, large)]
+        assert set(manager._combined_results) == large
+        directory_listing_cache.clear()
+
+    def test_prefilter_modes_run_concurrently(self, tmp_path):
+        manager = _manager([CompareMode.CLIP_EMBEDDING, CompareMode.SIZE, CompareMode.MODELS])
+        runs = []
+        barrier = threading.Barrier(2, timeout=10)
+        manager._wrappers[CompareMode.CLIP_EMBEDDING] = _FakeWrapper({"a": 0.9, "b": 0.9, "c": 0.9}, runs)
+        manager._wrappers[CompareMode.SIZE] = _FakeWrapper({"a": 1.0, "b": 1.0}, runs, barrier)
+        manager._wrappers[CompareMode.MODELS] = _FakeWrapper({"b": 1.0, "c": 1.0}, runs, barrier)
+
+        manager._run_composite(CompareArgs(base_dir=str(tmp_path)))
+        assert {mode for mode, _ in runs[:2]} == {CompareMode.SIZE, CompareMode.MODELS}
+        assert runs[2] == (CompareMode.CLIP_EMBEDDING, {"b"})
+        assert set(manager._combined_results) == {"b"}
@@ -0,0 +1,110 @@
+"""
+Tests for the models compare mode (compare/compare_models.py).
+
+Covers:
+  - model names are matched ignoring case, path separators and whitespace
+  - model_similarity_pairs groups files identically to scoring every pair with
+    model_similarity, with the same best score per file, for several thresholds
+  - CompareModels groups and searches files without reading the released
+    file data after saving it
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import compare.compare_models as compare_models
+from compare.compare_args import CompareArgs
+from compare.compare_models import CompareModels, model_similarity, model_similarity_pairs
+from compare.compare_result import DisjointSetGrouping
+from utils.constants import CompareMode
+
+
+def _random_file_models(rng, n_files):
+    '''
+    Models and loras drawn from small vocabularies, so that many files share
+    some of them and some files repeat the same lists or have none at all.
+    '''
+    models = ["base", "Base", "sdxl", "pony", "flux", "anime"]
+    loras = ["detail", "style\\ink", "style/ink", "light", "face", "hands", "blur"]
+    file_models = []
+    for _ in range(n_files):
+        file_models.append((
+            list(rng.choice(models, rng.integers(0, 3), replace=False)),
+            list(rng.choice(loras, rng.integers(0, 4), replace=False))))
+    return file_models
+
+
+def _partition(grouping):
+    groups = {}
+    for index, (group_index, _) in grouping.files_grouped().items():
+        groups.setdefault(group_index, set()).add(index)
+    return {frozenset(group) for group in groups.values()}
+
+
+def test_model_names_normalized():
+    assert model_similarity(["SDXL\\base "], [], ["sdxl/base"], []) == pytest.approx(0.7)
+
+
+@pytest.mark.parametrize("threshold", [0.3, 0.5, 0.7, 0.85, 1.0])
+def test_pairs_group_like_all_pairs(threshold):
+    file_models = _random_file_models(np.random.default_rng(int(threshold * 100)), 150)
+    expected = DisjointSetGrouping()
+    for i in range(len(file_models)):
+        for j in range(i + 1, len(file_models)):
+            similarity = model_similarity(*file_models[i], *file_models[j])
+            if similarity >= threshold:
+                expected.add_pair(i, j, similarity)
+    grouping = DisjointSetGrouping()
+    for indexes1, indexes2, similarities in model_similarity_pairs(file_models, threshold):
+        assert np.all(indexes1 < indexes2)
+        grouping.add_pairs(indexes1, indexes2, similarities)
+
+    assert len(_partition(expected)) > 1
+    assert _partition(grouping) == _partition(expected)
+    for i in range(len(file_models)):
+        assert (i in grouping) == (i in expected)
+        if i in expected:
+            assert grouping.score(i) == pytest.approx(expected.score(i))
+
+
+class TestCompareModels:
+    FILE_MODELS = {
+        "a.png": (["sdxl"], ["detail"]),
+        "b.png": (["SDXL"], ["detail", "light"]),
+        "c.png": (["sdxl"], ["detail"]),
+        "d.png": (["pony"], ["ink"]),
+        "e.png": (["pony"], ["ink"]),
+        "f.png": ([], []),
+    }
+
+    @pytest.fixture(autouse=True)
+    def _models(self, tmp_path, monkeypatch):
+        for name in self.FILE_MODELS:
+            Image.new("RGB", (4, 4)).save(tmp_path / name)
+        monkeypatch.setattr(compare_models, "extract_models_from_image",
+                            lambda path: self.FILE_MODELS[path.replace("\\", "/").split("/")[-1]])
+
+    def _compare(self, tmp_path, search_file_path=None):
+        args = CompareArgs(base_dir=str(tmp_path), compare_mode=CompareMode.MODELS,
+                           search_file_path=search_file_path, compare_threshold=0.7)
+        compare = CompareModels(args)
+        compare.verbose = False
+        compare.get_files()
+        compare.get_data()
+        return compare
+
+    def test_groups(self, tmp_path):
+        compare = self._compare(tmp_path)
+        assert compare.compare_data.file_data_dict is None
+        _, file_groups = compare.run()
+        groups = {frozenset(f.replace("\\", "/").split("/")[-1] for f in group)
+                  for group in file_groups.values()}
+        assert groups == {frozenset(["a.png", "b.png", "c.png"]), frozenset(["d.png", "e.png"])}
+
+    def test_search(self, tmp_path):
+        self._compare(tmp_path)
+        compare = self._compare(tmp_path, search_file_path=str(tmp_path / "a.png"))
+        files_grouped = compare.run()
+        assert files_grouped[0] == {str(tmp_path / "a.png"): 1.0, str(tmp_path / "c.png"): 1.0,
+                                    str(tmp_path / "b.png"): pytest.approx(0.85)}
@@ -0,0 +1,164 @@
+"""
+Tests for candidate generation in the exact prompts compare mode
+(compare/compare_prompts_exact.py, compare/minhash_lsh.py).
+
+Covers:
+  - compute_text_similarity with cached tokens matches the per-pair implementation
+  - the bounded edit distance matches the full distance up to its bound
+  - MinHashLSH candidates include the pairs above the target Jaccard similarity
+  - prompt_similarity_pairs groups files like scoring every pair, with the same
+    best score per file
+"""
+
+import numpy as np
+import pytest
+
+from compare.compare_prompts_exact import (
+    _compute_fuzzy_word_similarity, _levenshtein_distance, compute_text_similarity, prompt_similarity_pairs)
+from compare.compare_result import DisjointSetGrouping
+from compare.minhash_lsh import MinHashLSH
+
+TAGS = ["masterpiece", "best quality", "1girl", "solo", "long hair", "short hair", "smile", "blue eyes",
+        "red dress", "outdoors", "city", "night", "forest", "sunset", "portrait", "full body", "cat",
+        "dog", "castle", "mountain", "river", "rain", "snow", "cinematic lighting", "detailed face",
+        "watercolor", "oil painting", "sketch", "hat", "glasses", "sword", "armor", "flowers", "beach"]
+NEGATIVES = ["", "lowres, bad anatomy", "lowres, bad hands, blurry", "worst quality"]
+
+
+def _reference_similarity(text1, text2):
+    '''
+    compute_text_similarity as it was before tokens were cached.
+    '''
+    if not text1 or not text2:
+        return 0.0
+    text1_lower = text1.lower().strip()
+    text2_lower = text2.lower().strip()
+    if text1_lower == text2_lower:
+        return 1.0
+    if text1_lower in text2_lower or text2_lower in text1_lower:
+        return 0.9
+
+    def split_structured_elements(text):
+        elements = []
+        for separator in [',', '\n', '\r\n']:
+            elements.extend([elem.strip() for elem in text.split(separator)])
+        return [elem for elem in elements if elem]
+
+    elements1 = set(split_structured_elements(text1_lower))
+    elements2 = set(split_structured_elements(text2_lower))
+    if elements1 and elements2:
+        element_intersection = elements1.intersection(elements2)
+        element_union = elements1.union(elements2)
+        element_similarity = len(element_intersection) / len(element_union) if element_union else 0.0
+        if element_similarity > 0:
+            if len(element_intersection) >= 2:
+                element_similarity = min(0.95, element_similarity * 1.3)
+            return element_similarity
+
+    words1 = set(text1_lower.split())
+    words2 = set(text2_lower.split())
+    if not words1 or not words2:
+        return 0.0
+    return min(0.7, _compute_fuzzy_word_similarity(words1, words2))
+
+
+def _random_prompts(rng, n_files, n_bases=25):
+    '''
+    Prompts varying a few base prompts by dropping, adding or changing tags,
+    with repeated prompts, sentence prompts and some without any prompt.
+    '''
+    bases = [list(rng.choice(TAGS, rng.integers(5, 12), replace=False)) for _ in range(n_bases)]
+    positives, negatives = [], []
+    for _ in range(n_files):
+        tags = list(bases[rng.integers(n_bases)])
+        for _ in range(rng.integers(0, 4)):
+            change = rng.integers(3)
+            if change == 0 and len(tags) > 1:
+                tags.pop(rng.integers(len(tags)))
+            elif change == 1:
+                tags.append(str(rng.choice(TAGS)))
+            else:
+                tags[rng.integers(len(tags))] = str(rng.choice(TAGS))
+        kind = rng.integers(10)
+        if kind == 0:
+            positive = ""
+        elif kind == 1:
+            positive = " ".join(tags)
+        else:
+            positive = ", ".join(tags)
+        if rng.integers(3) == 0:
+            positive = positive.upper()
+        positives.append(positive)
+        negatives.append(str(rng.choice(NEGATIVES)))
+    return positives, negatives
+
+
+def _partition(grouping):
+    groups = {}
+    for index, (group_index, _) in grouping.files_grouped().items():
+        groups.setdefault(group_index, set()).add(index)
+    return {frozenset(group) for group in groups.values()}
+
+
+def test_similarity_matches_reference():
+    rng = np.random.default_rng(0)
+    positives, _ = _random_prompts(rng, 120)
+    positives += ["a cat sitting on a chair", "a cta siting on the chair", "  ", "CAT", "cats"]
+    for text1 in positives:
+        for text2 in positives[::7]:
+            assert compute_text_similarity(text1, text2) == _reference_similarity(text1, text2)
+
+
+def test_bounded_levenshtein():
+    words = ["kitten", "sitting", "mitten", "kit", "kitchen", "sittings", "", "a"]
+    for w1 in words:
+        for w2 in words:
+            distance = _levenshtein_distance(w1, w2)
+            for max_distance in range(4):
+                bounded = _levenshtein_distance(w1, w2, max_distance=max_distance)
+                assert bounded == distance if distance <= max_distance else bounded == max_distance + 1
+
+
+def test_minhash_lsh_candidates():
+    rng = np.random.default_rng(0)
+    token_sets = [rng.choice(200, rng.integers(5, 40), replace=False) for _ in range(300)]
+    token_sets += [np.concatenate([tokens[:-2], [500, 501]]) for tokens in token_sets[:100]]
+    token_sets.append([])
+    lsh = MinHashLSH(token_sets)
+    ids1, ids2 = lsh.candidate_pairs(MinHashLSH.rows_per_band_for(0.5))
+    assert np.all(ids1 < ids2)
+    candidates = set(zip(ids1.tolist(), ids2.tolist()))
+    assert len(candidates) == len(ids1)
+    assert all(len(token_sets) - 1 not in pair for pair in candidates)
+
+    expected = set()
+    for i in range(len(token_sets)):
+        for j in range(i + 1, len(token_sets)):
+            union = len(set(token_sets[i]) | set(token_sets[j]))
+            if union > 0 and len(set(token_sets[i]) & set(token_sets[j])) / union >= 0.5:
+                expected.add((i, j))
+    assert len(expected) >= 90
+    assert len(expected - candidates) <= 0.02 * len(expected)
+    assert len(candidates) < 20 * len(expected)
+
+
+@pytest.mark.parametrize("threshold", [0.75, 0.85, 0.95])
+def test_pairs_group_like_all_pairs(threshold):
+    positives, negatives = _random_prompts(np.random.default_rng(int(threshold * 100)), 250)
+    expected = DisjointSetGrouping()
+    for i in range(len(positives)):
+        for j in range(i + 1, len(positives)):
+            similarity = (compute_text_similarity(positives[i], positives[j]) * 0.7
+                          + compute_text_similarity(negatives[i], negatives[j]) * 0.3)
+            if similarity >= threshold:
+                expected.add_pair(i, j, similarity)
+    grouping = DisjointSetGrouping()
+    for indexes1, indexes2, similarities in prompt_similarity_pairs(positives, negatives, threshold):
+        assert np.all(indexes1 < indexes2)
+        grouping.add_pairs(indexes1, indexes2, similarities)
+
+    assert len(_partition(expected)) > 1
+    assert _partition(grouping) == _partition(expected)
+    for i in range(len(positives)):
+        if i in expected:
+            assert grouping.score(i) == pytest.approx(expected.score(i))
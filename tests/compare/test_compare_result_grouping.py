@@ -0,0 +1,281 @@
+"""
+Tests for DisjointSetGrouping and the CompareResult grouping integration.
+
+Covers:
+  - transitive grouping of pairs and group numbering
+  - best score tracking per file and per group (similarity and diff scores)
+  - duplicate registry ordering and deduplication
+  - compact pickling, checkpoint load and legacy result migration (uses tmp_path)
+  - pair graph remapping and incremental update of stored results for changed files
+  - prompt groups after removing and readding files keep the prompt grouping threshold (requires torch)
+"""
+
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from compare.compare_result import CompareResult, DisjointSetGrouping, PairGraph
+
+
+class TestGrouping:
+    def test_pairs_are_joined_transitively(self):
+        grouping = DisjointSetGrouping()
+        grouping.add_pair(0, 1, 0.9)
+        grouping.add_pair(3, 4, 0.9)
+        grouping.add_pair(1, 2, 0.9)
+        files_grouped = grouping.files_grouped()
+        assert files_grouped[0][0] == files_grouped[1][0] == files_grouped[2][0]
+        assert files_grouped[3][0] == files_grouped[4][0]
+        assert files_grouped[0][0] != files_grouped[3][0]
+
+    def test_group_indexes_ordered_by_lowest_file(self):
+        grouping = DisjointSetGrouping()
+        grouping.add_pair(7, 8, 0.9)
+        grouping.add_pair(2, 9, 0.9)
+        grouping.add_pair(5, 7, 0.9)
+        files_grouped = grouping.files_grouped()
+        assert files_grouped[2][0] == 0
+        assert files_grouped[5][0] == 1
+
+    def test_merging_large_groups(self):
+        grouping = DisjointSetGrouping()
+        for i in range(0, 1000, 2):
+            grouping.add_pair(i, i + 1, 1.0)
+        for i in range(1, 999, 2):
+            grouping.add_pair(i, i + 1, 1.0)
+        assert len({group for group, _ in grouping.files_grouped().values()}) == 1
+        assert len(grouping) == 1000
+
+    def test_add_pairs_matches_add_pair(self):
+        rng = np.random.default_rng(0)
+        pairs_i = rng.integers(0, 50, 200)
+        pairs_j = rng.integers(0, 50, 200)
+        scores = rng.random(200)
+        expected = DisjointSetGrouping()
+        for i, j, score in zip(pairs_i.tolist(), pairs_j.tolist(), scores.tolist()):
+            expected.add_pair(i, j, score)
+        grouping = DisjointSetGrouping()
+        grouping.add_pairs(pairs_i, pairs_j, scores)
+        assert grouping.files_grouped() == expected.files_grouped()
+
+
+class TestScores:
+    def test_best_similarity_kept(self):
+        grouping = DisjointSetGrouping()
+        grouping.add_pair(0, 1, 0.8)
+        grouping.add_pair(0, 2, 0.95)
+        grouping.add_pair(2, 3, 0.85)
+        assert grouping.score(0) == 0.95
+        assert grouping.score(1) == 0.8
+        assert grouping.group_score(3) == 0.95
+
+    def test_lowest_diff_score_kept(self):
+        grouping = DisjointSetGrouping(higher_is_better=False)
+        grouping.add_pair(0, 1, 30)
+        grouping.add_pair(2, 3, 10)
+        grouping.add_pair(1, 2, 20)
+        assert grouping.score(1) == 20
+        assert grouping.group_scores() == {0: 10}
+
+
+class TestDuplicates:
+    def test_duplicates_registered_once(self):
+        grouping = DisjointSetGrouping()
+        grouping.add_pair(3, 1, 0.99, is_duplicate=True)
+        grouping.add_pair(1, 3, 0.99, is_duplicate=True)
+        grouping.add_pair(1, 2, 0.9)
+        assert grouping.duplicate_pairs() == [(1, 3)]
+
+    def test_duplicate_mask(self):
+        grouping = DisjointSetGrouping()
+        scores = np.array([0.99, 0.9, 0.995])
+        grouping.add_pairs([0, 2, 4], [1, 3, 5], scores, duplicates=scores > 0.98)
+        assert grouping.duplicate_pairs() == [(0, 1), (4, 5)]
+
+
+class TestCompareResult:
+    def test_build_groups(self):
+        files = ["a.png", "b.png", "c.png", "d.png"]
+        result = CompareResult(files=files)
+        result.add_pair(0, 2, 0.9)
+        result.add_pair(1, 3, 0.99, is_duplicate=True)
+        files_grouped, file_groups = result.build_groups(files)
+        assert files_grouped == {0: (0, 0.9), 1: (1, 0.99), 2: (0, 0.9), 3: (1, 0.99)}
+        assert file_groups == {0: {"a.png": 0.9, "c.png": 0.9}, 1: {"b.png": 0.99, "d.png": 0.99}}
+        assert result.probable_duplicates == [("b.png", "d.png")]
+
+    def test_grouping_pickle_round_trip(self):
+        grouping = DisjointSetGrouping(higher_is_better=False)
+        for i in range(100):
+            grouping.add_pair(i, (i * 7) % 100, float(i), is_duplicate=i % 10 == 0)
+        restored = pickle.loads(pickle.dumps(grouping))
+        assert restored.files_grouped() == grouping.files_grouped()
+        assert restored.group_scores() == grouping.group_scores()
+        assert restored.duplicate_pairs() == grouping.duplicate_pairs()
+        assert not restored.higher_is_better
+
+    def test_stored_result_is_rebuilt_on_load(self, tmp_path):
+        files = [str(tmp_path / f"{i}.png") for i in range(4)]
+        result = CompareResult(base_dir=str(tmp_path), files=files)
+        result.add_pair(0, 1, 0.9, is_duplicate=True)
+        result.build_groups(files)
+        result.is_complete = True
+        result.store()
+
+        loaded = CompareResult.load(str(tmp_path), files)
+        assert loaded.file_groups == result.file_groups
+        assert loaded.probable_duplicates == [(files[0], files[1])]
+
+    def test_checkpoint_resumes_grouping(self, tmp_path):
+        files = [str(tmp_path / f"{i}.png") for i in range(4)]
+        result = CompareResult(base_dir=str(tmp_path), files=files)
+        result.add_pair(0, 1, 0.9)
+        result.tile_row = 2
+        result.store()
+
+        loaded = CompareResult.load(str(tmp_path), files)
+        assert loaded.tile_row == 2
+        loaded.add_pair(1, 3, 0.95)
+        _, file_groups = loaded.build_groups(files)
+        assert len(file_groups) == 1
+        assert len(file_groups[0]) == 3
+
+    def test_legacy_result_migrated(self, tmp_path, monkeypatch):
+        files = [str(tmp_path / f"{i}.png") for i in range(4)]
+        legacy = CompareResult(base_dir=str(tmp_path), files=files)
+        del legacy.grouping
+        del legacy.probable_duplicates
+        legacy.files_grouped = {0: (0, 0.9), 2: (0, 0.9), 1: (1, 0.8), 3: (1, 0.85)}
+        # Legacy results were pickled with the default object state
+        monkeypatch.delattr(CompareResult, "__getstate__")
+        legacy.store()
+        monkeypatch.undo()
+
+        loaded = CompareResult.load(str(tmp_path), files)
+        _, file_groups = loaded.build_groups(files)
+        assert file_groups == {0: {files[0]: 0.9, files[2]: 0.9}, 1: {files[1]: 0.8, files[3]: 0.85}}
+
+    def test_invalid_grouping_indices_discarded(self, tmp_path):
+        files = [str(tmp_path / f"{i}.png") for i in range(3)]
+        result = CompareResult(base_dir=str(tmp_path), files=files)
+        result.add_pair(0, 5, 0.9)
+        assert not result.validate_indices(files)
+
+
+class TestPairGraph:
+    def test_remap_drops_removed_files(self):
+        graph = PairGraph(["a", "b", "c", "d"])
+        graph.add_pairs([0, 1], [1, 3], [0.9, 0.95], duplicates=[False, True])
+        graph.add_pair(2, 3, 0.8)
+        new_rows = graph.remap(["b", "c", "d", "e"])
+        indexes1, indexes2, scores, duplicates = graph.arrays()
+        assert list(zip(indexes1.tolist(), indexes2.tolist())) == [(0, 2), (1, 2)]
+        assert scores.tolist() == [0.95, 0.8]
+        assert duplicates.tolist() == [True, False]
+        assert new_rows.tolist() == [3]
+
+    def test_grouping_matches_streamed_grouping(self):
+        rng = np.random.default_rng(0)
+        result = CompareResult(files=[str(i) for i in range(40)])
+        for _ in range(5):
+            scores = rng.random(20)
+            result.add_pairs(rng.integers(0, 40, 20), rng.integers(0, 40, 20), scores, duplicates=scores > 0.9)
+        grouping = result.pair_graph.to_grouping()
+        assert grouping.files_grouped() == result.grouping.files_grouped()
+        assert grouping.duplicate_pairs() == result.grouping.duplicate_pairs()
+
+    def test_save_load_round_trip(self, tmp_path):
+        graph = PairGraph(["a.png", "b.png", "c.png"])
+        graph.add_pair(0, 2, 0.9, is_duplicate=True)
+        graph.save(str(tmp_path / PairGraph.GRAPH_FILENAME))
+        loaded = PairGraph.load(str(tmp_path / PairGraph.GRAPH_FILENAME))
+        assert loaded.files == graph.files
+        for loaded_array, array in zip(loaded.arrays(), graph.arrays()):
+            assert loaded_array.tolist() == array.tolist()
+
+
+class TestIncrementalUpdate:
+    def _stored_result(self, tmp_path, files):
+        result = CompareResult(base_dir=str(tmp_path), files=files)
+        result.add_pair(0, 1, 0.9)
+        result.add_pair(2, 3, 0.95, is_duplicate=True)
+        result.build_groups(files)
+        result.is_complete = True
+        result.store()
+        return result
+
+    def test_changed_files_raise_without_incremental(self, tmp_path):
+        files = [str(tmp_path / f"{i}.png") for i in range(4)]
+        self._stored_result(tmp_path, files)
+        with pytest.raises(ValueError):
+            CompareResult.load(str(tmp_path), files + [str(tmp_path / "4.png")])
+
+    def test_added_and_removed_files(self, tmp_path):
+        files = [str(tmp_path / f"{i}.png") for i in range(4)]
+        self._stored_result(tmp_path, files)
+        new_files = [files[0], files[1], str(tmp_path / "1a.png"), files[3]]
+
+        loaded = CompareResult.load(str(tmp_path), new_files, incremental=True)
+        assert not loaded.is_complete
+        assert loaded.pending_rows.tolist() == [2]
+        assert loaded.equals_hash(new_files)
+        loaded.add_pair(2, 3, 0.99)
+        _, file_groups = loaded.build_groups(new_files)
+        assert file_groups == {0: {files[0]: 0.9, files[1]: 0.9}, 1: {new_files[2]: 0.99, files[3]: 0.99}}
+        assert loaded.probable_duplicates == []
+
+    def test_incomplete_result_is_not_updated(self, tmp_path):
+        files = [str(tmp_path / f"{i}.png") for i in range(4)]
+        result = CompareResult(base_dir=str(tmp_path), files=files)
+        result.add_pair(0, 1, 0.9)
+        result.store()
+        with pytest.raises(ValueError):
+            CompareResult.load(str(tmp_path), files[:3], incremental=True)
+
+    def test_result_without_pair_graph_is_not_updated(self, tmp_path):
+        files = [str(tmp_path / f"{i}.png") for i in range(4)]
+        self._stored_result(tmp_path, files)
+        os.remove(CompareResult.graph_path(str(tmp_path)))
+        with pytest.raises(ValueError):
+            CompareResult.load(str(tmp_path), files[:3], incremental=True)
+
+
+class TestPromptsIncrementalUpdate:
+    @pytest.fixture
+    def compare(self, tmp_path):
+        pytest.importorskip("torch")
+        from compare.compare_args import CompareArgs
+        from compare.compare_prompts import ComparePrompts
+        # Files 0 and 1 are near duplicate prompts, files 2 and 3 are only similar
+        embeddings = np.zeros((5, 8), dtype=np.float32)
+        embeddings[0, 0] = embeddings[2, 2] = embeddings[4, 4] = 1.0
+        embeddings[1, [0, 1]] = [0.98, np.sqrt(1 - 0.98 ** 2)]
+        embeddings[3, [2, 3]] = [0.9, np.sqrt(1 - 0.9 ** 2)]
+        compare = ComparePrompts(CompareArgs(base_dir=str(tmp_path), compare_faces=False))
+        compare.verbose = False
+        compare.embedding_similarity_threshold = 0.8
+        # The growable array wraps the embeddings without a copy and deletes in place
+        compare._file_embeddings = embeddings.copy()
+        compare.compare_data.files_found = [str(tmp_path / f"{i}.png") for i in range(5)]
+        compare.compare_data.n_files_found = 5
+        compare.compare_data.file_data_dict = None
+        compare.all_embeddings = embeddings
+        return compare
+
+    def _grouped_files(self, compare):
+        return {frozenset(group) for group in compare.compare_result.file_groups.values()}
+
+    def test_readded_files_use_prompt_threshold(self, compare, monkeypatch):
+        files = list(compare.compare_data.files_found)
+        compare.run_comparison()
+        assert self._grouped_files(compare) == {frozenset(files[:2])}
+
+        compare.remove_from_groups([files[1], files[3]])
+        assert self._grouped_files(compare) == set()
+
+        monkeypatch.setattr(compare, "_get_image_embeddings",
+                            lambda paths: [compare.all_embeddings[files.index(path)] for path in paths])
+        compare.readd_files([files[1], files[3]])
+        assert self._grouped_files(compare) == {frozenset(files[:2])}
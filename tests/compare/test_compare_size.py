@@ -0,0 +1,101 @@
+"""
+Tests for the size compare mode (compare/compare_size.py).
+
+Covers:
+  - SizeIndex pairs and range queries match size_similarity over every pair
+    for several pixel tolerances
+  - aspect ratio matching joins sizes with close aspect ratios
+  - CompareSize groups files by size and searches by image and by size text
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import compare.compare_size as compare_size
+from compare.compare_args import CompareArgs
+from compare.compare_size import CompareSize, SizeIndex, size_similarity
+from utils.constants import CompareMode
+
+
+def _random_sizes(rng, n_sizes):
+    widths = rng.choice([512, 510, 515, 768, 770, 1024, 1030, 1536], n_sizes)
+    heights = rng.choice([512, 511, 520, 768, 1024, 1022, 1536], n_sizes)
+    return np.stack([widths, heights], axis=1)
+
+
+@pytest.mark.parametrize("tolerance", [0, 10, 50, 200])
+def test_pairs_and_matching_match_size_similarity(tolerance):
+    sizes = _random_sizes(np.random.default_rng(tolerance), 200)
+    index = SizeIndex(sizes)
+    expected = {}
+    for i in range(len(index.sizes)):
+        for j in range(i + 1, len(index.sizes)):
+            similarity = size_similarity(tuple(index.sizes[i]), tuple(index.sizes[j]), tolerance=tolerance)
+            if similarity >= 0.95:
+                expected[(i, j)] = similarity
+    ids1, ids2, scores = index.pairs(tolerance, 0.95)
+    assert dict(zip(zip(ids1.tolist(), ids2.tolist()), scores.tolist())) == pytest.approx(expected)
+
+    for search_size in [(512, 512), (513, 515), (1000, 1000), (1536, 1536)]:
+        ids, scores = index.matching(search_size, tolerance, 0.95)
+        expected = {i: size_similarity(search_size, tuple(size), tolerance=tolerance)
+                    for i, size in enumerate(index.sizes)}
+        assert dict(zip(ids.tolist(), scores.tolist())) == \
+            pytest.approx({i: score for i, score in expected.items() if score >= 0.95})
+
+    assert sorted(index for files in index.size_files for index in files) == list(range(len(sizes)))
+    for size_id, files in enumerate(index.size_files):
+        assert all(tuple(sizes[i]) == tuple(index.sizes[size_id]) for i in files)
+
+
+def test_aspect_ratio_pairs():
+    index = SizeIndex([(512, 768), (1024, 1536), (1030, 1536), (768, 512), (600, 600)])
+    ids1, ids2, scores = index.pairs(0, 0.95, aspect_ratio_tolerance=0.01)
+    pairs = {(tuple(index.sizes[i]), tuple(index.sizes[j])): score
+             for i, j, score in zip(ids1.tolist(), ids2.tolist(), scores.tolist())}
+    assert set(pairs) == {((512, 768), (1024, 1536)), ((512, 768), (1030, 1536)), ((1024, 1536), (1030, 1536))}
+    assert pairs[((512, 768), (1024, 1536))] == pytest.approx(1.0)
+    ids, _ = index.matching((256, 384), 0, 0.95, aspect_ratio_tolerance=0.01)
+    assert {tuple(index.sizes[i]) for i in ids.tolist()} == {(512, 768), (1024, 1536), (1030, 1536)}
+
+
+class TestCompareSize:
+    SIZES = {"a.png": (32, 48), "b.png": (32, 48), "c.png": (33, 48), "d.png": (64, 64), "e.png": (64, 64),
+             "f.png": (20, 10)}
+
+    @pytest.fixture(autouse=True)
+    def _images(self, tmp_path):
+        for name, size in self.SIZES.items():
+            Image.new("RGB", size).save(tmp_path / name)
+
+    def _compare(self, tmp_path, threshold="0", search_file_path=None, search_text=None):
+        args = CompareArgs(base_dir=str(tmp_path), compare_mode=CompareMode.SIZE, compare_threshold=threshold,
+                           search_file_path=search_file_path)
+        args.search_text = search_text
+        compare = CompareSize(args)
+        compare.verbose = False
+        compare.get_files()
+        compare.get_data()
+        return compare
+
+    def _names(self, files):
+        return frozenset(f.replace("\\", "/").split("/")[-1] for f in files)
+
+    @pytest.mark.parametrize("threshold,aspect_ratio_tolerance,expected", [
+        ("0", 0.0, {frozenset(["a.png", "b.png"]), frozenset(["d.png", "e.png"])}),
+        ("20", 0.0, {frozenset(["a.png", "b.png", "c.png"]), frozenset(["d.png", "e.png"])}),
+        ("0", 0.05, {frozenset(["a.png", "b.png", "c.png"]), frozenset(["d.png", "e.png"])}),
+    ])
+    def test_groups(self, tmp_path, monkeypatch, threshold, aspect_ratio_tolerance, expected):
+        monkeypatch.setattr(compare_size.config, "size_aspect_ratio_tolerance", aspect_ratio_tolerance)
+        _, file_groups = self._compare(tmp_path, threshold).run()
+        assert {self._names(group) for group in file_groups.values()} == expected
+
+    def test_search(self, tmp_path):
+        self._compare(tmp_path)
+        files_grouped = self._compare(tmp_path, search_file_path=str(tmp_path / "d.png")).run()
+        assert self._names(files_grouped[0]) == {"d.png", "e.png"}
+        files_grouped = self._compare(tmp_path, threshold="20", search_text="32x48").run()
+        assert files_grouped[0] == pytest.approx({str(tmp_path / "a.png"): 1.0, str(tmp_path / "b.png"): 1.0,
+                                                  str(tmp_path / "c.png"): 0.975})
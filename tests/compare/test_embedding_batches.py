@@ -0,0 +1,109 @@
+"""
+Tests for batched image embedding in compare/model.py and BaseCompareEmbedding.get_data.
+
+Covers:
+  - batches keep the order of the image paths, and unreadable images are skipped
+    without dropping the rest of the batch
+  - a failed batch is retried one image at a time
+  - get_data with mixed cached, uncached and unreadable files keeps the file order
+    and only embeds uncached files (uses tmp_path, requires torch)
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip("torch")
+
+from compare.compare_args import CompareArgs
+from compare.compare_embeddings_clip import CompareEmbeddingClip
+from compare.model import _embed_image_batches
+from utils.constants import CompareMode
+
+DIM = 512
+
+
+def _write_images(tmp_path, n, broken=()):
+    '''
+    Write n images whose widths identify them, and unreadable files at the
+    given indexes.
+    '''
+    files = []
+    for i in range(n):
+        path = str(tmp_path / f"{i:03d}.png")
+        if i in broken:
+            with open(path, "wb") as f:
+                f.write(b"not an image")
+        else:
+            Image.new("RGB", (10 + i, 10)).save(path)
+        files.append(path)
+    return files
+
+
+def _embedding(i):
+    embedding = np.zeros(DIM, dtype=np.float32)
+    embedding[i] = 1.0
+    return embedding
+
+
+def _embed_images(images, failing_width=None):
+    if failing_width is not None and any(image.size[0] == failing_width for image in images):
+        raise RuntimeError("bad image in batch")
+    return [_embedding(image.size[0] - 10).tolist() for image in images]
+
+
+class TestEmbedImageBatches:
+    def test_order_and_unreadable_images(self, tmp_path):
+        files = _write_images(tmp_path, 8, broken=(2, 6))
+        batches = []
+
+        def embed_images(images):
+            batches.append(len(images))
+            return _embed_images(images)
+
+        embeddings = _embed_image_batches(files, 3, embed_images)
+        assert batches == [2, 3, 1]
+        assert embeddings[2] is None and embeddings[6] is None
+        for i in (0, 1, 3, 4, 5, 7):
+            np.testing.assert_array_equal(embeddings[i], _embedding(i))
+
+    def test_failed_batch_retried_per_image(self, tmp_path):
+        files = _write_images(tmp_path, 6)
+        embeddings = _embed_image_batches(files, 6, lambda images: _embed_images(images, failing_width=14))
+        assert embeddings[4] is None
+        for i in (0, 1, 2, 3, 5):
+            np.testing.assert_array_equal(embeddings[i], _embedding(i))
+
+
+class TestGetDataBatches:
+    def _compare(self, tmp_path, files, embedded_paths, monkeypatch):
+        import compare.base_compare_embedding as base_compare_embedding
+        monkeypatch.setattr(base_compare_embedding.config, "embedding_batch_size", 3)
+        args = CompareArgs(base_dir=str(tmp_path), compare_mode=CompareMode.CLIP_EMBEDDING, compare_faces=False)
+        compare = CompareEmbeddingClip(args)
+        compare.verbose = False
+        compare.files = list(files)
+        compare.max_files_processed_even = len(files)
+
+        def embed_batch(image_paths, batch_size):
+            embedded_paths.extend(image_paths)
+            return _embed_image_batches(image_paths, batch_size, _embed_images)
+
+        compare.image_embeddings_batch_func = embed_batch
+        return compare
+
+    def test_mixed_cached_and_uncached_files(self, tmp_path, monkeypatch):
+        files = _write_images(tmp_path, 14, broken=(5, 9))
+        cached = [files[i] for i in (0, 1, 4, 7, 8, 13)]
+        embedded_paths = []
+        self._compare(tmp_path, cached, embedded_paths, monkeypatch).get_data()
+        assert embedded_paths == cached
+
+        embedded_paths.clear()
+        compare = self._compare(tmp_path, files, embedded_paths, monkeypatch)
+        compare.get_data()
+
+        readable = [i for i in range(len(files)) if i not in (5, 9)]
+        assert embedded_paths == [f for f in files if f not in cached]
+        assert compare.compare_data.files_found == [files[i] for i in readable]
+        np.testing.assert_array_equal(compare._file_embeddings, np.array([_embedding(i) for i in readable]))
@@ -0,0 +1,208 @@
+"""
+Tests for compare/embedding_precision.py.
+
+Covers:
+  - int8 quantization with a scale per vector
+  - reduced precision growable arrays (append, insert, delete) and their views
+  - the tiled similarity engine on dequantized views
+  - grouping and ANN range pairs dequantize one block at a time, never all rows (uses tmp_path)
+  - the precision evaluation report against float32
+  - converting the dtype of a feature store (uses tmp_path)
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from compare.ann_index import IVFIndex
+from compare.base_compare import BaseCompare
+from compare.compare_args import CompareArgs
+from compare.embedding_precision import (QuantizedEmbeddings, QuantizedGrowableArray,
+                                         embedding_array, evaluate_precision, leading_rows, quantize_int8)
+from compare.feature_store import FeatureStore
+from compare.growable_array import GrowableArray
+from utils.constants import EmbeddingPrecision
+
+
+def _normalized(n, d, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n, d)).astype(np.float32)
+    embeddings[1::5] = embeddings[0::5][:len(embeddings[1::5])] + 0.05 * rng.standard_normal((len(embeddings[1::5]), d))
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+class TestQuantize:
+    def test_int8_round_trip_error(self):
+        embeddings = _normalized(50, 64)
+        codes, scales = quantize_int8(embeddings)
+        assert codes.dtype == np.int8
+        assert scales.shape == (50,)
+        np.testing.assert_allclose(codes * scales[:, None], embeddings, atol=scales.max() / 2 + 1e-6)
+
+    def test_zero_vector(self):
+        codes, scales = quantize_int8(np.zeros((1, 8)))
+        assert np.all(codes == 0)
+        assert np.all(np.isfinite(scales))
+
+
+class TestQuantizedGrowableArray:
+    @pytest.mark.parametrize("precision", [EmbeddingPrecision.FLOAT16, EmbeddingPrecision.INT8])
+    def test_operations_match_float32(self, precision):
+        embeddings = _normalized(20, 16)
+        array = QuantizedGrowableArray(precision)
+        expected = GrowableArray()
+        for row in embeddings[:10]:
+            array.append(row)
+            expected.append(row)
+        array.extend(embeddings[10:19])
+        expected.extend(embeddings[10:19])
+        array.insert_first(embeddings[19])
+        expected.insert_first(embeddings[19])
+        array.delete([0, 5])
+        expected.delete([0, 5])
+        view = array.view()
+        assert len(view) == len(expected) == 18
+        np.testing.assert_allclose(view[:], expected.view(), atol=0.01)
+        np.testing.assert_allclose(view[3], expected.view()[3], atol=0.01)
+        np.testing.assert_allclose(view[[1, 4]], expected.view()[[1, 4]], atol=0.01)
+
+    def test_int8_memory(self):
+        view = embedding_array(_normalized(100, 512), EmbeddingPrecision.INT8).view()
+        assert view.nbytes == 100 * (512 + 4)
+
+    def test_float32_is_unchanged(self):
+        embeddings = _normalized(10, 8)
+        array = embedding_array(embeddings)
+        assert isinstance(array, GrowableArray)
+        assert array.view().dtype == np.float32
+
+    def test_matmul_in_blocks(self, monkeypatch):
+        monkeypatch.setattr(QuantizedEmbeddings, "BLOCK_ROWS", 7)
+        embeddings = _normalized(30, 8)
+        view = embedding_array(embeddings, EmbeddingPrecision.INT8).view()
+        np.testing.assert_allclose(view @ embeddings[0], view[:] @ embeddings[0], rtol=1e-6)
+        np.testing.assert_allclose(view @ embeddings[:3].T, view[:] @ embeddings[:3].T, rtol=1e-6)
+
+
+class TestReducedPrecisionEngine:
+    @pytest.mark.parametrize("precision", [EmbeddingPrecision.FLOAT16, EmbeddingPrecision.INT8])
+    def test_tiled_pairs_on_view(self, precision):
+        view = embedding_array(_normalized(60, 32), precision).view()
+        dequantized = view[:]
+        expected = {(i, j) for _, pairs_i, pairs_j, _ in BaseCompare.tiled_similarity_pairs(dequantized, 0.8, tile_rows=16)
+                    for i, j in zip(pairs_i.tolist(), pairs_j.tolist())}
+        result = {(i, j) for _, pairs_i, pairs_j, _ in BaseCompare.tiled_similarity_pairs(view, 0.8, tile_rows=16)
+                  for i, j in zip(pairs_i.tolist(), pairs_j.tolist())}
+        assert result == expected
+        assert len(result) > 0
+
+
+class TestDequantizedBlocks:
+    @pytest.fixture
+    def max_rows_dequantized(self, monkeypatch):
+        # Record the most rows dequantized by any single read of a quantized view
+        max_rows = [0]
+        getitem = QuantizedEmbeddings.__getitem__
+
+        def recording_getitem(view, key):
+            rows = getitem(view, key)
+            max_rows[0] = max(max_rows[0], len(rows) if rows.ndim > 1 else 1)
+            return rows
+
+        monkeypatch.setattr(QuantizedEmbeddings, "__getitem__", recording_getitem)
+        return max_rows
+
+    def test_leading_rows_stay_quantized(self):
+        view = embedding_array(_normalized(20, 8), EmbeddingPrecision.INT8).view()
+        head = leading_rows(view, 12)
+        assert isinstance(head, QuantizedEmbeddings)
+        assert head.codes.base is not None
+        np.testing.assert_array_equal(head[:], view[:12])
+        np.testing.assert_array_equal(leading_rows(view[:], 12), view[:12])
+
+    @pytest.mark.parametrize("precision", [EmbeddingPrecision.FLOAT16, EmbeddingPrecision.INT8])
+    def test_grouping_reads_blocks(self, tmp_path, monkeypatch, max_rows_dequantized, precision):
+        pytest.importorskip("torch")
+        from compare.base_compare_embedding import BaseCompareEmbedding
+        import compare.base_compare_embedding as base_compare_embedding
+        monkeypatch.setattr(base_compare_embedding.config, "embedding_precision", precision)
+        monkeypatch.setattr(BaseCompare, "TILE_COLS", 16)
+        monkeypatch.setattr(BaseCompare, "TILE_MAX_ROWS", 16)
+        n = 100
+        embeddings = _normalized(n, 32)
+        compare = BaseCompareEmbedding(CompareArgs(base_dir=str(tmp_path), compare_faces=False))
+        compare.verbose = False
+        compare.embedding_similarity_threshold = 0.8
+        compare.threshold_duplicate = 0.99
+        compare._file_embeddings = embeddings
+        files = [str(tmp_path / f"{i}.png") for i in range(n)]
+        compare.compare_data = SimpleNamespace(files_found=files, n_files_found=n, ann_index=None)
+
+        files_grouped, _ = compare.run_comparison()
+
+        assert isinstance(compare._file_embeddings, QuantizedEmbeddings)
+        assert len(files_grouped) > 0
+        assert 0 < max_rows_dequantized[0] <= 16
+
+    def test_range_pairs_reads_lists(self, monkeypatch, max_rows_dequantized):
+        monkeypatch.setattr(IVFIndex, "CHUNK_ROWS", 32)
+        embeddings = _normalized(200, 16)
+        index = IVFIndex(8)
+        index.train(embeddings)
+        index.add(embeddings, np.arange(len(embeddings)))
+        view = embedding_array(embeddings, EmbeddingPrecision.INT8).view()
+        expected = {(i, j) for _, pairs_i, pairs_j, _ in index.range_pairs(view[:], 0.8, n_probe=2)
+                    for i, j in zip(pairs_i.tolist(), pairs_j.tolist())}
+        max_rows_dequantized[0] = 0
+        result = {(i, j) for _, pairs_i, pairs_j, _ in index.range_pairs(view, 0.8, n_probe=2)
+                  for i, j in zip(pairs_i.tolist(), pairs_j.tolist())}
+        assert result == expected
+        assert len(result) > 0
+        assert max_rows_dequantized[0] < len(embeddings)
+
+
+class TestEvaluatePrecision:
+    def test_float32_matches_exactly(self):
+        report = evaluate_precision(_normalized(100, 32), EmbeddingPrecision.FLOAT32, 0.8, k=5, n_queries=20)
+        assert report["pair_recall"] == 1.0
+        assert report["pair_precision"] == 1.0
+        assert report["files_regrouped"] == 0
+        assert report["top_k_recall"] == 1.0
+        assert report["max_similarity_error"] == 0.0
+
+    @pytest.mark.parametrize("precision", ["float16", "int8"])
+    def test_reduced_precision_report(self, precision):
+        embeddings = _normalized(200, 64)
+        report = evaluate_precision(embeddings, precision, 0.8, k=10, n_queries=50)
+        assert report["precision"] == precision
+        assert report["pairs_float32"] > 0
+        assert report["pair_recall"] > 0.9
+        assert report["top_k_recall"] > 0.9
+        assert report["max_similarity_error"] < 0.05
+        assert report["bytes_per_embedding"] < report["float32_bytes_per_embedding"]
+
+    def test_sampled_files(self):
+        report = evaluate_precision(_normalized(100, 16), "int8", 0.8, max_files=40, n_queries=10)
+        assert report["n_files"] == 40
+
+
+class TestFeatureStoreConvert:
+    def test_convert_rewrites_dtype(self, tmp_path):
+        base = str(tmp_path / "image_embeddings")
+        store = FeatureStore(base)
+        store["a.png"] = [0.5, 0.25]
+        store.flush()
+
+        reopened = FeatureStore(base)
+        reopened.open()
+        reopened.convert(np.float16)
+        reopened["b.png"] = [1.0, 0.0]
+        reopened.flush()
+
+        converted = FeatureStore(base)
+        converted.open()
+        assert converted.dtype == np.float16
+        assert converted.matrix.dtype == np.float16
+        np.testing.assert_allclose(converted["a.png"], [0.5, 0.25])
+        np.testing.assert_allclose(converted["b.png"], [1.0, 0.0])
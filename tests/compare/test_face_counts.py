@@ -0,0 +1,63 @@
+"""
+Tests for cached, parallel face counting in compare/base_compare.py.
+
+Covers:
+  - cached counts are reused while the file is unchanged, and changed files
+    and counts from older caches without file times are counted again
+  - counts are computed in pipeline threads and stored with the file times
+  - images are bounded in size before face detection (uses tmp_path)
+"""
+
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+import compare.base_compare as base_compare
+from compare.compare_args import CompareArgs
+from compare.compare_hash import CompareHash
+
+
+def _write(path, size=(20, 10)):
+    Image.new("RGB", size).save(path)
+    return str(path)
+
+
+def test_cached_and_counted_in_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(base_compare.config, "pipeline_workers", 3)
+    files = [_write(tmp_path / f"{i}.png") for i in range(6)]
+    compare = CompareHash(CompareArgs(base_dir=str(tmp_path)))
+    stat = os.stat(files[0])
+    changed_stat = os.stat(files[1])
+    compare.compare_data.file_faces_dict = {
+        files[0]: (stat.st_mtime_ns, stat.st_size, 2),
+        files[1]: (changed_stat.st_mtime_ns - 1, changed_stat.st_size, 5),
+        files[2]: 4,
+    }
+    counted = []
+    threads = set()
+
+    def count_faces(filepath):
+        counted.append(filepath)
+        threads.add(threading.current_thread().name)
+        return int(os.path.basename(filepath)[0]) * 10
+
+    monkeypatch.setattr(compare, "_get_faces_count", count_faces)
+    assert compare._get_faces_counts(files) == [2, 10, 20, 30, 40, 50]
+    assert sorted(counted) == files[1:]
+    assert all(name.startswith("pipeline_faces") for name in threads)
+    stat = os.stat(files[3])
+    assert compare.compare_data.file_faces_dict[files[3]] == (stat.st_mtime_ns, stat.st_size, 30)
+
+    counted.clear()
+    assert compare._get_faces_counts(files) == [2, 10, 20, 30, 40, 50]
+    assert counted == []
+
+
+def test_detection_image_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(base_compare.config, "face_detection_max_side", 100)
+    gray = base_compare.BaseCompare._face_detection_image(_write(tmp_path / "a.png", (300, 150)))
+    assert gray.shape == (50, 100) and gray.dtype == np.uint8
+    gray = base_compare.BaseCompare._face_detection_image(_write(tmp_path / "b.png", (60, 40)))
+    assert gray.shape == (40, 60)
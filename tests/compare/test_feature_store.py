@@ -0,0 +1,215 @@
+"""
+Tests for compare/feature_store.py and the CompareData integration.
+
+Covers:
+  - dict-like access and flush / open round-trip (uses tmp_path)
+  - append-only writes and mtime/size invalidation
+  - clear, delete and row shape changes
+  - automatic migration from legacy pickles in CompareData
+"""
+
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from compare.compare_data import CompareData
+from compare.feature_store import FeatureStore
+from utils.constants import CompareMode
+
+
+def _touch(path, content=b"x"):
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+class TestRoundTrip:
+    def test_flush_and_open(self, tmp_path):
+        base = str(tmp_path / "image_embeddings")
+        store = FeatureStore(base)
+        store["a.png"] = [1.0, 0.0]
+        store["b.png"] = [0.0, 1.0]
+        store.flush()
+
+        reopened = FeatureStore(base)
+        reopened.open()
+        assert len(reopened) == 2
+        assert "a.png" in reopened
+        np.testing.assert_allclose(reopened["b.png"], [0.0, 1.0])
+
+    def test_matrix_is_memmap(self, tmp_path):
+        base = str(tmp_path / "image_embeddings")
+        store = FeatureStore(base)
+        store["a.png"] = np.ones(4)
+        store.flush()
+        store.open()
+        assert isinstance(store.matrix, np.memmap)
+        assert store.matrix.shape == (1, 4)
+
+    def test_matrix_file_is_valid_npy(self, tmp_path):
+        base = str(tmp_path / "image_embeddings")
+        store = FeatureStore(base)
+        store["a.png"] = [1.0, 2.0, 3.0]
+        store["b.png"] = [4.0, 5.0, 6.0]
+        store.flush()
+        loaded = np.load(base + FeatureStore.MATRIX_EXT)
+        assert loaded.shape == (2, 3)
+        assert loaded.dtype == np.float32
+
+    def test_pending_rows_readable_before_flush(self, tmp_path):
+        store = FeatureStore(str(tmp_path / "s"))
+        store["a.png"] = [1.0, 2.0]
+        assert "a.png" in store
+        np.testing.assert_allclose(store["a.png"], [1.0, 2.0])
+
+    def test_multidimensional_rows(self, tmp_path):
+        base = str(tmp_path / "image_thumb_colors")
+        store = FeatureStore(base, dtype=np.float64)
+        store["a.png"] = np.arange(6).reshape(3, 2)
+        store.flush()
+        store.open()
+        assert store["a.png"].shape == (3, 2)
+        assert store.matrix.dtype == np.float64
+
+
+class TestAppend:
+    def test_append_does_not_rewrite_existing_rows(self, tmp_path):
+        base = str(tmp_path / "s")
+        store = FeatureStore(base)
+        store["a.png"] = [1.0, 1.0]
+        store.flush()
+        store["b.png"] = [2.0, 2.0]
+        store.flush()
+
+        reopened = FeatureStore(base)
+        reopened.open()
+        assert reopened.rows_for(["a.png", "b.png"]).tolist() == [0, 1]
+        np.testing.assert_allclose(reopened.matrix, [[1.0, 1.0], [2.0, 2.0]])
+
+    def test_update_points_to_new_row(self, tmp_path):
+        base = str(tmp_path / "s")
+        store = FeatureStore(base)
+        store["a.png"] = [1.0]
+        store.flush()
+        store["a.png"] = [5.0]
+        store.flush()
+        store.open()
+        assert len(store) == 1
+        np.testing.assert_allclose(store["a.png"], [5.0])
+
+    def test_truncated_index_record_is_ignored(self, tmp_path):
+        base = str(tmp_path / "s")
+        store = FeatureStore(base)
+        store["a.png"] = [1.0]
+        store.flush()
+        with open(base + FeatureStore.INDEX_EXT, "ab") as f:
+            f.write(b"\x80\x05garbage")
+        store.open()
+        assert "a.png" in store
+
+
+class TestValidation:
+    def test_modified_file_is_not_cached(self, tmp_path):
+        image = _touch(tmp_path / "a.png", b"1")
+        store = FeatureStore(str(tmp_path / "s"))
+        store[image] = [1.0]
+        store.flush()
+        store.open()
+        assert image in store
+        _touch(image, b"22")
+        assert image not in store
+
+    def test_missing_file_is_cached(self, tmp_path):
+        store = FeatureStore(str(tmp_path / "s"))
+        store[str(tmp_path / "missing.png")] = [1.0]
+        store.flush()
+        store.open()
+        assert str(tmp_path / "missing.png") in store
+
+
+class TestClearAndDelete:
+    def test_clear_rewrites_store(self, tmp_path):
+        base = str(tmp_path / "s")
+        store = FeatureStore(base)
+        store["a.png"] = [1.0]
+        store.flush()
+        store.clear()
+        store["b.png"] = [2.0]
+        store.flush()
+        store.open()
+        assert "a.png" not in store
+        assert store.matrix.shape == (1, 1)
+
+    def test_delete_persists(self, tmp_path):
+        base = str(tmp_path / "s")
+        store = FeatureStore(base)
+        store["a.png"] = [1.0]
+        store["b.png"] = [2.0]
+        store.flush()
+        del store["a.png"]
+        store.flush()
+        store.open()
+        assert "a.png" not in store
+        assert "b.png" in store
+
+    def test_delete_missing_raises(self, tmp_path):
+        store = FeatureStore(str(tmp_path / "s"))
+        with pytest.raises(KeyError):
+            del store["a.png"]
+
+    def test_shape_change_drops_old_rows(self, tmp_path):
+        base = str(tmp_path / "s")
+        store = FeatureStore(base)
+        store["a.png"] = [1.0, 2.0]
+        store.flush()
+        store["b.png"] = [1.0, 2.0, 3.0]
+        store.flush()
+        store.open()
+        assert "a.png" not in store
+        assert store["b.png"].shape == (3,)
+
+
+class TestCompareDataMigration:
+    def test_migrates_legacy_pickle(self, tmp_path):
+        legacy = {str(tmp_path / f"{i}.png"): [float(i)] * 4 for i in range(3)}
+        with open(tmp_path / CompareData.EMBEDDINGS_DATA, "wb") as f:
+            pickle.dump(legacy, f)
+
+        data = CompareData(base_dir=str(tmp_path), mode=CompareMode.CLIP_EMBEDDING)
+        data.load_data()
+        assert isinstance(data.file_data_dict, FeatureStore)
+        assert len(data.file_data_dict) == 3
+        np.testing.assert_allclose(data.file_data_dict[str(tmp_path / "2.png")], [2.0] * 4)
+        assert os.path.exists(tmp_path / "image_embeddings.npy")
+
+    def test_save_and_reload(self, tmp_path):
+        data = CompareData(base_dir=str(tmp_path), mode=CompareMode.SIGLIP_EMBEDDING)
+        data.load_data()
+        data.file_data_dict["a.png"] = [0.5, 0.5]
+        data.files_found.append("a.png")
+        data.has_new_file_data = True
+        data.save_data()
+        assert data.file_data_dict is None
+
+        reloaded = CompareData(base_dir=str(tmp_path), mode=CompareMode.SIGLIP_EMBEDDING)
+        reloaded.load_data()
+        assert "a.png" in reloaded.file_data_dict
+
+    def test_overwrite_clears_store(self, tmp_path):
+        data = CompareData(base_dir=str(tmp_path), mode=CompareMode.CLIP_EMBEDDING)
+        data.load_data()
+        data.file_data_dict["a.png"] = [1.0]
+        data.files_found.append("a.png")
+        data.has_new_file_data = True
+        data.save_data()
+
+        data = CompareData(base_dir=str(tmp_path), mode=CompareMode.CLIP_EMBEDDING)
+        data.load_data(overwrite=True)
+        assert "a.png" not in data.file_data_dict
+
+    def test_non_numeric_modes_use_pickle(self, tmp_path):
+        data = CompareData(base_dir=str(tmp_path), mode=CompareMode.PROMPTS_EXACT)
+        data.load_data()
+        assert isinstance(data.file_data_dict, dict)
@@ -0,0 +1,116 @@
+"""
+Tests for compare/growable_array.py.
+
+Covers the accumulator used for per-file compare data:
+  - append / extend growth and view contents
+  - row shape inference and placeholder replacement
+  - insert_first / delete ordering
+  - from_array wrapping
+"""
+
+import numpy as np
+import pytest
+
+from compare.growable_array import GrowableArray
+
+
+class TestAppend:
+    def test_empty_view(self):
+        arr = GrowableArray((4,))
+        assert arr.view().shape == (0, 4)
+        assert len(arr) == 0
+
+    def test_append_rows_match_vstack(self):
+        rows = np.random.default_rng(0).random((1000, 8))
+        arr = GrowableArray((8,))
+        for row in rows:
+            arr.append(row)
+        assert len(arr) == 1000
+        np.testing.assert_allclose(arr.view(), rows.astype(np.float32))
+
+    def test_default_dtype_is_float32(self):
+        arr = GrowableArray((2,))
+        arr.append([1.0, 2.0])
+        assert arr.view().dtype == np.float32
+
+    def test_growth_is_geometric(self):
+        arr = GrowableArray((2,))
+        capacities = set()
+        for i in range(5000):
+            arr.append([i, i])
+            capacities.add(arr.capacity)
+        assert len(capacities) < 20
+
+    def test_scalar_rows(self):
+        arr = GrowableArray.from_array(np.empty((0)))
+        for n in (0, 1, 3):
+            arr.append(n)
+        assert arr.view().tolist() == [0, 1, 3]
+
+    def test_extend(self):
+        arr = GrowableArray((3,))
+        arr.extend(np.ones((5, 3)))
+        arr.extend(np.zeros((0, 3)))
+        assert arr.view().shape == (5, 3)
+
+
+class TestRowShape:
+    def test_inferred_from_first_row(self):
+        arr = GrowableArray()
+        arr.append([1, 2, 3])
+        assert arr.row_shape == (3,)
+
+    def test_placeholder_shape_replaced_when_empty(self):
+        arr = GrowableArray.from_array(np.empty((0, 512)))
+        arr.append(np.ones(768))
+        assert arr.view().shape == (1, 768)
+
+    def test_mismatched_shape_raises(self):
+        arr = GrowableArray((2,))
+        arr.append([1, 2])
+        with pytest.raises(ValueError):
+            arr.append([1, 2, 3])
+
+
+class TestInsertAndDelete:
+    def test_insert_first(self):
+        arr = GrowableArray((1,))
+        arr.extend([[1], [2]])
+        arr.insert_first([0])
+        assert arr.view().ravel().tolist() == [0, 1, 2]
+
+    def test_delete_preserves_order(self):
+        arr = GrowableArray((1,))
+        arr.extend([[i] for i in range(6)])
+        arr.delete([4, 1])
+        assert arr.view().ravel().tolist() == [0, 2, 3, 5]
+
+    def test_delete_empty_indexes(self):
+        arr = GrowableArray((1,))
+        arr.extend([[1], [2]])
+        arr.delete([])
+        assert len(arr) == 2
+
+    def test_append_after_delete(self):
+        arr = GrowableArray((1,))
+        arr.extend([[1], [2], [3]])
+        arr.delete([0])
+        arr.append([4])
+        assert arr.view().ravel().tolist() == [2, 3, 4]
+
+
+class TestFromArray:
+    def test_no_copy_for_float32_contiguous(self):
+        data = np.ones((3, 2), dtype=np.float32)
+        arr = GrowableArray.from_array(data)
+        assert np.shares_memory(arr.view(), data)
+
+    def test_converts_dtype(self):
+        arr = GrowableArray.from_array(np.ones((3, 2), dtype=np.float64))
+        assert arr.view().dtype == np.float32
+
+    def test_keeps_requested_dtype(self):
+        arr = GrowableArray.from_array(np.ones((3, 2)), dtype=np.float64)
+        arr.append([2, 2])
+        assert arr.view().dtype == np.float64
+        assert len(arr) == 4
@@ -0,0 +1,185 @@
+"""
+Tests for the staged data pipeline (compare/pipeline.py) and its use by
+BaseCompareEmbedding.get_data.
+
+Covers:
+  - results come back in input order through multi-threaded and batched stages
+  - items that raise skip later stages, and a failed batch is retried per item
+  - items already done bypass the stages, and cancellation stops the run
+  - get_data decodes, preprocesses and embeds uncached files in file order
+    (uses tmp_path, requires torch)
+  - the file limit counts only files with data, whatever the thread timing
+"""
+
+import random
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from compare.pipeline import PipelineStage, StagedPipeline
+
+
+def _jitter(value):
+    time.sleep(random.random() * 0.002)
+    return value
+
+
+class TestStagedPipeline:
+    def test_order_kept_across_workers_and_batches(self):
+        batches = []
+
+        def double_batch(values):
+            batches.append(len(values))
+            return [v * 2 for v in values]
+
+        pipeline = StagedPipeline([
+            PipelineStage("jitter", _jitter, workers=4),
+            PipelineStage("double", double_batch, batch_size=5),
+            PipelineStage("increment", lambda v: _jitter(v + 1), workers=3),
+        ], queue_size=4)
+        results = list(pipeline.run(range(50)))
+        assert [item for item, _, _ in results] == list(range(50))
+        assert [result for _, result, _ in results] == [i * 2 + 1 for i in range(50)]
+        assert all(error is None for _, _, error in results)
+        assert max(batches) <= 5 and sum(batches) == 50
+        assert pipeline.stage_items == {"jitter": 50, "double": 50, "increment": 50}
+        assert "double" in pipeline.timings_summary()
+
+    def test_errors_skip_later_stages(self):
+        later = []
+
+        def fail_on_three(v):
+            if v == 3:
+                raise ValueError("three")
+            return v
+
+        pipeline = StagedPipeline([
+            PipelineStage("fail", fail_on_three, workers=2),
+            PipelineStage("record", lambda v: later.append(v) or v),
+        ])
+        results = list(pipeline.run(range(6)))
+        assert [r for _, r, _ in results] == [0, 1, 2, None, 4, 5]
+        assert isinstance(results[3][2], ValueError)
+        assert 3 not in later
+
+    def test_failed_batch_retried_per_item(self):
+        calls = []
+
+        def batch(values):
+            calls.append(list(values))
+            if 4 in values:
+                raise RuntimeError("bad item in batch")
+            return [-v for v in values]
+
+        results = list(StagedPipeline([PipelineStage("negate", batch, batch_size=3)]).run(range(6)))
+        assert [r for _, r, _ in results] == [0, -1, -2, -3, None, -5]
+        assert isinstance(results[4][2], RuntimeError)
+        assert [3, 4, 5] in calls and [3] in calls and [5] in calls
+
+    def test_done_items_bypass_stages(self):
+        seen = []
+        pipeline = StagedPipeline([PipelineStage("square", lambda v: seen.append(v) or v * v)])
+        results = list(pipeline.run(range(6), is_done=lambda v: v % 2 == 0))
+        assert [r for _, r, _ in results] == [0, 1, 2, 9, 4, 25]
+        assert seen == [1, 3, 5]
+
+    def test_cancellation_stops_run(self):
+        cancelled = threading.Event()
+        pipeline = StagedPipeline([PipelineStage("slow", _jitter, workers=2)],
+                                  queue_size=2, is_cancelled=cancelled.is_set)
+        results = []
+        for item, _, _ in pipeline.run(range(1000)):
+            results.append(item)
+            if item == 5:
+                cancelled.set()
+        assert results == list(range(6))
+        assert all(not thread.is_alive() for thread in threading.enumerate()
+                   if thread.name.startswith("pipeline_"))
+
+    def test_feed_error_raised_after_fed_items(self):
+        def items():
+            yield 1
+            yield 2
+            raise KeyError("feed")
+
+        pipeline = StagedPipeline([PipelineStage("identity", lambda v: v)])
+        results = []
+        with pytest.raises(KeyError):
+            for item, _, _ in pipeline.run(items()):
+                results.append(item)
+        assert results == [1, 2]
+
+
+class TestGetDataPipeline:
+    def test_preprocess_and_embed_stages(self, tmp_path, monkeypatch):
+        pytest.importorskip("torch")
+        import compare.base_compare_embedding as base_compare_embedding
+        from compare.compare_args import CompareArgs
+        from compare.compare_embeddings_clip import CompareEmbeddingClip
+        from utils.constants import CompareMode
+
+        monkeypatch.setattr(base_compare_embedding.config, "embedding_batch_size", 4)
+        files = []
+        for i in range(11):
+            path = str(tmp_path / f"{i:03d}.png")
+            if i == 6:
+                with open(path, "wb") as f:
+                    f.write(b"not an image")
+            else:
+                Image.new("RGB", (10 + i, 10)).save(path)
+            files.append(path)
+
+        args = CompareArgs(base_dir=str(tmp_path), compare_mode=CompareMode.CLIP_EMBEDDING, compare_faces=False)
+        compare = CompareEmbeddingClip(args)
+        compare.verbose = False
+        compare.files = files
+        compare.max_files_processed_even = len(files)
+        batch_sizes = []
+
+        def embed_preprocessed(widths):
+            batch_sizes.append(len(widths))
+            embeddings = []
+            for width in widths:
+                embedding = np.zeros(512, dtype=np.float32)
+                embedding[width - 10] = 1.0
+                embeddings.append(embedding)
+            return embeddings
+
+        compare.image_preprocess_func = lambda image: image.size[0]
+        compare.image_embeddings_preprocessed_func = embed_preprocessed
+        compare.get_data()
+
+        readable = [i for i in range(len(files)) if i != 6]
+        assert compare.compare_data.files_found == [files[i] for i in readable]
+        assert max(batch_sizes) <= 4 and sum(batch_sizes) == len(readable)
+        assert np.argmax(compare._file_embeddings, axis=1).tolist() == readable
+
+    def test_counter_limit_with_failing_files(self, tmp_path, monkeypatch):
+        import compare.base_compare as base_compare
+        import compare.compare_hash as compare_hash
+        from compare.compare_args import CompareArgs
+        from compare.compare_hash import CompareHash
+
+        monkeypatch.setattr(base_compare.config, "pipeline_workers", 4)
+        monkeypatch.setattr(base_compare.config, "pipeline_queue_size", 2)
+        failing = {1, 2, 4, 7}
+
+        def extract_hash(path):
+            index = int(path[-7:-4])
+            time.sleep(random.random() * 0.005)
+            return None if index in failing else index
+
+        monkeypatch.setattr(compare_hash, "extract_hash_from_image", extract_hash)
+        files = [str(tmp_path / f"{i:03d}.png") for i in range(20)]
+        for _ in range(5):
+            compare = CompareHash(CompareArgs(base_dir=str(tmp_path), counter_limit=3))
+            compare.verbose = False
+            compare.files = files
+            compare.max_files_processed_even = len(files)
+            compare.get_data()
+            # The limit is checked before a file is added, as in the sequential loop
+            assert compare.compare_data.files_found == [files[i] for i in (0, 3, 5, 6)]
+            assert compare._file_hashes.tolist() == [0, 3, 5, 6]
@@ -0,0 +1,100 @@
+"""
+Tests for batched prompt embedding in compare/compare_prompts.py.
+
+Covers:
+  - each distinct prompt is encoded once, in batches, and stored in the text
+    embedding cache so later runs do not encode it again
+  - a failed batch is retried one prompt at a time, and pairs with a prompt
+    that could not be encoded get a zero vector
+  - get_data keeps the file order and skips files without prompts (uses tmp_path)
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import compare.compare_prompts as compare_prompts
+from compare.compare_args import CompareArgs
+from compare.compare_prompts import ComparePrompts, prompt_embeddings
+from compare.text_embedding_cache import TextEmbeddingCache
+
+DIM = compare_prompts.FLAVA_EMBEDDING_SIZE
+
+
+def _text_embedding(text):
+    return np.random.default_rng(sum(map(ord, text))).random(DIM).astype(np.float32)
+
+
+@pytest.fixture
+def encoder(monkeypatch):
+    '''
+    Replace the FLAVA text model, recording the batches of texts encoded.
+    '''
+    batches = []
+    failing = set()
+
+    def encode(texts):
+        batches.append(list(texts))
+        if any(text in failing for text in texts):
+            raise ValueError("Failed to encode")
+        return [_text_embedding(text).tolist() for text in texts]
+
+    monkeypatch.setattr(compare_prompts, "text_embeddings_flava_batch", encode)
+    monkeypatch.setattr(compare_prompts.config, "embedding_batch_size", 2)
+    monkeypatch.setattr(compare_prompts.config, "text_embedding_cache_max_entries", 1000)
+    encode.batches = batches
+    encode.failing = failing
+    return encode
+
+
+def _expected(positive, negative):
+    return _text_embedding(positive) - 0.5 * _text_embedding(negative)
+
+
+def test_distinct_prompts_encoded_once(tmp_path, encoder):
+    cache = TextEmbeddingCache("flava", cache_dir=str(tmp_path))
+    prompts = [("a cat", "blurry"), ("a dog", "blurry"), ("a cat", "blurry"), ("a bird", None)]
+    embeddings = prompt_embeddings(prompts, cache)
+    assert [len(batch) for batch in encoder.batches] == [2, 2, 1]
+    assert sorted(text for batch in encoder.batches for text in batch) == ["", "a bird", "a cat", "a dog", "blurry"]
+    np.testing.assert_allclose(embeddings[0], _expected("a cat", "blurry"), rtol=1e-6)
+    np.testing.assert_allclose(embeddings[3], _expected("a bird", ""), rtol=1e-6)
+    np.testing.assert_array_equal(embeddings[0], embeddings[2])
+
+    encoder.batches.clear()
+    reloaded = TextEmbeddingCache("flava", cache_dir=str(tmp_path))
+    embeddings = prompt_embeddings([("a dog", "blurry"), ("a fox", "blurry")], reloaded)
+    assert encoder.batches == [["a fox"]]
+    np.testing.assert_allclose(embeddings[0], _expected("a dog", "blurry"), rtol=1e-6)
+
+
+def test_failed_prompt_gets_zero_vector(tmp_path, encoder):
+    cache = TextEmbeddingCache("flava", cache_dir=str(tmp_path))
+    encoder.failing.add("bad")
+    long_prompt = "x" * 3000
+    embeddings = prompt_embeddings([("bad", "blurry"), ("good", "blurry"), (long_prompt, "")], cache)
+    assert encoder.batches[:3] == [["bad", "blurry"], ["bad"], ["blurry"]]
+    assert np.all(embeddings[0] == 0)
+    np.testing.assert_allclose(embeddings[1], _expected("good", "blurry"), rtol=1e-6)
+    assert "bad" not in cache
+    assert "x" * compare_prompts.MAX_PROMPT_LENGTH + "..." in cache
+
+
+def test_get_data(tmp_path, encoder, monkeypatch):
+    base_dir = tmp_path / "images"
+    base_dir.mkdir()
+    files = []
+    for name in ("a.png", "b.png", "c.png"):
+        Image.new("RGB", (10, 10)).save(base_dir / name)
+        files.append(str(base_dir / name))
+    prompts = {files[0]: ("a cat", "blurry"), files[2]: ("a cat", "blurry")}
+    monkeypatch.setattr(compare_prompts, "extract_prompts_from_image",
+                        lambda path: prompts.get(path, (None, None)))
+
+    compare = ComparePrompts(CompareArgs(base_dir=str(base_dir)))
+    compare.text_embedding_cache = TextEmbeddingCache("flava", cache_dir=str(tmp_path / "text"))
+    compare.get_files()
+    compare.get_data()
+    assert compare.compare_data.files_found == [files[0], files[2]]
+    assert encoder.batches == [["a cat", "blurry"]]
+    np.testing.assert_allclose(compare._file_embeddings_array.view()[1], _expected("a cat", "blurry"), rtol=1e-6)
@@ -0,0 +1,130 @@
+"""
+Tests for BaseCompare.top_k_indices and the vectorized embedding search.
+
+Covers:
+  - top-k selection against a full sort, for similarity and diff scores
+  - k larger than the number of scores, k of zero and tie ordering
+  - multi-query search scores against per-query scoring (requires torch)
+  - single file searches never return the search file, including in libraries
+    smaller than max_search_results, and prompt searches for the closest files
+    use the duplicate threshold
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from compare.base_compare import BaseCompare
+
+
+class TestTopKIndices:
+    @pytest.mark.parametrize("k", [1, 5, 50])
+    def test_largest_matches_full_sort(self, k):
+        scores = np.random.default_rng(0).random(200)
+        expected = np.argsort(-scores, kind="stable")[:k]
+        np.testing.assert_array_equal(BaseCompare.top_k_indices(scores, k), expected)
+
+    def test_smallest_matches_full_sort(self):
+        scores = np.random.default_rng(1).integers(0, 1000, 300)
+        expected = np.argsort(scores, kind="stable")[:20]
+        np.testing.assert_array_equal(scores[BaseCompare.top_k_indices(scores, 20, largest=False)],
+                                      scores[expected])
+
+    def test_k_larger_than_scores(self):
+        scores = np.array([0.2, 0.9, 0.5])
+        assert BaseCompare.top_k_indices(scores, 10).tolist() == [1, 2, 0]
+
+    def test_k_zero(self):
+        assert len(BaseCompare.top_k_indices(np.arange(5.0), 0)) == 0
+
+    def test_ties_keep_index_order(self):
+        scores = np.array([0.5, 0.7, 0.5, 0.7, 0.1])
+        assert BaseCompare.top_k_indices(scores, 5).tolist() == [1, 3, 0, 2, 4]
+
+    def test_excluded_index(self):
+        scores = np.array([1.0, 0.8, 0.9])
+        scores[0] = -np.inf
+        assert BaseCompare.top_k_indices(scores, 2).tolist() == [2, 1]
+
+
+class TestMultiEmbeddingSearch:
+    @pytest.fixture
+    def compare(self):
+        pytest.importorskip("torch")
+        from compare.base_compare_embedding import BaseCompareEmbedding
+        rng = np.random.default_rng(2)
+        embeddings = rng.standard_normal((500, 16)).astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        compare = BaseCompareEmbedding()
+        compare._file_embeddings = embeddings
+        compare.compare_data = SimpleNamespace(files_found=[f"{i}.png" for i in range(500)], ann_index=None)
+        return compare
+
+    def test_matches_per_query_scores(self, compare, monkeypatch):
+        import compare.base_compare_embedding as base_compare_embedding
+        monkeypatch.setattr(base_compare_embedding.config, "search_only_return_closest", False)
+        monkeypatch.setattr(base_compare_embedding.config, "max_search_results", 10)
+        embeddings = compare._file_embeddings
+        positives, negatives = [embeddings[0], embeddings[1]], [embeddings[2]]
+        compare._compute_multiembedding_diff(positives, negatives)
+        expected = (embeddings @ positives[0] + embeddings @ positives[1]) / 2 - embeddings @ negatives[0]
+        top = np.argsort(-expected)[:10]
+        assert list(compare.compare_result.files_grouped) == [f"{i}.png" for i in top.tolist()]
+        np.testing.assert_allclose(list(compare.compare_result.files_grouped.values()), expected[top], rtol=1e-5)
+
+
+def _search_result():
+    return SimpleNamespace(files_grouped={}, finalize_search_result=lambda *args, **kwargs: None)
+
+
+class TestSmallLibrarySearch:
+    def test_candidate_indices_exclude_search_file(self):
+        scores = np.array([0.3, 1.0, 0.5])
+        assert BaseCompare.top_k_candidate_indices(scores, [0, 2], 50).tolist() == [2, 0]
+
+    def _embeddings(self):
+        embeddings = np.array([[1.0, 0.0], [0.96, 0.28], [0.6, 0.8], [0.0, 1.0]], dtype=np.float32)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    @pytest.mark.parametrize("closest", [False, True])
+    def test_embedding_search(self, closest, monkeypatch):
+        pytest.importorskip("torch")
+        import compare.base_compare_embedding as base_compare_embedding
+        monkeypatch.setattr(base_compare_embedding.config, "search_only_return_closest", closest)
+        monkeypatch.setattr(base_compare_embedding.config, "max_search_results", 50)
+        compare = base_compare_embedding.BaseCompareEmbedding()
+        compare._file_embeddings = self._embeddings()
+        compare.compare_data = SimpleNamespace(files_found=["a", "b", "c", "d"])
+        compare.compare_result = _search_result()
+        compare.compare_faces = False
+        compare.embedding_similarity_threshold = 0.5
+        compare.find_similars_to_image("a", 0)
+        assert "a" not in compare.compare_result.files_grouped
+        assert list(compare.compare_result.files_grouped)[:2] == (["c", "b"] if closest else ["b", "c"])
+
+    @pytest.mark.parametrize("closest", [False, True])
+    def test_prompt_search(self, closest, monkeypatch):
+        import compare.compare_prompts as compare_prompts
+        monkeypatch.setattr(compare_prompts.config, "search_only_return_closest", closest)
+        monkeypatch.setattr(compare_prompts.config, "max_search_results", 50)
+        compare = compare_prompts.ComparePrompts()
+        compare._file_embeddings = self._embeddings()
+        compare.compare_data = SimpleNamespace(files_found=["a", "b", "c", "d"])
+        compare.compare_result = _search_result()
+        compare.embedding_similarity_threshold = 0.5
+        compare.find_similars_to_image("a", 0)
+        # Closest files are those above the duplicate threshold of 0.95 only
+        expected = ["b"] if closest else ["b", "c", "d"]
+        assert list(compare.compare_result.files_grouped) == expected
+
+    def test_color_search(self, monkeypatch):
+        import compare.compare_colors as compare_colors
+        monkeypatch.setattr(compare_colors.config, "search_only_return_closest", False)
+        monkeypatch.setattr(compare_colors.config, "max_search_results", 50)
+        compare = compare_colors.CompareColors()
+        compare._file_colors = np.array([[[0, 0, 0]], [[10, 0, 0]], [[5, 0, 0]]], dtype=np.float64)
+        compare.compare_data = SimpleNamespace(files_found=["a", "b", "c"])
+        compare.compare_result = _search_result()
+        compare.find_similars_to_image("a", 0)
+        assert list(compare.compare_result.files_grouped) == ["c", "b"]
@@ -0,0 +1,139 @@
+"""
+Tests for compare/text_embedding_cache.py.
+
+Covers:
+  - embeddings persisted across cache instances (uses tmp_path)
+  - separate stores per model variant
+  - least recently used eviction beyond the configured size
+  - two instances sharing a store, as separate app processes would
+  - lock file handling
+"""
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+import compare.text_embedding_cache as text_embedding_cache
+from compare.text_embedding_cache import TextEmbeddingCache, _FileLock
+
+
+def _embedding(seed, dim=8):
+    return np.random.default_rng(seed).random(dim).astype(np.float32)
+
+
+@pytest.fixture
+def max_entries(monkeypatch):
+    def set_max_entries(n):
+        monkeypatch.setattr(text_embedding_cache.config, "text_embedding_cache_max_entries", n)
+    set_max_entries(1000)
+    return set_max_entries
+
+
+class TestPersistence:
+    def test_round_trip(self, tmp_path, max_entries):
+        cache = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        cache["a cat"] = _embedding(0)
+        cache["a dog"] = _embedding(1)
+
+        reloaded = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        assert "a cat" in reloaded
+        assert "a bird" not in reloaded
+        assert len(reloaded) == 2
+        np.testing.assert_array_equal(reloaded["a dog"], _embedding(1))
+
+    def test_get_default(self, tmp_path, max_entries):
+        cache = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        assert cache.get("missing") is None
+
+    def test_variants_are_separate(self, tmp_path, max_entries):
+        variant = ["ViT-B/32"]
+        cache = TextEmbeddingCache("clip", lambda: variant[0], cache_dir=str(tmp_path))
+        cache["a cat"] = _embedding(0)
+        variant[0] = "ViT-L/14"
+        assert "a cat" not in cache
+        cache["a cat"] = _embedding(1, dim=16)
+        variant[0] = "ViT-B/32"
+        np.testing.assert_array_equal(cache["a cat"], _embedding(0))
+
+    def test_text_matching_a_file_name(self, tmp_path, max_entries, monkeypatch):
+        (tmp_path / "cat").write_text("not an embedding")
+        monkeypatch.chdir(tmp_path)
+        cache = TextEmbeddingCache("clip", cache_dir=str(tmp_path / "cache"))
+        cache["cat"] = _embedding(0)
+        (tmp_path / "cat").write_text("changed")
+        assert "cat" in TextEmbeddingCache("clip", cache_dir=str(tmp_path / "cache"))
+
+
+class TestEviction:
+    def test_least_recently_used_evicted(self, tmp_path, max_entries):
+        max_entries(3)
+        cache = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        for i in range(3):
+            cache[f"text {i}"] = _embedding(i)
+            time.sleep(0.01)
+        cache["text 0"]
+        time.sleep(0.01)
+        cache["text 3"] = _embedding(3)
+
+        reloaded = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        assert len(reloaded) == 3
+        assert "text 1" not in reloaded
+        assert "text 0" in reloaded
+
+    def test_access_times_persisted(self, tmp_path, max_entries):
+        max_entries(2)
+        cache = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        cache["old"] = _embedding(0)
+        time.sleep(0.01)
+        cache["new"] = _embedding(1)
+        time.sleep(0.01)
+        cache["old"]
+        cache.flush()
+
+        reloaded = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        reloaded["newest"] = _embedding(2)
+        assert "old" in reloaded
+        assert "new" not in reloaded
+
+
+class TestSharing:
+    def test_other_instance_writes_visible(self, tmp_path, max_entries):
+        first = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        second = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        assert "a cat" not in second
+        first["a cat"] = _embedding(0)
+        assert "a cat" in second
+        np.testing.assert_array_equal(second["a cat"], _embedding(0))
+
+    def test_concurrent_writes_merged(self, tmp_path, max_entries):
+        first = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        second = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        # Both instances load the store before either writes
+        assert len(first) == len(second) == 0
+        first["a cat"] = _embedding(0)
+        second["a dog"] = _embedding(1)
+        reloaded = TextEmbeddingCache("clip", cache_dir=str(tmp_path))
+        assert "a cat" in reloaded and "a dog" in reloaded
+
+    def test_for_model_shared(self):
+        assert TextEmbeddingCache.for_model("test_model") is TextEmbeddingCache.for_model("test_model")
+
+
+class TestFileLock:
+    def test_exclusive(self, tmp_path):
+        path = str(tmp_path / "store.lock")
+        with _FileLock(path, 0.1, 60) as acquired:
+            assert acquired
+            with _FileLock(path, 0.1, 60) as acquired_again:
+                assert not acquired_again
+        assert not os.path.exists(path)
+
+    def test_stale_lock_removed(self, tmp_path):
+        path = str(tmp_path / "store.lock")
+        open(path, "w").close()
+        old = time.time() - 120
+        os.utime(path, (old, old))
+        with _FileLock(path, 0.1, 60) as acquired:
+            assert acquired
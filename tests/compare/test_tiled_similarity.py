@@ -0,0 +1,125 @@
+"""
+Tests for BaseCompare.tiled_similarity_pairs and similarity_pairs_for_rows.
+
+Checks the tiled upper-triangle engine against a brute force similarity matrix
+for several tile shapes, with and without the face count filter, and that
+comparing added rows finds the pairs missing from a comparison of the others.
+"""
+
+import numpy as np
+import pytest
+
+from compare.base_compare import BaseCompare
+
+
+def _normalized(n, d, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n, d)).astype(np.float32)
+    # Add some near-duplicates so that there are pairs above threshold
+    embeddings[1::7] = embeddings[0::7][:len(embeddings[1::7])] + 0.01
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def _brute_force_pairs(embeddings, threshold, faces=None):
+    sims = embeddings @ embeddings.T
+    pairs = set()
+    for i in range(len(embeddings)):
+        for j in range(i + 1, len(embeddings)):
+            if sims[i, j] > threshold and (faces is None or faces[i] == faces[j]):
+                pairs.add((i, j))
+    return pairs
+
+
+def _collect(generator):
+    pairs = {}
+    for _, pairs_i, pairs_j, sims in generator:
+        for i, j, sim in zip(pairs_i.tolist(), pairs_j.tolist(), sims.tolist()):
+            assert (i, j) not in pairs
+            pairs[(i, j)] = sim
+    return pairs
+
+
+class TestTiledSimilarityPairs:
+    @pytest.mark.parametrize("tile_rows", [1, 3, 16, 100])
+    def test_matches_brute_force(self, tile_rows):
+        embeddings = _normalized(60, 8)
+        expected = _brute_force_pairs(embeddings, 0.5)
+        result = _collect(BaseCompare.tiled_similarity_pairs(embeddings, 0.5, tile_rows=tile_rows))
+        assert set(result) == expected
+
+    def test_column_tiles(self, monkeypatch):
+        monkeypatch.setattr(BaseCompare, "TILE_COLS", 7)
+        embeddings = _normalized(50, 8)
+        expected = _brute_force_pairs(embeddings, 0.5)
+        result = _collect(BaseCompare.tiled_similarity_pairs(embeddings, 0.5, tile_rows=5))
+        assert set(result) == expected
+
+    def test_pairs_are_upper_triangle(self):
+        embeddings = _normalized(30, 4)
+        result = _collect(BaseCompare.tiled_similarity_pairs(embeddings, -1.0, tile_rows=4))
+        assert all(i < j for i, j in result)
+        assert len(result) == 30 * 29 // 2
+
+    def test_similarity_values(self):
+        embeddings = _normalized(20, 4)
+        sims = embeddings @ embeddings.T
+        result = _collect(BaseCompare.tiled_similarity_pairs(embeddings, 0.0, tile_rows=6))
+        for (i, j), sim in result.items():
+            assert sim == pytest.approx(float(sims[i, j]), abs=1e-5)
+
+    def test_face_filter(self):
+        embeddings = _normalized(40, 8)
+        faces = np.arange(40) % 3
+        expected = _brute_force_pairs(embeddings, 0.3, faces=faces)
+        result = _collect(BaseCompare.tiled_similarity_pairs(embeddings, 0.3, faces=faces, tile_rows=9))
+        assert set(result) == expected
+
+    def test_start_row_resumes(self):
+        embeddings = _normalized(40, 8)
+        all_pairs = _collect(BaseCompare.tiled_similarity_pairs(embeddings, 0.3, tile_rows=10))
+        resumed = _collect(BaseCompare.tiled_similarity_pairs(embeddings, 0.3, start_row=20, tile_rows=10))
+        assert set(resumed) == {(i, j) for i, j in all_pairs if i >= 20}
+
+    def test_row_end_reported(self):
+        embeddings = _normalized(25, 4)
+        row_ends = [row_end for row_end, _, _, _ in BaseCompare.tiled_similarity_pairs(embeddings, 0.5, tile_rows=10)]
+        assert row_ends == [10, 20, 25]
+
+    def test_single_row(self):
+        embeddings = _normalized(1, 4)
+        assert list(BaseCompare.tiled_similarity_pairs(embeddings, 0.5)) == []
+
+
+class TestSimilarityPairsForRows:
+    @pytest.mark.parametrize("tile_rows", [1, 4, 100])
+    def test_added_rows_complete_comparison(self, tile_rows):
+        embeddings = _normalized(50, 8)
+        rows = np.array([3, 4, 17, 40, 49])
+        expected = _brute_force_pairs(embeddings, 0.4)
+        others = np.setdiff1d(np.arange(50), rows)
+        existing = {(int(others[i]), int(others[j]))
+                    for i, j in _brute_force_pairs(embeddings[others], 0.4)}
+        added = {}
+        for pairs_i, pairs_j, _ in BaseCompare.similarity_pairs_for_rows(embeddings, rows, 0.4, tile_rows=tile_rows):
+            for i, j in zip(pairs_i.tolist(), pairs_j.tolist()):
+                pair = (min(i, j), max(i, j))
+                assert pair not in added
+                added[pair] = True
+        assert existing | set(added) == expected
+        assert not existing & set(added)
+
+    def test_column_tiles_and_faces(self, monkeypatch):
+        monkeypatch.setattr(BaseCompare, "TILE_COLS", 6)
+        embeddings = _normalized(30, 8)
+        faces = np.arange(30) % 2
+        rows = np.array([0, 29])
+        expected = {pair for pair in _brute_force_pairs(embeddings, 0.3, faces=faces) if pair[0] in (0, 29) or pair[1] in (0, 29)}
+        result = set()
+        for pairs_i, pairs_j, sims in BaseCompare.similarity_pairs_for_rows(embeddings, rows, 0.3, faces=faces, tile_rows=1):
+            assert np.all(sims > 0.3)
+            result.update((min(i, j), max(i, j)) for i, j in zip(pairs_i.tolist(), pairs_j.tolist()))
+        assert result == expected
+
+    def test_no_rows(self):
+        embeddings = _normalized(10, 4)
+        assert list(BaseCompare.similarity_pairs_for_rows(embeddings, [], 0.5)) == []
@@ -0,0 +1,104 @@
+"""
+Unit tests for the shared decoded image cache (image/decoded_image_cache.py).
+
+Covers:
+  - images are downscaled on their shorter side, JPEGs through a reduced draft
+  - decoded images are reused, and decoded again when the file changes
+  - the cache is bounded by its size in bytes
+  - concurrent requests for the same file decode it once
+"""
+
+import os
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import image.decoded_image_cache as decoded_image_cache_module
+from image.decoded_image_cache import DecodedImageCache, decode_image
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(decoded_image_cache_module.config, "decoded_image_size", 64)
+    monkeypatch.setattr(decoded_image_cache_module.config, "decoded_image_cache_mb", 1)
+    return DecodedImageCache()
+
+
+def _gradient(path, size, mode="RGB"):
+    x = np.linspace(0, 255, size[0], dtype=np.uint8)
+    array = np.broadcast_to(x, (size[1], size[0]))
+    if mode == "RGB":
+        array = np.stack([array, array[::-1], np.full_like(array, 128)], axis=-1)
+    Image.fromarray(np.ascontiguousarray(array), mode).save(path)
+    return str(path)
+
+
+def test_downscaled_on_shorter_side(tmp_path):
+    for name in ("a.png", "a.jpg"):
+        path = _gradient(tmp_path / name, (800, 400))
+        decoded = decode_image(path, 64)
+        assert decoded.array.shape == (64, 128, 3)
+        assert decoded.array.dtype == np.uint8 and not decoded.array.flags.writeable
+        assert decoded.source_size == (800, 400) and not decoded.is_grayscale
+        with Image.open(path) as img:
+            expected = np.asarray(img.convert("RGB").resize((128, 64), Image.Resampling.BICUBIC), dtype=np.int16)
+        assert np.abs(decoded.array.astype(np.int16) - expected).mean() < 4
+    small = decode_image(_gradient(tmp_path / "small.png", (40, 30)), 64)
+    assert small.array.shape == (30, 40, 3)
+    gray = decode_image(_gradient(tmp_path / "gray.png", (100, 100), mode="L"), 64)
+    assert gray.is_grayscale and gray.gray().shape == (64, 64)
+
+
+def test_reused_until_file_changes(cache, tmp_path, monkeypatch):
+    path = _gradient(tmp_path / "a.png", (100, 100))
+    decodes = []
+    decode = decoded_image_cache_module.decode_image
+    monkeypatch.setattr(decoded_image_cache_module, "decode_image", lambda *a: decodes.append(a) or decode(*a))
+    first = cache.get_array(path)
+    assert cache.get_array(path) is first
+    assert cache.get_image(path).size == (64, 64)
+    assert len(decodes) == 1
+
+    _gradient(tmp_path / "a.png", (200, 100))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert cache.get_array(path).shape == (64, 128, 3)
+    assert len(decodes) == 2
+
+
+def test_bounded_by_bytes(cache, tmp_path):
+    # Each image is 64 * 1024 * 3 bytes, so five fit in a megabyte
+    paths = [_gradient(tmp_path / f"{i}.png", (1024, 64)) for i in range(7)]
+    for path in paths:
+        cache.get(path)
+    assert len(cache) == 5
+    assert set(cache._entries) == set(paths[2:])
+
+
+def test_concurrent_requests_decode_once(cache, tmp_path, monkeypatch):
+    path = _gradient(tmp_path / "a.png", (100, 100))
+    started = threading.Event()
+    release = threading.Event()
+    decodes = []
+    decode = decoded_image_cache_module.decode_image
+
+    def slow_decode(*args):
+        decodes.append(args)
+        started.set()
+        release.wait(10)
+        return decode(*args)
+
+    monkeypatch.setattr(decoded_image_cache_module, "decode_image", slow_decode)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(path))) for _ in range(4)]
+    threads[0].start()
+    started.wait(10)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert len(decodes) == 1
+    assert len(results) == 4 and all(result is results[0] for result in results)
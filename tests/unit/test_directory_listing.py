@@ -0,0 +1,81 @@
+"""
+Unit tests for single-pass directory listings (files/directory_listing.py) and
+their use by compare.base_compare.gather_files.
+
+Covers:
+  - gather_files matches the per-extension recursive globs it replaced
+  - hidden entries are skipped and extensions match case-insensitively
+  - listings are reused, including by non-recursive requests, and invalidated
+    when a scanned directory changes
+"""
+
+import os
+from glob import glob
+
+import pytest
+
+import compare.base_compare as base_compare
+from compare.base_compare import gather_files
+from files.directory_listing import directory_listing_cache, walk_files
+
+EXTS = [".png", ".jpg", ".webp"]
+
+
+@pytest.fixture(autouse=True)
+def _clear_listings():
+    directory_listing_cache.clear()
+    yield
+    directory_listing_cache.clear()
+
+
+def _make_tree(root):
+    for relative_path in ["a.png", "b.jpg", "c.txt", "sub/d.png", "sub/deep/e.webp", "sub/deep/f.gif",
+                          "other/g.jpg", ".hidden.png", ".hidden_dir/h.png", "sub/.i.jpg"]:
+        path = os.path.join(root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x")
+    return str(root)
+
+
+@pytest.mark.parametrize("recursive", [True, False])
+def test_matches_glob(tmp_path, recursive):
+    root = _make_tree(tmp_path)
+    expected = []
+    for ext in EXTS:
+        expected.extend(glob(os.path.join(root, ("**/" if recursive else "") + "*" + ext), recursive=recursive))
+    assert sorted(gather_files(root, exts=EXTS, recursive=recursive)) == sorted(expected)
+
+
+def test_hidden_and_case(tmp_path):
+    root = _make_tree(tmp_path)
+    (tmp_path / "UPPER.PNG").write_bytes(b"x")
+    names = {os.path.basename(f) for f in walk_files(root, EXTS)}
+    assert {".hidden.png", "h.png", ".i.jpg", "UPPER.PNG"} <= names
+    names = {os.path.basename(f) for f in walk_files(root, EXTS, skip_hidden=True)}
+    assert names == {"a.png", "b.jpg", "d.png", "e.webp", "g.jpg", "UPPER.PNG"}
+
+
+def test_listing_reused_until_directory_changes(tmp_path, monkeypatch):
+    root = _make_tree(tmp_path)
+    expected_recursive = sorted(walk_files(root, EXTS, skip_hidden=True))
+    expected_flat = sorted(walk_files(root, EXTS, recursive=False, skip_hidden=True))
+    # A file browser listing of every file type, including hidden files
+    dir_mtimes = {}
+    listed = list(walk_files(root + os.sep, EXTS + [".gif"], dir_mtimes=dir_mtimes))
+    directory_listing_cache.store(root + os.sep, True, EXTS + [".gif"], listed, dir_mtimes)
+
+    def fail_walk(*args, **kwargs):
+        raise AssertionError("Directory walked again")
+
+    monkeypatch.setattr(base_compare, "walk_files", fail_walk)
+    assert sorted(gather_files(root, exts=EXTS, recursive=False)) == expected_flat
+    assert sorted(gather_files(root, exts=EXTS, recursive=True)) == expected_recursive
+    assert directory_listing_cache.get(root, True, EXTS + [".bmp"]) is None
+
+    # A new file changes the modification time of its directory
+    deep_dir = str(tmp_path / "sub" / "deep")
+    (tmp_path / "sub" / "deep" / "new.png").write_bytes(b"x")
+    stat = os.stat(deep_dir)
+    os.utime(deep_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert directory_listing_cache.get(root, True, EXTS, skip_hidden=True) is None
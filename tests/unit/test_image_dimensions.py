@@ -0,0 +1,95 @@
+"""
+Unit tests for the image dimension service (image/image_dimensions.py).
+
+Covers:
+  - header parsers match PIL for each supported format and variant
+  - files without a supported header fall back to PIL or report None
+  - dimensions are memoized, invalidated when a file changes, and persisted
+"""
+
+import os
+
+import pytest
+from PIL import Image
+
+import image.image_dimensions as image_dimensions_module
+from image.image_dimensions import ImageDimensions, read_header_dimensions
+
+
+@pytest.mark.parametrize("name,mode,kwargs", [
+    ("a.png", "RGB", {}),
+    ("a.jpg", "RGB", {}),
+    ("progressive.jpg", "RGB", {"progressive": True}),
+    ("a.gif", "P", {}),
+    ("a.bmp", "RGB", {}),
+    ("a.tif", "RGB", {}),
+    ("lzw.tif", "RGB", {"compression": "tiff_lzw"}),
+    ("lossy.webp", "RGB", {"lossless": False}),
+    ("lossless.webp", "RGB", {"lossless": True}),
+    ("alpha.webp", "RGBA", {}),
+    ("a.avif", "RGB", {}),
+])
+def test_header_matches_pil(tmp_path, name, mode, kwargs):
+    path = str(tmp_path / name)
+    try:
+        Image.new(mode, (123, 45)).save(path, **kwargs)
+    except (KeyError, OSError) as e:
+        pytest.skip(f"PIL cannot write {name}: {e}")
+    with Image.open(path) as img:
+        assert read_header_dimensions(path) == img.size
+
+
+def test_jpeg_with_large_segments(tmp_path):
+    path = str(tmp_path / "icc.jpg")
+    Image.new("RGB", (640, 480)).save(path, icc_profile=b"x" * 200000)
+    assert read_header_dimensions(path) == (640, 480)
+
+
+def test_unsupported_and_invalid(tmp_path):
+    invalid = tmp_path / "invalid.png"
+    invalid.write_bytes(b"not an image" * 10)
+    assert read_header_dimensions(str(invalid)) is None
+    assert read_header_dimensions(str(tmp_path / "missing.png")) is None
+    ppm = str(tmp_path / "a.ppm")
+    Image.new("RGB", (7, 9)).save(ppm)
+    assert read_header_dimensions(ppm) is None
+    dimensions = ImageDimensions(cache_path=str(tmp_path / "cache.pkl"))
+    assert dimensions.get_dimensions(ppm) == (7, 9)
+    assert dimensions.get_dimensions(str(invalid)) is None
+
+
+def test_memoized_and_persisted(tmp_path, monkeypatch):
+    path = str(tmp_path / "a.png")
+    Image.new("RGB", (10, 20)).save(path)
+    cache_path = str(tmp_path / "cache" / "dimensions.pkl")
+    dimensions = ImageDimensions(cache_path=cache_path)
+    assert dimensions.get_dimensions(path) == (10, 20)
+
+    reads = []
+    monkeypatch.setattr(image_dimensions_module, "read_header_dimensions", lambda p: reads.append(p) or (1, 1))
+    assert dimensions.get_dimensions(path) == (10, 20)
+    dimensions.flush()
+    assert ImageDimensions(cache_path=cache_path).get_dimensions(path) == (10, 20)
+    assert reads == []
+
+    # A changed file is read again
+    Image.new("RGB", (30, 40)).save(path)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert ImageDimensions(cache_path=cache_path).get_dimensions(path) == (1, 1)
+    assert reads == [path]
+
+
+def test_max_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_dimensions_module.config, "image_dimensions_cache_max_entries", 2)
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f"{i}.png"))
+        Image.new("RGB", (i + 1, 1)).save(paths[-1])
+    cache_path = str(tmp_path / "dimensions.pkl")
+    dimensions = ImageDimensions(cache_path=cache_path)
+    for path in paths:
+        dimensions.get_dimensions(path)
+    dimensions.flush()
+    reloaded = ImageDimensions(cache_path=cache_path)
+    assert set(reloaded._ensure_loaded()) == set(paths[1:])
@@ -0,0 +1,42 @@
+"""
+Startup import budget, measured with tests/benchmark_startup_imports.py.
+
+Covers:
+  - the modules imported when the app starts do not load heavy ML libraries
+  - their import time stays within the startup budget
+  - LazyModule imports its module on first attribute access only
+"""
+
+import importlib.util
+import os
+import sys
+
+from utils.lazy_import import LazyModule, lazy_import
+
+_BENCHMARK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               "benchmark_startup_imports.py")
+
+
+def _load_benchmark():
+    spec = importlib.util.spec_from_file_location("benchmark_startup_imports", _BENCHMARK_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_startup_imports_within_budget():
+    benchmark = _load_benchmark()
+    cumulative_us, heavy_loaded = benchmark.measure_imports(benchmark.STARTUP_MODULES)
+    assert heavy_loaded == []
+    assert "compare.compare_manager" in cumulative_us
+    assert sum(cumulative_us.values()) / 1000 < benchmark.DEFAULT_BUDGET_MS
+
+
+def test_lazy_module_imported_on_first_use():
+    name = "email.mime.audio"
+    sys.modules.pop(name, None)
+    module = lazy_import(name)
+    assert isinstance(module, LazyModule) and not module.is_loaded
+    assert name not in sys.modules
+    assert module.MIMEAudio.__name__ == "MIMEAudio"
+    assert module.is_loaded and name in sys.modules
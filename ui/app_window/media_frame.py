@@ -23,6 +23,7 @@ from PySide6.QtWidgets import (
 from PySide6.QtCore import Qt, QRectF, QSize, QPoint, QRect, QEvent, QTimer, Signal, QObject, QThread, Slot
 from PySide6.QtGui import QImage, QPixmap, QImageReader, QPainter, QCursor, QMovie
 
+from image.image_dimensions import image_dimensions
 from ui.app_style import AppStyle
 from ui.app_window.media_controls_overlay import MediaControlsOverlay, OVERLAY_HEIGHT
 from utils.config import config
@@ -404,18 +405,14 @@ class MediaFrame(QFrame):
         self._cancel_decode_worker()
 
     def _probe_image_size(self, path: str) -> tuple[int, int]:
+        dims = image_dimensions.get_dimensions(path)
+        if dims is not None:
+            return dims
+        # Formats only Qt can read
         reader = QImageReader(path)
         size = reader.size()
         if size.width() > 0 and size.height() > 0:
             return int(size.width()), int(size.height())
-        if _PIL_AVAILABLE:
-            try:
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    with Image.open(path) as pil_img:
-                        return int(pil_img.width), int(pil_img.height)
-            except Exception:
-                pass
         return 0, 0
 
     def _is_large_image_dims(self, dims: tuple[int, int]) -> bool:
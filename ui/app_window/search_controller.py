@@ -401,6 +401,8 @@ class SearchController:
         primary_mode = self._cm.compare_mode
         if primary_mode == CompareMode.COLOR_MATCHING:
             return config.color_diff_threshold
+        if primary_mode == CompareMode.PERCEPTUAL_HASH:
+            return config.hash_distance_threshold
         return config.embedding_similarity_threshold
 
     def get_inclusion_pattern(self) -> Optional[str]:
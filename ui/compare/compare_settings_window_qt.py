@@ -324,6 +324,8 @@ class CompareSettingsWindow(SmartDialog):
             current_val = str(current_args.threshold)
         elif mode == CompareMode.COLOR_MATCHING:
             current_val = str(config.color_diff_threshold)
+        elif mode == CompareMode.PERCEPTUAL_HASH:
+            current_val = str(config.hash_distance_threshold)
         else:
             current_val = str(config.embedding_similarity_threshold)
 
@@ -344,6 +346,8 @@ class CompareSettingsWindow(SmartDialog):
         if current_val not in [str(v) for v in threshold_vals]:
             if mode == CompareMode.COLOR_MATCHING:
                 default_val = config.color_diff_threshold
+            elif mode == CompareMode.PERCEPTUAL_HASH:
+                default_val = config.hash_distance_threshold
             else:
                 default_val = config.embedding_similarity_threshold
             self._threshold_combo.setCurrentText(str(default_val))
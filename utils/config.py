@@ -5,7 +5,7 @@ import subprocess
 import sys
 
 from image.image_edit_configuration import ImageEditConfiguration
-from utils.constants import CompareMode, SortBy
+from utils.constants import CompareMode, EmbeddingPrecision, SortBy
 from utils.logging_setup import get_logger
 from utils.running_tasks_registry import running_tasks_registry
 from utils.utils import Utils
@@ -52,6 +52,8 @@ class Config:
         self.store_checkpoints = False
         self.embedding_similarity_threshold = 0.9
         self.color_diff_threshold = 15
+        self.hash_distance_threshold = 6
+        self.size_aspect_ratio_tolerance = 0.0  # above 0, size mode also matches sizes with aspect ratios this close
         self.escape_backslash_filepaths = False
         self.file_counter_limit = 40000
         self.fill_canvas = False
@@ -90,6 +92,22 @@ class Config:
         self.xvlm_model_loc = None
         self.xvlm_model_size = "4m"
         self.laion_enable_half_precision = False
+        self.embedding_batch_size = 16
+        self.embedding_ann_min_files = 50000
+        self.embedding_ann_grouping = False  # group from approximate neighbours, which can miss pairs
+        self.embedding_ann_n_probe = 32
+        self.embedding_ann_pq_subspaces = 0
+        self.embedding_precision = EmbeddingPrecision.FLOAT32
+        self.color_extraction_workers = 0  # 0 = one less than the number of CPUs
+        self.file_hash_workers = 8  # threads reading files to find exact duplicates
+        self.pipeline_workers = 0  # threads per compare data pipeline stage, 0 = one less than the number of CPUs
+        self.pipeline_queue_size = 64
+        self.duplicates_match_pixels = False  # also find duplicates differing only in metadata
+        self.text_embedding_cache_max_entries = 20000
+        self.image_dimensions_cache_max_entries = 500000
+        self.decoded_image_size = 512  # shorter side of images decoded for analysis, 0 = full size
+        self.decoded_image_cache_mb = 256
+        self.face_detection_max_side = 640  # longer side of images searched for faces, 0 = decoded image size
         self.always_open_new_windows = False
         self.image_types = [".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp", ".bmp", ".heic", ".avif"]
         self.video_types = [".mp4", ".mkv", ".avi", ".wmv", ".mov", ".flv"]
@@ -208,12 +226,28 @@ class Config:
                             "enable_prevalidations",
                             "show_negative_prompt",
                             "large_image_enable_hq_idle_downscale",
-                            "large_image_enable_full_res_promotion")
+                            "large_image_enable_full_res_promotion",
+                            "embedding_ann_grouping",
+                            "duplicates_match_pixels")
             self.set_values(int,
                             "max_search_results",
+                            "embedding_batch_size",
+                            "embedding_ann_min_files",
+                            "embedding_ann_n_probe",
+                            "embedding_ann_pq_subspaces",
+                            "text_embedding_cache_max_entries",
+                            "image_dimensions_cache_max_entries",
+                            "decoded_image_size",
+                            "decoded_image_cache_mb",
+                            "face_detection_max_side",
+                            "color_extraction_workers",
+                            "file_hash_workers",
+                            "pipeline_workers",
+                            "pipeline_queue_size",
                             "file_actions_history_max",
                             "file_actions_window_rows_max",
                             "color_diff_threshold",
+                            "hash_distance_threshold",
                             "file_counter_limit",
                             "slideshow_interval_seconds",
                             "file_check_interval_seconds",
@@ -234,6 +268,7 @@ class Config:
                             "refacdir_client_port")
             self.set_values(float,
                             "embedding_similarity_threshold",
+                            "size_aspect_ratio_tolerance",
                             "threshold_potential_duplicate_embedding",
                             "large_image_preview_overscan",
                             "large_image_hq_downscale_ratio_threshold",
@@ -263,6 +298,12 @@ class Config:
             except Exception:
                 raise AssertionError("Invalid compare mode for compare_mode config setting. Must be one of CLIP_EMBEDDING, COLOR_MATCHING")
 
+            if "embedding_precision" in self.dict:
+                try:
+                    self.embedding_precision = EmbeddingPrecision.get(self.dict["embedding_precision"])
+                except Exception:
+                    logger.warning("Invalid embedding_precision config setting. Must be one of float32, float16, int8")
+
             try:
                 self.sort_by = SortBy[self.dict["sort_by"]]
             except Exception:
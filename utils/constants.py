@@ -44,6 +44,8 @@ class CompareMode(Enum):
     PROMPTS_EXACT = _("Prompts (Exact Match)")
     SIZE = _("Size")
     MODELS = _("Models")
+    PERCEPTUAL_HASH = _("Perceptual Hash")
+    EXACT_DUPLICATES = _("Exact Duplicates")
 
     def get_text(self):
         if self == CompareMode.COLOR_MATCHING:
@@ -68,6 +70,10 @@ class CompareMode(Enum):
             return _("Size")
         elif self == CompareMode.MODELS:
             return _("Models")
+        elif self == CompareMode.PERCEPTUAL_HASH:
+            return _("Perceptual Hash")
+        elif self == CompareMode.EXACT_DUPLICATES:
+            return _("Exact Duplicates")
         raise Exception("Unhandled Compare Mode text: " + str(self))
 
     def __str__(self):
@@ -97,6 +103,10 @@ class CompareMode(Enum):
             return _("Size tolerance")
         elif self == CompareMode.MODELS:
             return _("Model similarity threshold")
+        elif self == CompareMode.PERCEPTUAL_HASH:
+            return _("Hash distance threshold")
+        elif self == CompareMode.EXACT_DUPLICATES:
+            return _("Duplicate threshold")
         raise Exception("Unhandled Compare Mode text: " + str(self))
 
     def threshold_vals(self):
@@ -111,6 +121,10 @@ class CompareMode(Enum):
             return [str(i) for i in list(range(0, 201, 10))]  # 0-200 pixel tolerance
         elif self == CompareMode.MODELS:
             return [0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99]
+        elif self == CompareMode.PERCEPTUAL_HASH:
+            return [str(i) for i in list(range(17))]  # 0-16 differing bits of 64
+        elif self == CompareMode.EXACT_DUPLICATES:
+            return ["0"]  # Only identical content matches
         # Default fallback for any unhandled modes
         return [0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.925, 0.95, 0.98, 0.99]
 
@@ -118,7 +132,9 @@ class CompareMode(Enum):
         return (self != CompareMode.COLOR_MATCHING and 
                 self != CompareMode.SIZE and 
                 self != CompareMode.MODELS and
-                self != CompareMode.PROMPTS_EXACT)
+                self != CompareMode.PROMPTS_EXACT and
+                self != CompareMode.PERCEPTUAL_HASH and
+                self != CompareMode.EXACT_DUPLICATES)
 
     @staticmethod
     def embedding_modes():
@@ -126,7 +142,8 @@ class CompareMode(Enum):
 
     @staticmethod
     def text_search_modes():
-        return [mode for mode in CompareMode if mode != CompareMode.SIZE and mode != CompareMode.COLOR_MATCHING]
+        return [mode for mode in CompareMode if mode != CompareMode.SIZE and mode != CompareMode.COLOR_MATCHING
+                and mode != CompareMode.PERCEPTUAL_HASH and mode != CompareMode.EXACT_DUPLICATES]
 
 
 class SortBy(Enum):
@@ -358,6 +375,22 @@ class ImageGenerationType(Enum):
         return [value.get_text() for key, value in ImageGenerationType.__members__.items()]
 
 
+class EmbeddingPrecision(Enum):
+    """Storage precision of image embeddings held for comparison and search."""
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INT8 = "int8"  # with a float32 scale per vector
+
+    @staticmethod
+    def get(name):
+        if isinstance(name, EmbeddingPrecision):
+            return name
+        for key, value in EmbeddingPrecision.__members__.items():
+            if value.name == name or value.value == name:
+                return value
+        raise Exception(f"Not a valid embedding precision: {name}")
+
+
 class Direction(Enum):
     FORWARD = "forward"
     BACKWARD = "back"
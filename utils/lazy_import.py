@@ -0,0 +1,45 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported when one of its attributes is
+    first used. Heavy libraries such as torch and transformers take seconds to
+    import, so modules reached from the UI hold them as LazyModule and the cost
+    is only paid once a compare, prevalidation or classifier actually runs.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        # Only called for attributes not set in __init__
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.is_loaded else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Get a module that is imported on first attribute access.
+
+    Args:
+        name: Full name of the module, for example "matplotlib.pyplot"
+    """
+    return LazyModule(name)